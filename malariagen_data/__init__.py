@@ -4,9 +4,16 @@ from .af1 import Af1
 from .ag3 import Ag3
 from .amin1 import Amin1
 from .anopheles import AnophelesDataResource, Region
+from .dataset_cache import DatasetCache
 from .pf7 import Pf7
 from .pf8 import Pf8
 from .pv4 import Pv4
+from .results_cache import (
+    FsspecResultsCacheBackend,
+    LocalResultsCacheBackend,
+    MemoryResultsCacheBackend,
+    ResultsCacheBackend,
+)
 from .util import SiteClass
 
 try:
@@ -32,8 +32,34 @@ class Adir1(AnophelesDataResource):
         Site filters analysis version.
     bokeh_output_notebook : bool, optional
         If True (default), configure bokeh to output plots to the notebook.
-    results_cache : str, optional
-        Path to directory on local file system to save results.
+    results_cache : str or ResultsCacheBackend, optional
+        Path to directory on local file system to save results. Can also be
+        a URL supported by fsspec (e.g., "gs://my-bucket/results_cache"), or
+        a backend instance, e.g., MemoryResultsCacheBackend() to keep results
+        in memory for the current session only.
+    results_cache_options : dict, optional
+        Options for the results cache. Supported keys are "max_size", the
+        maximum total size of the results cache on disk (e.g., "100GB");
+        "max_age", the maximum time in seconds since a result was last used;
+        "quotas", a dict mapping analysis names (e.g., "snp_allele_counts")
+        to maximum sizes on disk; and "memory_size", the maximum size of
+        results held in memory for reuse within the session (default "1GB").
+        When any limit is exceeded, the least recently used results are
+        evicted. Also "lock_timeout", the maximum time in seconds to wait for
+        another process computing the same results (default no limit). And
+        "storage_options", passed through to fsspec if `results_cache` is a
+        URL.
+    dataset_cache : DatasetCache, optional
+        Cache for lazily constructed datasets such as SNP calls and
+        haplotypes, which are reused when the same data are accessed again.
+        By default, a cache shared by all data resources in the current
+        process is used, with a capacity of 2GB.
+    allele_counts_engine : {"dask", "stream"}, optional
+        Default engine for computing SNP allele counts. If "dask" (default),
+        use a dask computation. If "stream", read chunks of genotype calls
+        directly using a pool of threads, which can be much faster for large
+        regions. Can be overridden via the `engine` parameter of
+        `snp_allele_counts()`.
     log : str or stream, optional
         File path or stream output for logging messages.
     debug : bool, optional
@@ -77,6 +103,9 @@ class Adir1(AnophelesDataResource):
         public_url=GCS_DEFAULT_PUBLIC_URL,
         bokeh_output_notebook=True,
         results_cache=None,
+        results_cache_options=None,
+        dataset_cache=None,
+        allele_counts_engine="dask",
         log=sys.stdout,
         debug=False,
         show_progress=None,
@@ -106,6 +135,9 @@ class Adir1(AnophelesDataResource):
             default_coverage_calls_analysis="dirus",
             bokeh_output_notebook=bokeh_output_notebook,
             results_cache=results_cache,
+            results_cache_options=results_cache_options,
+            dataset_cache=dataset_cache,
+            allele_counts_engine=allele_counts_engine,
             log=log,
             debug=debug,
             show_progress=show_progress,
@@ -1,15 +1,17 @@
 import os
 
 import json
-from contextlib import nullcontext
+from contextlib import contextmanager, nullcontext
 from datetime import date
-from pathlib import Path
 import re
+import threading
 from typing import (
     IO,
     Any,
+    Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     Literal,
     Mapping,
@@ -23,12 +25,12 @@ import bokeh.io
 import ipinfo  # type: ignore
 import numpy as np
 import pandas as pd  # type: ignore
-import zarr  # type: ignore
 from numpydoc_decorator import doc  # type: ignore
 from tqdm.auto import tqdm as tqdm_auto  # type: ignore
 from tqdm.dask import TqdmCallback  # type: ignore
 from yaspin import yaspin  # type: ignore
 import xarray as xr
+import zarr  # type: ignore
 
 from ..util import (
     CacheMiss,
@@ -40,6 +42,13 @@ from ..util import (
     _hash_params,
     _init_filesystem,
 )
+from ..dataset_cache import DatasetCache, DatasetCacheStats, shared_dataset_cache
+from ..results_cache import (
+    ResultsCache,
+    ResultsCacheBackend,
+    ResultsCacheEntry,
+    ResultsCacheLock,
+)
 from . import base_params
 
 
@@ -61,7 +70,9 @@ class AnophelesBase:
         show_progress: Optional[bool] = None,
         check_location: bool = False,
         storage_options: Optional[Mapping] = None,
-        results_cache: Optional[str] = None,
+        results_cache: Optional[Union[str, ResultsCacheBackend]] = None,
+        results_cache_options: Optional[Mapping] = None,
+        dataset_cache: Optional[DatasetCache] = None,
         tqdm_class=None,
         unrestricted_use_only: Optional[bool] = False,
         surveillance_use_only: Optional[bool] = False,
@@ -182,10 +193,33 @@ class AnophelesBase:
         self._cache_sample_set_to_terms_of_use_info: Optional[Dict[str, dict]] = None
         self._cache_files: Dict[str, bytes] = dict()
 
-        # Set up results cache directory path.
-        self._results_cache: Optional[Path] = None
+        # Set up results cache.
+        self._results_cache: Optional[str] = None
+        self._results_cache_store: Optional[ResultsCache] = None
+        # N.B., locks held are tracked per thread, so that re-entrant calls
+        # within a thread do not wait on themselves, but separate threads
+        # computing the same results are kept apart.
+        self._results_cache_thread_state = threading.local()
         if results_cache is not None:
-            self._results_cache = Path(results_cache).expanduser().resolve()
+            if results_cache_options is None:
+                results_cache_options = dict()
+            results_cache_options = dict(results_cache_options)
+            # Quotas are given by analysis name, but results are stored
+            # under names prefixed with the class name, see below.
+            quotas = results_cache_options.pop("quotas", None) or dict()
+            prefix = type(self).__name__.lower() + "_"
+            self._results_cache_store = ResultsCache(
+                results_cache,
+                quotas={prefix + k: v for k, v in quotas.items()},
+                **results_cache_options,
+            )
+            self._results_cache = str(self._results_cache_store)
+
+        # Set up cache of lazily constructed datasets.
+        if dataset_cache is None:
+            dataset_cache = shared_dataset_cache
+        self._dataset_cache = dataset_cache
+        self._dataset_cache_token = dataset_cache.register(self)
 
     def _progress(self, iterable, desc=None, leave=False, **kwargs):  # pragma: no cover
         # Progress doesn't mix well with debug logging.
@@ -980,54 +1014,141 @@ class AnophelesBase:
         # Expect sub-classes will override to add any analysis parameters.
         pass
 
-    @_check_types
-    def results_cache_get(
-        self, *, name: str, params: Dict[str, Any]
-    ) -> Mapping[str, np.ndarray]:
+    def _results_cache_key(self, *, name: str, params: Dict[str, Any]):
         name = type(self).__name__.lower() + "_" + name
-        if self._results_cache is None:
-            raise CacheMiss
         params = params.copy()
         self._results_cache_add_analysis_params(params)
-        cache_key, _ = _hash_params(params)
-        cache_path = self._results_cache / name / cache_key
-
-        # Read zipped zarr format.
-        results_path = cache_path / "results.zarr.zip"
-        if results_path.exists():
-            return zarr.load(results_path)
+        cache_key, params_json = _hash_params(params)
+        return name, cache_key, params_json
 
-        # For backwards compatibility, read npz format.
-        legacy_results_path = cache_path / "results.npz"
-        if legacy_results_path.exists():  # pragma: no cover
-            return np.load(legacy_results_path)
+    @property
+    def _results_cache_locks(self) -> Dict[Tuple[str, str], ResultsCacheLock]:
+        """Results cache locks held by the current thread."""
+        state = self._results_cache_thread_state
+        if not hasattr(state, "locks"):
+            state.locks = dict()
+        return state.locks
 
-        raise CacheMiss
+    @_check_types
+    def results_cache_get(
+        self, *, name: str, params: Dict[str, Any]
+    ) -> Mapping[str, np.ndarray]:
+        if self._results_cache_store is None:
+            raise CacheMiss
+        name, cache_key, _ = self._results_cache_key(name=name, params=params)
+        # If results are being computed by another worker, this will wait for
+        # them, see also results_cache_lock().
+        lock = self._results_cache_locks.get((name, cache_key))
+        return self._results_cache_store.get(name=name, key=cache_key, lock=lock)
+
+    @contextmanager
+    def results_cache_open(
+        self, *, name: str, params: Dict[str, Any]
+    ) -> Iterator[Mapping[str, Any]]:
+        """Context manager providing cached results like `results_cache_get()`,
+        but reading arrays lazily where possible and without holding them in
+        the in-memory tier, for large results which will be copied elsewhere
+        in blocks. Raises CacheMiss if the results are not in the cache."""
+        if self._results_cache_store is None:
+            raise CacheMiss
+        name, cache_key, _ = self._results_cache_key(name=name, params=params)
+        lock = self._results_cache_locks.get((name, cache_key))
+        with self._results_cache_store.open(
+            name=name, key=cache_key, lock=lock
+        ) as results:
+            yield results
 
     @_check_types
     def results_cache_set(
-        self, *, name: str, params: Dict[str, Any], results: Mapping[str, np.ndarray]
+        self,
+        *,
+        name: str,
+        params: Dict[str, Any],
+        results: Mapping[str, Union[np.ndarray, zarr.Array]],
     ):
-        name = type(self).__name__.lower() + "_" + name
-        if self._results_cache is None:
+        if self._results_cache_store is None:
             return
 
         # Set up parameters for the results to be saved.
-        params = params.copy()
-        self._results_cache_add_analysis_params(params)
-        cache_key, params_json = _hash_params(params)
+        name, cache_key, params_json = self._results_cache_key(name=name, params=params)
 
-        # Determine storage path.
-        cache_path = self._results_cache / name / cache_key
-        cache_path.mkdir(exist_ok=True, parents=True)
+        with self._spinner("Save results to cache"):
+            self._results_cache_store.set(
+                name=name, key=cache_key, params_json=params_json, results=results
+            )
 
-        # Write the parameters as a JSON file.
-        params_path = cache_path / "params.json"
+    @contextmanager
+    def results_cache_lock(self, *, name: str, params: Dict[str, Any]) -> Iterator:
+        """Context manager to use around getting, computing and setting the
+        results for a single analysis, to avoid duplicating work between
+        workers sharing the same results cache. If results are not found
+        in the cache, `results_cache_get()` will acquire an advisory lock,
+        waiting for any other worker already computing the same results,
+        and the lock will be released on exit."""
+        if self._results_cache_store is None:
+            yield
+            return
+        name, cache_key, _ = self._results_cache_key(name=name, params=params)
+        if (name, cache_key) in self._results_cache_locks:
+            # Already locked by an outer context, e.g., a re-entrant call.
+            yield
+            return
+        lock = self._results_cache_store.lock(name=name, key=cache_key)
+        self._results_cache_locks[(name, cache_key)] = lock
+        try:
+            yield
+        finally:
+            del self._results_cache_locks[(name, cache_key)]
+            lock.release()
 
-        # Write the data to be cached as a zipped zarr file.
-        results_path = cache_path / "results.zarr.zip"
+    @doc(
+        summary="""
+            Evict least recently used results from the results cache until the
+            size, age and quota constraints given via `results_cache_options`
+            are satisfied.
+        """,
+        returns="The entries which were evicted.",
+        notes="""
+            Eviction also happens automatically whenever new results are saved
+            to the cache. This function is provided for housekeeping of a
+            cache shared between several processes or users.
+        """,
+    )
+    def results_cache_evict(self) -> List[ResultsCacheEntry]:
+        if self._results_cache_store is None:
+            return []
+        return self._results_cache_store.evict()
 
-        with self._spinner("Save results to cache"):
-            with params_path.open(mode="w") as f:
-                f.write(params_json)
-            zarr.save(results_path, **results)
+    def _cached_dataset(self, key: Tuple, build: Callable[[], Any]):
+        """Obtain a lazily constructed dataset from the dataset cache, or build
+        and cache it. The key should identify the kind of dataset and include
+        all parameters used to build it."""
+        return self._dataset_cache.get_or_build(self._dataset_cache_token, key, build)
+
+    @doc(
+        summary="""
+            Obtain statistics for the cache of lazily constructed datasets,
+            e.g., SNP calls and haplotypes.
+        """,
+        returns="Hit and miss counts and current usage of the cache.",
+        notes="""
+            By default the cache is shared by all data resources in the
+            current process, in which case statistics include usage by other
+            data resources.
+        """,
+    )
+    def dataset_cache_stats(self) -> DatasetCacheStats:
+        return self._dataset_cache.stats()
+
+    @doc(
+        summary="""
+            Remove all datasets for this data resource from the cache of
+            lazily constructed datasets.
+        """,
+        notes="""
+            Datasets are also removed automatically when the cache is full
+            and when this data resource is garbage collected.
+        """,
+    )
+    def dataset_cache_clear(self):
+        self._dataset_cache.invalidate(self._dataset_cache_token)
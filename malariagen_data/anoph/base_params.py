@@ -1,7 +1,8 @@
 """General parameters common to many functions in the public API."""
 
-from typing import Final, List, Mapping, Optional, Sequence, Tuple, Union
+from typing import Final, List, Literal, Mapping, Optional, Sequence, Tuple, Union
 
+import numpy as np
 from typing_extensions import Annotated, TypeAlias
 
 from ..util import (
@@ -227,6 +228,14 @@ confidence_level: TypeAlias = Annotated[
 
 field: TypeAlias = Annotated[str, "Name of array or column to access."]
 
+positions: TypeAlias = Annotated[
+    Union[Sequence[int], np.ndarray],
+    """
+    Positions (1-based) within a contig. Positions which are not SNP sites
+    are ignored.
+    """,
+]
+
 inline_array: TypeAlias = Annotated[
     bool,
     "Passed through to dask `from_array()`.",
@@ -256,6 +265,22 @@ chunks: TypeAlias = Annotated[
 # amounts of data.
 native_chunks: chunks = "native"
 
+allele_counts_engine: TypeAlias = Annotated[
+    Literal["dask", "stream"],
+    """
+    How to compute allele counts from genotype calls. If 'dask', build a dask
+    computation over all chunks of genotype calls. If 'stream', read native
+    zarr chunks of genotype calls directly using a pool of threads, counting
+    alleles for the selected sites and samples as each chunk is read. This
+    avoids the overhead of building and scheduling a large dask graph, which
+    can be significant for large regions and many sample sets, and uses a
+    bounded amount of memory. Both give the same results. If not provided,
+    use the default given when instantiating the class.
+    """,
+]
+
+allele_counts_engine_default: allele_counts_engine = "dask"
+
 gff_attributes: TypeAlias = Annotated[
     Optional[Union[Sequence[str], str]],
     """
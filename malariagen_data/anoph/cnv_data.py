@@ -208,46 +208,21 @@ class AnophelesCnvData(
 
         with self._spinner("Access CNV HMM data"):
             debug("access CNV HMM data and concatenate as needed")
-            lx = []
-            for r in regions:
-                ly = []
-                for s in prepared_sample_sets:
-                    y = self._cnv_hmm_dataset(
-                        contig=r.contig,
-                        sample_set=s,
-                        inline_array=inline_array,
-                        chunks=chunks,
-                    )
-
-                    # If no CNV HMM dataset was found then skip
-                    if y is None:
-                        continue
-
-                    ly.append(y)
-
-                if len(ly) == 0:
-                    # Bail out, no data for given sample sets and analysis.
-                    raise ValueError("No data found for requested sample sets.")
-
-                debug("concatenate data from multiple sample sets")
-                x = _simple_xarray_concat(ly, dim=DIM_SAMPLE)
-
-                debug("handle region, do this only once - optimisation")
-                if r.start is not None or r.end is not None:
-                    start = x["variant_position"].values
-                    end = x["variant_end"].values
-                    index = pd.IntervalIndex.from_arrays(start, end, closed="both")
-                    # noinspection PyArgumentList
-                    other = pd.Interval(r.start, r.end, closed="both")
-                    loc_region = index.overlaps(other)  # type: ignore
-                    # Convert boolean mask to integer indices for NumPy 2.x compatibility
-                    variant_indices = np.where(loc_region)[0]
-                    x = x.isel(variants=variant_indices)
-
-                lx.append(x)
-
-            debug("concatenate data from multiple regions")
-            ds = _simple_xarray_concat(lx, dim=DIM_VARIANT)
+            ds = self._cached_dataset(
+                key=(
+                    "cnv_hmm",
+                    tuple(regions),
+                    tuple(prepared_sample_sets),
+                    inline_array,
+                    chunks,
+                ),
+                build=lambda: self._build_cnv_hmm(
+                    regions=regions,
+                    sample_sets=prepared_sample_sets,
+                    inline_array=inline_array,
+                    chunks=chunks,
+                ),
+            )
 
             debug("handle sample query")
             # If there's a sample query...
@@ -275,6 +250,52 @@ class AnophelesCnvData(
 
         return ds
 
+    def _build_cnv_hmm(
+        self, *, regions, sample_sets, inline_array, chunks
+    ) -> xr.Dataset:
+        debug = self._log.debug
+
+        lx = []
+        for r in regions:
+            ly = []
+            for s in sample_sets:
+                y = self._cnv_hmm_dataset(
+                    contig=r.contig,
+                    sample_set=s,
+                    inline_array=inline_array,
+                    chunks=chunks,
+                )
+
+                # If no CNV HMM dataset was found then skip
+                if y is None:
+                    continue
+
+                ly.append(y)
+
+            if len(ly) == 0:
+                # Bail out, no data for given sample sets and analysis.
+                raise ValueError("No data found for requested sample sets.")
+
+            debug("concatenate data from multiple sample sets")
+            x = _simple_xarray_concat(ly, dim=DIM_SAMPLE)
+
+            debug("handle region, do this only once - optimisation")
+            if r.start is not None or r.end is not None:
+                start = x["variant_position"].values
+                end = x["variant_end"].values
+                index = pd.IntervalIndex.from_arrays(start, end, closed="both")
+                # noinspection PyArgumentList
+                other = pd.Interval(r.start, r.end, closed="both")
+                loc_region = index.overlaps(other)  # type: ignore
+                # Convert boolean mask to integer indices for NumPy 2.x compatibility
+                variant_indices = np.where(loc_region)[0]
+                x = x.isel(variants=variant_indices)
+
+            lx.append(x)
+
+        debug("concatenate data from multiple regions")
+        return _simple_xarray_concat(lx, dim=DIM_VARIANT)
+
     @_check_types
     @doc(
         summary="Open CNV coverage calls zarr.",
@@ -9,9 +9,7 @@ import pandas as pd  # type: ignore
 from ..util import (
     CacheMiss,
     _check_types,
-    _multiallelic_diplotype_pdist,
-    _multiallelic_diplotype_mean_sqeuclidean,
-    _multiallelic_diplotype_mean_cityblock,
+    _multiallelic_diplotype_pairwise_distances,
 )
 from ..plotly_dendrogram import _plot_dendrogram
 from . import (
@@ -238,14 +236,15 @@ class AnophelesDipClustAnalysis(
         )
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._diplotype_pairwise_distances(
-                chunks=chunks, inline_array=inline_array, **params
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._diplotype_pairwise_distances(
+                    chunks=chunks, inline_array=inline_array, **params
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results")
         dist: np.ndarray = results["dist"]
@@ -271,9 +270,9 @@ class AnophelesDipClustAnalysis(
     ):
         metric = None  # To prevent using before assignment (Pylint).
         if distance_metric == "cityblock":
-            metric = _multiallelic_diplotype_mean_cityblock
+            metric = "cityblock"
         elif distance_metric == "euclidean":
-            metric = _multiallelic_diplotype_mean_sqeuclidean
+            metric = "sqeuclidean"
 
         # Load SNP data.
         ds_snps = self.snp_calls(
@@ -303,7 +302,7 @@ class AnophelesDipClustAnalysis(
 
         # Compute pairwise distances.
         with self._spinner(desc="Compute pairwise distances"):
-            dist = _multiallelic_diplotype_pdist(X, metric=metric)
+            dist = _multiallelic_diplotype_pairwise_distances(X, metric=metric)
 
         # Extract IDs of samples. Convert to "U" dtype here
         # to allow these to be saved to the results cache.
@@ -10,68 +10,96 @@ from numpydoc_decorator import doc  # type: ignore
 # Internal imports.
 from .snp_data import AnophelesSnpData
 from . import base_params, distance_params, plotly_params, pca_params, tree_params
-from ..util import _square_to_condensed, _check_types, CacheMiss
+from ..util import (
+    _condensed_offset,
+    _copy_condensed_distances,
+    _open_condensed_distances,
+    _pdist_condensed,
+    _pdist_tiles,
+    _square_to_condensed,
+    _check_types,
+    CacheMiss,
+)
 
 
-@numba.njit(parallel=True)
-def _biallelic_diplotype_pdist(X, distfun):
-    n_samples = X.shape[0]
-    n_pairs = (n_samples * (n_samples - 1)) // 2
-    out = np.zeros(n_pairs, dtype=np.float32)
-
-    # Loop over samples, first in pair.
-    for i in range(n_samples):
-        x = X[i, :]
-
-        # Loop over observations again, second in pair.
-        for j in numba.prange(i + 1, n_samples):
-            y = X[j, :]
-
-            # Compute distance for the current pair.
-            d = distfun(x, y)
-
-            # Store result for the current pair.
-            k = _square_to_condensed(i, j, n_samples)
-            out[k] = d
-
-    return out
-
-
-@numba.njit
-def _biallelic_diplotype_cityblock(x, y):
-    n_sites = x.shape[0]
-    distance = np.float32(0)
-
-    # Loop over sites.
-    for i in range(n_sites):
-        # Compute cityblock distance (absolute difference).
-        d = np.fabs(x[i] - y[i])
-
-        # Accumulate distance for the current pair.
-        distance += d
-
-    return distance
-
+# Number of sites to process at a time when computing pairwise distances.
+_PDIST_BLOCK_SIZE = 4096
 
-@numba.njit
-def _biallelic_diplotype_sqeuclidean(x, y):
-    n_sites = x.shape[0]
-    distance = np.float32(0)
-
-    # Loop over sites.
-    for i in range(n_sites):
-        # Compute squared euclidean distance.
-        d = (x[i] - y[i]) ** 2
-
-        # Accumulate distance for the current pair.
-        distance += d
-
-    return distance
 
+@numba.njit(parallel=True)
+def _biallelic_diplotype_pdist(
+    X, squared, root, tiles, tile_size, block_size, row_stop, k_offset, out
+):
+    n_samples = X.shape[0]
+    n_sites = X.shape[1]
+
+    # Loop over tiles of pairs of samples in parallel. Each tile covers a block
+    # of rows and a block of columns of the upper triangle of the distance
+    # matrix.
+    for t in numba.prange(tiles.shape[0]):
+        i_start = tiles[t, 0]
+        j_start = tiles[t, 1]
+        i_stop = min(i_start + tile_size, row_stop)
+        j_stop = min(j_start + tile_size, n_samples)
+        acc = np.zeros((tile_size, tile_size), dtype=np.int64)
+
+        # Loop over blocks of sites, so that diplotypes for the tile are reused
+        # while in the CPU cache. N.B., distances are accumulated as integers,
+        # so the result does not depend on the order of summation.
+        for k_start in range(0, n_sites, block_size):
+            k_stop = min(k_start + block_size, n_sites)
+            for i in range(i_start, i_stop):
+                x = X[i, k_start:k_stop]
+                for j in range(max(i + 1, j_start), j_stop):
+                    y = X[j, k_start:k_stop]
+                    d = 0
+                    if squared:
+                        for k in range(k_stop - k_start):
+                            z = np.int32(x[k]) - np.int32(y[k])
+                            d += z * z
+                    else:
+                        for k in range(k_stop - k_start):
+                            d += abs(np.int32(x[k]) - np.int32(y[k]))
+                    acc[i - i_start, j - j_start] += d
+
+        # Store results for the current tile.
+        for i in range(i_start, i_stop):
+            for j in range(max(i + 1, j_start), j_stop):
+                k = _square_to_condensed(i, j, n_samples) - k_offset
+                if root:
+                    out[k] = np.sqrt(np.float64(acc[i - i_start, j - j_start]))
+                else:
+                    out[k] = acc[i - i_start, j - j_start]
+
+
+def _biallelic_diplotype_pairwise_distances(X, metric, out=None):
+    """Compute pairwise distances between biallelic diplotypes, i.e., the
+    number of alternate alleles for each sample at each site, with axes in
+    the order (n_samples, n_sites). Returns a condensed distance matrix,
+    written into `out` if given, see also `_pdist_condensed()`."""
+    if metric not in ("cityblock", "sqeuclidean", "euclidean"):
+        raise ValueError("Unsupported metric.")
+
+    # Alternate allele counts for a diploid sample fit in 8 bits.
+    X = np.ascontiguousarray(X, dtype=np.int8)
+    n_samples = X.shape[0]
+    row_nbytes = min(X[:1].nbytes, _PDIST_BLOCK_SIZE)
+
+    def compute(row_start, row_stop, block):
+        tile_size, tiles = _pdist_tiles(n_samples, row_nbytes, row_start, row_stop)
+        _biallelic_diplotype_pdist(
+            X,
+            squared=metric != "cityblock",
+            root=metric == "euclidean",
+            tiles=tiles,
+            tile_size=tile_size,
+            block_size=_PDIST_BLOCK_SIZE,
+            row_stop=row_stop,
+            k_offset=_condensed_offset(row_start, n_samples),
+            out=block,
+        )
 
-@numba.njit
-def _biallelic_diplotype_euclidean(x, y):
-    return np.sqrt(_biallelic_diplotype_sqeuclidean(x, y))
+    return _pdist_condensed(compute, n_samples, dtype=np.float32, out=out)
 
 
 class AnophelesDistanceAnalysis(AnophelesSnpData):
@@ -108,6 +136,7 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         random_seed: base_params.random_seed = 42,
         inline_array: base_params.inline_array = base_params.inline_array_default,
         chunks: base_params.chunks = base_params.native_chunks,
+        dist_path: Optional[distance_params.dist_path] = None,
     ) -> Tuple[
         distance_params.dist, distance_params.samples, distance_params.n_snps_used
     ]:
@@ -159,17 +188,37 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         )
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
-
-        except CacheMiss:
-            results = self._biallelic_diplotype_pairwise_distances(
-                inline_array=inline_array, chunks=chunks, **params
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                if dist_path is None:
+                    results = self.results_cache_get(name=name, params=params)
+
+                else:
+                    # Stream cached distances to the requested location, block
+                    # by block, without loading the whole matrix into memory.
+                    with self.results_cache_open(name=name, params=params) as cached:
+                        dist = _open_condensed_distances(
+                            dist_path,
+                            n_obs=cached["samples"].shape[0],
+                            dtype=cached["dist"].dtype,
+                        )
+                        dist = _copy_condensed_distances(cached["dist"], dist)
+                        results = {
+                            k: dist if k == "dist" else np.asarray(v[...])
+                            for k, v in cached.items()
+                        }
+
+            except CacheMiss:
+                results = self._biallelic_diplotype_pairwise_distances(
+                    inline_array=inline_array,
+                    chunks=chunks,
+                    dist_path=dist_path,
+                    **params,
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results.
-        dist: np.ndarray = results["dist"]
+        dist = results["dist"]
         samples: np.ndarray = results["samples"]
         n_snps_used: int = int(results["n_snps"][()])  # ensure scalar
 
@@ -193,6 +242,7 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         random_seed,
         min_minor_ac,
         max_missing_an,
+        dist_path=None,
     ):
         # Compute diplotypes.
         gn, samples = self.biallelic_diplotypes(
@@ -219,18 +269,15 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         # Prepare data for pairwise distance calculation.
         X = np.ascontiguousarray(gn.T)
 
-        # Look up distance function.
-        if metric == "cityblock":
-            distfun = _biallelic_diplotype_cityblock
-        elif metric == "sqeuclidean":
-            distfun = _biallelic_diplotype_sqeuclidean
-        elif metric == "euclidean":
-            distfun = _biallelic_diplotype_euclidean
-        else:
-            raise ValueError("Unsupported metric.")
+        # Set up an array on disk to write distances to, if requested.
+        out = None
+        if dist_path is not None:
+            out = _open_condensed_distances(
+                dist_path, n_obs=X.shape[0], dtype=np.float32
+            )
 
         with self._spinner("Compute pairwise distances"):
-            dist = _biallelic_diplotype_pdist(X, distfun=distfun)
+            dist = _biallelic_diplotype_pairwise_distances(X, metric=metric, out=out)
 
         return dict(
             dist=dist,
@@ -272,6 +319,7 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         random_seed: base_params.random_seed = 42,
         inline_array: base_params.inline_array = base_params.inline_array_default,
         chunks: base_params.chunks = base_params.native_chunks,
+        dist_path: Optional[distance_params.dist_path] = None,
     ) -> Tuple[distance_params.Z, distance_params.samples, distance_params.n_snps_used]:
         # Change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data.
@@ -322,12 +370,18 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         )
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
-
-        except CacheMiss:
-            results = self._njt(inline_array=inline_array, chunks=chunks, **params)
-            self.results_cache_set(name=name, params=params, results=results)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                results = self._njt(
+                    inline_array=inline_array,
+                    chunks=chunks,
+                    dist_path=dist_path,
+                    **params,
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results.
         Z: np.ndarray = results["Z"]
@@ -355,11 +409,11 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
         random_seed,
         min_minor_ac,
         max_missing_an,
+        dist_path=None,
     ):
         # Only import anjl if needed, as it requires a couple of seconds to compile
         # functions.
         import anjl  # type: ignore
-        from scipy.spatial.distance import squareform  # type: ignore
 
         # Compute pairwise distances.
         dist, samples, n_snps = self.biallelic_diplotype_pairwise_distances(
@@ -379,8 +433,12 @@ class AnophelesDistanceAnalysis(AnophelesSnpData):
             max_missing_an=max_missing_an,
             min_minor_ac=min_minor_ac,
             thin_offset=thin_offset,
+            dist_path=dist_path,
         )
-        D = squareform(dist)
+
+        # N.B., anjl accepts a condensed distance matrix, so avoid converting to
+        # square form here. Only the "rapid" algorithm requires square form.
+        D = dist
 
         # anjl supports passing in a progress bar function to get progress on the
         # neighbour-joining iterations.
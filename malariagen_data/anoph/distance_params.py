@@ -1,8 +1,9 @@
-from typing import Literal
+from typing import Literal, Union
 
 from typing_extensions import Annotated, TypeAlias
 
 import numpy as np
+import zarr  # type: ignore
 
 distance_metric: TypeAlias = Annotated[
     Literal[
@@ -23,9 +24,23 @@ nj_algorithm: TypeAlias = Annotated[
 default_nj_algorithm: nj_algorithm = "dynamic"
 
 dist: TypeAlias = Annotated[
-    np.ndarray,
+    Union[np.ndarray, zarr.Array],
+    """
+    An array containing the distance between each pair of samples, as a
+    condensed distance matrix. By default this is a numpy array held in
+    memory. If `dist_path` was given, this is a numpy memory-mapped array, or
+    a zarr array if the path ends with ".zarr", stored at that path.
+    """,
+]
+
+dist_path: TypeAlias = Annotated[
+    str,
     """
-    A numpy array containing the distance between each pair of samples.
+    Path to a file to write pairwise distances to, rather than holding them in
+    memory, which may be useful for large numbers of samples. If the path ends
+    with ".zarr", distances are computed in blocks and written to a zarr array,
+    otherwise distances are written to a numpy memory-mapped array in ".npy"
+    format. Any existing data at this path will be overwritten.
     """,
 ]
 
@@ -87,3 +87,19 @@ taxon_by: TypeAlias = Annotated[
 ]
 
 taxon_by_default: taxon_by = "taxon"
+
+snp_effects_store: TypeAlias = Annotated[
+    str,
+    """
+    Path to a zarr store of precomputed SNP effects, as created by
+    `build_snp_effects_store()`. Can be a local path or a URL supported by
+    fsspec.
+    """,
+]
+
+n_workers: TypeAlias = Annotated[
+    int,
+    """
+    Number of worker processes to use. Defaults to the number of CPUs.
+    """,
+]
@@ -44,32 +44,21 @@ class AnophelesFstAnalysis(
         chunks,
         clip_min,
     ):
-        # Compute allele counts.
-        ac1 = self.snp_allele_counts(
+        # Compute allele counts, reading genotype calls once for both cohorts.
+        ac1, ac2 = self._snp_allele_counts_for_queries(
             region=contig,
-            sample_query=cohort1_query,
-            sample_query_options=sample_query_options,
-            sample_sets=sample_sets,
-            site_mask=site_mask,
-            cohort_size=cohort_size,
-            min_cohort_size=min_cohort_size,
-            max_cohort_size=max_cohort_size,
-            random_seed=random_seed,
-            inline_array=inline_array,
-            chunks=chunks,
-        )
-        ac2 = self.snp_allele_counts(
-            region=contig,
-            sample_query=cohort2_query,
+            sample_queries=[cohort1_query, cohort2_query],
             sample_query_options=sample_query_options,
             sample_sets=sample_sets,
             site_mask=site_mask,
+            site_class=None,
             cohort_size=cohort_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             random_seed=random_seed,
             inline_array=inline_array,
             chunks=chunks,
+            engine=None,
         )
 
         with self._spinner(desc="Load SNP positions"):
@@ -143,12 +132,15 @@ class AnophelesFstAnalysis(
             clip_min=clip_min,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._fst_gwss(**params, inline_array=inline_array, chunks=chunks)
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._fst_gwss(
+                    **params, inline_array=inline_array, chunks=chunks
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         x = results["x"]
         fst = results["fst"]
@@ -378,48 +370,23 @@ class AnophelesFstAnalysis(
         random_seed: base_params.random_seed = 42,
     ) -> Tuple[float, float]:
         # Calculate allele counts for each cohort.
-        ac1 = self.snp_allele_counts(
+        ac1, ac2 = self._snp_allele_counts_for_queries(
             region=region,
-            sample_sets=sample_sets,
-            sample_query=cohort1_query,
+            sample_queries=[cohort1_query, cohort2_query],
             sample_query_options=sample_query_options,
-            cohort_size=cohort_size,
-            site_mask=site_mask,
-            site_class=site_class,
-            min_cohort_size=min_cohort_size,
-            max_cohort_size=max_cohort_size,
-            random_seed=random_seed,
-        )
-        ac2 = self.snp_allele_counts(
-            region=region,
             sample_sets=sample_sets,
-            sample_query=cohort2_query,
-            sample_query_options=sample_query_options,
-            cohort_size=cohort_size,
             site_mask=site_mask,
             site_class=site_class,
+            cohort_size=cohort_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             random_seed=random_seed,
+            inline_array=base_params.inline_array_default,
+            chunks=base_params.native_chunks,
+            engine=None,
         )
 
-        # Calculate block length for jackknife.
-        n_sites = ac1.shape[0]  # number of sites
-        block_length = n_sites // n_jack  # number of sites in each block
-
-        # Calculate average Fst.
-        fst, se, _, _ = allel.blockwise_hudson_fst(ac1, ac2, blen=block_length)
-
-        # Normalise to Python scalar types.
-        fst = float(fst)
-        se = float(se)
-
-        # Fst estimate can sometimes be slightly negative, but clip at
-        # zero.
-        if fst < 0:
-            fst = 0.0
-
-        return fst, se
+        return _average_fst(ac1, ac2, n_jack=n_jack)
 
     @_check_types
     @doc(
@@ -463,22 +430,27 @@ class AnophelesFstAnalysis(
         fst_stats = []
         se_stats = []
 
+        # Calculate allele counts for all cohorts, reading genotype calls once.
+        acs = self._snp_allele_counts_for_queries(
+            region=region,
+            sample_queries=cohort_queries,
+            sample_query_options=sample_query_options,
+            sample_sets=sample_sets,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+            inline_array=base_params.inline_array_default,
+            chunks=base_params.native_chunks,
+            engine=None,
+        )
+
         n_cohorts = len(cohorts_checked)
         for i in range(n_cohorts):
             for j in range(i + 1, n_cohorts):
-                (fst, se) = self.average_fst(
-                    region=region,
-                    cohort1_query=cohort_queries[i],
-                    cohort2_query=cohort_queries[j],
-                    sample_sets=sample_sets,
-                    cohort_size=cohort_size,
-                    min_cohort_size=min_cohort_size,
-                    max_cohort_size=max_cohort_size,
-                    n_jack=n_jack,
-                    site_mask=site_mask,
-                    site_class=site_class,
-                    random_seed=random_seed,
-                )
+                (fst, se) = _average_fst(acs[i], acs[j], n_jack=n_jack)
                 cohort1_ids.append(cohort_ids[i])
                 cohort2_ids.append(cohort_ids[j])
                 fst_stats.append(fst)
@@ -584,3 +556,23 @@ class AnophelesFstAnalysis(
             return None
         else:
             return fig
+
+
+def _average_fst(ac1, ac2, *, n_jack):
+    # Calculate block length for jackknife.
+    n_sites = ac1.shape[0]  # number of sites
+    block_length = n_sites // n_jack  # number of sites in each block
+
+    # Calculate average Fst.
+    fst, se, _, _ = allel.blockwise_hudson_fst(ac1, ac2, blen=block_length)
+
+    # Normalise to Python scalar types.
+    fst = float(fst)
+    se = float(se)
+
+    # Fst estimate can sometimes be slightly negative, but clip at
+    # zero.
+    if fst < 0:
+        fst = 0.0
+
+    return fst, se
@@ -1,14 +1,23 @@
+from contextlib import ExitStack
 from collections import Counter
-from typing import Optional, Tuple, Dict, Mapping
+from typing import Optional, Tuple, Dict, Iterator, List, Mapping
 
 import allel  # type: ignore
 import numpy as np
+import pandas as pd
 from numpydoc_decorator import doc  # type: ignore
 import bokeh.plotting
 
 from .snp_data import AnophelesSnpData
 from .hap_data import AnophelesHapData
-from ..util import _hash_columns, _check_types, CacheMiss
+from ..util import (
+    _hash_columns,
+    _check_types,
+    CacheMiss,
+    _moving_garud_h,
+    _moving_garud_h_stream,
+    _MovingGarudHStream,
+)
 from . import base_params
 from . import g123_params, gplt_params
 
@@ -34,73 +43,126 @@ class AnophelesG123Analysis(
         # to the superclass constructor.
         super().__init__(**kwargs)
 
-    def _load_data_for_g123(
+    def _g123_blocks_multi(
         self,
         *,
         contig,
         sites,
         site_mask,
         sample_sets,
-        sample_query,
+        sample_queries: Mapping[str, Optional[str]],
         sample_query_options,
         min_cohort_size,
         max_cohort_size,
         random_seed,
         inline_array,
         chunks,
-    ):
-        ds_snps = self.snp_calls(
+    ) -> Iterator[Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+        """Iterate over chunks of genotypes and positions along a contig, for
+        the sites to be used for G123 calculation, for multiple cohorts. Each
+        chunk of genotypes is read only once, and a dictionary mapping cohort
+        labels to genotypes and positions is yielded for each chunk."""
+        ds_all = self.snp_calls(
             region=contig,
-            sample_query=sample_query,
-            sample_query_options=sample_query_options,
             sample_sets=sample_sets,
             site_mask=site_mask,
-            min_cohort_size=min_cohort_size,
-            max_cohort_size=max_cohort_size,
-            random_seed=random_seed,
             inline_array=inline_array,
             chunks=chunks,
         )
 
-        with self._dask_progress(desc="Load genotypes"):
-            gt = ds_snps["call_genotype"].data.compute()
+        # Locate samples for each cohort. N.B., this is lazy, so no
+        # genotype data are read here.
+        sample_index = pd.Index(ds_all["sample_id"].values)
+        loc_cohorts = dict()
+        for cohort_label, sample_query in sample_queries.items():
+            ds = self.snp_calls(
+                region=contig,
+                sample_query=sample_query,
+                sample_query_options=sample_query_options,
+                sample_sets=sample_sets,
+                site_mask=site_mask,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+                inline_array=inline_array,
+                chunks=chunks,
+            )
+            loc_cohorts[cohort_label] = sample_index.get_indexer(ds["sample_id"].values)
+
+        # Only read samples in any of the cohorts.
+        loc_union = np.unique(np.concatenate(list(loc_cohorts.values())))
+        loc_cohorts = {
+            cohort_label: np.searchsorted(loc_union, loc)
+            for cohort_label, loc in loc_cohorts.items()
+        }
+        gt_dask = ds_all["call_genotype"].data[:, loc_union]
 
         with self._dask_progress(desc="Load SNP positions"):
-            pos = ds_snps["variant_position"].data.compute()
+            pos_all = ds_all["variant_position"].data.compute()
 
+        haplotype_pos = None
         if sites in self.phasing_analysis_ids:
             # Here we use sites from a phasing analysis. This is effectively
             # using a set of sites ascertained as polymorphic in whatever panel
             # of samples was used to set up the phasing analysis.
-            with self._spinner("Subsetting to selected sites"):
-                haplotype_pos = self.haplotype_sites(
-                    region=contig,
-                    analysis=sites,
-                    field="POS",
-                    inline_array=True,
-                    chunks="native",
-                ).compute()
-                hap_site_mask = np.isin(pos, haplotype_pos, assume_unique=True)
-                pos = pos[hap_site_mask]
-                gt = gt.compress(hap_site_mask, axis=0)
-
-        elif sites == "segregating":
-            # Here we use sites which are segregating within the samples
-            # to be analysed. This is sometimes less preferable, because
-            # a selective sweep can cause a deficit of segregating sites,
-            # but windows for G123 calculation use a fixed number of SNPs.
-            # This means that windows spanning a selective sweep can end
-            # up covering a larger genome region, which in turn can weaken
-            # the signal of a selective sweep. Hence it is generally better
-            # to use sites ascertained as polymorphic in a different population
-            # or panel of populations, for which using a phasing analysis is
-            # a proxy.
-            with self._spinner("Subsetting to segregating sites"):
-                ac = allel.GenotypeArray(gt).count_alleles(max_allele=3)
-                seg = ac.is_segregating()
-                pos = pos[seg]
-                gt = gt.compress(seg, axis=0)
-
+            haplotype_pos = self.haplotype_sites(
+                region=contig,
+                analysis=sites,
+                field="POS",
+                inline_array=True,
+                chunks="native",
+            ).compute()
+
+        offset = 0
+        for i in self._progress(range(gt_dask.numblocks[0]), desc="Load genotypes"):
+            gt_block = gt_dask.blocks[i].compute()
+            pos_block = pos_all[offset : offset + gt_block.shape[0]]
+            offset += gt_block.shape[0]
+
+            hap_site_mask = None
+            if haplotype_pos is not None:
+                hap_site_mask = np.isin(pos_block, haplotype_pos, assume_unique=True)
+
+            out = dict()
+            for cohort_label, loc in loc_cohorts.items():
+                gt = gt_block[:, loc]
+                pos = pos_block
+
+                if hap_site_mask is not None:
+                    pos = pos[hap_site_mask]
+                    gt = gt.compress(hap_site_mask, axis=0)
+
+                elif sites == "segregating":
+                    # Here we use sites which are segregating within the samples
+                    # to be analysed. This is sometimes less preferable, because
+                    # a selective sweep can cause a deficit of segregating sites,
+                    # but windows for G123 calculation use a fixed number of SNPs.
+                    # This means that windows spanning a selective sweep can end
+                    # up covering a larger genome region, which in turn can weaken
+                    # the signal of a selective sweep. Hence it is generally better
+                    # to use sites ascertained as polymorphic in a different
+                    # population or panel of populations, for which using a
+                    # phasing analysis is a proxy.
+                    ac = allel.GenotypeArray(gt).count_alleles(max_allele=3)
+                    seg = ac.is_segregating()
+                    pos = pos[seg]
+                    gt = gt.compress(seg, axis=0)
+
+                out[cohort_label] = gt, pos
+
+            yield out
+
+    def _g123_blocks(self, *, sample_query, **kwargs):
+        """Iterate over chunks of genotypes and positions along a contig, for
+        the sites to be used for G123 calculation."""
+        blocks = self._g123_blocks_multi(sample_queries={"": sample_query}, **kwargs)
+        for block in blocks:
+            yield block[""]
+
+    def _load_data_for_g123(self, **kwargs):
+        blocks = list(self._g123_blocks(**kwargs))
+        gt = np.concatenate([gt for gt, _ in blocks])
+        pos = np.concatenate([pos for _, pos in blocks])
         return gt, pos
 
     def _g123_gwss(
@@ -119,7 +181,10 @@ class AnophelesG123Analysis(
         inline_array,
         chunks,
     ):
-        gt, pos = self._load_data_for_g123(
+        # Compute G123, streaming chunks of genotypes along the contig, so
+        # that the genotypes for the whole contig are never loaded into
+        # memory at once.
+        blocks = self._g123_blocks(
             contig=contig,
             sites=sites,
             site_mask=site_mask,
@@ -132,10 +197,16 @@ class AnophelesG123Analysis(
             inline_array=inline_array,
             chunks=chunks,
         )
+        l_pos = []
+
+        def diplotype_blocks():
+            for gt, pos in blocks:
+                l_pos.append(pos)
+                yield _diplotypes(gt)
 
-        with self._spinner("Compute G123"):
-            g123 = allel.moving_statistic(gt, statistic=_garud_g123, size=window_size)
-            x = allel.moving_statistic(pos, statistic=np.mean, size=window_size)
+        g123 = _moving_garud_h_stream(diplotype_blocks(), size=window_size, n_pooled=3)
+        pos = np.concatenate(l_pos)
+        x = allel.moving_statistic(pos, statistic=np.mean, size=window_size)
 
         results = dict(x=x, g123=g123)
 
@@ -168,6 +239,48 @@ class AnophelesG123Analysis(
         inline_array: base_params.inline_array = base_params.inline_array_default,
         chunks: base_params.chunks = base_params.native_chunks,
     ) -> Tuple[np.ndarray, np.ndarray]:
+        name, params = self._prep_g123_gwss_params(
+            contig=contig,
+            sites=sites,
+            site_mask=site_mask,
+            window_size=window_size,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                results = self._g123_gwss(
+                    inline_array=inline_array, chunks=chunks, **params
+                )
+                self.results_cache_set(name=name, params=params, results=results)
+
+        x = results["x"]
+        g123 = results["g123"]
+
+        return x, g123
+
+    def _prep_g123_gwss_params(
+        self,
+        *,
+        contig,
+        sites,
+        site_mask,
+        window_size,
+        sample_sets,
+        sample_query,
+        sample_query_options,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+    ):
         # Change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data.
         name = "g123_gwss_v1"
@@ -194,19 +307,181 @@ class AnophelesG123Analysis(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        return name, params
+
+    def _g123_gwss_multi(
+        self,
+        *,
+        contig,
+        sites,
+        site_mask,
+        window_sizes: Mapping[str, int],
+        sample_sets,
+        sample_queries: Mapping[str, Optional[str]],
+        sample_query_options,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        inline_array,
+        chunks,
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        blocks = self._g123_blocks_multi(
+            contig=contig,
+            sites=sites,
+            site_mask=site_mask,
+            sample_sets=sample_sets,
+            sample_queries=sample_queries,
+            sample_query_options=sample_query_options,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+            inline_array=inline_array,
+            chunks=chunks,
+        )
 
-        except CacheMiss:
-            results = self._g123_gwss(
-                inline_array=inline_array, chunks=chunks, **params
+        # Compute G123 for all cohorts, streaming chunks of genotypes along
+        # the contig.
+        streams = {
+            cohort_label: _MovingGarudHStream(size=window_size, n_pooled=3)
+            for cohort_label, window_size in window_sizes.items()
+        }
+        l_pos: Dict[str, List[np.ndarray]] = {k: [] for k in window_sizes}
+        for block in blocks:
+            for cohort_label, (gt, pos) in block.items():
+                streams[cohort_label].update(_diplotypes(gt))
+                l_pos[cohort_label].append(pos)
+
+        results = dict()
+        for cohort_label, stream in streams.items():
+            pos = np.concatenate(l_pos[cohort_label])
+            x = allel.moving_statistic(
+                pos, statistic=np.mean, size=window_sizes[cohort_label]
             )
-            self.results_cache_set(name=name, params=params, results=results)
+            results[cohort_label] = dict(x=x, g123=stream.result())
 
-        x = results["x"]
-        g123 = results["g123"]
+        return results
 
-        return x, g123
+    @_check_types
+    @doc(
+        summary="Run G123 genome-wide selection scans for multiple cohorts.",
+        returns="""
+            A dictionary mapping cohort labels to tuples of window centre
+            positions and G123 values for each window, as returned by
+            `g123_gwss()`.
+        """,
+        notes="""
+            This gives the same results as calling `g123_gwss()` for each
+            cohort, but is much faster for many cohorts, because genotypes are
+            only read and decompressed once. Results for each cohort are cached
+            as for `g123_gwss()`, so subsequent calls to `g123_gwss()` for any
+            of the cohorts will re-use them, if the `results_cache` parameter
+            was set when instantiating the class.
+        """,
+    )
+    def g123_gwss_multi(
+        self,
+        contig: base_params.contig,
+        cohorts: base_params.cohorts,
+        window_size: g123_params.multi_window_size,
+        sites: g123_params.sites = g123_params.DEFAULT_SITE_PARAMETER,
+        site_mask: Optional[base_params.site_mask] = base_params.DEFAULT,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        min_cohort_size: Optional[
+            base_params.min_cohort_size
+        ] = g123_params.min_cohort_size_default,
+        max_cohort_size: Optional[
+            base_params.max_cohort_size
+        ] = g123_params.max_cohort_size_default,
+        random_seed: base_params.random_seed = 42,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+        chunks: base_params.chunks = base_params.native_chunks,
+    ) -> Mapping[str, Tuple[np.ndarray, np.ndarray]]:
+        cohort_queries = self._setup_cohort_queries(
+            cohorts=cohorts,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            cohort_size=None,
+            min_cohort_size=None,
+        )
+
+        if isinstance(window_size, int):
+            window_size = {k: window_size for k in cohort_queries.keys()}
+        elif isinstance(window_size, Mapping):
+            if set(window_size.keys()) != set(cohort_queries.keys()):
+                raise ValueError("Cohorts and window_sizes should have the same keys.")
+
+        all_params = dict()
+        for cohort_label, cohort_query in cohort_queries.items():
+            name, params = self._prep_g123_gwss_params(
+                contig=contig,
+                sites=sites,
+                site_mask=site_mask,
+                window_size=window_size[cohort_label],
+                sample_sets=sample_sets,
+                sample_query=cohort_query,
+                sample_query_options=sample_query_options,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
+            all_params[cohort_label] = params
+
+        all_results = dict()
+        with ExitStack() as stack:
+            # Look for results in the cache, taking the lock for each cohort.
+            # N.B., take locks in a consistent order, to avoid deadlocks
+            # between workers computing overlapping sets of cohorts.
+            order = sorted(
+                all_params,
+                key=lambda k: self._results_cache_key(name=name, params=all_params[k]),
+            )
+            for cohort_label in order:
+                stack.enter_context(
+                    self.results_cache_lock(name=name, params=all_params[cohort_label])
+                )
+                try:
+                    all_results[cohort_label] = self.results_cache_get(
+                        name=name, params=all_params[cohort_label]
+                    )
+                except CacheMiss:
+                    pass
+
+            # Compute any missing results in a single pass.
+            missing = [k for k in cohort_queries if k not in all_results]
+            if missing:
+                # N.B., parameters other than the sample query and window size
+                # are shared.
+                params = all_params[missing[0]]
+                computed = self._g123_gwss_multi(
+                    contig=contig,
+                    sites=sites,
+                    site_mask=site_mask,
+                    window_sizes={k: all_params[k]["window_size"] for k in missing},
+                    sample_sets=params["sample_sets"],
+                    sample_queries={k: all_params[k]["sample_query"] for k in missing},
+                    sample_query_options=sample_query_options,
+                    min_cohort_size=min_cohort_size,
+                    max_cohort_size=max_cohort_size,
+                    random_seed=random_seed,
+                    inline_array=inline_array,
+                    chunks=chunks,
+                )
+                for cohort_label, results in computed.items():
+                    self.results_cache_set(
+                        name=name, params=all_params[cohort_label], results=results
+                    )
+                    all_results[cohort_label] = results
+
+        return {
+            cohort_label: (
+                all_results[cohort_label]["x"],
+                all_results[cohort_label]["g123"],
+            )
+            for cohort_label in cohort_queries.keys()
+        }
 
     def _g123_calibration(
         self,
@@ -238,9 +513,14 @@ class AnophelesG123Analysis(
             chunks=chunks,
         )
 
+        # Compute all window sizes from a single pass over the genotypes.
+        timings: Dict[int, float] = dict()
+        with self._spinner(desc="Compute G123"):
+            g123s = _moving_g123(gt, window_sizes=window_sizes, timings=timings)
+
         calibration_runs: Dict[str, np.ndarray] = dict()
-        for window_size in self._progress(window_sizes, desc="Compute G123"):
-            g123 = allel.moving_statistic(gt, statistic=_garud_g123, size=window_size)
+        for window_size, g123 in zip(window_sizes, g123s):
+            self._log.debug(f"window size {window_size}: {timings[window_size]:.3f}s")
             calibration_runs[str(window_size)] = g123
 
         return calibration_runs
@@ -298,14 +578,17 @@ class AnophelesG123Analysis(
             random_seed=random_seed,
         )
 
-        try:
-            calibration_runs = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                calibration_runs = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            calibration_runs = self._g123_calibration(
-                inline_array=inline_array, chunks=chunks, **params
-            )
-            self.results_cache_set(name=name, params=params, results=calibration_runs)
+            except CacheMiss:
+                calibration_runs = self._g123_calibration(
+                    inline_array=inline_array, chunks=chunks, **params
+                )
+                self.results_cache_set(
+                    name=name, params=params, results=calibration_runs
+                )
 
         return calibration_runs
 
@@ -620,6 +903,23 @@ def _diplotype_frequencies(gt):
     return freqs
 
 
+def _moving_g123(gt, window_sizes, timings=None):
+    """Compute Garud's G123 in moving windows of each of the given sizes,
+    in a single pass over the genotypes."""
+
+    x = _diplotypes(gt)
+    return _moving_garud_h(x, sizes=window_sizes, n_pooled=3, timings=timings)
+
+
+def _diplotypes(gt):
+    """Combine the two int8 alleles in each genotype call into a single int16,
+    so that diplotypes can be hashed in the same way as haplotypes."""
+    gt = np.ascontiguousarray(gt)
+    m = gt.shape[0]
+    n = gt.shape[1]
+    return gt.view(np.int16).reshape((m, n))
+
+
 def _garud_g123(gt):
     """Compute Garud's G123."""
 
@@ -1,6 +1,6 @@
 """Parameter definitions for G123 analysis functions."""
 
-from typing import Sequence
+from typing import Sequence, Union
 
 from typing_extensions import Annotated, TypeAlias
 
@@ -34,6 +34,16 @@ window_size: TypeAlias = Annotated[
     """,
 ]
 
+multi_window_size: TypeAlias = Annotated[
+    Union[window_size, dict[str, int]],
+    """
+    The size of windows (number of sites) used to calculate statistics within. Can
+    be a single value, in which case the same window size will be used for all
+    cohorts. Can also be a mapping from cohort identifiers to values, in case
+    you need to provide different window sizes for different cohorts.
+    """,
+]
+
 DEFAULT_SITE_PARAMETER: sites = "segregating"
 
 min_cohort_size_default: base_params.min_cohort_size = 20
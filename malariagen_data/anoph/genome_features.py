@@ -1,4 +1,4 @@
-from typing import Dict, Optional, Tuple, Mapping
+from typing import Any, Dict, Optional, Tuple, Mapping
 
 import bokeh.models
 import bokeh.plotting
@@ -8,8 +8,14 @@ from numpydoc_decorator import doc  # type: ignore
 from pandas.io.common import infer_compression  # type: ignore
 
 from ..util import (
+    CacheMiss,
     Region,
+    _GenomeFeaturesIndex,
+    _arrays_to_gff3,
     _check_types,
+    _gff3_attributes_dicts,
+    _gff3_attributes_table,
+    _gff3_to_arrays,
     _parse_multi_region,
     _parse_single_region,
     _read_gff3,
@@ -47,6 +53,13 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
 
         # Setup caches.
         self._cache_genome_features: Dict[Tuple[str, ...], pd.DataFrame] = dict()
+        self._cache_genome_features_index: Dict[
+            Tuple[str, ...], _GenomeFeaturesIndex
+        ] = dict()
+        self._cache_genome_features_gff3: Optional[
+            Tuple[pd.DataFrame, pd.DataFrame]
+        ] = None
+        self._cache_geneset_gff3_params: Optional[Dict[str, Any]] = None
 
     @property
     def _geneset_gff3_path(self):
@@ -56,29 +69,98 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
         """Deprecated, this method has been renamed to genome_features()."""
         return self.genome_features(*args, **kwargs)
 
+    def _geneset_gff3_params(self) -> Dict[str, Any]:
+        """Identify the GFF3 file by its path and version, for use in results
+        cache parameters."""
+        if self._cache_geneset_gff3_params is None:
+            path = f"{self._base_path}/{self._geneset_gff3_path}"
+            info = self._fs.info(path)
+            self._cache_geneset_gff3_params = dict(
+                path=path,
+                version={
+                    k: str(info[k])
+                    for k in ("etag", "ETag", "md5Hash", "generation", "mtime", "size")
+                    if k in info
+                },
+            )
+        return self._cache_geneset_gff3_params
+
+    def _genome_features_gff3(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Read and parse the GFF3 file, returning a dataframe of features
+        without attributes, and a long table of attributes. If a results cache
+        is configured, the parsed data are stored there, keyed by the path and
+        version of the file, so that other processes can load them quickly."""
+        if self._cache_genome_features_gff3 is not None:
+            return self._cache_genome_features_gff3
+
+        path = f"{self._base_path}/{self._geneset_gff3_path}"
+
+        # Change this name if you ever change the behaviour of this function, to
+        # invalidate any previously cached data.
+        name = "genome_features_gff3_v1"
+        params = self._geneset_gff3_params()
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+                df, table = _arrays_to_gff3(results)
+
+            except CacheMiss:
+                compression = infer_compression(path, compression="infer")
+                with self._fs.open(path, mode="rb") as f:
+                    df = _read_gff3(f, compression=compression, parse_attributes=False)
+                table = _gff3_attributes_table(df.pop("attributes"))
+                self.results_cache_set(
+                    name=name, params=params, results=_gff3_to_arrays(df, table)
+                )
+
+        self._cache_genome_features_gff3 = df, table
+        return df, table
+
     def _genome_features(self, *, attributes: Tuple[str, ...]):
         try:
             df = self._cache_genome_features[attributes]
 
         except KeyError:
-            path = f"{self._base_path}/{self._geneset_gff3_path}"
-            compression = infer_compression(path, compression="infer")
-            with self._fs.open(path, mode="rb") as f:
-                df = _read_gff3(f, compression=compression)
+            df, table = self._genome_features_gff3()
             if attributes:
-                df = _unpack_gff3_attributes(df, attributes=attributes)
+                df = _unpack_gff3_attributes(df, attributes=attributes, table=table)
+            else:
+                df = df.assign(attributes=_gff3_attributes_dicts(len(df), table))
             self._cache_genome_features[attributes] = df
 
         return df
 
-    def _genome_features_for_contig(self, *, contig: str, attributes: Tuple[str, ...]):
+    def _genome_features_index(
+        self, *, attributes: Tuple[str, ...]
+    ) -> _GenomeFeaturesIndex:
+        try:
+            index = self._cache_genome_features_index[attributes]
+
+        except KeyError:
+            df = self._genome_features(attributes=attributes)
+            index = _GenomeFeaturesIndex(df)
+            self._cache_genome_features_index[attributes] = index
+
+        return index
+
+    def _genome_features_for_region(
+        self, *, region: Region, attributes: Tuple[str, ...]
+    ) -> pd.DataFrame:
+        index = self._genome_features_index(attributes=attributes)
+
         # Handle virtual contigs.
-        if contig in self.virtual_contigs:
-            contigs = self.virtual_contigs[contig]
+        if region.contig in self.virtual_contigs:
+            contigs = self.virtual_contigs[region.contig]
             dfs = []
             offset = 0
             for c in contigs:
-                dfc = self._genome_features_for_contig(contig=c, attributes=attributes)
+                loc = index.locate_overlapping(
+                    contig=c,
+                    start=None if region.start is None else region.start - offset,
+                    end=None if region.end is None else region.end - offset,
+                )
+                dfc = index.df.iloc[loc]
                 if offset > 0:
                     dfc = dfc.assign(
                         start=lambda x: x.start + offset,
@@ -91,17 +173,16 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
             df = pd.concat(dfs, axis=0)
 
             # Assign name of the virtual contig.
-            df = df.assign(contig=contig)
+            df = df.assign(contig=region.contig)
             return df
 
         # Handle normal contigs in the reference genome.
         else:
-            assert contig in self.contigs
-            df = self._genome_features(attributes=attributes)
-
-            # Apply contig query.
-            df = df.query(f"contig == '{contig}'")
-            return df
+            assert region.contig in self.contigs
+            loc = index.locate_overlapping(
+                contig=region.contig, start=region.start, end=region.end
+            )
+            return index.df.iloc[loc]
 
     def _prep_gff_attributes(
         self, attributes: base_params.gff_attributes
@@ -138,25 +219,18 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
                 del region
 
                 debug("Apply region query.")
-                parts = []
-                for r in regions:
-                    df_part = self._genome_features_for_contig(
-                        contig=r.contig, attributes=attributes_normed
+                parts = [
+                    self._genome_features_for_region(
+                        region=r, attributes=attributes_normed
                     )
-                    if r.end is not None:
-                        df_part = df_part.query(f"start <= {r.end}")
-                    if r.start is not None:
-                        df_part = df_part.query(f"end >= {r.start}")
-                    parts.append(df_part)
+                    for r in regions
+                ]
                 df = pd.concat(parts, axis=0)
-                return df.sort_values(["contig", "start"]).reset_index(drop=True).copy()
+                if len(parts) > 1:
+                    df = df.sort_values(["contig", "start"])
+                return df.reset_index(drop=True).copy()
 
-            return (
-                self._genome_features(attributes=attributes_normed)
-                .sort_values(["contig", "start"])
-                .reset_index(drop=True)
-                .copy()
-            )
+            return self._genome_features_index(attributes=attributes_normed).df.copy()
 
     def genome_feature_children(
         self, parent: str, attributes: base_params.gff_attributes = base_params.DEFAULT
@@ -166,18 +240,12 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
         if "Parent" not in attributes_normed:
             attributes_normed += ("Parent",)
 
-        # Obtain dataframe of all genome features.
-        df_gf = self._genome_features(attributes=attributes_normed).copy()
+        # Locate children of the requested parent.
+        index = self._genome_features_index(attributes=attributes_normed)
+        loc = index.locate_children(parent)
+        df_children = index.df.iloc[loc].assign(Parent=parent)
 
-        # Split the Parent column and explode.
-        # See also https://github.com/malariagen/malariagen-data-python/issues/334
-        df_gf["Parent"] = df_gf["Parent"].str.split(",")
-        df_gf = df_gf.explode(column="Parent", ignore_index=True)
-
-        # Query to find children of the requested parent.
-        df_children = df_gf.query(f"Parent == '{parent}'")
-
-        return df_children.copy()
+        return df_children.reset_index(drop=True)
 
     @_check_types
     @doc(summary="Plot a transcript, using bokeh.")
@@ -538,19 +606,21 @@ class AnophelesGenomeFeaturesData(AnophelesGenomeSequenceData):
         fig.xaxis[0].formatter = bokeh.models.NumeralTickFormatter(format="0,0")
 
     def _transcript_to_parent_name(self, transcript):
-        df_genome_features = self.genome_features().set_index("ID")
+        index = self._genome_features_index(attributes=self._gff_default_attributes)
 
-        try:
-            rec_transcript = df_genome_features.loc[transcript]
-        except KeyError:
+        loc_transcript = index.locate_id(transcript)
+        if len(loc_transcript) == 0:
             return None
 
-        parent_id = rec_transcript["Parent"]
+        parent_id = index.df["Parent"].iloc[loc_transcript[0]]
 
         try:
             # Manual override.
             return self._gene_name_overrides[parent_id]
         except KeyError:
-            rec_parent = df_genome_features.loc[parent_id]
+            loc_parent = index.locate_id(parent_id)
+            if len(loc_parent) == 0:
+                raise
+            rec_parent = index.df.iloc[loc_parent[0]]
             # Try to access gene name attribute, fall back to "ID" if not present.
             return rec_parent.get(self._gff_gene_name_attribute, parent_id)
@@ -116,8 +116,12 @@ class AnophelesGenomeSequenceData(AnophelesBase):
         del region
 
         # Obtain complete sequence for the requested contig.
-        d = self._genome_sequence_for_contig(
-            contig=resolved_region.contig, inline_array=inline_array, chunks=chunks
+        contig = resolved_region.contig
+        d = self._cached_dataset(
+            key=("genome_sequence", contig, inline_array, chunks),
+            build=lambda: self._genome_sequence_for_contig(
+                contig=contig, inline_array=inline_array, chunks=chunks
+            ),
         )
 
         # Deal with region start and stop.
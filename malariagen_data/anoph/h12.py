@@ -1,3 +1,4 @@
+from contextlib import ExitStack
 from typing import Optional, Tuple, Dict, Mapping
 
 import allel  # type: ignore
@@ -6,7 +7,14 @@ from numpydoc_decorator import doc  # type: ignore
 import bokeh.plotting
 
 from .hap_data import AnophelesHapData
-from ..util import _check_types, CacheMiss, _haplotype_frequencies
+from ..util import (
+    _check_types,
+    CacheMiss,
+    _haplotype_frequencies,
+    _moving_garud_h,
+    _moving_garud_h_stream,
+    _MovingGarudHStream,
+)
 from . import base_params
 from . import h12_params, gplt_params, hap_params
 
@@ -56,9 +64,14 @@ class AnophelesH12Analysis(
         with self._dask_progress(desc="Load haplotypes"):
             ht = gt.to_haplotypes().compute()
 
+        # Compute all window sizes from a single pass over the haplotypes.
+        timings: Dict[int, float] = dict()
+        with self._spinner(desc="Compute H12"):
+            h12s = _moving_garud_h(ht, sizes=window_sizes, n_pooled=2, timings=timings)
+
         calibration_runs: Dict[str, np.ndarray] = dict()
-        for window_size in self._progress(window_sizes, desc="Compute H12"):
-            h12 = allel.moving_statistic(ht, statistic=_garud_h12, size=window_size)
+        for window_size, h12 in zip(window_sizes, h12s):
+            self._log.debug(f"window size {window_size}: {timings[window_size]:.3f}s")
             calibration_runs[str(window_size)] = h12
 
         return calibration_runs
@@ -110,14 +123,17 @@ class AnophelesH12Analysis(
             random_seed=random_seed,
         )
 
-        try:
-            calibration_runs = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                calibration_runs = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            calibration_runs = self._h12_calibration(
-                inline_array=inline_array, chunks=chunks, **params
-            )
-            self.results_cache_set(name=name, params=params, results=calibration_runs)
+            except CacheMiss:
+                calibration_runs = self._h12_calibration(
+                    inline_array=inline_array, chunks=chunks, **params
+                )
+                self.results_cache_set(
+                    name=name, params=params, results=calibration_runs
+                )
 
         return calibration_runs
 
@@ -254,25 +270,29 @@ class AnophelesH12Analysis(
             inline_array=inline_array,
         )
 
-        gt = allel.GenotypeDaskArray(ds_haps["call_genotype"].data)
-        with self._dask_progress(desc="Load haplotypes"):
-            ht = gt.to_haplotypes().compute()
-
-        with self._spinner(desc="Compute H12"):
-            # Compute H12.
-            h12 = allel.moving_statistic(ht, statistic=_garud_h12, size=window_size)
-
-            # Compute window midpoints.
-            pos = ds_haps["variant_position"].values
-            x = allel.moving_statistic(pos, statistic=np.mean, size=window_size)
-            contigs = np.asarray(
-                allel.moving_statistic(
-                    ds_haps["variant_contig"].values,
-                    statistic=np.median,
-                    size=window_size,
-                ),
-                dtype=int,
-            )
+        # Compute H12, streaming chunks of haplotypes along the contig, so
+        # that the haplotypes for the whole contig are never loaded into
+        # memory at once.
+        gt = ds_haps["call_genotype"].data
+
+        def haplotype_blocks():
+            for i in self._progress(range(gt.numblocks[0]), desc="Compute H12"):
+                block = gt.blocks[i].compute()
+                yield block.reshape((block.shape[0], -1))
+
+        h12 = _moving_garud_h_stream(haplotype_blocks(), size=window_size, n_pooled=2)
+
+        # Compute window midpoints.
+        pos = ds_haps["variant_position"].values
+        x = allel.moving_statistic(pos, statistic=np.mean, size=window_size)
+        contigs = np.asarray(
+            allel.moving_statistic(
+                ds_haps["variant_contig"].values,
+                statistic=np.median,
+                size=window_size,
+            ),
+            dtype=int,
+        )
 
         results = dict(x=x, h12=h12, contigs=contigs)
 
@@ -306,6 +326,49 @@ class AnophelesH12Analysis(
         chunks: base_params.chunks = base_params.native_chunks,
         inline_array: base_params.inline_array = base_params.inline_array_default,
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        name, params = self._prep_h12_gwss_params(
+            contig=contig,
+            analysis=analysis,
+            window_size=window_size,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                results = self._h12_gwss(
+                    chunks=chunks, inline_array=inline_array, **params
+                )
+                self.results_cache_set(name=name, params=params, results=results)
+
+        x = results["x"]
+        h12 = results["h12"]
+        contigs = results["contigs"]
+
+        return x, h12, contigs
+
+    def _prep_h12_gwss_params(
+        self,
+        *,
+        contig,
+        analysis,
+        window_size,
+        sample_sets,
+        sample_query,
+        sample_query_options,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+    ):
         # Change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data.
         name = "h12_gwss_v2"
@@ -326,18 +389,187 @@ class AnophelesH12Analysis(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        return name, params
 
-        except CacheMiss:
-            results = self._h12_gwss(chunks=chunks, inline_array=inline_array, **params)
-            self.results_cache_set(name=name, params=params, results=results)
+    def _h12_gwss_multi(
+        self,
+        *,
+        contig,
+        analysis,
+        window_sizes: Mapping[str, int],
+        sample_sets,
+        sample_queries: Mapping[str, Optional[str]],
+        sample_query_options,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        chunks,
+        inline_array,
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        ds_haps, blocks = self._haplotypes_multi(
+            contig=contig,
+            analysis=analysis,
+            sample_sets=sample_sets,
+            sample_queries=sample_queries,
+            sample_query_options=sample_query_options,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+            chunks=chunks,
+            inline_array=inline_array,
+        )
 
-        x = results["x"]
-        h12 = results["h12"]
-        contigs = results["contigs"]
+        # Compute H12 for all cohorts, streaming chunks of haplotypes along
+        # the contig.
+        streams = {
+            cohort_label: _MovingGarudHStream(size=window_size, n_pooled=2)
+            for cohort_label, window_size in window_sizes.items()
+        }
+        for block in blocks:
+            for cohort_label, ht in block.items():
+                streams[cohort_label].update(ht)
+
+        # Compute window midpoints.
+        pos = ds_haps["variant_position"].values
+        variant_contig = ds_haps["variant_contig"].values
+        results = dict()
+        for cohort_label, stream in streams.items():
+            window_size = window_sizes[cohort_label]
+            x = allel.moving_statistic(pos, statistic=np.mean, size=window_size)
+            contigs = np.asarray(
+                allel.moving_statistic(
+                    variant_contig, statistic=np.median, size=window_size
+                ),
+                dtype=int,
+            )
+            results[cohort_label] = dict(x=x, h12=stream.result(), contigs=contigs)
 
-        return x, h12, contigs
+        return results
+
+    @_check_types
+    @doc(
+        summary="Run h12 genome-wide selection scans for multiple cohorts.",
+        returns="""
+            A dictionary mapping cohort labels to tuples of window centre
+            positions, h12 values and contigs for each window, as returned
+            by `h12_gwss()`.
+        """,
+        notes="""
+            This gives the same results as calling `h12_gwss()` for each cohort,
+            but is much faster for many cohorts, because haplotypes are only read
+            and decompressed once. Results for each cohort are cached as for
+            `h12_gwss()`, so subsequent calls to `h12_gwss()` for any of the
+            cohorts will re-use them, if the `results_cache` parameter was set
+            when instantiating the class.
+        """,
+    )
+    def h12_gwss_multi(
+        self,
+        contig: base_params.contig,
+        cohorts: base_params.cohorts,
+        window_size: h12_params.multi_window_size,
+        analysis: hap_params.analysis = base_params.DEFAULT,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        cohort_size: Optional[base_params.cohort_size] = h12_params.cohort_size_default,
+        min_cohort_size: Optional[
+            base_params.min_cohort_size
+        ] = h12_params.min_cohort_size_default,
+        max_cohort_size: Optional[
+            base_params.max_cohort_size
+        ] = h12_params.max_cohort_size_default,
+        random_seed: base_params.random_seed = 42,
+        chunks: base_params.chunks = base_params.native_chunks,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+    ) -> Mapping[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        cohort_queries = self._setup_cohort_queries(
+            cohorts=cohorts,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            cohort_size=cohort_size,
+            min_cohort_size=None,
+        )
+
+        if isinstance(window_size, int):
+            window_size = {k: window_size for k in cohort_queries.keys()}
+        elif isinstance(window_size, Mapping):
+            if set(window_size.keys()) != set(cohort_queries.keys()):
+                raise ValueError("Cohorts and window_sizes should have the same keys.")
+
+        all_params = dict()
+        for cohort_label, cohort_query in cohort_queries.items():
+            name, params = self._prep_h12_gwss_params(
+                contig=contig,
+                analysis=analysis,
+                window_size=window_size[cohort_label],
+                sample_sets=sample_sets,
+                sample_query=cohort_query,
+                sample_query_options=sample_query_options,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
+            all_params[cohort_label] = params
+
+        all_results = dict()
+        with ExitStack() as stack:
+            # Look for results in the cache, taking the lock for each cohort.
+            # N.B., take locks in a consistent order, to avoid deadlocks
+            # between workers computing overlapping sets of cohorts.
+            order = sorted(
+                all_params,
+                key=lambda k: self._results_cache_key(name=name, params=all_params[k]),
+            )
+            for cohort_label in order:
+                stack.enter_context(
+                    self.results_cache_lock(name=name, params=all_params[cohort_label])
+                )
+                try:
+                    all_results[cohort_label] = self.results_cache_get(
+                        name=name, params=all_params[cohort_label]
+                    )
+                except CacheMiss:
+                    pass
+
+            # Compute any missing results in a single pass.
+            missing = [k for k in cohort_queries if k not in all_results]
+            if missing:
+                # N.B., parameters other than the sample query and window size
+                # are shared.
+                params = all_params[missing[0]]
+                computed = self._h12_gwss_multi(
+                    contig=params["contig"],
+                    analysis=params["analysis"],
+                    window_sizes={k: all_params[k]["window_size"] for k in missing},
+                    sample_sets=params["sample_sets"],
+                    sample_queries={k: all_params[k]["sample_query"] for k in missing},
+                    sample_query_options=sample_query_options,
+                    cohort_size=cohort_size,
+                    min_cohort_size=min_cohort_size,
+                    max_cohort_size=max_cohort_size,
+                    random_seed=random_seed,
+                    chunks=chunks,
+                    inline_array=inline_array,
+                )
+                for cohort_label, results in computed.items():
+                    self.results_cache_set(
+                        name=name, params=all_params[cohort_label], results=results
+                    )
+                    all_results[cohort_label] = results
+
+        return {
+            cohort_label: (
+                all_results[cohort_label]["x"],
+                all_results[cohort_label]["h12"],
+                all_results[cohort_label]["contigs"],
+            )
+            for cohort_label in cohort_queries.keys()
+        }
 
     @_check_types
     @doc(
@@ -574,20 +806,18 @@ class AnophelesH12Analysis(
             if set(window_size.keys()) != set(cohort_queries.keys()):
                 raise ValueError("Cohorts and window_sizes should have the same keys.")
 
-        # Compute H12.
-        res = {}
-        for cohort_label, cohort_query in cohort_queries.items():
-            res[cohort_label] = self.h12_gwss(
-                contig=contig,
-                analysis=analysis,
-                window_size=window_size[cohort_label],
-                cohort_size=cohort_size,
-                min_cohort_size=min_cohort_size,
-                max_cohort_size=max_cohort_size,
-                sample_query=cohort_query,
-                sample_sets=sample_sets,
-                random_seed=random_seed,
-            )
+        # Compute H12 for all cohorts, reading haplotypes once.
+        res = self.h12_gwss_multi(
+            contig=contig,
+            cohorts=cohort_queries,
+            analysis=analysis,
+            window_size=window_size,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            sample_sets=sample_sets,
+            random_seed=random_seed,
+        )
 
         # Determine X axis range.
         x, _, _ = res[list(cohort_queries.keys())[0]]
@@ -6,7 +6,12 @@ from numpydoc_decorator import doc  # type: ignore
 import bokeh.plotting
 
 from .hap_data import AnophelesHapData
-from ..util import _check_types, CacheMiss, _haplotype_frequencies
+from ..util import (
+    _check_types,
+    CacheMiss,
+    _haplotype_frequencies,
+    _moving_joint_haplotype_frequency,
+)
 from . import base_params
 from . import h12_params, gplt_params, hap_params
 
@@ -149,12 +154,15 @@ class AnophelesH1XAnalysis(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._h1x_gwss(chunks=chunks, inline_array=inline_array, **params)
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._h1x_gwss(
+                    chunks=chunks, inline_array=inline_array, **params
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         x = results["x"]
         h1x = results["h1x"]
@@ -410,10 +418,9 @@ def _moving_h1x(ha, hb, size, start=0, stop=None, step=None):
     assert ha.ndim == hb.ndim == 2
     assert ha.shape[0] == hb.shape[0]
 
-    # Construct moving windows.
-    windows = allel.index_windows(ha, size, start, stop, step)
-
-    # Compute statistics for each window.
-    out = np.array([_h1x(ha[i:j], hb[i:j]) for i, j in windows])
+    # Compute statistics for all windows in a single pass.
+    out = _moving_joint_haplotype_frequency(
+        np.asarray(ha), np.asarray(hb), size=size, start=start, stop=stop, step=step
+    )
 
     return out
@@ -1,7 +1,8 @@
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
 
 import dask.array as da
 import numpy as np
+import pandas as pd
 import xarray as xr
 import zarr  # type: ignore
 from numpydoc_decorator import doc  # type: ignore
@@ -359,41 +360,23 @@ class AnophelesHapData(
         analysis = self._prep_phasing_analysis_param(analysis=analysis)
 
         # Build dataset.
-        with self._spinner(desc="Access haplotypes"):
-            lx = []
-            for r in regions:
-                ly = []
-
-                for s in sample_sets_prepped:
-                    y = self._haplotypes_for_contig(
-                        contig=r.contig,
-                        sample_set=s,
-                        analysis=analysis,
-                        inline_array=inline_array,
-                        chunks=chunks,
-                    )
-                    if y is not None:
-                        ly.append(y)
-
-                if len(ly) == 0:
-                    # Bail out, no data for given sample sets and analysis.
-                    raise ValueError(
-                        f"No samples found for phasing analysis {analysis!r}"
-                    )
-
-                # Concatenate data from multiple sample sets.
-                x = _simple_xarray_concat(ly, dim=DIM_SAMPLE)
-
-                # Handle region.
-                if r.start or r.end:
-                    pos = x["variant_position"].values
-                    loc_region = _locate_region(r, pos)
-                    x = x.isel(variants=loc_region)
-
-                lx.append(x)
-
-            # Concatenate data from multiple regions.
-            ds = _simple_xarray_concat(lx, dim=DIM_VARIANT)
+        ds = self._cached_dataset(
+            key=(
+                "haplotypes",
+                tuple(regions),
+                tuple(sample_sets_prepped),
+                analysis,
+                inline_array,
+                chunks,
+            ),
+            build=lambda: self._build_haplotypes(
+                regions=regions,
+                sample_sets=sample_sets_prepped,
+                analysis=analysis,
+                inline_array=inline_array,
+                chunks=chunks,
+            ),
+        )
 
         # Handle sample query.
         if sample_query_prepped is not None:
@@ -445,3 +428,113 @@ class AnophelesHapData(
                 ds = ds.isel(samples=loc_downsample)
 
         return ds
+
+    def _haplotypes_multi(
+        self,
+        *,
+        contig,
+        analysis,
+        sample_sets,
+        sample_queries: Mapping[str, Optional[str]],
+        sample_query_options,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        chunks,
+        inline_array,
+    ) -> Tuple[xr.Dataset, Iterator[Dict[str, np.ndarray]]]:
+        """Access haplotypes for multiple cohorts, reading each chunk of
+        haplotypes only once. Returns a dataset of haplotypes for all samples,
+        with the variants shared by all cohorts, and an iterator over chunks
+        along the contig, yielding a dictionary mapping cohort labels to arrays
+        of shape (n_variants, n_haplotypes). Samples for each cohort are
+        selected exactly as by `haplotypes()`."""
+
+        ds_all = self.haplotypes(
+            region=contig,
+            analysis=analysis,
+            sample_sets=sample_sets,
+            chunks=chunks,
+            inline_array=inline_array,
+        )
+
+        # Locate samples for each cohort. N.B., this is lazy, so no
+        # haplotype data are read here.
+        sample_index = pd.Index(ds_all["sample_id"].values)
+        loc_cohorts = dict()
+        for cohort_label, sample_query in sample_queries.items():
+            ds = self.haplotypes(
+                region=contig,
+                analysis=analysis,
+                sample_sets=sample_sets,
+                sample_query=sample_query,
+                sample_query_options=sample_query_options,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+                chunks=chunks,
+                inline_array=inline_array,
+            )
+            loc_cohorts[cohort_label] = sample_index.get_indexer(ds["sample_id"].values)
+
+        # Only read samples in any of the cohorts.
+        loc_union = np.unique(np.concatenate(list(loc_cohorts.values())))
+        loc_cohorts = {
+            cohort_label: np.searchsorted(loc_union, loc)
+            for cohort_label, loc in loc_cohorts.items()
+        }
+        gt = ds_all["call_genotype"].data[:, loc_union]
+
+        def blocks():
+            for i in self._progress(range(gt.numblocks[0]), desc="Load haplotypes"):
+                block = gt.blocks[i].compute()
+                n_variants = block.shape[0]
+                yield {
+                    cohort_label: block[:, loc].reshape((n_variants, -1))
+                    for cohort_label, loc in loc_cohorts.items()
+                }
+
+        return ds_all, blocks()
+
+    def _build_haplotypes(
+        self, *, regions, sample_sets, analysis, inline_array, chunks
+    ) -> xr.Dataset:
+        with self._spinner(desc="Access haplotypes"):
+            lx = []
+            for r in regions:
+                ly = []
+
+                for s in sample_sets:
+                    y = self._haplotypes_for_contig(
+                        contig=r.contig,
+                        sample_set=s,
+                        analysis=analysis,
+                        inline_array=inline_array,
+                        chunks=chunks,
+                    )
+                    if y is not None:
+                        ly.append(y)
+
+                if len(ly) == 0:
+                    # Bail out, no data for given sample sets and analysis.
+                    raise ValueError(
+                        f"No samples found for phasing analysis {analysis!r}"
+                    )
+
+                # Concatenate data from multiple sample sets.
+                x = _simple_xarray_concat(ly, dim=DIM_SAMPLE)
+
+                # Handle region.
+                if r.start or r.end:
+                    pos = x["variant_position"].values
+                    loc_region = _locate_region(r, pos)
+                    x = x.isel(variants=loc_region)
+
+                lx.append(x)
+
+            # Concatenate data from multiple regions.
+            ds = _simple_xarray_concat(lx, dim=DIM_VARIANT)
+
+        return ds
@@ -5,7 +5,13 @@ import numpy as np
 import pandas as pd
 from numpydoc_decorator import doc  # type: ignore
 
-from ..util import CacheMiss, _check_types, _pdist_abs_hamming
+from ..util import (
+    CacheMiss,
+    _check_types,
+    _copy_condensed_distances,
+    _open_condensed_distances,
+    _pdist_abs_hamming,
+)
 from ..plotly_dendrogram import _plot_dendrogram
 from . import (
     base_params,
@@ -13,6 +19,7 @@ from . import (
     tree_params,
     hap_params,
     clustering_params,
+    distance_params,
     hapclust_params,
 )
 from .snp_data import AnophelesSnpData
@@ -66,6 +73,7 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
         legend_sizing: plotly_params.legend_sizing = "constant",
         chunks: base_params.chunks = base_params.native_chunks,
         inline_array: base_params.inline_array = base_params.inline_array_default,
+        dist_path: Optional[distance_params.dist_path] = None,
     ) -> plotly_params.figure:
         import sys
 
@@ -96,6 +104,7 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
             random_seed=random_seed,
             chunks=chunks,
             inline_array=inline_array,
+            dist_path=dist_path,
         )
 
         # Align sample metadata with haplotypes.
@@ -189,7 +198,11 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
             Compute pairwise distances between haplotypes.
         """,
         returns=dict(
-            dist="Pairwise distance.",
+            dist="""
+                Pairwise distance, as a condensed distance matrix. If `dist_path`
+                was given, this is a numpy memory-mapped array, or a zarr array
+                if the path ends with ".zarr", stored at that path.
+            """,
             phased_samples="Sample identifiers for haplotypes.",
             n_snps="Number of SNPs used.",
         ),
@@ -205,7 +218,8 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
         random_seed: base_params.random_seed = 42,
         chunks: base_params.chunks = base_params.native_chunks,
         inline_array: base_params.inline_array = base_params.inline_array_default,
-    ) -> Tuple[np.ndarray, np.ndarray, int]:
+        dist_path: Optional[distance_params.dist_path] = None,
+    ) -> Tuple[distance_params.dist, np.ndarray, int]:
         # Change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data.
         name = "haplotype_pairwise_distances"
@@ -228,17 +242,38 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
         )
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                if dist_path is None:
+                    results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._haplotype_pairwise_distances(
-                chunks=chunks, inline_array=inline_array, **params
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+                else:
+                    # Stream cached distances to the requested location, block
+                    # by block, without loading the whole matrix into memory.
+                    with self.results_cache_open(name=name, params=params) as cached:
+                        dist = _open_condensed_distances(
+                            dist_path,
+                            # N.B., two haplotypes per phased sample.
+                            n_obs=2 * cached["phased_samples"].shape[0],
+                            dtype=cached["dist"].dtype,
+                        )
+                        dist = _copy_condensed_distances(cached["dist"], dist)
+                        results = {
+                            k: dist if k == "dist" else np.asarray(v[...])
+                            for k, v in cached.items()
+                        }
+
+            except CacheMiss:
+                results = self._haplotype_pairwise_distances(
+                    chunks=chunks,
+                    inline_array=inline_array,
+                    dist_path=dist_path,
+                    **params,
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results")
-        dist: np.ndarray = results["dist"]
+        dist = results["dist"]
         phased_samples: np.ndarray = results["phased_samples"]
         n_snps: int = int(results["n_snps"][()])  # ensure scalar
 
@@ -256,9 +291,8 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
         random_seed,
         chunks,
         inline_array,
+        dist_path=None,
     ):
-        from scipy.spatial.distance import squareform  # type: ignore
-
         # Load haplotypes.
         ds_haps = self.haplotypes(
             region=region,
@@ -282,10 +316,16 @@ class AnophelesHapClustAnalysis(AnophelesHapData, AnophelesSnpData):
         # Transpose memory layout for faster hamming distance calculations.
         ht_t = np.ascontiguousarray(ht_seg.T)
 
-        # Compute pairwise distances.
+        # Set up an array on disk to write distances to, if requested.
+        out = None
+        if dist_path is not None:
+            out = _open_condensed_distances(
+                dist_path, n_obs=ht_t.shape[0], dtype=np.int32
+            )
+
+        # Compute pairwise distances, directly in condensed form.
         with self._spinner(desc="Compute pairwise distances"):
-            dist_sq = _pdist_abs_hamming(ht_t)
-        dist = squareform(dist_sq)
+            dist = _pdist_abs_hamming(ht_t, out=out)
 
         # Extract IDs of phased samples. Convert to "U" dtype here
         # to allow these to be saved to the results cache.
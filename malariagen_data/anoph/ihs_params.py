@@ -111,6 +111,18 @@ use_threads: TypeAlias = Annotated[
     bool, "If True, use multiple threads to compute iHS."
 ]
 
+segment_size: TypeAlias = Annotated[
+    int,
+    """
+    If provided, split the contig into segments of this number of SNPs and
+    compute iHS for segments in parallel. Segments are extended to overlap
+    as far as needed for EHH to decay, so results are identical to computing
+    over the whole contig at once. Smaller segments bound the memory used
+    by each task, but the overlapping margins are scanned more than once,
+    so this only pays off when several cores are available.
+    """,
+]
+
 palette: TypeAlias = Annotated[
     str, "Name of bokeh palette to use for plotting multiple percentiles."
 ]
@@ -81,12 +81,11 @@ class AnophelesKaryotypeAnalysis(AnophelesSnpData):
         inversion_alts = df_tagsnps["alt_allele"]
         contig = inversion[0:2]
 
-        # get snp calls for inversion region
-        start, end = np.min(inversion_pos), np.max(inversion_pos)
-        region = f"{contig}:{start}-{end}"
-
-        ds_snps = self.snp_calls(
-            region=region,
+        # get snp calls at inversion tag positions, only reading the chunks
+        # which contain tag snps
+        ds_snps = self.snp_calls_at_positions(
+            contig=contig,
+            positions=inversion_pos.values,
             sample_sets=sample_sets,
             sample_query=sample_query,
             sample_query_options=sample_query_options,
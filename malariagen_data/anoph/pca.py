@@ -1,6 +1,7 @@
 from typing import Optional, Tuple
 
 import allel  # type: ignore
+import dask.array as da
 import numpy as np
 import pandas as pd
 import plotly.express as px  # type: ignore
@@ -11,6 +12,122 @@ from . import base_params, pca_params, plotly_params
 from .snp_data import AnophelesSnpData
 
 
+# Number of additional components to compute with the randomized algorithm,
+# which improves the accuracy of the leading components.
+_PCA_N_OVERSAMPLES = 10
+
+# Number of power iterations to run with the randomized algorithm.
+_PCA_N_ITER = 4
+
+# Approximate size of each block of scaled diplotypes held in memory.
+_PCA_BLOCK_NBYTES = 2**27
+
+
+def _pca_blocks(gn):
+    """Iterate over blocks of diplotypes with shape (n_snps, n_samples), given
+    either as a numpy array or as a dask array, in which case each chunk along
+    the first dimension is computed in turn."""
+    if isinstance(gn, da.Array):
+        for i in range(gn.numblocks[0]):
+            yield from _pca_blocks(gn.blocks[i].compute())
+        return
+    block_size = max(_PCA_BLOCK_NBYTES // (8 * max(gn.shape[1], 1)), 1)
+    for start in range(0, gn.shape[0], block_size):
+        yield gn[start : start + block_size]
+
+
+def _exact_pca(gn, loc_fit, n_components):
+    """Compute principal components of diplotypes via a full singular value
+    decomposition, fitting to samples selected by `loc_fit`, or all samples
+    if not given. Returns coordinates for all samples and explained variance
+    ratios."""
+    fit_all = loc_fit is None
+    gn_fit = gn if fit_all else gn[:, loc_fit]
+
+    # Remove any sites where all genotypes are identical.
+    loc_var = np.any(gn_fit != gn_fit[:, 0, np.newaxis], axis=1)
+    gn_fit_var = np.compress(loc_var, gn_fit, axis=0)
+
+    # Run the PCA.
+    if fit_all:
+        # Simple fit and transform on the same data.
+        coords, model = allel.pca(gn_fit_var, n_components=n_components)
+
+    else:
+        # Fit and transform separately.
+        gn_var = np.compress(loc_var, gn, axis=0)
+        model = allel.stats.decomposition.GenotypePCA(
+            n_components=n_components,
+        )
+        model.fit(gn_fit_var)
+        coords = model.transform(gn_var, copy=False)
+
+    return coords, model.explained_variance_ratio_
+
+
+def _randomized_pca(blocks, loc_fit, n_components, random_seed):
+    """Compute principal components of diplotypes by randomized power
+    iterations. Diplotypes are scaled as for `allel.pca()`, using samples
+    selected by `loc_fit`, and SNPs which are not variable among those
+    samples are ignored. The `blocks` argument is a function returning an
+    iterator over blocks of diplotypes with shape (n_snps, n_samples), which
+    is called once for each pass over the data. Returns coordinates for all
+    samples and explained variance ratios."""
+    n_fit = int(np.count_nonzero(loc_fit))
+    project = n_fit < len(loc_fit)
+    n_basis = min(n_components + _PCA_N_OVERSAMPLES, n_fit)
+
+    def scaled_blocks():
+        for gn in blocks():
+            gn_fit = gn[:, loc_fit]
+            mean = gn_fit.mean(axis=1)
+            p = mean / 2
+            std = np.sqrt(p * (1 - p))
+            # Scale non-variable SNPs to zero, which is the same as removing them.
+            loc_var = np.any(gn_fit != gn_fit[:, 0, np.newaxis], axis=1)
+            std[~loc_var] = np.inf
+            x = (gn - mean[:, np.newaxis]) / std[:, np.newaxis]
+            yield x[:, loc_fit].T, x.T
+
+    # Find an orthonormal basis approximating the range of the leading
+    # components over samples. N.B., start from a random basis over samples,
+    # which avoids holding a random matrix over all SNPs.
+    rng = np.random.default_rng(random_seed)
+    q, _ = np.linalg.qr(rng.standard_normal((n_fit, n_basis)))
+    for _ in range(_PCA_N_ITER + 1):
+        y = np.zeros_like(q)
+        for x_fit, _ in scaled_blocks():
+            y += x_fit @ (x_fit.T @ q)
+        q, _ = np.linalg.qr(y)
+
+    # Project the data onto the basis. Also accumulate the total variance, to
+    # compute explained variance ratios, and the projection of all samples
+    # if some samples were excluded from fitting.
+    b = np.zeros((n_basis, n_basis))
+    total = 0.0
+    coords_all = np.zeros((len(loc_fit), n_basis))
+    for x_fit, x in scaled_blocks():
+        t = x_fit.T @ q
+        b += t.T @ t
+        total += np.sum(x_fit * x_fit)
+        if project:
+            coords_all += x @ t
+
+    # Decompose the small projected matrix.
+    w, v = np.linalg.eigh(b)
+    k = min(n_components, n_basis)
+    w = np.clip(w[::-1][:k], 0, None)
+    v = v[:, ::-1][:, :k]
+    s = np.sqrt(w)
+    if project:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coords = np.nan_to_num((coords_all @ v) / s)
+    else:
+        coords = (q @ v) * s
+    evr = w / total
+    return coords, evr
+
+
 class AnophelesPca(
     AnophelesSnpData,
 ):
@@ -77,6 +194,7 @@ class AnophelesPca(
         random_seed: base_params.random_seed = 42,
         inline_array: base_params.inline_array = base_params.inline_array_default,
         chunks: base_params.chunks = base_params.native_chunks,
+        algorithm: pca_params.algorithm = pca_params.algorithm_default,
     ) -> Tuple[pca_params.df_pca, pca_params.evr]:
         # Change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data.
@@ -129,14 +247,19 @@ class AnophelesPca(
             fit_exclude_samples=fit_exclude_samples,
             random_seed=random_seed,
         )
+        if algorithm != "exact":
+            # N.B., only add the algorithm if not the default, so that results
+            # cached before the algorithm parameter was added are still used.
+            params["algorithm"] = algorithm
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._pca(chunks=chunks, inline_array=inline_array, **params)
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._pca(chunks=chunks, inline_array=inline_array, **params)
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results.
         coords = results["coords"]
@@ -194,25 +317,50 @@ class AnophelesPca(
         random_seed,
         chunks,
         inline_array,
+        algorithm="exact",
     ):
-        # Load diplotypes.
-        gn, samples = self.biallelic_diplotypes(
-            region=region,
-            n_snps=n_snps,
-            thin_offset=thin_offset,
-            sample_sets=sample_sets,
-            sample_indices=sample_indices,
-            site_mask=site_mask,
-            min_minor_ac=min_minor_ac,
-            max_missing_an=max_missing_an,
-            site_class=site_class,
-            cohort_size=cohort_size,
-            min_cohort_size=min_cohort_size,
-            max_cohort_size=max_cohort_size,
-            random_seed=random_seed,
-            chunks=chunks,
-            inline_array=inline_array,
-        )
+        if algorithm == "incremental":
+            # Set up diplotypes to be computed chunk by chunk, without loading
+            # all diplotypes into memory.
+            ds = self.biallelic_snp_calls(
+                region=region,
+                n_snps=n_snps,
+                thin_offset=thin_offset,
+                sample_sets=sample_sets,
+                sample_indices=sample_indices,
+                site_mask=site_mask,
+                min_minor_ac=min_minor_ac,
+                max_missing_an=max_missing_an,
+                site_class=site_class,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+                chunks=chunks,
+                inline_array=inline_array,
+            )
+            samples = ds["sample_id"].values.astype("U")
+            gn = allel.GenotypeDaskArray(ds["call_genotype"].data).to_n_alt()
+
+        else:
+            # Load diplotypes.
+            gn, samples = self.biallelic_diplotypes(
+                region=region,
+                n_snps=n_snps,
+                thin_offset=thin_offset,
+                sample_sets=sample_sets,
+                sample_indices=sample_indices,
+                site_mask=site_mask,
+                min_minor_ac=min_minor_ac,
+                max_missing_an=max_missing_an,
+                site_class=site_class,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+                chunks=chunks,
+                inline_array=inline_array,
+            )
 
         with self._spinner(desc="Compute PCA"):
             # Exclude any samples prior to computing PCA.
@@ -226,28 +374,24 @@ class AnophelesPca(
             if fit_exclude_samples is not None:
                 xf = np.array(fit_exclude_samples, dtype="U")
                 loc_keep_fit = ~np.isin(samples, xf)
-                gn_fit = gn[:, loc_keep_fit]
             else:
                 loc_keep_fit = np.ones(len(samples), dtype=bool)
-                gn_fit = gn
-
-            # Remove any sites where all genotypes are identical.
-            loc_var = np.any(gn_fit != gn_fit[:, 0, np.newaxis], axis=1)
-            gn_fit_var = np.compress(loc_var, gn_fit, axis=0)
-            gn_var = np.compress(loc_var, gn, axis=0)
-
-            # Run the PCA.
-            if fit_exclude_samples is None:
-                # Simple fit and transform on the same data.
-                coords, model = allel.pca(gn_fit_var, n_components=n_components)
 
+            if algorithm == "exact":
+                coords, evr = _exact_pca(
+                    gn,
+                    loc_fit=None if fit_exclude_samples is None else loc_keep_fit,
+                    n_components=n_components,
+                )
             else:
-                # Fit and transform separately.
-                model = allel.stats.decomposition.GenotypePCA(
+                # N.B., blocks of diplotypes are scaled and processed one at a
+                # time, on each pass over the data.
+                coords, evr = _randomized_pca(
+                    lambda: _pca_blocks(gn),
+                    loc_fit=loc_keep_fit,
                     n_components=n_components,
+                    random_seed=random_seed,
                 )
-                model.fit(gn_fit_var)
-                coords = model.transform(gn_var, copy=False)
 
             # Work around sign indeterminacy.
             for i in range(coords.shape[1]):
@@ -258,7 +402,7 @@ class AnophelesPca(
         results = dict(
             samples=samples,
             coords=coords,
-            evr=model.explained_variance_ratio_,
+            evr=evr,
             loc_keep_fit=loc_keep_fit,
         )
         return results
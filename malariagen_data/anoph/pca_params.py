@@ -1,5 +1,7 @@
 """Parameters for PCA functions."""
 
+from typing import Literal
+
 import numpy as np
 import pandas as pd
 from typing_extensions import Annotated, TypeAlias
@@ -12,6 +14,24 @@ n_components: TypeAlias = Annotated[
 
 n_components_default: n_components = 20
 
+algorithm: TypeAlias = Annotated[
+    Literal["exact", "randomized", "incremental"],
+    """
+    Algorithm used to compute principal components. If 'exact', compute a full
+    singular value decomposition of the scaled diplotypes. If 'randomized',
+    compute an approximate decomposition of the leading components by
+    randomized power iterations, processing blocks of SNPs at a time, which
+    uses much less memory and time for larger numbers of SNPs and samples.
+    If 'incremental', use the randomized algorithm but read genotype calls
+    chunk by chunk on each pass over the data, rather than loading all
+    diplotypes into memory, so that data larger than memory can be analysed.
+    In this case the memory used depends on the size of chunks, see also the
+    `chunks` parameter.
+    """,
+]
+
+algorithm_default: algorithm = "exact"
+
 df_pca: TypeAlias = Annotated[
     pd.DataFrame,
     """
@@ -1,5 +1,5 @@
-from functools import lru_cache
-from typing import Any, Dict, List, Optional, Tuple, Union
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import allel  # type: ignore
 import bokeh
@@ -18,6 +18,8 @@ from ..util import (
     CacheMiss,
     Region,
     _apply_allele_mapping,
+    _biallelic_genotype_counts,
+    _biallelic_snp_conditions,
     _check_types,
     _da_compress,
     _da_concat,
@@ -26,12 +28,17 @@ from ..util import (
     _dask_compress_dataset,
     _dask_genotype_array_map_alleles,
     _init_zarr_store,
+    _locate_biallelic_snps,
     _locate_region,
     _parse_multi_region,
     _parse_single_region,
     _simple_xarray_concat,
+    _thin_snps,
     _trim_alleles,
     _true_runs,
+    _count_alleles_cohorts,
+    _genotype_chunk_tasks,
+    _threaded_map,
 )
 from . import base_params
 from .genome_features import AnophelesGenomeFeaturesData, gplt_params
@@ -39,6 +46,11 @@ from .genome_sequence import AnophelesGenomeSequenceData
 from .sample_metadata import AnophelesSampleMetadata
 
 
+# Maximum size of genotype allele counts to buffer while counting alleles, when
+# computing genotype allele counts for a thinned set of biallelic SNPs.
+_BIALLELIC_BUFFER_NBYTES = 2**30
+
+
 class AnophelesSnpData(
     AnophelesSampleMetadata, AnophelesGenomeFeaturesData, AnophelesGenomeSequenceData
 ):
@@ -46,6 +58,7 @@ class AnophelesSnpData(
         self,
         site_filters_analysis: Optional[str] = None,
         default_site_mask: Optional[str] = None,
+        allele_counts_engine: base_params.allele_counts_engine = base_params.allele_counts_engine_default,
         **kwargs,
     ):
         # N.B., this class is designed to work cooperatively, and
@@ -60,13 +73,17 @@ class AnophelesSnpData(
         # These will vary between data resources.
         self._default_site_mask = default_site_mask
 
+        # Default engine for computing allele counts.
+        self._allele_counts_engine = allele_counts_engine
+
         # Set up caches.
         # TODO review type annotations here, maybe can tighten
         self._cache_snp_sites = None
         self._cache_snp_genotypes: Dict = dict()
         self._cache_site_filters: Dict = dict()
         self._cache_site_annotations = None
-        self._cache_locate_site_class: Dict = dict()
+        self._cache_site_bitmaps: Dict = dict()
+        self._cache_snp_sites_index: Dict = dict()
 
     @property
     def _site_filters_analysis(self) -> Optional[str]:
@@ -242,13 +259,7 @@ class AnophelesSnpData(
             chunks=chunks,
         )
         if region.start or region.end:
-            pos = self._snp_sites_for_contig(
-                contig=region.contig,
-                field="POS",
-                inline_array=inline_array,
-                chunks=chunks,
-            )
-            loc_region = _locate_region(region, np.asarray(pos))
+            loc_region = self._locate_snp_sites_region(region=region)
             d = d[loc_region]
         return d
 
@@ -327,6 +338,145 @@ class AnophelesSnpData(
             ret = _da_from_zarr(z, inline_array=inline_array, chunks=chunks)
             return ret
 
+    def _snp_sites_index(
+        self, *, contig: base_params.contig
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Obtain a positional index of SNP sites for a single contig, as
+        the index bounds of each native chunk of SNP positions, and the
+        minimum and maximum position within each chunk. The index is cached
+        in memory and in the results cache, if configured."""
+
+        # Handle virtual contig.
+        if contig in self.virtual_contigs:
+            l_bounds, l_pos_min, l_pos_max = [np.zeros(1, dtype=np.int64)], [], []
+            index_offset = 0
+            pos_offset = 0
+            for c in self.virtual_contigs[contig]:
+                bounds, pos_min, pos_max = self._snp_sites_index(contig=c)
+                l_bounds.append(bounds[1:] + index_offset)
+                l_pos_min.append(pos_min + pos_offset)
+                l_pos_max.append(pos_max + pos_offset)
+                index_offset += bounds[-1]
+                pos_offset += self.genome_sequence(region=c).shape[0]
+            return (
+                np.concatenate(l_bounds),
+                np.concatenate(l_pos_min),
+                np.concatenate(l_pos_max),
+            )
+
+        try:
+            return self._cache_snp_sites_index[contig]
+        except KeyError:
+            pass
+
+        assert contig in self.contigs
+        root = self.open_snp_sites()
+        pos_z = root[f"{contig}/variants/POS"]
+        n_sites = pos_z.shape[0]
+        chunk_size = pos_z.chunks[0]
+
+        # N.B., include the shape of the positions array, so that a stale
+        # index is never used if the underlying data change.
+        name = "snp_sites_index_v1"
+        params = dict(contig=contig, n_sites=n_sites, chunk_size=chunk_size)
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                bounds = np.append(np.arange(0, n_sites, chunk_size), n_sites)
+
+                def load_extremes(k):
+                    # Positions are sorted, so only need the first and last
+                    # position within each chunk.
+                    pos = pos_z[bounds[k] : bounds[k + 1]]
+                    return pos[0], pos[-1]
+
+                with self._spinner(desc="Build SNP sites index"):
+                    extremes = list(
+                        _threaded_map(load_extremes, range(len(bounds) - 1))
+                    )
+                extremes_arr = np.array(extremes, dtype=np.int64).reshape(-1, 2)
+                results = dict(
+                    bounds=bounds.astype(np.int64),
+                    pos_min=extremes_arr[:, 0],
+                    pos_max=extremes_arr[:, 1],
+                )
+                self.results_cache_set(name=name, params=params, results=results)
+
+        index = results["bounds"], results["pos_min"], results["pos_max"]
+        self._cache_snp_sites_index[contig] = index
+        return index
+
+    def _locate_snp_sites_region(self, *, region: Region) -> slice:
+        """Locate a region within the SNP sites for the region's contig,
+        reading only chunks of SNP positions which overlap the region."""
+        bounds, pos_min, pos_max = self._snp_sites_index(contig=region.contig)
+
+        # Find chunks which overlap the region.
+        chunk_start = 0
+        if region.start:
+            chunk_start = np.searchsorted(pos_max, region.start, side="left")
+        chunk_stop = len(pos_min)
+        if region.end:
+            chunk_stop = np.searchsorted(pos_min, region.end, side="right")
+        if chunk_stop <= chunk_start:
+            return slice(0, 0)
+
+        # Load positions for overlapping chunks only.
+        index_start, index_stop = bounds[chunk_start], bounds[chunk_stop]
+        pos = self._snp_sites_for_contig(
+            contig=region.contig,
+            field="POS",
+            inline_array=True,
+            chunks=base_params.native_chunks,
+        )
+        loc_region = _locate_region(region, np.asarray(pos[index_start:index_stop]))
+        if loc_region.stop == loc_region.start:
+            return slice(0, 0)
+        return slice(
+            int(index_start + loc_region.start), int(index_start + loc_region.stop)
+        )
+
+    def _locate_snp_sites_positions(
+        self, *, contig: base_params.contig, positions: np.ndarray
+    ) -> np.ndarray:
+        """Locate the given positions within the SNP sites for a contig,
+        reading only chunks of SNP positions which may contain them. Returns
+        the sorted indices of SNP sites found at any of the positions."""
+        bounds, pos_min, pos_max = self._snp_sites_index(contig=contig)
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+
+        # Find the chunk which may contain each position.
+        chunk_index = np.searchsorted(pos_max, positions, side="left")
+        in_range = chunk_index < len(pos_max)
+        positions, chunk_index = positions[in_range], chunk_index[in_range]
+        in_chunk = pos_min[chunk_index] <= positions
+        positions, chunk_index = positions[in_chunk], chunk_index[in_chunk]
+        chunks = np.unique(chunk_index)
+        if chunks.size == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Load positions for the chunks needed, concurrently.
+        pos = self._snp_sites_for_contig(
+            contig=contig,
+            field="POS",
+            inline_array=True,
+            chunks=base_params.native_chunks,
+        )
+        chunk_pos = da.compute(*[pos[bounds[k] : bounds[k + 1]] for k in chunks])
+
+        # Locate exact matches within each chunk.
+        indices = []
+        for k, p in zip(chunks, chunk_pos):
+            targets = positions[chunk_index == k]
+            loc = np.searchsorted(p, targets)
+            found = loc < len(p)
+            found[found] = p[loc[found]] == targets[found]
+            indices.append(bounds[k] + loc[found])
+        return np.concatenate(indices).astype(np.int64)
+
     def _snp_sites_for_region(
         self,
         *,
@@ -342,16 +492,7 @@ class AnophelesSnpData(
 
         # Deal with a region.
         if region.start or region.end:
-            if field == "POS":
-                pos = ret
-            else:
-                pos = self._snp_sites_for_contig(
-                    contig=region.contig,
-                    field="POS",
-                    inline_array=inline_array,
-                    chunks=chunks,
-                )
-            loc_region = _locate_region(region, np.asarray(pos))
+            loc_region = self._locate_snp_sites_region(region=region)
             ret = ret[loc_region]
 
         return ret
@@ -394,11 +535,11 @@ class AnophelesSnpData(
 
         # Apply site mask if requested.
         if site_mask_prepped is not None:
-            loc_sites = self.site_filters(
-                region=regions,
-                mask=site_mask_prepped,
-                chunks=chunks,
-                inline_array=inline_array,
+            loc_sites = np.concatenate(
+                [
+                    self._locate_sites(region=r, site_masks=[site_mask_prepped])
+                    for r in regions
+                ]
             )
             ret = _da_compress(loc_sites, ret, axis=0)
 
@@ -495,13 +636,7 @@ class AnophelesSnpData(
 
                 # Locate region - do this only once, optimisation.
                 if r.start or r.end:
-                    pos = self._snp_sites_for_contig(
-                        contig=contig,
-                        field="POS",
-                        inline_array=inline_array,
-                        chunks=chunks,
-                    )
-                    loc_region = _locate_region(r, np.asarray(pos))
+                    loc_region = self._locate_snp_sites_region(region=r)
                     x = x[loc_region]
 
                 lx.append(x)
@@ -511,9 +646,11 @@ class AnophelesSnpData(
 
         # Apply site filters if requested.
         if prepared_site_mask is not None:
-            loc_sites = self.site_filters(
-                region=prepared_regions,
-                mask=prepared_site_mask,
+            loc_sites = np.concatenate(
+                [
+                    self._locate_sites(region=r, site_masks=[prepared_site_mask])
+                    for r in prepared_regions
+                ]
             )
             d = _da_compress(loc_sites, d, axis=0)
 
@@ -659,8 +796,7 @@ class AnophelesSnpData(
 
             # Handle region.
             if r.start or r.end:
-                pos = x["variant_position"].values
-                loc_region = _locate_region(r, pos)
+                loc_region = self._locate_snp_sites_region(region=r)
                 x = x.isel(variants=loc_region)
 
             lx.append(x)
@@ -670,9 +806,13 @@ class AnophelesSnpData(
 
         # Apply site filters.
         if site_mask_prepped is not None:
-            ds = _dask_compress_dataset(
-                ds, indexer=f"variant_filter_pass_{site_mask_prepped}", dim=DIM_VARIANT
+            loc_sites = np.concatenate(
+                [
+                    self._locate_sites(region=r, site_masks=[site_mask_prepped])
+                    for r in regions
+                ]
             )
+            ds = _dask_compress_dataset(ds, indexer=loc_sites, dim=DIM_VARIANT)
 
         return ds
 
@@ -769,166 +909,260 @@ class AnophelesSnpData(
 
         return ds
 
-    def _locate_site_class(
+    def _compute_site_class(
         self,
         *,
-        region: Region,
-        site_mask: Optional[base_params.site_mask],
+        contig: base_params.contig,
         site_class: base_params.site_class,
-        inline_array: base_params.inline_array = base_params.inline_array_default,
-        chunks: base_params.chunks = base_params.native_chunks,
-    ):
-        # Cache these data in memory to avoid repeated computation.
-        cache_key = (region, site_mask, site_class)
-
-        try:
-            loc_ann = self._cache_locate_site_class[cache_key]
-
-        except KeyError as exc:
-            # Access site annotations data.
-            ds_ann = self._site_annotations_raw(
-                contig=region.contig,
-                inline_array=inline_array,
-                chunks=chunks,
-            )
-            codon_pos = ds_ann["codon_position"].data
-            codon_deg = ds_ann["codon_degeneracy"].data
-            seq_cls = ds_ann["seq_cls"].data
-            seq_flen = ds_ann["seq_flen"].data
-            seq_relpos_start = ds_ann["seq_relpos_start"].data
-            seq_relpos_stop = ds_ann["seq_relpos_stop"].data
-            site_class = site_class.upper()
-
-            # Define constants used in site annotations data.
-            SEQ_CLS_UNKNOWN = 0  # noqa
-            SEQ_CLS_UPSTREAM = 1
-            SEQ_CLS_DOWNSTREAM = 2
-            SEQ_CLS_5UTR = 3
-            SEQ_CLS_3UTR = 4
-            SEQ_CLS_CDS_FIRST = 5
-            SEQ_CLS_CDS_MID = 6
-            SEQ_CLS_CDS_LAST = 7
-            SEQ_CLS_INTRON_FIRST = 8
-            SEQ_CLS_INTRON_MID = 9
-            SEQ_CLS_INTRON_LAST = 10
-            CODON_DEG_UNKNOWN = 0  # noqa
-            CODON_DEG_0 = 1
-            CODON_DEG_2_SIMPLE = 2
-            CODON_DEG_2_COMPLEX = 3  # noqa
-            CODON_DEG_4 = 4
-
-            # Set up site selection.
-
-            if site_class == "CDS_DEG_4":
-                # 4-fold degenerate coding sites
-                loc_ann = (
-                    (
-                        (seq_cls == SEQ_CLS_CDS_FIRST)
-                        | (seq_cls == SEQ_CLS_CDS_MID)
-                        | (seq_cls == SEQ_CLS_CDS_LAST)
-                    )
-                    & (codon_pos == 2)
-                    & (codon_deg == CODON_DEG_4)
-                )
-
-            elif site_class == "CDS_DEG_2_SIMPLE":
-                # 2-fold degenerate coding sites
-                loc_ann = (
-                    (
-                        (seq_cls == SEQ_CLS_CDS_FIRST)
-                        | (seq_cls == SEQ_CLS_CDS_MID)
-                        | (seq_cls == SEQ_CLS_CDS_LAST)
-                    )
-                    & (codon_pos == 2)
-                    & (codon_deg == CODON_DEG_2_SIMPLE)
-                )
-
-            elif site_class == "CDS_DEG_0":
-                # non-degenerate coding sites
-                loc_ann = (
+    ) -> np.ndarray:
+        """Compute a site class from site annotations, for all SNP sites in
+        a single contig. See also `_site_bitmap()`, which caches results."""
+        # Access site annotations data.
+        ds_ann = self._site_annotations_raw(contig=contig)
+        codon_pos = ds_ann["codon_position"].data
+        codon_deg = ds_ann["codon_degeneracy"].data
+        seq_cls = ds_ann["seq_cls"].data
+        seq_flen = ds_ann["seq_flen"].data
+        seq_relpos_start = ds_ann["seq_relpos_start"].data
+        seq_relpos_stop = ds_ann["seq_relpos_stop"].data
+        site_class = site_class.upper()
+
+        # Define constants used in site annotations data.
+        SEQ_CLS_UNKNOWN = 0  # noqa
+        SEQ_CLS_UPSTREAM = 1
+        SEQ_CLS_DOWNSTREAM = 2
+        SEQ_CLS_5UTR = 3
+        SEQ_CLS_3UTR = 4
+        SEQ_CLS_CDS_FIRST = 5
+        SEQ_CLS_CDS_MID = 6
+        SEQ_CLS_CDS_LAST = 7
+        SEQ_CLS_INTRON_FIRST = 8
+        SEQ_CLS_INTRON_MID = 9
+        SEQ_CLS_INTRON_LAST = 10
+        CODON_DEG_UNKNOWN = 0  # noqa
+        CODON_DEG_0 = 1
+        CODON_DEG_2_SIMPLE = 2
+        CODON_DEG_2_COMPLEX = 3  # noqa
+        CODON_DEG_4 = 4
+
+        # Set up site selection.
+
+        if site_class == "CDS_DEG_4":
+            # 4-fold degenerate coding sites
+            loc_ann = (
+                (
                     (seq_cls == SEQ_CLS_CDS_FIRST)
                     | (seq_cls == SEQ_CLS_CDS_MID)
                     | (seq_cls == SEQ_CLS_CDS_LAST)
-                ) & (codon_deg == CODON_DEG_0)
-
-            elif site_class == "INTRON_SHORT":
-                # short introns, excluding splice regions
-                loc_ann = (
-                    (
-                        (seq_cls == SEQ_CLS_INTRON_FIRST)
-                        | (seq_cls == SEQ_CLS_INTRON_MID)
-                        | (seq_cls == SEQ_CLS_INTRON_LAST)
-                    )
-                    & (seq_flen < 100)
-                    & (seq_relpos_start > 10)
-                    & (seq_relpos_stop > 10)
                 )
+                & (codon_pos == 2)
+                & (codon_deg == CODON_DEG_4)
+            )
 
-            elif site_class == "INTRON_LONG":
-                # long introns, excluding splice regions
-                loc_ann = (
-                    (
-                        (seq_cls == SEQ_CLS_INTRON_FIRST)
-                        | (seq_cls == SEQ_CLS_INTRON_MID)
-                        | (seq_cls == SEQ_CLS_INTRON_LAST)
-                    )
-                    & (seq_flen > 200)
-                    & (seq_relpos_start > 10)
-                    & (seq_relpos_stop > 10)
+        elif site_class == "CDS_DEG_2_SIMPLE":
+            # 2-fold degenerate coding sites
+            loc_ann = (
+                (
+                    (seq_cls == SEQ_CLS_CDS_FIRST)
+                    | (seq_cls == SEQ_CLS_CDS_MID)
+                    | (seq_cls == SEQ_CLS_CDS_LAST)
                 )
+                & (codon_pos == 2)
+                & (codon_deg == CODON_DEG_2_SIMPLE)
+            )
 
-            elif site_class == "INTRON_SPLICE_5PRIME":
-                # 5' intron splice regions
-                loc_ann = (
+        elif site_class == "CDS_DEG_0":
+            # non-degenerate coding sites
+            loc_ann = (
+                (seq_cls == SEQ_CLS_CDS_FIRST)
+                | (seq_cls == SEQ_CLS_CDS_MID)
+                | (seq_cls == SEQ_CLS_CDS_LAST)
+            ) & (codon_deg == CODON_DEG_0)
+
+        elif site_class == "INTRON_SHORT":
+            # short introns, excluding splice regions
+            loc_ann = (
+                (
                     (seq_cls == SEQ_CLS_INTRON_FIRST)
                     | (seq_cls == SEQ_CLS_INTRON_MID)
                     | (seq_cls == SEQ_CLS_INTRON_LAST)
-                ) & (seq_relpos_start < 2)
+                )
+                & (seq_flen < 100)
+                & (seq_relpos_start > 10)
+                & (seq_relpos_stop > 10)
+            )
 
-            elif site_class == "INTRON_SPLICE_3PRIME":
-                # 3' intron splice regions
-                loc_ann = (
+        elif site_class == "INTRON_LONG":
+            # long introns, excluding splice regions
+            loc_ann = (
+                (
                     (seq_cls == SEQ_CLS_INTRON_FIRST)
                     | (seq_cls == SEQ_CLS_INTRON_MID)
                     | (seq_cls == SEQ_CLS_INTRON_LAST)
-                ) & (seq_relpos_stop < 2)
+                )
+                & (seq_flen > 200)
+                & (seq_relpos_start > 10)
+                & (seq_relpos_stop > 10)
+            )
 
-            elif site_class == "UTR_5PRIME":
-                # 5' UTR
-                loc_ann = seq_cls == SEQ_CLS_5UTR
+        elif site_class == "INTRON_SPLICE_5PRIME":
+            # 5' intron splice regions
+            loc_ann = (
+                (seq_cls == SEQ_CLS_INTRON_FIRST)
+                | (seq_cls == SEQ_CLS_INTRON_MID)
+                | (seq_cls == SEQ_CLS_INTRON_LAST)
+            ) & (seq_relpos_start < 2)
+
+        elif site_class == "INTRON_SPLICE_3PRIME":
+            # 3' intron splice regions
+            loc_ann = (
+                (seq_cls == SEQ_CLS_INTRON_FIRST)
+                | (seq_cls == SEQ_CLS_INTRON_MID)
+                | (seq_cls == SEQ_CLS_INTRON_LAST)
+            ) & (seq_relpos_stop < 2)
+
+        elif site_class == "UTR_5PRIME":
+            # 5' UTR
+            loc_ann = seq_cls == SEQ_CLS_5UTR
+
+        elif site_class == "UTR_3PRIME":
+            # 3' UTR
+            loc_ann = seq_cls == SEQ_CLS_3UTR
+
+        elif site_class == "INTERGENIC":
+            # intergenic regions, distant from a gene
+            loc_ann = ((seq_cls == SEQ_CLS_UPSTREAM) & (seq_relpos_stop > 10_000)) | (
+                (seq_cls == SEQ_CLS_DOWNSTREAM) & (seq_relpos_start > 10_000)
+            )
 
-            elif site_class == "UTR_3PRIME":
-                # 3' UTR
-                loc_ann = seq_cls == SEQ_CLS_3UTR
+        else:
+            raise NotImplementedError(site_class)
 
-            elif site_class == "INTERGENIC":
-                # intergenic regions, distant from a gene
-                loc_ann = (
-                    (seq_cls == SEQ_CLS_UPSTREAM) & (seq_relpos_stop > 10_000)
-                ) | ((seq_cls == SEQ_CLS_DOWNSTREAM) & (seq_relpos_start > 10_000))
+        # N.B., site annotations data are provided for every position in the genome. We need to
+        # therefore subset to SNP positions.
+        pos = self._snp_sites_for_contig(
+            contig=contig,
+            field="POS",
+            inline_array=True,
+            chunks=base_params.native_chunks,
+        )
+        idx = (pos - 1).compute()
+        loc_ann = da.take(loc_ann, idx, axis=0)
 
-            else:
-                raise NotImplementedError(site_class) from exc
+        # Compute site selection.
+        with self._dask_progress(desc=f"Locate {site_class} sites"):
+            loc_ann = loc_ann.compute()
 
-            # N.B., site annotations data are provided for every position in the genome. We need to
-            # therefore subset to SNP positions.
-            pos = self.snp_sites(
-                region=region,
-                field="POS",
-                site_mask=site_mask,
-                inline_array=inline_array,
-                chunks=chunks,
-            )
-            idx = (pos - 1).compute()
-            loc_ann = da.take(loc_ann, idx, axis=0)
+        return loc_ann
+
+    def _site_bitmap(
+        self,
+        *,
+        contig: base_params.contig,
+        site_mask: Optional[base_params.site_mask] = None,
+        site_class: Optional[base_params.site_class] = None,
+    ) -> np.ndarray:
+        """Obtain a site mask or site class as a bitmap over all SNP sites in
+        a single contig, packed with `np.packbits()`. Bitmaps are cached in
+        memory and in the results cache, if configured."""
+        assert contig in self.contigs
+        assert (site_mask is None) != (site_class is None)
+        if site_class is not None:
+            site_class = site_class.upper()
+
+        cache_key = (contig, site_mask, site_class)
+        try:
+            return self._cache_site_bitmaps[cache_key]
+        except KeyError:
+            pass
 
-            # Compute site selection.
-            with self._dask_progress(desc=f"Locate {site_class} sites"):
-                loc_ann = loc_ann.compute()
+        n_sites = self.open_snp_sites()[f"{contig}/variants/POS"].shape[0]
+        name = "site_bitmap_v1"
+        params = dict(
+            contig=contig, site_mask=site_mask, site_class=site_class, n_sites=n_sites
+        )
 
-            self._cache_locate_site_class[cache_key] = loc_ann
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        return loc_ann
+            except CacheMiss:
+                if site_mask is not None:
+                    loc_sites = self._site_filters_for_contig(
+                        contig=contig,
+                        mask=site_mask,
+                        field="filter_pass",
+                        inline_array=True,
+                        chunks=base_params.native_chunks,
+                    )
+                    with self._dask_progress(desc="Load site filters"):
+                        loc_sites = loc_sites.compute()
+                else:
+                    assert site_class is not None
+                    loc_sites = self._compute_site_class(
+                        contig=contig, site_class=site_class
+                    )
+                assert loc_sites.shape[0] == n_sites
+                results = dict(bits=np.packbits(loc_sites))
+                self.results_cache_set(name=name, params=params, results=results)
+
+        bits = results["bits"]
+        self._cache_site_bitmaps[cache_key] = bits
+        return bits
+
+    def _locate_sites(
+        self,
+        *,
+        region: Region,
+        site_masks: Sequence[base_params.site_mask] = (),
+        site_classes: Sequence[base_params.site_class] = (),
+        how: str = "and",
+    ) -> np.ndarray:
+        """Locate SNP sites within a region which pass the given site masks
+        and belong to the given site classes, as a boolean array over all SNP
+        sites within the region. Masks and classes are combined with logical
+        AND if `how` is "and", or logical OR if `how` is "or"."""
+        assert how in {"and", "or"}
+        op = np.bitwise_and if how == "and" else np.bitwise_or
+
+        # Locate the region within the contig.
+        bounds, _, _ = self._snp_sites_index(contig=region.contig)
+        if region.start or region.end:
+            loc_region = self._locate_snp_sites_region(region=region)
+        else:
+            loc_region = slice(0, int(bounds[-1]))
+        if not site_masks and not site_classes:
+            return np.ones(loc_region.stop - loc_region.start, dtype=bool)
+
+        # Combine bitmaps for each contig overlapping the region.
+        contigs = self.virtual_contigs.get(region.contig, [region.contig])
+        loc_sites = []
+        offset = 0
+        for c in contigs:
+            n_sites = self.open_snp_sites()[f"{c}/variants/POS"].shape[0]
+            start = max(loc_region.start - offset, 0)
+            stop = min(loc_region.stop - offset, n_sites)
+            offset += n_sites
+            if stop <= start:
+                continue
+
+            # N.B., combine packed bitmaps, only for the bytes needed.
+            byte_start, byte_stop = start // 8, (stop + 7) // 8
+            bitmaps = [
+                self._site_bitmap(contig=c, site_mask=m)[byte_start:byte_stop]
+                for m in site_masks
+            ] + [
+                self._site_bitmap(contig=c, site_class=k)[byte_start:byte_stop]
+                for k in site_classes
+            ]
+            bits = op.reduce(bitmaps)
+            bit_start = start - byte_start * 8
+            loc = np.unpackbits(bits)[bit_start : bit_start + stop - start]
+            loc_sites.append(loc.astype(bool))
+
+        if not loc_sites:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(loc_sites)
 
     def _snp_calls_for_contig(
         self,
@@ -1088,15 +1322,106 @@ class AnophelesSnpData(
             chunks=chunks,
         )
 
+    @_check_types
+    @doc(
+        summary="""
+            Access SNP sites, site filters and genotype calls at specific
+            positions within a contig.
+        """,
+        returns="""
+            A dataset with the same layout as returned by `snp_calls()`,
+            containing only SNP sites found at the given positions, in
+            order of position.
+        """,
+        notes="""
+            Only chunks of data containing the given positions are read, which
+            is much faster than accessing SNP calls for a whole region when
+            positions are sparse, e.g., tag SNPs spread across a chromosome arm.
+        """,
+    )
+    def snp_calls_at_positions(
+        self,
+        contig: base_params.contig,
+        positions: base_params.positions,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        sample_indices: Optional[base_params.sample_indices] = None,
+        site_mask: Optional[base_params.site_mask] = None,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+        chunks: base_params.chunks = base_params.native_chunks,
+        cohort_size: Optional[base_params.cohort_size] = None,
+        min_cohort_size: Optional[base_params.min_cohort_size] = None,
+        max_cohort_size: Optional[base_params.max_cohort_size] = None,
+        random_seed: base_params.random_seed = 42,
+    ) -> xr.Dataset:
+        # Check that either sample_query xor sample_indices are provided.
+        base_params._validate_sample_selection_params(
+            sample_query=sample_query, sample_indices=sample_indices
+        )
+
+        # Normalise parameters.
+        prepared_site_mask = self._prep_optional_site_mask_param(site_mask=site_mask)
+        (
+            prepared_sample_sets,
+            prepared_sample_indices,
+        ) = self._prep_sample_selection_cache_params(
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            sample_indices=sample_indices,
+        )
+        del sample_sets
+        del sample_query
+        del sample_indices
+        del site_mask
+
+        # Access SNP calls for the whole contig. N.B., this is lazy, and
+        # the dataset is cached, so no data are read here.
+        ds = self._snp_calls(
+            regions=(Region(contig),),
+            sample_sets=(
+                tuple(prepared_sample_sets)
+                if prepared_sample_sets is not None
+                else None
+            ),
+            sample_indices=(
+                tuple(prepared_sample_indices)
+                if prepared_sample_indices is not None
+                else None
+            ),
+            site_mask=None,
+            site_class=None,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+            inline_array=inline_array,
+            chunks=chunks,
+        )
+
+        # Locate SNP sites at the given positions.
+        loc_sites = self._locate_snp_sites_positions(
+            contig=contig, positions=np.asarray(positions)
+        )
+
+        # Handle site mask.
+        if prepared_site_mask is not None:
+            loc_pass = self._locate_sites(
+                region=Region(contig), site_masks=[prepared_site_mask]
+            )
+            loc_sites = loc_sites[loc_pass[loc_sites]]
+
+        # N.B., selecting variants with sorted integer indices creates tasks
+        # only for the chunks containing the selected variants.
+        return ds.isel(variants=loc_sites)
+
     # Here we cache to improve performance for functions which
     # access SNP calls more than once. For example, this currently
     # happens during access of biallelic SNP calls, because a
     # first computation of allele counts is required, before
-    # then using that to filter SNP calls.
-    #
-    # We only cache up to 2 items because otherwise we can see
-    # high memory usage.
-    @lru_cache(maxsize=2)
+    # then using that to filter SNP calls. The dataset cache is
+    # bounded by memory usage rather than number of items.
     def _cached_snp_calls(
         self,
         *,
@@ -1106,6 +1431,36 @@ class AnophelesSnpData(
         site_class,
         inline_array,
         chunks,
+    ):
+        return self._cached_dataset(
+            key=(
+                "snp_calls",
+                regions,
+                sample_sets,
+                site_mask,
+                site_class,
+                inline_array,
+                chunks,
+            ),
+            build=lambda: self._build_snp_calls(
+                regions=regions,
+                sample_sets=sample_sets,
+                site_mask=site_mask,
+                site_class=site_class,
+                inline_array=inline_array,
+                chunks=chunks,
+            ),
+        )
+
+    def _build_snp_calls(
+        self,
+        *,
+        regions: Tuple[Region, ...],
+        sample_sets,
+        site_mask,
+        site_class,
+        inline_array,
+        chunks,
     ):
         # Access SNP calls and concatenate multiple sample sets and/or regions.
         with self._spinner("Access SNP calls"):
@@ -1132,35 +1487,24 @@ class AnophelesSnpData(
 
                 # Handle region, do this only once - optimisation.
                 if r.start or r.end:
-                    pos = x["variant_position"].values
-                    loc_region = _locate_region(r, pos)
+                    loc_region = self._locate_snp_sites_region(region=r)
                     x = x.isel(variants=loc_region)
 
-                # Handle site class.
-                if site_class is not None:
-                    loc_ann = self._locate_site_class(
+                # Handle site class and site filters.
+                if site_class is not None or site_mask is not None:
+                    loc_sites = self._locate_sites(
                         region=r,
-                        site_class=site_class,
-                        site_mask=None,
-                        inline_array=inline_array,
-                        chunks=chunks,
+                        site_masks=[site_mask] if site_mask is not None else [],
+                        site_classes=[site_class] if site_class is not None else [],
                     )
-                    assert x.sizes["variants"] == loc_ann.shape[0]
-                    x = x.isel(variants=loc_ann)
+                    assert x.sizes["variants"] == loc_sites.shape[0]
+                    x = _dask_compress_dataset(x, indexer=loc_sites, dim=DIM_VARIANT)
 
                 lx.append(x)
 
             # Concatenate data from multiple regions.
             ds = _simple_xarray_concat(lx, dim=DIM_VARIANT)
 
-        if site_mask is not None:
-            with self._spinner(desc="Apply site filters"):
-                ds = _dask_compress_dataset(
-                    ds,
-                    indexer=f"variant_filter_pass_{site_mask}",
-                    dim=DIM_VARIANT,
-                )
-
         # Add call_genotype_mask.
         ds["call_genotype_mask"] = ds["call_genotype"] < 0
 
@@ -1199,17 +1543,50 @@ class AnophelesSnpData(
             chunks=chunks,
         )
 
+        # Handle sample selection.
+        loc_samples = self._locate_snp_calls_samples(
+            sample_ids=ds.coords["sample_id"].values,
+            sample_sets=sample_sets,
+            sample_indices=sample_indices,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+        if loc_samples is not None:
+            ds = ds.isel(samples=loc_samples)
+
+        return ds
+
+    def _locate_snp_calls_samples(
+        self,
+        *,
+        sample_ids: np.ndarray,
+        sample_sets,
+        sample_indices,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+    ) -> Optional[np.ndarray]:
+        """Locate the samples selected from SNP calls for the given sample sets,
+        where `sample_ids` are the identifiers of all samples in the SNP calls.
+        Returns None if all samples are selected."""
+
+        loc_samples = None
+        n_samples = len(sample_ids)
+
         # Handle sample selection.
         if sample_indices is not None:
-            # Note: `sample_indices` could be any tuple of integers, while the `ds` DataSet will contain data for all samples in the `sample_sets`.
-            # In other words, the internal `sample_query` is not being applied to `ds`.
+            # Note: `sample_indices` could be any tuple of integers, while the SNP calls will contain data for all samples in the `sample_sets`.
+            # In other words, the internal `sample_query` is not being applied to the SNP calls.
             # We need to get the filtered set of samples from `sample_metadata` and then select samples based on that set.
 
             # Get the relevant sample metadata.
             relevant_samples_df = self.sample_metadata(sample_sets=sample_sets)
 
             # We need to select only the samples that are identified by the `sample_indices` tuple relative to the results of `sample_metadata`.
-            # However, the `ds` DataSet contains data for all samples in the `sample_sets`, regardless of any internal `sample_query`.
+            # However, the SNP calls contain data for all samples in the `sample_sets`, regardless of any internal `sample_query`.
 
             # Get the samples identified via `sample_indices`.
             # Note: this might raise `IndexingError` if the user provides bad indices, e.g. "positional indexers are out-of-bounds".
@@ -1220,21 +1597,15 @@ class AnophelesSnpData(
             # Get the selected sample ids from the sample metadata DataFrame.
             relevant_sample_ids = selected_samples_df["sample_id"].values
 
-            # Get all the sample ids from the unfiltered Dataset.
-            ds_sample_ids = ds.coords["sample_id"].values
-
-            # Get the indices of samples in the Dataset that match the relevant sample ids.
+            # Get the indices of samples in the SNP calls that match the relevant sample ids.
             # Note: we use `[0]` to get the first element of the tuple returned by `np.where`.
-            relevant_sample_indices = np.where(
-                np.isin(ds_sample_ids, relevant_sample_ids)
-            )[0]
+            loc_samples = np.where(np.isin(sample_ids, relevant_sample_ids))[0]
 
             # Preserve the behaviour of raising a `ValueError` instead of empty results.
-            if relevant_sample_indices.size == 0:
+            if loc_samples.size == 0:
                 raise ValueError("No relevant samples found.")
 
-            # Select only the relevant samples from the Dataset.
-            ds = ds.isel(samples=relevant_sample_indices)
+            n_samples = loc_samples.size
 
         # Handle cohort size, overrides min and max.
         if cohort_size is not None:
@@ -1243,7 +1614,6 @@ class AnophelesSnpData(
 
         # Handle min cohort size.
         if min_cohort_size is not None:
-            n_samples = ds.sizes["samples"]
             if n_samples < min_cohort_size:
                 raise ValueError(
                     f"not enough samples ({n_samples}) for minimum cohort size ({min_cohort_size})"
@@ -1251,16 +1621,18 @@ class AnophelesSnpData(
 
         # Handle max cohort size.
         if max_cohort_size is not None:
-            n_samples = ds.sizes["samples"]
             if n_samples > max_cohort_size:
                 rng = np.random.default_rng(seed=random_seed)
                 loc_downsample = rng.choice(
                     n_samples, size=max_cohort_size, replace=False
                 )
                 loc_downsample.sort()
-                ds = ds.isel(samples=loc_downsample)
+                if loc_samples is None:
+                    loc_samples = loc_downsample
+                else:
+                    loc_samples = loc_samples[loc_downsample]
 
-        return ds
+        return loc_samples
 
     def snp_dataset(self, *args, **kwargs):  # pragma: no cover
         """Deprecated, this method has been renamed to snp_calls()."""
@@ -1300,12 +1672,12 @@ class AnophelesSnpData(
         random_seed,
         inline_array,
         chunks,
+        engine=base_params.allele_counts_engine_default,
     ):
-        # Access SNP calls.
-        ds_snps = self.snp_calls(
+        (ac,) = self._snp_allele_counts_multi(
             region=region,
             sample_sets=sample_sets,
-            sample_indices=sample_indices,
+            sample_indices=[sample_indices],
             site_mask=site_mask,
             site_class=site_class,
             cohort_size=cohort_size,
@@ -1314,61 +1686,248 @@ class AnophelesSnpData(
             random_seed=random_seed,
             inline_array=inline_array,
             chunks=chunks,
+            engine=engine,
         )
-        gt = ds_snps["call_genotype"]
-
-        # Set up and run allele counts computation.
-        gt = allel.GenotypeDaskArray(gt.data)
-        ac = gt.count_alleles(max_allele=3)
-        with self._dask_progress(desc="Compute SNP allele counts"):
-            ac = ac.compute()
 
-        # Return plain numpy array.
-        results = dict(ac=ac.values)
+        results = dict(ac=ac)
 
         return results
 
-    @_check_types
-    @doc(
-        summary="""
-            Compute SNP allele counts. This returns the number of times each
-            SNP allele was observed in the selected samples.
-        """,
-        returns="""
-            A numpy array of shape (n_variants, 4), where the first column has
-            the reference allele (0) counts, the second column has the first
-            alternate allele (1) counts, the third column has the second
-            alternate allele (2) counts, and the fourth column has the third
-            alternate allele (3) counts.
-        """,
-        notes="""
-            This computation may take some time to run, depending on your
-            computing environment. Results of this computation will be cached
-            and re-used if the `results_cache` parameter was set when
-            instantiating the class.
-        """,
-    )
-    def snp_allele_counts(
+    def _snp_allele_counts_multi(
         self,
-        region: base_params.regions,
-        sample_sets: Optional[base_params.sample_sets] = None,
-        sample_query: Optional[base_params.sample_query] = None,
-        sample_query_options: Optional[base_params.sample_query_options] = None,
-        sample_indices: Optional[base_params.sample_indices] = None,
-        site_mask: Optional[base_params.site_mask] = None,
-        site_class: Optional[base_params.site_class] = None,
-        cohort_size: Optional[base_params.cohort_size] = None,
-        min_cohort_size: Optional[base_params.min_cohort_size] = None,
-        max_cohort_size: Optional[base_params.max_cohort_size] = None,
-        random_seed: base_params.random_seed = 42,
-        inline_array: base_params.inline_array = base_params.inline_array_default,
-        chunks: base_params.chunks = base_params.native_chunks,
-    ) -> np.ndarray:
-        # Change this name if you ever change the behaviour of this function,
-        # to invalidate any previously cached data.
-        name = "snp_allele_counts_v2"
-
-        # Check that either sample_query xor sample_indices are provided.
+        *,
+        region,
+        sample_sets,
+        sample_indices: List[Optional[Tuple[int, ...]]],
+        site_mask,
+        site_class,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        inline_array,
+        chunks,
+        engine,
+    ) -> List[np.ndarray]:
+        """Compute SNP allele counts for multiple sample selections, reading
+        genotype calls only once."""
+
+        if engine == "stream":
+            return self._snp_allele_counts_stream(
+                region=region,
+                sample_sets=sample_sets,
+                sample_indices=sample_indices,
+                site_mask=site_mask,
+                site_class=site_class,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+                inline_array=inline_array,
+                chunks=chunks,
+            )
+
+        # Access SNP calls for all samples.
+        ds_snps = self._snp_calls(
+            regions=tuple(_parse_multi_region(self, region)),
+            sample_sets=tuple(sample_sets),
+            sample_indices=None,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=None,
+            min_cohort_size=None,
+            max_cohort_size=None,
+            random_seed=random_seed,
+            inline_array=inline_array,
+            chunks=chunks,
+        )
+        sample_ids = ds_snps["sample_id"].values
+        gt = ds_snps["call_genotype"].data
+
+        # Set up allele counts computations for each sample selection.
+        ac_list = []
+        for x in sample_indices:
+            loc_samples = self._locate_snp_calls_samples(
+                sample_ids=sample_ids,
+                sample_sets=sample_sets,
+                sample_indices=x,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
+            gt_x = gt if loc_samples is None else gt[:, loc_samples]
+            ac = allel.GenotypeDaskArray(gt_x).count_alleles(max_allele=3)
+            ac_list.append(ac.values)
+
+        # N.B., compute together, so that tasks reading genotype calls are
+        # shared between all sample selections.
+        with self._dask_progress(desc="Compute SNP allele counts"):
+            ac_list = da.compute(*ac_list)
+
+        # Return plain numpy arrays.
+        return [np.asarray(ac) for ac in ac_list]
+
+    def _locate_snp_calls_variants(
+        self, *, region: Region, site_mask, site_class, inline_array, chunks
+    ) -> np.ndarray:
+        """Locate the variants selected from SNP calls for a single region,
+        as indices into all variants for the region's contig, matching the
+        selection made by `snp_calls()`."""
+
+        pos = self._snp_sites_for_contig(
+            contig=region.contig,
+            field="POS",
+            inline_array=inline_array,
+            chunks=chunks,
+        )
+        loc_variants = np.arange(pos.shape[0])
+
+        # Handle region.
+        if region.start or region.end:
+            loc_region = self._locate_snp_sites_region(region=region)
+            loc_variants = loc_variants[loc_region]
+
+        # Handle site class and site filters.
+        if site_class is not None or site_mask is not None:
+            loc_sites = self._locate_sites(
+                region=region,
+                site_masks=[site_mask] if site_mask is not None else [],
+                site_classes=[site_class] if site_class is not None else [],
+            )
+            loc_variants = loc_variants[loc_sites]
+
+        return loc_variants
+
+    def _snp_allele_counts_stream(
+        self,
+        *,
+        region,
+        sample_sets,
+        sample_indices: List[Optional[Tuple[int, ...]]],
+        site_mask,
+        site_class,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        inline_array,
+        chunks,
+        max_allele=3,
+    ) -> List[np.ndarray]:
+        """Compute SNP allele counts for multiple sample selections by reading
+        native zarr chunks of genotype calls directly, rather than via a dask
+        computation. Each chunk is read only once."""
+
+        regions: List[Region] = _parse_multi_region(self, region)
+
+        # Locate selected samples, in the same order as SNP calls.
+        calls_roots = [self.open_snp_genotypes(sample_set=s) for s in sample_sets]
+        sample_ids_by_set = [root["samples"][:].astype("U") for root in calls_roots]
+        sample_ids = np.concatenate(sample_ids_by_set)
+        loc_samples_list = []
+        for x in sample_indices:
+            loc_samples = self._locate_snp_calls_samples(
+                sample_ids=sample_ids,
+                sample_sets=sample_sets,
+                sample_indices=x,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
+            if loc_samples is None:
+                loc_samples = np.arange(len(sample_ids))
+            loc_samples_list.append(loc_samples)
+
+        # Split selected samples by sample set.
+        loc_samples_by_set = []
+        sample_offset = 0
+        for ids in sample_ids_by_set:
+            n = len(ids)
+            loc_samples_by_set.append(
+                [
+                    loc[(loc >= sample_offset) & (loc < sample_offset + n)]
+                    - sample_offset
+                    for loc in loc_samples_list
+                ]
+            )
+            sample_offset += n
+
+        # Locate selected variants.
+        with self._spinner("Locate SNP calls"):
+            loc_variants_by_region = [
+                self._locate_snp_calls_variants(
+                    region=r,
+                    site_mask=site_mask,
+                    site_class=site_class,
+                    inline_array=inline_array,
+                    chunks=chunks,
+                )
+                for r in regions
+            ]
+        n_variants = sum(loc.size for loc in loc_variants_by_region)
+        ac = np.zeros((len(sample_indices), n_variants, max_allele + 1), dtype=np.int32)
+
+        def tasks():
+            # Generate a task for each native zarr chunk of genotype calls
+            # which contains selected variants and samples.
+            out_offset = 0
+            for r, loc_variants in zip(regions, loc_variants_by_region):
+                contigs = self.virtual_contigs.get(r.contig, [r.contig])
+                for root, loc_s in zip(calls_roots, loc_samples_by_set):
+                    contig_offset = 0
+                    for c in contigs:
+                        gt_z = root[f"{c}/calldata/GT"]
+                        yield from _genotype_chunk_tasks(
+                            gt_z=gt_z,
+                            loc_variants=loc_variants - contig_offset,
+                            loc_samples=loc_s,
+                            out_offset=out_offset,
+                        )
+                        contig_offset += gt_z.shape[0]
+                out_offset += loc_variants.size
+
+        def count(task):
+            gt_z, selection, loc_v, loc_s, cohort_bounds, out_start = task
+            gt = gt_z[selection]
+            ac_block = _count_alleles_cohorts(
+                gt, loc_v, loc_s, cohort_bounds, max_allele
+            )
+            return out_start, ac_block
+
+        # N.B., counts for each block are accumulated as they are completed,
+        # so memory usage is bounded by the number of blocks in flight.
+        results = _threaded_map(count, tasks())
+        for out_start, ac_block in self._progress(
+            results, desc="Compute SNP allele counts"
+        ):
+            ac[:, out_start : out_start + ac_block.shape[1]] += ac_block
+
+        return list(ac)
+
+    def _prep_snp_allele_counts_params(
+        self,
+        *,
+        region,
+        sample_sets,
+        sample_query,
+        sample_query_options,
+        sample_indices,
+        site_mask,
+        site_class,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+    ) -> Tuple[str, dict]:
+        """Obtain the results cache name and parameters for SNP allele counts."""
+
+        # Change this name if you ever change the behaviour of this function,
+        # to invalidate any previously cached data.
+        name = "snp_allele_counts_v2"
+
+        # Check that either sample_query xor sample_indices are provided.
         base_params._validate_sample_selection_params(
             sample_query=sample_query, sample_indices=sample_indices
         )
@@ -1386,19 +1945,11 @@ class AnophelesSnpData(
             sample_query_options=sample_query_options,
             sample_indices=sample_indices,
         )
-        del sample_sets
-        del sample_query
-        del sample_query_options
-        del sample_indices
-        region_prepped = self._prep_region_cache_param(region=region)
-        del region
-        site_mask_prepped = self._prep_optional_site_mask_param(site_mask=site_mask)
-        del site_mask
         params = dict(
-            region=region_prepped,
+            region=self._prep_region_cache_param(region=region),
             sample_sets=sample_sets_prepped,
             sample_indices=sample_indices_prepped,
-            site_mask=site_mask_prepped,
+            site_mask=self._prep_optional_site_mask_param(site_mask=site_mask),
             site_class=site_class,
             cohort_size=cohort_size,
             min_cohort_size=min_cohort_size,
@@ -1406,18 +1957,234 @@ class AnophelesSnpData(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        return name, params
 
-        except CacheMiss:
-            results = self._snp_allele_counts(
-                **params, inline_array=inline_array, chunks=chunks
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+    @_check_types
+    @doc(
+        summary="""
+            Compute SNP allele counts. This returns the number of times each
+            SNP allele was observed in the selected samples.
+        """,
+        returns="""
+            A numpy array of shape (n_variants, 4), where the first column has
+            the reference allele (0) counts, the second column has the first
+            alternate allele (1) counts, the third column has the second
+            alternate allele (2) counts, and the fourth column has the third
+            alternate allele (3) counts.
+        """,
+        notes="""
+            This computation may take some time to run, depending on your
+            computing environment. Results of this computation will be cached
+            and re-used if the `results_cache` parameter was set when
+            instantiating the class.
+        """,
+    )
+    def snp_allele_counts(
+        self,
+        region: base_params.regions,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        sample_indices: Optional[base_params.sample_indices] = None,
+        site_mask: Optional[base_params.site_mask] = None,
+        site_class: Optional[base_params.site_class] = None,
+        cohort_size: Optional[base_params.cohort_size] = None,
+        min_cohort_size: Optional[base_params.min_cohort_size] = None,
+        max_cohort_size: Optional[base_params.max_cohort_size] = None,
+        random_seed: base_params.random_seed = 42,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+        chunks: base_params.chunks = base_params.native_chunks,
+        engine: Optional[base_params.allele_counts_engine] = None,
+    ) -> np.ndarray:
+        # N.B., all engines give the same results, so the engine is not
+        # included in the cache parameters.
+        if engine is None:
+            engine = self._allele_counts_engine
+
+        name, params = self._prep_snp_allele_counts_params(
+            region=region,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            sample_indices=sample_indices,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                results = self._snp_allele_counts(
+                    **params, inline_array=inline_array, chunks=chunks, engine=engine
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         ac = results["ac"]
         return ac
 
+    def _snp_allele_counts_for_queries(
+        self,
+        *,
+        region,
+        sample_queries: List[Optional[str]],
+        sample_query_options,
+        sample_sets,
+        site_mask,
+        site_class,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        inline_array,
+        chunks,
+        engine,
+    ) -> List[np.ndarray]:
+        """Compute SNP allele counts for multiple sample queries in a single
+        pass over genotype calls. Results for each query are cached as for
+        `snp_allele_counts()`, and only queries not found in the cache are
+        computed."""
+
+        if engine is None:
+            engine = self._allele_counts_engine
+
+        # Set up cache parameters for each query.
+        all_params = []
+        for sample_query in sample_queries:
+            name, params = self._prep_snp_allele_counts_params(
+                region=region,
+                sample_sets=sample_sets,
+                sample_query=sample_query,
+                sample_query_options=sample_query_options,
+                sample_indices=None,
+                site_mask=site_mask,
+                site_class=site_class,
+                cohort_size=cohort_size,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
+            all_params.append(params)
+
+        ac_list: List[Optional[np.ndarray]] = [None] * len(sample_queries)
+        with ExitStack() as stack:
+            # Look for results in the cache, taking the lock for each query.
+            # N.B., take locks in a consistent order, to avoid deadlocks
+            # between workers computing overlapping sets of queries.
+            order = sorted(
+                range(len(all_params)),
+                key=lambda i: self._results_cache_key(name=name, params=all_params[i]),
+            )
+            for i in order:
+                stack.enter_context(
+                    self.results_cache_lock(name=name, params=all_params[i])
+                )
+                try:
+                    ac_list[i] = self.results_cache_get(
+                        name=name, params=all_params[i]
+                    )["ac"]
+                except CacheMiss:
+                    pass
+
+            # Compute any missing results in a single pass.
+            missing = [i for i, ac in enumerate(ac_list) if ac is None]
+            if missing:
+                # N.B., parameters other than sample indices are shared.
+                params = all_params[missing[0]]
+                ac_missing = self._snp_allele_counts_multi(
+                    region=params["region"],
+                    sample_sets=params["sample_sets"],
+                    sample_indices=[all_params[i]["sample_indices"] for i in missing],
+                    site_mask=params["site_mask"],
+                    site_class=site_class,
+                    cohort_size=cohort_size,
+                    min_cohort_size=min_cohort_size,
+                    max_cohort_size=max_cohort_size,
+                    random_seed=random_seed,
+                    inline_array=inline_array,
+                    chunks=chunks,
+                    engine=engine,
+                )
+                for i, ac in zip(missing, ac_missing):
+                    self.results_cache_set(
+                        name=name, params=all_params[i], results=dict(ac=ac)
+                    )
+                    ac_list[i] = ac
+
+        return ac_list  # type: ignore
+
+    @_check_types
+    @doc(
+        summary="""
+            Compute SNP allele counts for multiple cohorts, reading genotype
+            calls only once.
+        """,
+        returns="""
+            A numpy array of shape (n_cohorts, n_variants, 4), where the first
+            dimension corresponds to the cohorts, in the order given, or in
+            order of cohort label if `cohorts` is the name of a cohort set. The
+            remaining dimensions are as for `snp_allele_counts()`.
+        """,
+        notes="""
+            This gives the same results as calling `snp_allele_counts()` for
+            each cohort, but is much faster for many cohorts, because genotype
+            calls are only read and decompressed once. Results for each cohort
+            are cached and re-used as for `snp_allele_counts()` if the
+            `results_cache` parameter was set when instantiating the class.
+        """,
+    )
+    def snp_allele_counts_multi(
+        self,
+        region: base_params.regions,
+        cohorts: base_params.cohorts,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        site_mask: Optional[base_params.site_mask] = None,
+        site_class: Optional[base_params.site_class] = None,
+        cohort_size: Optional[base_params.cohort_size] = None,
+        min_cohort_size: Optional[base_params.min_cohort_size] = None,
+        max_cohort_size: Optional[base_params.max_cohort_size] = None,
+        random_seed: base_params.random_seed = 42,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+        chunks: base_params.chunks = base_params.native_chunks,
+        engine: Optional[base_params.allele_counts_engine] = None,
+    ) -> np.ndarray:
+        # N.B., don't drop any cohorts here, so that the output corresponds
+        # to the cohorts requested. Cohorts which are too small will raise
+        # an error, as for `snp_allele_counts()`.
+        cohort_queries = self._setup_cohort_queries(
+            cohorts,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            cohort_size=None,
+            min_cohort_size=None,
+        )
+
+        ac_list = self._snp_allele_counts_for_queries(
+            region=region,
+            sample_queries=list(cohort_queries.values()),
+            sample_query_options=sample_query_options,
+            sample_sets=sample_sets,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+            inline_array=inline_array,
+            chunks=chunks,
+            engine=engine,
+        )
+
+        return np.stack(ac_list)
+
     @_check_types
     @doc(
         summary="""
@@ -1850,43 +2617,21 @@ class AnophelesSnpData(
             ds_out = xr.Dataset(coords=coords, data_vars=data_vars, attrs=ds.attrs)
 
             # Apply conditions.
-            if max_missing_an is not None or min_minor_ac is not None:
-                loc_out = np.ones(ds_out.sizes["variants"], dtype=bool)
-                an = ac_out.sum(axis=1)
-
-                # Apply missingness condition.
-                if max_missing_an is not None:
-                    an_missing = (ds_out.sizes["samples"] * ds_out.sizes["ploidy"]) - an
-                    if isinstance(max_missing_an, float):
-                        an_missing_frac = an_missing / an
-                        loc_missing = an_missing_frac <= max_missing_an
-                    else:
-                        loc_missing = an_missing <= max_missing_an
-                    loc_out &= loc_missing
-
-                # Apply minor allele count condition.
-                if min_minor_ac is not None:
-                    ac_minor = ac_out.min(axis=1)
-                    if isinstance(min_minor_ac, float):
-                        ac_minor_frac = ac_minor / an
-                        loc_minor = ac_minor_frac >= min_minor_ac
-                    else:
-                        loc_minor = ac_minor >= min_minor_ac
-                    loc_out &= loc_minor
-
-                # Apply selection from conditions.
+            loc_out = _biallelic_snp_conditions(
+                ac_out,
+                n_haps=ds_out.sizes["samples"] * ds_out.sizes["ploidy"],
+                max_missing_an=max_missing_an,
+                min_minor_ac=min_minor_ac,
+            )
+            if loc_out is not None:
                 ds_out = _dask_compress_dataset(ds_out, indexer=loc_out, dim="variants")
 
             # Try to meet target number of SNPs.
-            if n_snps is not None:
-                if ds_out.sizes["variants"] > (n_snps * 2):
-                    # Apply thinning.
-                    thin_step = ds_out.sizes["variants"] // n_snps
-                    loc_thin = slice(thin_offset, None, thin_step)
-                    ds_out = ds_out.isel(variants=loc_thin)
-
-                elif ds_out.sizes["variants"] < n_snps:
-                    raise ValueError("Not enough SNPs.")
+            loc_thin = _thin_snps(
+                ds_out.sizes["variants"], n_snps=n_snps, thin_offset=thin_offset
+            )
+            if loc_thin is not None:
+                ds_out = ds_out.isel(variants=loc_thin)
 
         return ds_out
 
@@ -1900,6 +2645,18 @@ class AnophelesSnpData(
             """,
             samples="Sample identifiers.",
         ),
+        parameters=dict(
+            inline_array="""
+                Has no effect, retained for backwards compatibility. Genotype
+                calls are read directly in their native zarr chunks, without
+                building dask arrays.
+            """,
+            chunks="""
+                Has no effect, retained for backwards compatibility. Genotype
+                calls are read directly in their native zarr chunks, without
+                building dask arrays.
+            """,
+        ),
     )
     def biallelic_diplotypes(
         self,
@@ -1971,14 +2728,15 @@ class AnophelesSnpData(
         )
 
         # Try to retrieve results from the cache.
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._biallelic_diplotypes(
-                inline_array=inline_array, chunks=chunks, **params
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._biallelic_diplotypes(
+                    inline_array=inline_array, chunks=chunks, **params
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         # Unpack results.
         gn = results["gn"]
@@ -2007,8 +2765,9 @@ class AnophelesSnpData(
     ):
         # Note: this function uses sample_indices and should not expect a sample_query.
 
-        # Access biallelic SNPs.
-        ds = self.biallelic_snp_calls(
+        # N.B., the chunks and inline_array parameters are not needed, because
+        # native zarr chunks of genotype calls are read directly.
+        results = self._biallelic_genotypes_stream(
             region=region,
             sample_sets=sample_sets,
             sample_indices=sample_indices,
@@ -2022,16 +2781,232 @@ class AnophelesSnpData(
             min_minor_ac=min_minor_ac,
             n_snps=n_snps,
             thin_offset=thin_offset,
-            inline_array=inline_array,
-            chunks=chunks,
         )
 
-        # Load sample IDs
-        samples = ds["sample_id"].values.astype("U")
+        return dict(samples=results["samples"], gn=results["gn"])
+
+    def _biallelic_genotypes_stream(
+        self,
+        *,
+        region,
+        sample_sets,
+        sample_indices,
+        site_mask,
+        site_class,
+        cohort_size,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+        max_missing_an,
+        min_minor_ac,
+        n_snps,
+        thin_offset,
+        ref=False,
+    ):
+        """Compute genotype allele counts at biallelic SNPs, selecting the same
+        SNPs as `biallelic_snp_calls()`, by reading native zarr chunks of
+        genotype calls directly.
+
+        If SNP allele counts are not already in the results cache, allele
+        counts and genotype allele counts are computed together in a single
+        pass, and the allele counts are saved to the results cache. Genotype
+        allele counts for SNPs meeting all conditions are buffered, unless
+        the buffer grows beyond `_BIALLELIC_BUFFER_NBYTES` when thinning, in
+        which case only chunks containing the thinned SNPs are read again.
+
+        Returns a dict with the selected sample identifiers ("samples"), the
+        indices of the selected SNPs within the SNP calls for the region
+        ("variant_index"), the indices of the reference and alternate alleles
+        ("alleles"), and the number of alternate alleles in each genotype call
+        ("gn"), or the number of reference alleles if `ref` is true.
+        """
 
-        # Compute diplotypes as the number of alt alleles per genotype call.
-        gt = allel.GenotypeDaskArray(ds["call_genotype"].data)
-        with self._dask_progress(desc="Compute biallelic diplotypes"):
-            gn = gt.to_n_alt().compute()
+        regions: List[Region] = _parse_multi_region(self, region)
 
-        return dict(samples=samples, gn=gn)
+        # Locate selected samples, in the same order as SNP calls.
+        calls_roots = [self.open_snp_genotypes(sample_set=s) for s in sample_sets]
+        sample_ids_by_set = [root["samples"][:].astype("U") for root in calls_roots]
+        sample_ids = np.concatenate(sample_ids_by_set)
+        loc_samples = self._locate_snp_calls_samples(
+            sample_ids=sample_ids,
+            sample_sets=sample_sets,
+            sample_indices=sample_indices,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+        if loc_samples is None:
+            loc_samples = np.arange(len(sample_ids))
+        samples = sample_ids[loc_samples]
+
+        # Split selected samples by sample set.
+        loc_samples_by_set = []
+        sample_offset = 0
+        for ids in sample_ids_by_set:
+            n = len(ids)
+            loc_s = loc_samples[
+                (loc_samples >= sample_offset) & (loc_samples < sample_offset + n)
+            ]
+            loc_samples_by_set.append(loc_s - sample_offset)
+            sample_offset += n
+
+        # Locate selected variants.
+        with self._spinner("Locate SNP calls"):
+            loc_variants_by_region = [
+                self._locate_snp_calls_variants(
+                    region=r,
+                    site_mask=site_mask,
+                    site_class=site_class,
+                    inline_array=True,
+                    chunks="native",
+                )
+                for r in regions
+            ]
+
+        # Split selected variants into blocks, one for each native chunk of
+        # genotype calls. Each block is a list of genotype call arrays, one
+        # for each sample set, and the indices of variants within the arrays.
+        blocks = []
+        for r, loc_variants in zip(regions, loc_variants_by_region):
+            contigs = self.virtual_contigs.get(r.contig, [r.contig])
+            contig_offset = 0
+            for c in contigs:
+                gt_zs = [root[f"{c}/calldata/GT"] for root in calls_roots]
+                n = gt_zs[0].shape[0]
+                loc_v = loc_variants[
+                    (loc_variants >= contig_offset) & (loc_variants < contig_offset + n)
+                ]
+                loc_v = loc_v - contig_offset
+                _, v_starts = np.unique(loc_v // gt_zs[0].chunks[0], return_index=True)
+                for loc_v_block in np.split(loc_v, v_starts[1:]):
+                    if loc_v_block.size > 0:
+                        blocks.append((gt_zs, loc_v_block))
+                contig_offset += n
+        block_offsets = np.cumsum([0] + [loc_v.size for _, loc_v in blocks])
+
+        def read(task):
+            gt_z, loc_v, loc_s = task
+            if loc_v.size == 0 or loc_s.size == 0:
+                return np.zeros((loc_v.size, loc_s.size, 2), dtype="i1")
+            v_lo, s_lo = loc_v[0], loc_s[0]
+            gt = gt_z[v_lo : loc_v[-1] + 1, s_lo : loc_s[-1] + 1]
+            return gt[loc_v - v_lo][:, loc_s - s_lo]
+
+        def read_blocks(selected_blocks):
+            # Read genotype calls for each block of variants, for all selected
+            # samples, yielding the block index and genotype calls.
+            def tasks():
+                for i, loc_v in selected_blocks:
+                    gt_zs, _ = blocks[i]
+                    for gt_z, loc_s in zip(gt_zs, loc_samples_by_set):
+                        yield gt_z, loc_v, loc_s
+
+            parts = _threaded_map(read, tasks())
+            for i, _ in selected_blocks:
+                gt = np.concatenate([next(parts) for _ in sample_sets], axis=1)
+                yield i, gt
+
+        n_haps = len(samples) * 2
+        ac_name, ac_params = self._prep_snp_allele_counts_params(
+            region=region,
+            sample_sets=sample_sets,
+            sample_query=None,
+            sample_query_options=None,
+            sample_indices=sample_indices,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=cohort_size,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+        gn_parts: Optional[List[np.ndarray]] = None
+        with self.results_cache_lock(name=ac_name, params=ac_params):
+            try:
+                ac = self.results_cache_get(name=ac_name, params=ac_params)["ac"]
+
+            except CacheMiss:
+                # Read all genotype calls once, counting alleles, and computing
+                # genotype allele counts for biallelic SNPs meeting conditions.
+                ac_parts = []
+                gn_parts = []
+                gn_nbytes = 0
+                for _, gt in self._progress(
+                    read_blocks(list(enumerate(loc_v for _, loc_v in blocks))),
+                    total=len(blocks),
+                    desc="Compute SNP allele counts",
+                ):
+                    ac_block = (
+                        allel.GenotypeArray(gt).count_alleles(max_allele=3).values
+                    )
+                    ac_parts.append(ac_block.astype(np.int32))
+                    if gn_parts is not None:
+                        loc_block, alleles_block = _locate_biallelic_snps(
+                            ac_block,
+                            n_haps=n_haps,
+                            max_missing_an=max_missing_an,
+                            min_minor_ac=min_minor_ac,
+                        )
+                        gn_block = _biallelic_genotype_counts(
+                            gt[loc_block], alleles_block, ref=ref
+                        )
+                        gn_parts.append(gn_block)
+                        gn_nbytes += gn_block.nbytes
+                        if n_snps is not None and gn_nbytes > _BIALLELIC_BUFFER_NBYTES:
+                            # Too many SNPs to buffer, read thinned SNPs again later.
+                            gn_parts = None
+                ac = np.concatenate(ac_parts) if ac_parts else np.zeros((0, 4), "i4")
+                self.results_cache_set(
+                    name=ac_name, params=ac_params, results=dict(ac=ac)
+                )
+
+        # Select biallelic SNPs.
+        variant_index, alleles = _locate_biallelic_snps(
+            ac,
+            n_haps=n_haps,
+            max_missing_an=max_missing_an,
+            min_minor_ac=min_minor_ac,
+        )
+        loc_thin = _thin_snps(
+            variant_index.size, n_snps=n_snps, thin_offset=thin_offset
+        )
+        if loc_thin is not None:
+            variant_index = variant_index[loc_thin]
+            alleles = alleles[loc_thin]
+
+        if gn_parts is not None:
+            # Use buffered genotype allele counts.
+            gn = (
+                np.concatenate(gn_parts)
+                if gn_parts
+                else np.zeros((0, len(samples)), "i1")
+            )
+            if loc_thin is not None:
+                gn = gn[loc_thin]
+
+        else:
+            # Read genotype calls only for blocks containing selected SNPs.
+            gn = np.zeros((variant_index.size, len(samples)), dtype=np.int8)
+            bounds = np.searchsorted(variant_index, block_offsets)
+            selected_blocks = [
+                (i, loc_v[variant_index[a:b] - block_offsets[i]])
+                for i, ((_, loc_v), a, b) in enumerate(
+                    zip(blocks, bounds[:-1], bounds[1:])
+                )
+                if b > a
+            ]
+            for i, gt in self._progress(
+                read_blocks(selected_blocks),
+                total=len(selected_blocks),
+                desc="Compute biallelic diplotypes",
+            ):
+                a, b = bounds[i], bounds[i + 1]
+                gn[a:b] = _biallelic_genotype_counts(gt, alleles[a:b], ref=ref)
+
+        return dict(
+            samples=samples,
+            variant_index=variant_index,
+            alleles=alleles,
+            gn=gn,
+        )
@@ -1,18 +1,29 @@
-from typing import Optional, Dict, Union, Callable, List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import Optional, Deque, Dict, Union, Callable, List, Tuple
 import warnings
 
 import allel  # type: ignore
+import dask.array as da
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
 from numpydoc_decorator import doc  # type: ignore
 import xarray as xr
 import numba  # type: ignore
+import zarr  # type: ignore
 
 from .. import veff
 from ..util import (
+    CacheMiss,
+    _arrays_to_strings,
     _check_types,
     _pandas_apply,
+    Region,
+    _parse_single_region,
+    _strings_to_arrays,
 )
 from .snp_data import AnophelesSnpData
 from .frq_base import (
@@ -25,6 +36,75 @@ from .frq_base import AnophelesFrequencyAnalysis
 from . import base_params, frq_params
 
 
+# N.B., amino acid positions are stored as integers, all other effect fields
+# are strings.
+_effect_string_fields = tuple(f for f in veff._effect_fields if f != "aa_pos")
+
+
+_snp_effects_store_dtypes = {
+    "effect": np.int8,
+    "impact": np.int8,
+    "ref_codon": "U3",
+    "alt_codon": "U3",
+    "aa_pos": np.int32,
+    "ref_aa": "U1",
+    "alt_aa": "U1",
+}
+
+
+# SNP site data stored alongside effects in the SNP effects store, so that
+# effects can be read without accessing the SNP sites. N.B., the alternate
+# alleles have one column per allele, the other fields have one value per
+# site. Positions keep the dtype of the SNP sites, and site filters are also
+# stored, one field per site mask.
+_snp_effects_store_site_dtypes = {
+    "position": None,
+    "ref_allele": "U1",
+    "alt_allele": "U1",
+}
+
+
+# Variant effect annotator used by worker processes building the SNP effects
+# store, see build_snp_effects_store().
+_worker_annotator: Optional[veff.Annotator] = None
+
+
+def _init_snp_effects_worker(genome, genome_features):
+    global _worker_annotator
+    _worker_annotator = veff.Annotator(genome=genome, genome_features=genome_features)
+
+
+def _snp_effects_worker(transcript, contig, pos, ref, alt, filter_pass):
+    """Compute effects for all possible SNP alleles at the given sites, with
+    one row per site and one column per alternate allele. The site data are
+    included in the results, to be stored alongside the effects."""
+    assert _worker_annotator is not None
+    block = dict(
+        position=pos,
+        ref_allele=ref.astype("U1"),
+        alt_allele=alt.astype("U1"),
+    )
+    for m, x in filter_pass.items():
+        block[f"filter_pass_{m}"] = x
+    df = pd.DataFrame(
+        {
+            "contig": contig,
+            "position": np.repeat(block["position"], 3),
+            "ref_allele": np.repeat(block["ref_allele"], 3),
+            "alt_allele": block["alt_allele"].flatten(),
+        }
+    )
+    _worker_annotator.get_effects(transcript=transcript, variants=df)
+    shape = (len(pos), 3)
+    for field in "effect", "impact":
+        block[field] = df[field].to_numpy(dtype=str).reshape(shape)
+    for field in "ref_codon", "alt_codon", "ref_aa", "alt_aa":
+        x = df[field].fillna("").to_numpy(dtype=_snp_effects_store_dtypes[field])
+        block[field] = x.reshape(shape)
+    block["aa_pos"] = df["aa_pos"].fillna(0).to_numpy(dtype=np.int32).reshape(shape)
+    return block
+
+
 AA_CHANGE_QUERY = (
     "effect in ['NON_SYNONYMOUS_CODING', 'START_LOST', 'STOP_LOST', 'STOP_GAINED']"
 )
@@ -42,6 +122,10 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
 
         # Set up cache variables.
         self._cache_annotator = None
+        self._snp_effects_store: Optional[zarr.hierarchy.Group] = None
+        self._cache_snp_effects_store_index: Dict[
+            str, Dict[str, Tuple[int, int, int]]
+        ] = dict()
 
     def _snp_df_melt(self, *, ds_snp: xr.Dataset) -> pd.DataFrame:
         """Set up a dataframe with SNP site and filter data,
@@ -89,6 +173,413 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
             )
         return self._cache_annotator
 
+    def _snp_effects_table(self, *, transcript: str) -> Dict[str, np.ndarray]:
+        """Obtain a table of effects for all possible SNP alleles at every SNP
+        site within a transcript, one row per alternate allele. The table is
+        computed once per transcript and cached in the dataset cache, which
+        bounds memory usage, and in the results cache, if configured."""
+        return self._cached_dataset(
+            key=("snp_effects_table", transcript),
+            build=lambda: self._snp_effects_table_build(transcript=transcript),
+        )
+
+    def _snp_effects_table_build(self, *, transcript: str) -> Dict[str, np.ndarray]:
+        region = _parse_single_region(self, transcript)
+
+        # N.B., include the version of the geneset and the number of SNP sites
+        # on the contig, so that a stale table is never used if the underlying
+        # data change.
+        name = "snp_effects_table_v1"
+        params = dict(
+            transcript=transcript,
+            geneset=self._geneset_gff3_params(),
+            contig=region.contig,
+            n_sites=self.snp_sites(region=region.contig, field="POS").shape[0],
+        )
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+                results = {k: np.asarray(results[k]) for k in results}
+
+            except CacheMiss:
+                # Set up all possible SNP alleles, one row per alternate allele.
+                pos, ref, alt = da.compute(
+                    self.snp_sites(region=transcript, field="POS"),
+                    self.snp_sites(region=transcript, field="REF"),
+                    self.snp_sites(region=transcript, field="ALT"),
+                )
+                df_snps = pd.DataFrame(
+                    {
+                        "contig": region.contig,
+                        "position": np.repeat(pos, 3),
+                        "ref_allele": np.repeat(ref.astype("U1"), 3),
+                        "alt_allele": alt.astype("U1").flatten(),
+                    }
+                )
+
+                # Annotate effects.
+                ann = self._snp_effect_annotator()
+                ann.get_effects(
+                    transcript=transcript, variants=df_snps, progress=self._progress
+                )
+
+                # Encode the table as arrays for the results cache.
+                results = dict(
+                    position=df_snps["position"].to_numpy(dtype=np.int64),
+                    ref_allele=df_snps["ref_allele"].to_numpy(dtype="U1"),
+                    alt_allele=df_snps["alt_allele"].to_numpy(dtype="U1"),
+                    # N.B., amino acid positions start at 1, so use 0 for
+                    # variants outside of coding sequences.
+                    aa_pos=df_snps["aa_pos"].fillna(0).to_numpy(dtype=np.int64),
+                )
+                for field in _effect_string_fields:
+                    codes, strings = _strings_to_arrays(df_snps[field].to_numpy())
+                    results[f"{field}_codes"] = codes
+                    results[f"{field}_strings"] = strings
+                self.results_cache_set(name=name, params=params, results=results)
+
+        return results
+
+    def _snp_effects_join(
+        self, *, transcript: str, variants: pd.DataFrame
+    ) -> pd.DataFrame:
+        """Add effect annotations to a dataframe of SNP alleles, by joining
+        against the effects table for the transcript. This adds the same
+        columns as the annotator's get_effects() method."""
+        table = self._snp_effects_table(transcript=transcript)
+
+        # Make sure all alleles are uppercase.
+        variants.ref_allele = variants.ref_allele.str.upper()
+        variants.alt_allele = variants.alt_allele.str.upper()
+
+        # Locate variants in the table. N.B., the table has up to three rows
+        # per position, one for each alternate allele.
+        table_pos = table["position"]
+        pos = variants["position"].to_numpy()
+        ref = variants["ref_allele"].to_numpy(dtype=str)
+        alt = variants["alt_allele"].to_numpy(dtype=str)
+        n_rows = len(table_pos)
+        if n_rows > 0:
+            candidates = np.searchsorted(table_pos, pos)[:, None] + np.arange(3)
+            candidates = np.minimum(candidates, n_rows - 1)
+            match = (
+                (table_pos[candidates] == pos[:, None])
+                & (table["ref_allele"][candidates] == ref[:, None])
+                & (table["alt_allele"][candidates] == alt[:, None])
+            )
+            loc_found = np.any(match, axis=1)
+            rows = candidates[np.arange(len(pos)), np.argmax(match, axis=1)]
+        else:
+            loc_found = np.zeros(len(pos), dtype=bool)
+            rows = np.zeros(len(pos), dtype=np.int64)
+
+        # Look up effects.
+        values: Dict[str, np.ndarray] = dict()
+        for field in _effect_string_fields:
+            codes = table[f"{field}_codes"][rows]
+            x = _arrays_to_strings(codes, table[f"{field}_strings"])
+            x[codes < 0] = None
+            values[field] = x
+        aa_pos = table["aa_pos"][rows]
+        values["aa_pos"] = np.full(len(rows), None, dtype=object)
+        values["aa_pos"][aa_pos > 0] = aa_pos[aa_pos > 0]
+
+        # Annotate any variants not found in the table, e.g., alleles which
+        # are not present in the SNP sites.
+        if not np.all(loc_found):
+            df_other = variants.loc[~loc_found].copy()
+            ann = self._snp_effect_annotator()
+            ann.get_effects(transcript=transcript, variants=df_other)
+            for field in values:
+                values[field][~loc_found] = df_other[field].to_numpy(dtype=object)
+
+        variants["transcript"] = transcript
+        for field in veff._effect_fields:
+            variants[field] = values[field].tolist()
+
+        return variants
+
+    @_check_types
+    @doc(
+        summary="""
+            Compute SNP effects for all transcripts and store them in a zarr
+            store, for fast access to effects in subsequent analyses.
+        """,
+        extended_summary="""
+            Effects are computed for every possible SNP allele at every SNP
+            site within each transcript, using a pool of worker processes.
+            For each contig, effects are stored as arrays with one column per
+            alternate allele, and one row per SNP site within each transcript,
+            alongside the positions, alleles and site filters of the SNP
+            sites, so that effects for a transcript can be read as a single
+            slice of the store. The rows for each transcript are stored
+            contiguously, one transcript after another, so SNP sites within
+            more than one transcript, e.g., overlapping isoforms, have one row
+            per transcript. For each transcript, the "offset" array gives its
+            first row, and the "sites_start" and "sites_stop" arrays give the
+            corresponding slice of the SNP sites for the contig. Once the
+            store has been built, it is used by `snp_effects()`. To use a
+            store built previously, see `open_snp_effects_store()`.
+        """,
+        returns="Zarr hierarchy.",
+    )
+    def build_snp_effects_store(
+        self,
+        path: frq_params.snp_effects_store,
+        contigs: Optional[base_params.contigs] = None,
+        n_workers: Optional[frq_params.n_workers] = None,
+    ) -> zarr.hierarchy.Group:
+        # Normalise parameters.
+        if contigs is None:
+            contigs = self.contigs
+        elif isinstance(contigs, str):
+            contigs = [contigs]
+        for contig in contigs:
+            if contig not in self.contigs:
+                raise ValueError(
+                    f"Contig {contig!r} not found. Valid contigs are {self.contigs!r}."
+                )
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+
+        root = zarr.open_group(path, mode="w")
+        root.attrs["geneset"] = self._geneset_gff3_params()
+
+        df_genome_features = self.genome_features(attributes=["ID", "Parent"])
+        df_transcripts = df_genome_features.query("type == 'mRNA'")
+
+        for contig in contigs:
+            self._build_snp_effects_store_contig(
+                root=root,
+                contig=contig,
+                df_transcripts=df_transcripts.query(f"contig == {contig!r}"),
+                df_genome_features=df_genome_features,
+                n_workers=n_workers,
+            )
+
+        zarr.consolidate_metadata(root.store)
+        self._snp_effects_store = root
+        self._cache_snp_effects_store_index = dict()
+        return root
+
+    def _build_snp_effects_store_contig(
+        self,
+        *,
+        root: zarr.hierarchy.Group,
+        contig: str,
+        df_transcripts: pd.DataFrame,
+        df_genome_features: pd.DataFrame,
+        n_workers: int,
+    ):
+        # Locate the SNP sites for each transcript.
+        pos_z = self.open_snp_sites()[f"{contig}/variants/POS"]
+        transcript_ids = []
+        sites_start = []
+        sites_stop = []
+        for transcript in df_transcripts.sort_values("start").itertuples():
+            loc_sites = self._locate_snp_sites_region(
+                region=Region(contig, transcript.start, transcript.end)
+            )
+            transcript_ids.append(transcript.ID)
+            sites_start.append(loc_sites.start)
+            sites_stop.append(loc_sites.stop)
+        n_sites = np.array(sites_stop, dtype=np.int64) - np.array(
+            sites_start, dtype=np.int64
+        )
+        offset = np.concatenate([[0], np.cumsum(n_sites)])
+
+        # Set up the output arrays.
+        group = root.create_group(contig)
+        group.attrs["n_sites"] = pos_z.shape[0]
+        group.create_dataset("transcript_id", data=np.array(transcript_ids, dtype=str))
+        group.create_dataset("sites_start", data=np.array(sites_start, dtype=np.int64))
+        group.create_dataset("sites_stop", data=np.array(sites_stop, dtype=np.int64))
+        group.create_dataset("offset", data=offset[:-1])
+        chunk_size = pos_z.chunks[0]
+        arrays = {
+            field: group.create_dataset(
+                field, shape=(offset[-1], 3), chunks=(chunk_size, 3), dtype=dtype
+            )
+            for field, dtype in _snp_effects_store_dtypes.items()
+        }
+        for field, dtype in _snp_effects_store_site_dtypes.items():
+            if field == "position":
+                dtype = pos_z.dtype
+            shape: Tuple[int, ...] = (offset[-1],)
+            if field == "alt_allele":
+                shape = (offset[-1], 3)
+            arrays[field] = group.create_dataset(
+                field, shape=shape, chunks=(chunk_size,) + shape[1:], dtype=dtype
+            )
+        for m in self.site_mask_ids:
+            arrays[f"filter_pass_{m}"] = group.create_dataset(
+                f"filter_pass_{m}",
+                shape=(offset[-1],),
+                chunks=(chunk_size,),
+                dtype=bool,
+            )
+        categories: Dict[str, Dict[str, int]] = dict(effect=dict(), impact=dict())
+
+        pos = self.snp_sites(region=contig, field="POS")
+        ref = self.snp_sites(region=contig, field="REF")
+        alt = self.snp_sites(region=contig, field="ALT")
+        filter_pass = {
+            m: self.site_filters(region=contig, mask=m) for m in self.site_mask_ids
+        }
+
+        def load_sites(i):
+            loc_sites = slice(sites_start[i], sites_stop[i])
+            return da.compute(
+                pos[loc_sites],
+                ref[loc_sites],
+                alt[loc_sites],
+                {m: x[loc_sites] for m, x in filter_pass.items()},
+            )
+
+        # Compute effects for each transcript in worker processes. N.B., each
+        # worker is sent the genome sequence for the contig just once.
+        genome = {contig: self.genome_sequence(region=contig).compute()}
+        n_transcripts = len(transcript_ids)
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_snp_effects_worker,
+            initargs=(genome, df_genome_features),
+        ) as executor:
+            # N.B., submit transcripts in bounded batches, loading sites only
+            # when submitting, so that only a few blocks of sites and effects
+            # are held in memory at any time. Results are consumed in order,
+            # and each future is dropped once its block has been written.
+            max_submitted = 2 * n_workers
+            submitted: Deque[Future] = deque()
+            n_submitted = 0
+
+            # Write results, buffering so that only whole chunks are written,
+            # except for the final write.
+            pending: List[Dict[str, np.ndarray]] = []
+            n_pending = 0
+            n_written = 0
+            for i in self._progress(
+                range(n_transcripts), desc=f"Compute SNP effects for {contig}"
+            ):
+                while n_submitted < n_transcripts and len(submitted) < max_submitted:
+                    submitted.append(
+                        executor.submit(
+                            _snp_effects_worker,
+                            transcript_ids[n_submitted],
+                            contig,
+                            *load_sites(n_submitted),
+                        )
+                    )
+                    n_submitted += 1
+                block = submitted.popleft().result()
+                for field, field_categories in categories.items():
+                    uniques, inverse = np.unique(block[field], return_inverse=True)
+                    codes = np.array(
+                        [
+                            field_categories.setdefault(str(u), len(field_categories))
+                            for u in uniques
+                        ],
+                        dtype=np.int8,
+                    )
+                    block[field] = codes[inverse].reshape(block[field].shape)
+                pending.append(block)
+                del block
+                n_pending += n_sites[i]
+                is_last = i == n_transcripts - 1
+                if n_pending < chunk_size and not is_last:
+                    continue
+                n_write = n_pending
+                if not is_last:
+                    n_write = (n_pending // chunk_size) * chunk_size
+                data = {
+                    field: np.concatenate([b[field] for b in pending])
+                    for field in arrays
+                }
+                for field, z in arrays.items():
+                    z[n_written : n_written + n_write] = data[field][:n_write]
+                pending = [{field: x[n_write:] for field, x in data.items()}]
+                del data
+                n_written += n_write
+                n_pending -= n_write
+
+        for field, field_categories in categories.items():
+            group.attrs[f"{field}_categories"] = list(field_categories)
+
+    @_check_types
+    @doc(
+        summary="""
+            Open a zarr store of precomputed SNP effects, created previously by
+            `build_snp_effects_store()`, and use it in subsequent analyses.
+        """,
+        returns="Zarr hierarchy.",
+    )
+    def open_snp_effects_store(
+        self,
+        path: frq_params.snp_effects_store,
+    ) -> zarr.hierarchy.Group:
+        root = zarr.open_consolidated(path, mode="r")
+        if root.attrs["geneset"] != self._geneset_gff3_params():
+            raise ValueError(
+                "SNP effects store was built with a different geneset, please "
+                "build it again."
+            )
+        self._snp_effects_store = root
+        self._cache_snp_effects_store_index = dict()
+        return root
+
+    def _snp_effects_from_store(
+        self, *, transcript: str, contig: str
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """Read effects for a transcript from the SNP effects store, if one is
+        in use and it contains the transcript, otherwise return None."""
+        root = self._snp_effects_store
+        if root is None or contig not in root:
+            return None
+        group = root[contig]
+        if (
+            group.attrs["n_sites"]
+            != self.open_snp_sites()[f"{contig}/variants/POS"].shape[0]
+        ):
+            return None
+
+        # Index transcripts.
+        try:
+            index = self._cache_snp_effects_store_index[contig]
+        except KeyError:
+            index = {
+                t: (int(start), int(stop), int(offset))
+                for t, start, stop, offset in zip(
+                    group["transcript_id"][:],
+                    group["sites_start"][:],
+                    group["sites_stop"][:],
+                    group["offset"][:],
+                )
+            }
+            self._cache_snp_effects_store_index[contig] = index
+        if transcript not in index:
+            return None
+
+        fields = (
+            list(_snp_effects_store_dtypes)
+            + list(_snp_effects_store_site_dtypes)
+            + [f"filter_pass_{m}" for m in self.site_mask_ids]
+        )
+        if not all(field in group for field in fields):
+            return None
+
+        # N.B., all data for the transcript are read as a single slice.
+        start, stop, offset = index[transcript]
+        loc_rows = slice(offset, offset + stop - start)
+        block = {field: group[field][loc_rows] for field in fields}
+        for field in "effect", "impact":
+            field_categories = np.array(
+                group.attrs[f"{field}_categories"], dtype=object
+            )
+            block[field] = field_categories[block[field]]
+        return block
+
     @_check_types
     @doc(
         summary="Compute variant effects for a gene transcript.",
@@ -102,6 +593,19 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
         transcript: base_params.transcript,
         site_mask: Optional[base_params.site_mask] = None,
     ) -> pd.DataFrame:
+        # Read effects from the SNP effects store, if available.
+        region = _parse_single_region(self, transcript)
+        block = self._snp_effects_from_store(
+            transcript=transcript, contig=region.contig
+        )
+        if block is not None:
+            return self._snp_effects_from_block(
+                transcript=transcript,
+                site_mask=site_mask,
+                block=block,
+                contig=region.contig,
+            )
+
         # Access SNP data.
         ds_snp = self.snp_variants(
             region=transcript,
@@ -111,14 +615,87 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
         # Setup initial dataframe of SNPs.
         df_snps = self._snp_df_melt(ds_snp=ds_snp)
 
-        # Setup variant effect annotator.
-        ann = self._snp_effect_annotator()
-
         # Add effects to the dataframe.
-        ann.get_effects(transcript=transcript, variants=df_snps)
+        self._snp_effects_join(transcript=transcript, variants=df_snps)
+
+        return df_snps
+
+    def _snp_effects_from_block(
+        self,
+        *,
+        transcript: str,
+        site_mask: Optional[base_params.site_mask],
+        block: Dict[str, np.ndarray],
+        contig: str,
+    ) -> pd.DataFrame:
+        # Setup initial dataframe of SNPs from the site data in the block,
+        # melting each alternate allele into a separate row, as for
+        # _snp_df_melt().
+        cols = {
+            "contig": contig,
+            "position": np.repeat(block["position"], 3),
+            "ref_allele": np.repeat(block["ref_allele"], 3),
+            "alt_allele": block["alt_allele"].flatten(),
+        }
+        for m in self.site_mask_ids:
+            cols[f"pass_{m}"] = np.repeat(block[f"filter_pass_{m}"], 3)
+        df_snps = pd.DataFrame(cols)
+
+        # Add effects to the dataframe, matching the output of the annotator.
+        values = dict()
+        for field in "effect", "impact":
+            values[field] = block[field].ravel()
+        for field in "ref_codon", "alt_codon", "ref_aa", "alt_aa":
+            x = block[field].ravel().astype(object)
+            x[x == ""] = None
+            values[field] = x
+        aa_pos = block["aa_pos"].ravel()
+        loc_cds = aa_pos > 0
+        values["aa_pos"] = np.full(len(aa_pos), None, dtype=object)
+        values["aa_pos"][loc_cds] = aa_pos[loc_cds].astype(np.int64)
+        values["aa_change"] = np.full(len(aa_pos), None, dtype=object)
+        values["aa_change"][loc_cds] = np.char.add(
+            np.char.add(block["ref_aa"].ravel()[loc_cds], aa_pos[loc_cds].astype(str)),
+            block["alt_aa"].ravel()[loc_cds],
+        )
+        df_snps["transcript"] = transcript
+        for field in veff._effect_fields:
+            df_snps[field] = values[field].tolist()
+
+        # Apply site mask.
+        site_mask_prepped = self._prep_optional_site_mask_param(site_mask=site_mask)
+        if site_mask_prepped is not None:
+            df_snps = df_snps.loc[df_snps[f"pass_{site_mask_prepped}"].to_numpy()]
+            df_snps.reset_index(drop=True, inplace=True)
 
         return df_snps
 
+    def _cohort_allele_counts(
+        self, *, gt: da.Array, loc_cohorts: List[np.ndarray], max_allele: int
+    ) -> np.ndarray:
+        """Count alleles for multiple cohorts, given as boolean indexers
+        over samples, which may overlap. Genotypes are loaded one chunk of
+        variants at a time, so the full genotype array is never held in
+        memory. Returns an array of shape (n_variants, n_cohorts, n_alleles)."""
+        sample_cohort_bounds, sample_cohorts = _sample_cohorts_csr(loc_cohorts)
+        n_cohorts = len(loc_cohorts)
+        ac = np.zeros((gt.shape[0], n_cohorts, max_allele + 1), dtype=np.int32)
+        variant_bounds = np.cumsum((0,) + gt.chunks[0])
+        blocks_iterator = self._progress(
+            range(gt.numblocks[0]), desc="Compute allele frequencies"
+        )
+        for i in blocks_iterator:
+            v_start, v_stop = variant_bounds[i], variant_bounds[i + 1]
+            if v_stop == v_start:
+                continue
+            # N.B., load each chunk with dask, which reads sample chunks
+            # concurrently, then count alleles in parallel with numba.
+            gt_block = gt.blocks[i].compute()
+            ac[v_start:v_stop] = _cohort_allele_counts_kernel(
+                gt_block, sample_cohort_bounds, sample_cohorts, n_cohorts, max_allele
+            )
+        return ac
+
     @_check_types
     @doc(
         summary="""
@@ -186,26 +763,23 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
         if ds_snp.sizes["variants"] == 0:  # pragma: no cover
             raise ValueError("No SNPs available for the given region and site mask.")
 
-        # Access genotypes.
-        gt = ds_snp["call_genotype"].data
-        with self._dask_progress(desc="Load SNP genotypes"):
-            gt = gt.compute()
-
         # Set up initial dataframe of SNPs.
         df_snps = self._snp_df_melt(ds_snp=ds_snp)
 
-        # Count alleles.
+        # Count alleles for all cohorts at once.
+        gt = ds_snp["call_genotype"].data
+        ac = self._cohort_allele_counts(
+            gt=gt, loc_cohorts=list(coh_dict.values()), max_allele=3
+        )
+
+        # Compute allele frequencies.
         count_cols = dict()
         nobs_cols = dict()
         freq_cols = dict()
-        cohorts_iterator = self._progress(
-            coh_dict.items(), desc="Compute allele frequencies"
-        )
-        for coh, loc_coh in cohorts_iterator:
+        for cohort_index, (coh, loc_coh) in enumerate(coh_dict.items()):
             n_samples = np.count_nonzero(loc_coh)
             assert n_samples >= min_cohort_size
-            gt_coh = np.compress(loc_coh, gt, axis=1)
-            ac_coh = np.asarray(allel.GenotypeArray(gt_coh).count_alleles(max_allele=3))
+            ac_coh = ac[:, cohort_index]
             an_coh = np.sum(ac_coh, axis=1)[:, None]
             with np.errstate(divide="ignore", invalid="ignore"):
                 af_coh = np.where(an_coh > 0, ac_coh / an_coh, np.nan)
@@ -249,10 +823,7 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
 
         if effects:
             # Add effect annotations.
-            ann = self._snp_effect_annotator()
-            ann.get_effects(
-                transcript=transcript, variants=df_snps, progress=self._progress
-            )
+            self._snp_effects_join(transcript=transcript, variants=df_snps)
 
             # Add label.
             df_snps["label"] = _pandas_apply(
@@ -585,13 +1156,8 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
             nobs = np.compress(loc_variant, nobs, axis=0)
             frequency = np.compress(loc_variant, frequency, axis=0)
 
-        # Set up variant effect annotator.
-        ann = self._snp_effect_annotator()
-
         # Add effects to the dataframe.
-        ann.get_effects(
-            transcript=transcript, variants=df_variants, progress=self._progress
-        )
+        self._snp_effects_join(transcript=transcript, variants=df_variants)
 
         # Add variant labels.
         df_variants["label"] = _pandas_apply(
@@ -832,10 +1398,7 @@ class AnophelesSnpFrequencyAnalysis(AnophelesSnpData, AnophelesFrequencyAnalysis
         df_snps = pd.concat([df_snps, df_counts], axis=1)
 
         # Add effect annotations.
-        ann = self._snp_effect_annotator()
-        ann.get_effects(
-            transcript=transcript, variants=df_snps, progress=self._progress
-        )
+        self._snp_effects_join(transcript=transcript, variants=df_snps)
 
         # Add label.
         df_snps["label"] = _pandas_apply(
@@ -916,6 +1479,36 @@ def _cohort_alt_allele_counts_melt_kernel(
     return ac_alt_melt, an
 
 
+def _sample_cohorts_csr(loc_cohorts):
+    # Map each sample to the cohorts it belongs to, in compressed sparse row
+    # format, so that cohorts can overlap.
+    loc_samples = np.asarray(loc_cohorts, dtype=bool).reshape(len(loc_cohorts), -1)
+    sample_index, cohort_index = np.nonzero(loc_samples.T)
+    n_cohorts_per_sample = np.bincount(sample_index, minlength=loc_samples.shape[1])
+    sample_cohort_bounds = np.concatenate([[0], np.cumsum(n_cohorts_per_sample)])
+    return sample_cohort_bounds, cohort_index.astype(np.int64)
+
+
+@numba.njit(parallel=True)
+def _cohort_allele_counts_kernel(
+    gt, sample_cohort_bounds, sample_cohorts, n_cohorts, max_allele
+):  # pragma: no cover
+    n_variants, n_samples, ploidy = gt.shape
+    ac = np.zeros((n_variants, n_cohorts, max_allele + 1), dtype=np.int32)
+
+    for i in numba.prange(n_variants):
+        for j in range(n_samples):
+            for k in range(ploidy):
+                allele = gt[i, j, k]
+                if 0 <= allele <= max_allele:
+                    for m in range(
+                        sample_cohort_bounds[j], sample_cohort_bounds[j + 1]
+                    ):
+                        ac[i, sample_cohorts[m], allele] += 1
+
+    return ac
+
+
 def _map_snp_to_aa_change_frq_ds(ds):
     # Keep only variables that make sense for amino acid substitutions.
     keep_vars = [
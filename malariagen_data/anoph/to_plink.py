@@ -1,11 +1,9 @@
 from typing import Optional
 
-import allel  # type: ignore
 import numpy as np
 import os
 import bed_reader
 
-from ..util import _dask_compress_dataset
 from .snp_data import AnophelesSnpData
 from . import base_params
 from . import plink_params
@@ -85,46 +83,66 @@ class PlinkConverter(
             if not overwrite:
                 return plink_file_path
 
-        # Get snps
-        ds_snps = self.biallelic_snp_calls(
-            region=region,
+        # Normalize sample selection params.
+        (
+            prepared_sample_sets,
+            prepared_sample_indices,
+        ) = self._prep_sample_selection_cache_params(
             sample_sets=sample_sets,
             sample_query=sample_query,
             sample_query_options=sample_query_options,
             sample_indices=sample_indices,
-            site_mask=site_mask,
-            min_minor_ac=min_minor_ac,
+        )
+        prepared_region = self._prep_region_cache_param(region=region)
+        prepared_site_mask = self._prep_optional_site_mask_param(site_mask=site_mask)
+
+        # Compute gt ref counts, reading genotype calls only once.
+        results = self._biallelic_genotypes_stream(
+            region=prepared_region,
+            sample_sets=prepared_sample_sets,
+            sample_indices=prepared_sample_indices,
+            site_mask=prepared_site_mask,
+            site_class=None,
+            cohort_size=None,
+            min_cohort_size=None,
+            max_cohort_size=None,
+            random_seed=random_seed,
             max_missing_an=max_missing_an,
+            min_minor_ac=min_minor_ac,
             n_snps=n_snps,
             thin_offset=thin_offset,
-            random_seed=random_seed,
-            inline_array=inline_array,
-            chunks=chunks,
+            ref=True,
         )
-
-        # Set up dataset with required vars for plink conversion
-
-        # Compute gt ref counts
-        with self._dask_progress("Computing genotype ref counts"):
-            gt_asc = ds_snps["call_genotype"].data  # dask array
-            gn_ref = allel.GenotypeDaskArray(gt_asc).to_n_ref(fill=-127)
-            gn_ref = gn_ref.compute()
+        gn_ref = results["gn"]
 
         # Ensure genotypes vary
         loc_var = np.any(gn_ref != gn_ref[:, 0, np.newaxis], axis=1)
-
-        # Load final data
-        ds_snps_final = _dask_compress_dataset(ds_snps, loc_var, dim="variants")
+        variant_index = results["variant_index"][loc_var]
+        variant_alleles = results["alleles"][loc_var]
 
         # Init vars for input to bed reader
         gn_ref_final = gn_ref[loc_var]
         val = gn_ref_final.T
         with self._spinner("Prepare output data"):
-            alleles = ds_snps_final["variant_allele"].values
+            # Load site data for the selected SNPs only.
+            ds_sites = self.snp_calls(
+                region=prepared_region,
+                sample_sets=prepared_sample_sets,
+                sample_indices=prepared_sample_indices,
+                site_mask=prepared_site_mask,
+                inline_array=inline_array,
+                chunks=chunks,
+            )[["variant_contig", "variant_position", "variant_allele"]]
+            ds_sites = ds_sites.isel(variants=variant_index)
+            alleles = np.take_along_axis(
+                ds_sites["variant_allele"].values,
+                variant_alleles.astype(np.intp),
+                axis=1,
+            )
             properties = {
-                "iid": ds_snps_final["sample_id"].values,
-                "chromosome": ds_snps_final["variant_contig"].values,
-                "bp_position": ds_snps_final["variant_position"].values,
+                "iid": results["samples"],
+                "chromosome": ds_sites["variant_contig"].values,
+                "bp_position": ds_sites["variant_position"].values,
                 "allele_1": alleles[:, 0],
                 "allele_2": alleles[:, 1],
             }
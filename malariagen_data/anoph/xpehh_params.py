@@ -69,6 +69,16 @@ include_edges: TypeAlias = Annotated[
 use_threads: TypeAlias = Annotated[
     bool, "If True, use multiple threads to compute XP-EHH."
 ]
+
+segment_size: TypeAlias = Annotated[
+    int,
+    """
+    If provided, compute XP-EHH in parallel over blocks of this many SNPs,
+    each padded with enough flanking SNPs for EHH to decay in both
+    populations; larger blocks need more memory per task but repeat less
+    work in the padding.
+    """,
+]
 palette: TypeAlias = Annotated[
     str, "Name of bokeh palette to use for plotting multiple percentiles."
 ]
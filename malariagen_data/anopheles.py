@@ -42,6 +42,7 @@ from .anoph.fst import AnophelesFstAnalysis
 from .anoph.h12 import AnophelesH12Analysis
 from .anoph.h1x import AnophelesH1XAnalysis
 from .anoph.phenotypes import AnophelesPhenotypeData
+from .dataset_cache import DatasetCache
 from .mjn import _median_joining_network, _mjn_graph
 from .anoph.hapclust import AnophelesHapClustAnalysis
 from .anoph.dipclust import AnophelesDipClustAnalysis
@@ -52,6 +53,8 @@ from .util import (
     _jackknife_ci,
     _parse_single_region,
     _plotly_discrete_legend,
+    _segmented_ihs,
+    _segmented_xpehh,
 )
 
 
@@ -113,10 +116,13 @@ class AnophelesDataResource(
         site_filters_analysis: Optional[str],
         discordant_read_calls_analysis: Optional[str],
         default_site_mask: Optional[str],
+        allele_counts_engine: str,
         default_phasing_analysis: Optional[str],
         default_coverage_calls_analysis: Optional[str],
         bokeh_output_notebook: bool,
         results_cache: Optional[str],
+        results_cache_options: Optional[Mapping],
+        dataset_cache: Optional[DatasetCache],
         log,
         debug,
         show_progress,
@@ -164,9 +170,12 @@ class AnophelesDataResource(
             site_filters_analysis=site_filters_analysis,
             discordant_read_calls_analysis=discordant_read_calls_analysis,
             default_site_mask=default_site_mask,
+            allele_counts_engine=allele_counts_engine,
             default_phasing_analysis=default_phasing_analysis,
             default_coverage_calls_analysis=default_coverage_calls_analysis,
             results_cache=results_cache,
+            results_cache_options=results_cache_options,
+            dataset_cache=dataset_cache,
             tqdm_class=tqdm_class,
             taxon_colors=taxon_colors,
             virtual_contigs=virtual_contigs,
@@ -603,60 +612,61 @@ class AnophelesDataResource(
 
         del region
 
-        try:
-            # Load cached numeric data, adding str / obj data again.
-            results = self.results_cache_get(name=name, params=params)
-
-            # Reconstruct dataframe
-            df_roh = pd.DataFrame(
-                {
-                    "roh_start": results["roh_start"],
-                    "roh_stop": results["roh_stop"],
-                    "roh_length": results["roh_length"],
-                    "roh_is_marginal": results["roh_is_marginal"],
-                }
-            )
-
-            df_roh["sample_id"] = sample
-            df_roh["contig"] = resolved_region.contig
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                # Load cached numeric data, adding str / obj data again.
+                results = self.results_cache_get(name=name, params=params)
+
+                # Reconstruct dataframe
+                df_roh = pd.DataFrame(
+                    {
+                        "roh_start": results["roh_start"],
+                        "roh_stop": results["roh_stop"],
+                        "roh_length": results["roh_length"],
+                        "roh_is_marginal": results["roh_is_marginal"],
+                    }
+                )
 
-        except CacheMiss:
-            debug("compute windowed heterozygosity")
-            sample_id, sample_set, windows, counts = self._sample_count_het(
-                sample=sample,
-                region=resolved_region,
-                site_mask=site_mask,
-                window_size=window_size,
-                sample_set=sample_set,
-                chunks=chunks,
-                inline_array=inline_array,
-            )
+                df_roh["sample_id"] = sample
+                df_roh["contig"] = resolved_region.contig
+
+            except CacheMiss:
+                debug("compute windowed heterozygosity")
+                sample_id, sample_set, windows, counts = self._sample_count_het(
+                    sample=sample,
+                    region=resolved_region,
+                    site_mask=site_mask,
+                    window_size=window_size,
+                    sample_set=sample_set,
+                    chunks=chunks,
+                    inline_array=inline_array,
+                )
 
-            debug("compute runs of homozygosity")
-            df_roh = self._roh_hmm_predict(
-                windows=windows,
-                counts=counts,
-                phet_roh=phet_roh,
-                phet_nonroh=phet_nonroh,
-                transition=transition,
-                window_size=window_size,
-                sample_id=sample_id,
-                contig=resolved_region.contig,
-            )
+                debug("compute runs of homozygosity")
+                df_roh = self._roh_hmm_predict(
+                    windows=windows,
+                    counts=counts,
+                    phet_roh=phet_roh,
+                    phet_nonroh=phet_nonroh,
+                    transition=transition,
+                    window_size=window_size,
+                    sample_id=sample_id,
+                    contig=resolved_region.contig,
+                )
 
-            # Specify numeric columns to save (saving obj - sample ID and contig - breaks the save.
-            columns_to_save = [
-                "roh_start",
-                "roh_stop",
-                "roh_length",
-                "roh_is_marginal",
-            ]
+                # Specify numeric columns to save (saving obj - sample ID and contig - breaks the save.
+                columns_to_save = [
+                    "roh_start",
+                    "roh_stop",
+                    "roh_length",
+                    "roh_is_marginal",
+                ]
 
-            self.results_cache_set(
-                name=name,
-                params=params,
-                results={col: df_roh[col].to_numpy() for col in columns_to_save},
-            )
+                self.results_cache_set(
+                    name=name,
+                    params=params,
+                    results={col: df_roh[col].to_numpy() for col in columns_to_save},
+                )
 
         return df_roh
 
@@ -1011,6 +1021,65 @@ class AnophelesDataResource(
             tajima_d_ci_upp=tajima_d_ci_upp,
         )
 
+    def _cohort_diversity_stats(
+        self,
+        *,
+        cohort_label,
+        cohort_query,
+        sample_query_options,
+        ac,
+        sample_sets,
+        n_jack,
+        confidence_level,
+    ):
+        debug = self._log.debug
+
+        debug("compute diversity stats")
+        stats = self._block_jackknife_cohort_diversity_stats(
+            cohort_label=cohort_label,
+            ac=ac,
+            n_jack=n_jack,
+            confidence_level=confidence_level,
+        )
+
+        debug("compute some extra cohort variables")
+        df_samples = self.sample_metadata(
+            sample_sets=sample_sets,
+            sample_query=cohort_query,
+            sample_query_options=sample_query_options,
+        )
+        extra_fields = [
+            ("taxon", "unique"),
+            ("year", "unique"),
+            ("month", "unique"),
+            ("country", "unique"),
+            ("admin1_iso", "unique"),
+            ("admin1_name", "unique"),
+            ("admin2_name", "unique"),
+            ("longitude", "mean"),
+            ("latitude", "mean"),
+        ]
+        for field, agg in extra_fields:
+            if agg == "unique":
+                vals = df_samples[field].dropna().sort_values().unique()
+                if len(vals) == 0:
+                    val = np.nan
+                elif len(vals) == 1:
+                    val = vals[0]
+                else:
+                    val = vals.tolist()
+            elif agg == "mean":
+                vals = df_samples[field].dropna()
+                if len(vals) == 0:
+                    val = np.nan
+                else:
+                    val = np.mean(vals)
+            else:
+                val = np.nan
+            stats[field] = val
+
+        return pd.Series(stats)
+
     @_check_types
     @doc(
         summary="""
@@ -1079,50 +1148,16 @@ class AnophelesDataResource(
             inline_array=inline_array,
         )
 
-        debug("compute diversity stats")
-        stats = self._block_jackknife_cohort_diversity_stats(
+        return self._cohort_diversity_stats(
             cohort_label=cohort_label,
+            cohort_query=cohort_query,
+            sample_query_options=None,
             ac=ac,
+            sample_sets=sample_sets,
             n_jack=n_jack,
             confidence_level=confidence_level,
         )
 
-        debug("compute some extra cohort variables")
-        df_samples = self.sample_metadata(
-            sample_sets=sample_sets, sample_query=cohort_query
-        )
-        extra_fields = [
-            ("taxon", "unique"),
-            ("year", "unique"),
-            ("month", "unique"),
-            ("country", "unique"),
-            ("admin1_iso", "unique"),
-            ("admin1_name", "unique"),
-            ("admin2_name", "unique"),
-            ("longitude", "mean"),
-            ("latitude", "mean"),
-        ]
-        for field, agg in extra_fields:
-            if agg == "unique":
-                vals = df_samples[field].dropna().sort_values().unique()
-                if len(vals) == 0:
-                    val = np.nan
-                elif len(vals) == 1:
-                    val = vals[0]
-                else:
-                    val = vals.tolist()
-            elif agg == "mean":
-                vals = df_samples[field].dropna()
-                if len(vals) == 0:
-                    val = np.nan
-                else:
-                    val = np.mean(vals)
-            else:
-                val = np.nan
-            stats[field] = val
-
-        return pd.Series(stats)
-
     @_check_types
     @doc(
         summary="""
@@ -1166,21 +1201,34 @@ class AnophelesDataResource(
             min_cohort_size=None,
         )
 
+        # Compute allele counts for all cohorts, reading genotype calls once.
+        acs = self._snp_allele_counts_for_queries(
+            region=region,
+            sample_queries=list(cohort_queries.values()),
+            sample_query_options=sample_query_options,
+            sample_sets=sample_sets,
+            site_mask=site_mask,
+            site_class=site_class,
+            cohort_size=cohort_size,
+            min_cohort_size=None,
+            max_cohort_size=None,
+            random_seed=random_seed,
+            inline_array=inline_array,
+            chunks=chunks,
+            engine=None,
+        )
+
         # Compute diversity stats for cohorts.
         all_stats = []
-        for cohort_label, cohort_query in cohort_queries.items():
-            stats = self.cohort_diversity_stats(
-                cohort=(cohort_label, cohort_query),
-                cohort_size=cohort_size,
-                region=region,
-                site_mask=site_mask,
-                site_class=site_class,
+        for (cohort_label, cohort_query), ac in zip(cohort_queries.items(), acs):
+            stats = self._cohort_diversity_stats(
+                cohort_label=cohort_label,
+                cohort_query=cohort_query,
+                sample_query_options=sample_query_options,
+                ac=ac,
                 sample_sets=sample_sets,
-                random_seed=random_seed,
                 n_jack=n_jack,
                 confidence_level=confidence_level,
-                chunks=chunks,
-                inline_array=inline_array,
             )
             all_stats.append(stats)
         df_stats = pd.DataFrame(all_stats)
@@ -1353,6 +1401,7 @@ class AnophelesDataResource(
         gap_scale: ihs_params.gap_scale = ihs_params.gap_scale_default,
         include_edges: ihs_params.include_edges = True,
         use_threads: ihs_params.use_threads = True,
+        segment_size: Optional[ihs_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = ihs_params.min_cohort_size_default,
@@ -1363,6 +1412,73 @@ class AnophelesDataResource(
         chunks: base_params.chunks = base_params.native_chunks,
         inline_array: base_params.inline_array = base_params.inline_array_default,
     ) -> Tuple[np.ndarray, np.ndarray]:
+        name, params = self._prep_ihs_gwss_params(
+            contig=contig,
+            analysis=analysis,
+            window_size=window_size,
+            percentiles=percentiles,
+            standardize=standardize,
+            standardization_bins=standardization_bins,
+            standardization_n_bins=standardization_n_bins,
+            standardization_diagnostics=standardization_diagnostics,
+            filter_min_maf=filter_min_maf,
+            compute_min_maf=compute_min_maf,
+            min_ehh=min_ehh,
+            include_edges=include_edges,
+            max_gap=max_gap,
+            gap_scale=gap_scale,
+            use_threads=use_threads,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            min_cohort_size=min_cohort_size,
+            max_cohort_size=max_cohort_size,
+            random_seed=random_seed,
+        )
+
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
+
+            except CacheMiss:
+                results = self._ihs_gwss(
+                    chunks=chunks,
+                    inline_array=inline_array,
+                    segment_size=segment_size,
+                    **params,
+                )
+                self.results_cache_set(name=name, params=params, results=results)
+
+        x = results["x"]
+        ihs = results["ihs"]
+
+        return x, ihs
+
+    def _prep_ihs_gwss_params(
+        self,
+        *,
+        contig,
+        analysis,
+        window_size,
+        percentiles,
+        standardize,
+        standardization_bins,
+        standardization_n_bins,
+        standardization_diagnostics,
+        filter_min_maf,
+        compute_min_maf,
+        min_ehh,
+        include_edges,
+        max_gap,
+        gap_scale,
+        use_threads,
+        sample_sets,
+        sample_query,
+        sample_query_options,
+        min_cohort_size,
+        max_cohort_size,
+        random_seed,
+    ):
         # change this name if you ever change the behaviour of this function, to
         # invalidate any previously cached data
         name = "roh"
@@ -1394,17 +1510,119 @@ class AnophelesDataResource(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        return name, params
+
+    @_check_types
+    @doc(
+        summary="Run iHS GWSS for multiple cohorts.",
+        returns="""
+            A dictionary mapping cohort labels to tuples of window centre
+            positions and iHS values for each window, as returned by
+            `ihs_gwss()`.
+        """,
+        notes="""
+            This gives the same results as calling `ihs_gwss()` for each
+            cohort. Because iHS requires haplotypes for the whole contig,
+            cohorts are computed one at a time, and each cohort's haplotypes
+            are released before the next cohort is loaded, so memory usage is
+            bounded by the largest cohort. Results for each cohort are cached
+            as for `ihs_gwss()`, so subsequent calls to `ihs_gwss()` for any
+            of the cohorts will re-use them, if the `results_cache` parameter
+            was set when instantiating the class.
+        """,
+    )
+    def ihs_gwss_multi(
+        self,
+        contig: base_params.contig,
+        cohorts: base_params.cohorts,
+        analysis: hap_params.analysis = base_params.DEFAULT,
+        sample_sets: Optional[base_params.sample_sets] = None,
+        sample_query: Optional[base_params.sample_query] = None,
+        sample_query_options: Optional[base_params.sample_query_options] = None,
+        window_size: ihs_params.window_size = ihs_params.window_size_default,
+        percentiles: ihs_params.percentiles = ihs_params.percentiles_default,
+        standardize: ihs_params.standardize = True,
+        standardization_bins: Optional[ihs_params.standardization_bins] = None,
+        standardization_n_bins: ihs_params.standardization_n_bins = ihs_params.standardization_n_bins_default,
+        standardization_diagnostics: ihs_params.standardization_diagnostics = False,
+        filter_min_maf: ihs_params.filter_min_maf = ihs_params.filter_min_maf_default,
+        compute_min_maf: ihs_params.compute_min_maf = ihs_params.compute_min_maf_default,
+        min_ehh: ihs_params.min_ehh = ihs_params.min_ehh_default,
+        max_gap: ihs_params.max_gap = ihs_params.max_gap_default,
+        gap_scale: ihs_params.gap_scale = ihs_params.gap_scale_default,
+        include_edges: ihs_params.include_edges = True,
+        use_threads: ihs_params.use_threads = True,
+        segment_size: Optional[ihs_params.segment_size] = None,
+        min_cohort_size: Optional[
+            base_params.min_cohort_size
+        ] = ihs_params.min_cohort_size_default,
+        max_cohort_size: Optional[
+            base_params.max_cohort_size
+        ] = ihs_params.max_cohort_size_default,
+        random_seed: base_params.random_seed = 42,
+        chunks: base_params.chunks = base_params.native_chunks,
+        inline_array: base_params.inline_array = base_params.inline_array_default,
+    ) -> Mapping[str, Tuple[np.ndarray, np.ndarray]]:
+        cohort_queries = self._setup_cohort_queries(
+            cohorts=cohorts,
+            sample_sets=sample_sets,
+            sample_query=sample_query,
+            sample_query_options=sample_query_options,
+            cohort_size=None,
+            min_cohort_size=None,
+        )
+
+        # N.B., iHS requires haplotypes for the whole contig, so load, compute
+        # and cache each cohort in turn, releasing its haplotypes before the
+        # next cohort is loaded.
+        all_results = dict()
+        for cohort_label, cohort_query in cohort_queries.items():
+            name, params = self._prep_ihs_gwss_params(
+                contig=contig,
+                analysis=analysis,
+                window_size=window_size,
+                percentiles=percentiles,
+                standardize=standardize,
+                standardization_bins=standardization_bins,
+                standardization_n_bins=standardization_n_bins,
+                standardization_diagnostics=standardization_diagnostics,
+                filter_min_maf=filter_min_maf,
+                compute_min_maf=compute_min_maf,
+                min_ehh=min_ehh,
+                include_edges=include_edges,
+                max_gap=max_gap,
+                gap_scale=gap_scale,
+                use_threads=use_threads,
+                sample_sets=sample_sets,
+                sample_query=cohort_query,
+                sample_query_options=sample_query_options,
+                min_cohort_size=min_cohort_size,
+                max_cohort_size=max_cohort_size,
+                random_seed=random_seed,
+            )
 
-        except CacheMiss:
-            results = self._ihs_gwss(chunks=chunks, inline_array=inline_array, **params)
-            self.results_cache_set(name=name, params=params, results=results)
+            with self.results_cache_lock(name=name, params=params):
+                try:
+                    results = self.results_cache_get(name=name, params=params)
 
-        x = results["x"]
-        ihs = results["ihs"]
+                except CacheMiss:
+                    results = self._ihs_gwss(
+                        chunks=chunks,
+                        inline_array=inline_array,
+                        segment_size=segment_size,
+                        **params,
+                    )
+                    self.results_cache_set(name=name, params=params, results=results)
 
-        return x, ihs
+            all_results[cohort_label] = results
+
+        return {
+            cohort_label: (
+                all_results[cohort_label]["x"],
+                all_results[cohort_label]["ihs"],
+            )
+            for cohort_label in cohort_queries.keys()
+        }
 
     def _ihs_gwss(
         self,
@@ -1427,6 +1645,7 @@ class AnophelesDataResource(
         gap_scale,
         include_edges,
         use_threads,
+        segment_size,
         min_cohort_size,
         max_cohort_size,
         random_seed,
@@ -1449,10 +1668,51 @@ class AnophelesDataResource(
         gt = allel.GenotypeDaskArray(ds_haps["call_genotype"].data)
         with self._dask_progress(desc="Load haplotypes"):
             ht = gt.to_haplotypes().compute()
+        pos = ds_haps["variant_position"].values
+
+        return self._ihs_gwss_compute(
+            ht=ht,
+            pos=pos,
+            window_size=window_size,
+            percentiles=percentiles,
+            standardize=standardize,
+            standardization_bins=standardization_bins,
+            standardization_n_bins=standardization_n_bins,
+            standardization_diagnostics=standardization_diagnostics,
+            filter_min_maf=filter_min_maf,
+            compute_min_maf=compute_min_maf,
+            min_ehh=min_ehh,
+            max_gap=max_gap,
+            gap_scale=gap_scale,
+            include_edges=include_edges,
+            use_threads=use_threads,
+            segment_size=segment_size,
+        )
+
+    def _ihs_gwss_compute(
+        self,
+        *,
+        ht,
+        pos,
+        window_size,
+        percentiles,
+        standardize,
+        standardization_bins,
+        standardization_n_bins,
+        standardization_diagnostics,
+        filter_min_maf,
+        compute_min_maf,
+        min_ehh,
+        max_gap,
+        gap_scale,
+        include_edges,
+        use_threads,
+        segment_size,
+    ):
+        ht = allel.HaplotypeArray(ht)
 
         with self._spinner(desc="Compute IHS"):
             ac = ht.count_alleles(max_allele=1)
-            pos = ds_haps["variant_position"].values
 
             if filter_min_maf > 0:
                 af = ac.to_frequencies()
@@ -1463,16 +1723,29 @@ class AnophelesDataResource(
                 ac = ac[maf_filter]
 
             # compute iHS
-            ihs = allel.ihs(
-                h=ht,
-                pos=pos,
-                min_maf=compute_min_maf,
-                min_ehh=min_ehh,
-                include_edges=include_edges,
-                max_gap=max_gap,
-                gap_scale=gap_scale,
-                use_threads=use_threads,
-            )
+            if segment_size:
+                ihs = _segmented_ihs(
+                    ht,
+                    pos,
+                    min_maf=compute_min_maf,
+                    min_ehh=min_ehh,
+                    include_edges=include_edges,
+                    max_gap=max_gap,
+                    gap_scale=gap_scale,
+                    segment_size=segment_size,
+                    use_threads=use_threads,
+                )
+            else:
+                ihs = allel.ihs(
+                    h=ht,
+                    pos=pos,
+                    min_maf=compute_min_maf,
+                    min_ehh=min_ehh,
+                    include_edges=include_edges,
+                    max_gap=max_gap,
+                    gap_scale=gap_scale,
+                    use_threads=use_threads,
+                )
 
             # remove any NaNs
             na_mask = ~np.isnan(ihs)
@@ -1526,6 +1799,7 @@ class AnophelesDataResource(
         gap_scale: ihs_params.gap_scale = ihs_params.gap_scale_default,
         include_edges: ihs_params.include_edges = True,
         use_threads: ihs_params.use_threads = True,
+        segment_size: Optional[ihs_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = ihs_params.min_cohort_size_default,
@@ -1561,6 +1835,7 @@ class AnophelesDataResource(
             gap_scale=gap_scale,
             include_edges=include_edges,
             use_threads=use_threads,
+            segment_size=segment_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             sample_query=sample_query,
@@ -1669,6 +1944,7 @@ class AnophelesDataResource(
         gap_scale: xpehh_params.gap_scale = xpehh_params.gap_scale_default,
         include_edges: xpehh_params.include_edges = True,
         use_threads: xpehh_params.use_threads = True,
+        segment_size: Optional[xpehh_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = xpehh_params.min_cohort_size_default,
@@ -1707,6 +1983,7 @@ class AnophelesDataResource(
             gap_scale=gap_scale,
             include_edges=include_edges,
             use_threads=use_threads,
+            segment_size=segment_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             random_seed=random_seed,
@@ -1774,6 +2051,7 @@ class AnophelesDataResource(
         gap_scale: ihs_params.gap_scale = ihs_params.gap_scale_default,
         include_edges: ihs_params.include_edges = True,
         use_threads: ihs_params.use_threads = True,
+        segment_size: Optional[ihs_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = ihs_params.min_cohort_size_default,
@@ -1815,6 +2093,7 @@ class AnophelesDataResource(
             gap_scale=gap_scale,
             include_edges=include_edges,
             use_threads=use_threads,
+            segment_size=segment_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             random_seed=random_seed,
@@ -1883,6 +2162,7 @@ class AnophelesDataResource(
         gap_scale: xpehh_params.gap_scale = xpehh_params.gap_scale_default,
         include_edges: xpehh_params.include_edges = True,
         use_threads: xpehh_params.use_threads = True,
+        segment_size: Optional[xpehh_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = xpehh_params.min_cohort_size_default,
@@ -1921,14 +2201,18 @@ class AnophelesDataResource(
             random_seed=random_seed,
         )
 
-        try:
-            results = self.results_cache_get(name=name, params=params)
+        with self.results_cache_lock(name=name, params=params):
+            try:
+                results = self.results_cache_get(name=name, params=params)
 
-        except CacheMiss:
-            results = self._xpehh_gwss(
-                chunks=chunks, inline_array=inline_array, **params
-            )
-            self.results_cache_set(name=name, params=params, results=results)
+            except CacheMiss:
+                results = self._xpehh_gwss(
+                    chunks=chunks,
+                    inline_array=inline_array,
+                    segment_size=segment_size,
+                    **params,
+                )
+                self.results_cache_set(name=name, params=params, results=results)
 
         x = results["x"]
         xpehh = results["xpehh"]
@@ -1953,6 +2237,7 @@ class AnophelesDataResource(
         gap_scale,
         include_edges,
         use_threads,
+        segment_size,
         min_cohort_size,
         max_cohort_size,
         random_seed,
@@ -2010,17 +2295,31 @@ class AnophelesDataResource(
                 ac2 = ac2[maf_filter]
 
             # compute XP-EHH
-            xp = allel.xpehh(
-                h1=ht1,
-                h2=ht2,
-                pos=pos,
-                map_pos=map_pos,
-                min_ehh=min_ehh,
-                include_edges=include_edges,
-                max_gap=max_gap,
-                gap_scale=gap_scale,
-                use_threads=use_threads,
-            )
+            if segment_size:
+                xp = _segmented_xpehh(
+                    ht1,
+                    ht2,
+                    pos,
+                    map_pos=map_pos,
+                    min_ehh=min_ehh,
+                    include_edges=include_edges,
+                    max_gap=max_gap,
+                    gap_scale=gap_scale,
+                    segment_size=segment_size,
+                    use_threads=use_threads,
+                )
+            else:
+                xp = allel.xpehh(
+                    h1=ht1,
+                    h2=ht2,
+                    pos=pos,
+                    map_pos=map_pos,
+                    min_ehh=min_ehh,
+                    include_edges=include_edges,
+                    max_gap=max_gap,
+                    gap_scale=gap_scale,
+                    use_threads=use_threads,
+                )
 
             # remove any NaNs
             na_mask = ~np.isnan(xp)
@@ -2059,6 +2358,7 @@ class AnophelesDataResource(
         gap_scale: xpehh_params.gap_scale = xpehh_params.gap_scale_default,
         include_edges: xpehh_params.include_edges = True,
         use_threads: xpehh_params.use_threads = True,
+        segment_size: Optional[xpehh_params.segment_size] = None,
         min_cohort_size: Optional[
             base_params.min_cohort_size
         ] = xpehh_params.min_cohort_size_default,
@@ -2090,6 +2390,7 @@ class AnophelesDataResource(
             gap_scale=gap_scale,
             include_edges=include_edges,
             use_threads=use_threads,
+            segment_size=segment_size,
             min_cohort_size=min_cohort_size,
             max_cohort_size=max_cohort_size,
             cohort1_query=cohort1_query,
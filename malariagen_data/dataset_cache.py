@@ -0,0 +1,210 @@
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+from dask.highlevelgraph import HighLevelGraph
+from dask.utils import parse_bytes
+
+# Default capacity of the shared dataset cache.
+DEFAULT_DATASET_CACHE_SIZE = "2GB"
+
+# Rough estimate of the memory used by each task in a dask graph, including
+# keys, task tuples and small arguments such as slices.
+_TASK_NBYTES = 1024
+
+size_type = Union[int, str]
+
+
+def _dataset_nbytes(
+    obj: Union[xr.Dataset, xr.DataArray, da.Array, Mapping[str, np.ndarray]],
+) -> int:
+    """Estimate the memory held by a lazily constructed dataset or array, or
+    by a table of arrays given as a mapping of column names to arrays.
+
+    This counts the size of any materialised arrays, e.g., coordinates, and
+    the size of the dask graphs, but not the data which would be loaded when
+    computing. Graph layers shared between variables are counted once."""
+    arrays: List[Any]
+    if isinstance(obj, da.Array):
+        arrays = [obj]
+    elif isinstance(obj, xr.DataArray):
+        arrays = [obj.data]
+    elif isinstance(obj, xr.Dataset):
+        arrays = [v.data for v in obj.variables.values()]
+    else:
+        arrays = list(obj.values())
+    nbytes = 0
+    layers: Dict[str, Any] = dict()
+    for a in arrays:
+        if isinstance(a, da.Array):
+            graph = a.__dask_graph__()
+            if isinstance(graph, HighLevelGraph):
+                layers.update(graph.layers)
+            else:  # pragma: no cover
+                layers[a.name] = graph
+        else:
+            nbytes += int(np.asarray(a).nbytes)
+    nbytes += sum(len(layer) for layer in layers.values()) * _TASK_NBYTES
+    return nbytes
+
+
+def _shallow_copy(obj):
+    # N.B., hand out shallow copies of cached datasets, so that callers
+    # adding or removing variables do not affect the cache. Dask arrays
+    # are immutable.
+    if isinstance(obj, (xr.Dataset, xr.DataArray)):
+        return obj.copy(deep=False)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return obj
+
+
+class DatasetCacheStats(NamedTuple):
+    """Statistics for a dataset cache."""
+
+    hits: int
+    misses: int
+    evictions: int
+    n_entries: int
+    nbytes: int
+    max_size: int
+
+
+class DatasetCache:
+    """A bounded, thread-safe, least-recently-used cache of lazily
+    constructed datasets, e.g., xarray datasets of SNP calls backed by
+    dask arrays.
+
+    Constructing these datasets can be relatively expensive, e.g., because
+    site filters need to be loaded to compute the shape of the output, and
+    so it is useful to reuse them when the same data are accessed repeatedly.
+    Entries are weighted by the estimated memory held by the dataset,
+    including materialised coordinates and the dask graph, and the least
+    recently used entries are evicted when the total exceeds the capacity.
+
+    A single cache can be shared by multiple data resources. Each entry
+    belongs to an owner, and all entries for an owner can be invalidated
+    together, which happens automatically when the owner is garbage
+    collected. The cache does not hold references to owners.
+
+    Parameters
+    ----------
+    max_size : int or str, optional
+        Capacity of the cache, either as a number of bytes or a string like
+        "2GB". Set to 0 to disable caching.
+
+    """
+
+    def __init__(self, max_size: size_type = DEFAULT_DATASET_CACHE_SIZE):
+        self._entries: "OrderedDict[Tuple[int, Hashable], Any]" = OrderedDict()
+        self._nbytes: Dict[Tuple[int, Hashable], int] = dict()
+        self._total = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.RLock()
+        self._owners = itertools.count()
+        self._max_size = 0
+        self.max_size = max_size  # type: ignore
+
+    @property
+    def max_size(self) -> int:
+        """Capacity of the cache in bytes. Reducing the capacity evicts
+        entries as needed."""
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value: size_type):
+        with self._lock:
+            self._max_size = parse_bytes(value) if isinstance(value, str) else value
+            self._shrink()
+
+    def register(self, owner: object) -> int:
+        """Obtain a token to identify entries belonging to `owner`. Entries
+        are invalidated when `owner` is garbage collected."""
+        token = next(self._owners)
+        weakref.finalize(owner, self.invalidate, token)
+        return token
+
+    def get_or_build(self, token: int, key: Hashable, build: Callable[[], Any]):
+        """Return the cached dataset for `key`, or build and cache it."""
+        try:
+            entry = (token, key)
+            hash(entry)
+        except TypeError:
+            # Parameters are not hashable, e.g., a dict of chunk sizes,
+            # so the dataset cannot be cached.
+            with self._lock:
+                self._misses += 1
+            return build()
+
+        with self._lock:
+            if entry in self._entries:
+                self._hits += 1
+                self._entries.move_to_end(entry)
+                return _shallow_copy(self._entries[entry])
+            self._misses += 1
+
+        # N.B., build outside the lock, as this may take some time.
+        obj = build()
+        nbytes = _dataset_nbytes(obj)
+
+        with self._lock:
+            self._discard(entry)
+            if nbytes <= self._max_size:
+                self._entries[entry] = obj
+                self._nbytes[entry] = nbytes
+                self._total += nbytes
+                self._shrink()
+        return _shallow_copy(obj)
+
+    def invalidate(self, token: Optional[int] = None):
+        """Remove all entries belonging to the owner identified by `token`,
+        or all entries if not given."""
+        with self._lock:
+            for entry in list(self._entries):
+                if token is None or entry[0] == token:
+                    self._discard(entry)
+
+    def stats(self) -> DatasetCacheStats:
+        """Obtain hit and miss counts and current usage of the cache."""
+        with self._lock:
+            return DatasetCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                n_entries=len(self._entries),
+                nbytes=self._total,
+                max_size=self._max_size,
+            )
+
+    def _shrink(self):
+        while self._entries and self._total > self._max_size:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self._evictions += 1
+
+    def _discard(self, entry):
+        if entry in self._entries:
+            del self._entries[entry]
+            self._total -= self._nbytes.pop(entry)
+
+
+# Cache shared by all data resources which are not configured otherwise.
+shared_dataset_cache = DatasetCache()
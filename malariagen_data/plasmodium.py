@@ -319,7 +319,7 @@ class PlasmodiumDataResource:
         except KeyError:
             path = os.path.join(self._path, self.CONF["annotations_path"])
             with self._fs.open(path, mode="rb") as f:
-                df = _read_gff3(f, compression="gzip")
+                df = _read_gff3(f, compression="gzip", parse_attributes=False)
             if attributes is not None:
                 df = _unpack_gff3_attributes(df, attributes=attributes)
             self._cache_genome_features[attributes] = df
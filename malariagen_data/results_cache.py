@@ -0,0 +1,961 @@
+import io
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import warnings
+import zipfile
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import zarr  # type: ignore
+from dask.utils import parse_bytes
+from fsspec.core import url_to_fs  # type: ignore
+
+from .util import CacheMiss
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Not available on Windows, fall back to locking within the process only.
+    fcntl = None  # type: ignore
+
+# Default size of the in-memory tier, used if the user does not specify.
+DEFAULT_MEMORY_SIZE = "1GB"
+
+# Name of the directory within the cache where lock files are kept.
+_LOCKS_DIR = ".locks"
+
+# Interval in seconds between attempts to acquire a lock held elsewhere.
+_LOCK_POLL_INTERVAL = 0.5
+
+size_type = Union[int, str]
+
+
+def _parse_size(size: Optional[size_type]) -> Optional[int]:
+    """Normalise a size given as a number of bytes or a string like "10GB"."""
+    if size is None:
+        return None
+    if isinstance(size, str):
+        return parse_bytes(size)
+    return int(size)
+
+
+def _results_nbytes(results: Mapping[str, np.ndarray]) -> int:
+    # N.B., use the nbytes attribute where available, to avoid loading arrays
+    # which are not held in memory, e.g., zarr arrays.
+    return sum(
+        int(v.nbytes) if hasattr(v, "nbytes") else int(np.asarray(v).nbytes)
+        for v in results.values()
+    )
+
+
+def _in_memory(results: Mapping[str, np.ndarray]) -> bool:
+    """Check whether all results are held in memory, rather than being backed
+    by files on disk, e.g., numpy memory-mapped arrays or zarr arrays."""
+    return all(
+        isinstance(v, np.ndarray) and not isinstance(v, np.memmap)
+        for v in results.values()
+    )
+
+
+def _copy_results(results: Mapping[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # N.B., callers are free to modify the arrays they get back, so
+    # always hand out copies of the arrays held in memory.
+    return {k: np.array(v, copy=True) for k, v in results.items()}
+
+
+def _encode_results(results: Mapping[str, np.ndarray]) -> bytes:
+    """Encode results as the bytes of a zipped zarr file, in the same format
+    as written by zarr.save() to a path ending in ".zip"."""
+    store: Dict[str, bytes] = dict()
+    zarr.save(zarr.storage.KVStore(store), **results)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for k, v in store.items():
+            zf.writestr(k, v)
+    return buf.getvalue()
+
+
+def _decode_results(data: bytes) -> Dict[str, np.ndarray]:
+    """Decode results from the bytes of a zipped zarr file. Raises an exception
+    if the data are truncated or otherwise corrupted."""
+    with zipfile.ZipFile(io.BytesIO(data), mode="r") as zf:
+        # N.B., reading checks the CRC of each member.
+        store = {k: zf.read(k) for k in zf.namelist()}
+    root = zarr.open_group(zarr.storage.KVStore(store), mode="r")
+    return {k: a[...] for k, a in root.arrays()}
+
+
+class ResultsCacheEntry(NamedTuple):
+    """Summary of a single entry stored in the results cache."""
+
+    name: str
+    key: str
+    nbytes: int
+    last_used: float
+
+
+class _ResultsMemoryCache:
+    """A bounded, thread-safe, least-recently-used store of decoded results,
+    weighted by the number of bytes held in each entry."""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, np.ndarray]]" = (
+            OrderedDict()
+        )
+        self._nbytes: Dict[Tuple[str, str], int] = dict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._total
+
+    def get(
+        self, name: str, key: str, copy: bool = True
+    ) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            results = self._entries.get((name, key))
+            if results is None:
+                return None
+            self._entries.move_to_end((name, key))
+        if not copy:
+            # N.B., the caller must not modify the arrays.
+            return results
+        return _copy_results(results)
+
+    def set(self, name: str, key: str, results: Mapping[str, np.ndarray]):
+        nbytes = _results_nbytes(results)
+        with self._lock:
+            self._discard((name, key))
+            if nbytes > self._max_size or not _in_memory(results):
+                # Too big to hold in memory at all, or deliberately held
+                # out of memory by the caller.
+                return
+            self._entries[(name, key)] = _copy_results(results)
+            self._nbytes[(name, key)] = nbytes
+            self._total += nbytes
+            while self._total > self._max_size:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def discard(self, name: str, key: str):
+        with self._lock:
+            self._discard((name, key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes.clear()
+            self._total = 0
+
+    def _discard(self, entry: Tuple[str, str]):
+        if entry in self._entries:
+            del self._entries[entry]
+            self._total -= self._nbytes.pop(entry)
+
+
+def _match_quota(name: str, quota_name: str) -> bool:
+    """Quotas may be given with or without the version suffix used in cache
+    names, e.g., "snp_allele_counts" applies to "snp_allele_counts_v2"."""
+    return name == quota_name or (
+        re.fullmatch(re.escape(quota_name) + r"_v\d+", name) is not None
+    )
+
+
+@contextmanager
+def _atomic_path(path: Path) -> Iterator[Path]:
+    """Provide a temporary path to write to, which is renamed to the given
+    path on success and removed on failure."""
+    tmp_path = path.with_name(f".{uuid.uuid4().hex}.{path.name}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+# Locks used to exclude other threads within the current process, keyed by
+# lock name. N.B., POSIX advisory locks are held per process, and so cannot
+# be used to exclude threads.
+_thread_locks: Dict[str, threading.Lock] = dict()
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(lock_name: str) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(lock_name, threading.Lock())
+
+
+class ResultsCacheLock:
+    """An advisory lock on a single results cache entry.
+
+    The lock is always exclusive across threads within the current process.
+    If a lock file path is given, the lock is also exclusive across processes,
+    using POSIX record locks on the lock file, which are supported by NFS and
+    are released automatically if the process holding the lock dies.
+
+    Parameters
+    ----------
+    lock_name : str
+        Unique name for the lock within the current process.
+    path : Path, optional
+        Path to the lock file.
+    timeout : float, optional
+        Maximum time in seconds to wait. If the lock cannot be acquired within
+        this time, proceed without holding the lock.
+
+    """
+
+    def __init__(
+        self,
+        lock_name: str,
+        path: Optional[Path] = None,
+        timeout: Optional[float] = None,
+    ):
+        self._path = path
+        self._timeout = timeout
+        self._thread_lock = _thread_lock(lock_name)
+        self._thread_lock_held = False
+        self._file: Optional[IO] = None
+        self._held = False
+
+    @property
+    def held(self) -> bool:
+        return self._held
+
+    def acquire(self) -> bool:
+        """Acquire the lock, returning False if timed out."""
+        if self._held:
+            return True
+        deadline = None if self._timeout is None else time.time() + self._timeout
+        timeout = -1 if self._timeout is None else self._timeout
+        if not self._thread_lock.acquire(timeout=timeout):
+            return False
+        self._thread_lock_held = True
+        if self._path is not None and fcntl is not None:
+            while True:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                f = open(self._path, "a")
+                try:
+                    fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    if deadline is not None and time.time() >= deadline:
+                        self._release_thread_lock()
+                        return False
+                    time.sleep(_LOCK_POLL_INTERVAL)
+                    continue
+                if self._locked_current_file(f):
+                    break
+                # The lock file was removed by another worker after we opened
+                # it, and so locking it excludes nobody. Try again with the
+                # current lock file.
+                fcntl.lockf(f, fcntl.LOCK_UN)
+                f.close()
+            self._file = f
+        self._held = True
+        return True
+
+    def _locked_current_file(self, f: IO) -> bool:
+        """Check that the locked file is still the file at the lock path."""
+        try:
+            return os.fstat(f.fileno()).st_ino == os.stat(self._path).st_ino  # type: ignore
+        except FileNotFoundError:
+            return False
+
+    def release(self):
+        """Release the lock, if held."""
+        if self._file is not None:
+            try:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        self._release_thread_lock()
+        self._held = False
+
+    def _release_thread_lock(self):
+        if self._thread_lock_held:
+            self._thread_lock.release()
+            self._thread_lock_held = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class ResultsCacheBackend:
+    """Storage for results cache entries. Each entry is identified by an
+    analysis name and a key, and holds the analysis parameters as JSON and
+    the results as a mapping of names to numpy arrays.
+
+    Backends only provide storage, the in-memory tier and eviction policy are
+    handled by the ResultsCache class, and so behave the same way for all
+    backends."""
+
+    def load(self, *, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Load results for an entry, returning None if the entry does not
+        exist. May raise an exception if the entry is corrupted."""
+        raise NotImplementedError("Subclasses must implement `load`.")
+
+    @contextmanager
+    def open(self, *, name: str, key: str) -> Iterator[Optional[Mapping[str, Any]]]:
+        """Open results for an entry for reading, providing None if the entry
+        does not exist. Backends which can read arrays incrementally provide
+        lazy array-like objects, which are only valid within the context, and
+        otherwise the results are loaded into memory."""
+        yield self.load(name=name, key=key)
+
+    def save(
+        self,
+        *,
+        name: str,
+        key: str,
+        params_json: str,
+        results: Mapping[str, np.ndarray],
+    ):
+        """Save results for an entry, replacing any existing results. Readers
+        should never see partially saved results."""
+        raise NotImplementedError("Subclasses must implement `save`.")
+
+    def touch(self, *, name: str, key: str):
+        """Record that an entry has been used."""
+        raise NotImplementedError("Subclasses must implement `touch`.")
+
+    def entries(self) -> List[ResultsCacheEntry]:
+        """List all entries, in any order."""
+        raise NotImplementedError("Subclasses must implement `entries`.")
+
+    def delete(self, *, name: str, key: str):
+        """Delete an entry, if it exists."""
+        raise NotImplementedError("Subclasses must implement `delete`.")
+
+    def lock(
+        self, *, name: str, key: str, timeout: Optional[float] = None
+    ) -> ResultsCacheLock:
+        """Create an advisory lock for an entry."""
+        return ResultsCacheLock(f"{self!r}/{name}/{key}", timeout=timeout)
+
+
+class LocalResultsCacheBackend(ResultsCacheBackend):
+    """Store results in a directory on the local file system, which may be a
+    network file system shared between hosts. Locks are exclusive across
+    processes and hosts.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the directory.
+
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._path = Path(path).expanduser().resolve()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def __str__(self):
+        return str(self._path)
+
+    def __repr__(self):
+        return f"LocalResultsCacheBackend({str(self._path)!r})"
+
+    def load(self, *, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        cache_path = self._path / name / key
+
+        # Read zipped zarr format.
+        results_path = cache_path / "results.zarr.zip"
+        if results_path.exists():
+            # N.B., zarr.load() returns a lazy loader which decompresses the
+            # data on every access, so eagerly decode all arrays here.
+            with zarr.ZipStore(str(results_path), mode="r") as store:
+                root = zarr.open_group(store, mode="r")
+                return {k: a[...] for k, a in root.arrays()}
+
+        # For backwards compatibility, read npz format.
+        legacy_results_path = cache_path / "results.npz"
+        if legacy_results_path.exists():  # pragma: no cover
+            with np.load(legacy_results_path) as npz:
+                return {k: npz[k] for k in npz.files}
+
+        return None
+
+    @contextmanager
+    def open(self, *, name: str, key: str) -> Iterator[Optional[Mapping[str, Any]]]:
+        results_path = self._path / name / key / "results.zarr.zip"
+        if not results_path.exists():
+            # Fall back to loading, e.g., legacy npz format.
+            yield self.load(name=name, key=key)
+            return
+        with zarr.ZipStore(str(results_path), mode="r") as store:
+            root = zarr.open_group(store, mode="r")
+            yield dict(root.arrays())
+
+    def save(
+        self,
+        *,
+        name: str,
+        key: str,
+        params_json: str,
+        results: Mapping[str, np.ndarray],
+    ):
+        cache_path = self._path / name / key
+        cache_path.mkdir(exist_ok=True, parents=True)
+
+        # N.B., files are first written to a temporary location and then
+        # renamed, so that concurrent readers never see partially written
+        # files. Temporary file names begin with "." and end with the same
+        # suffix as the final file name, which zarr uses to select the
+        # storage format.
+
+        # Write the parameters as a JSON file.
+        params_path = cache_path / "params.json"
+        with _atomic_path(params_path) as tmp_path:
+            with tmp_path.open(mode="w") as f:
+                f.write(params_json)
+
+        # Write the data to be cached as a zipped zarr file.
+        results_path = cache_path / "results.zarr.zip"
+        with _atomic_path(results_path) as tmp_path:
+            zarr.save(tmp_path, **results)
+
+    def touch(self, *, name: str, key: str):
+        # Record use of the entry via the modification time, which is
+        # more reliable than access time on many file systems.
+        cache_path = self._path / name / key
+        for file_name in ["results.zarr.zip", "results.npz"]:
+            try:
+                os.utime(cache_path / file_name)
+            except OSError:
+                # File does not exist, or the cache may be on a read-only
+                # file system.
+                pass
+
+    def entries(self) -> List[ResultsCacheEntry]:
+        entries: List[ResultsCacheEntry] = []
+        if not self._path.exists():
+            return entries
+        for name_path in self._path.iterdir():
+            if not name_path.is_dir() or name_path.name.startswith("."):
+                continue
+            for cache_path in name_path.iterdir():
+                if not cache_path.is_dir():
+                    continue
+                try:
+                    nbytes = 0
+                    last_used = 0.0
+                    for f in cache_path.iterdir():
+                        stat = f.stat()
+                        nbytes += stat.st_size
+                        last_used = max(last_used, stat.st_mtime)
+                except FileNotFoundError:
+                    # Entry was removed concurrently.
+                    continue
+                entries.append(
+                    ResultsCacheEntry(
+                        name=name_path.name,
+                        key=cache_path.name,
+                        nbytes=nbytes,
+                        last_used=last_used,
+                    )
+                )
+        return entries
+
+    def delete(self, *, name: str, key: str):
+        shutil.rmtree(self._path / name / key, ignore_errors=True)
+
+        # Also remove the lock file, so that lock files do not accumulate as
+        # entries are evicted. N.B., only do this while holding the lock, and
+        # otherwise leave the lock file in place. Another worker may already
+        # have opened the lock file and be waiting to lock it, but will then
+        # find the file has been removed and retry with a new lock file.
+        lock_path = self._lock_path(name, key)
+        if not lock_path.exists():
+            return
+        lock = self.lock(name=name, key=key, timeout=0)
+        if lock.acquire():
+            try:
+                lock_path.unlink()
+            except OSError:
+                # File removed concurrently, or cannot be removed while open.
+                pass
+            finally:
+                lock.release()
+
+    def _lock_path(self, name: str, key: str) -> Path:
+        return self._path / _LOCKS_DIR / name / f"{key}.lock"
+
+    def lock(
+        self, *, name: str, key: str, timeout: Optional[float] = None
+    ) -> ResultsCacheLock:
+        path = self._lock_path(name, key)
+        return ResultsCacheLock(str(path), path=path, timeout=timeout)
+
+
+class FsspecResultsCacheBackend(ResultsCacheBackend):
+    """Store results in any file system supported by fsspec, e.g., a Google
+    Cloud Storage or S3 bucket. Entries use the same layout and format as the
+    local backend. Locks are only exclusive within the current process.
+
+    Parameters
+    ----------
+    url : str
+        URL of the root directory, e.g., "gs://my-bucket/results_cache".
+    **storage_options
+        Passed through to fsspec.
+
+    """
+
+    def __init__(self, url: str, **storage_options):
+        self._url = url
+        self._fs, path = url_to_fs(url, **storage_options)
+        self._root = path.rstrip("/")
+
+    def __str__(self):
+        return self._url
+
+    def __repr__(self):
+        return f"FsspecResultsCacheBackend({self._url!r})"
+
+    def _entry_path(self, name: str, key: str) -> str:
+        return f"{self._root}/{name}/{key}"
+
+    def load(self, *, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        results_path = f"{self._entry_path(name, key)}/results.zarr.zip"
+        try:
+            data = self._fs.cat_file(results_path)
+        except FileNotFoundError:
+            return None
+        return _decode_results(data)
+
+    def save(
+        self,
+        *,
+        name: str,
+        key: str,
+        params_json: str,
+        results: Mapping[str, np.ndarray],
+    ):
+        entry_path = self._entry_path(name, key)
+        self._pipe_atomic(f"{entry_path}/params.json", params_json.encode())
+        self._pipe_atomic(f"{entry_path}/results.zarr.zip", _encode_results(results))
+        self.touch(name=name, key=key)
+
+    def _pipe_atomic(self, path: str, data: bytes):
+        # N.B., file systems differ in whether writes are atomic, so write to
+        # a temporary location and then move into place.
+        parent, file_name = path.rsplit("/", 1)
+        tmp_path = f"{parent}/.{uuid.uuid4().hex}.{file_name}"
+        try:
+            self._fs.pipe_file(tmp_path, data)
+            self._fs.mv(tmp_path, path)
+        finally:
+            if self._fs.exists(tmp_path):
+                self._fs.rm(tmp_path)
+
+    def touch(self, *, name: str, key: str):
+        # N.B., object stores generally do not support updating modification
+        # times, so record the time of last use within a separate file.
+        path = f"{self._entry_path(name, key)}/last_used"
+        try:
+            self._fs.pipe_file(path, repr(time.time()).encode())
+        except OSError:  # pragma: no cover
+            # The cache may be read-only.
+            pass
+
+    def entries(self) -> List[ResultsCacheEntry]:
+        try:
+            files = self._fs.find(self._root, detail=True)
+        except FileNotFoundError:  # pragma: no cover
+            return []
+        nbytes: Dict[Tuple[str, str], int] = dict()
+        prefix = self._root + "/"
+        for path, info in files.items():
+            parts = path[len(prefix) :].split("/") if path.startswith(prefix) else []
+            if len(parts) != 3 or any(p.startswith(".") for p in parts):
+                continue
+            name, key, _ = parts
+            nbytes[(name, key)] = nbytes.get((name, key), 0) + int(info["size"])
+        if not nbytes:
+            return []
+        last_used_paths = {
+            f"{self._entry_path(name, key)}/last_used": (name, key)
+            for name, key in nbytes
+        }
+        last_used_data = self._fs.cat(list(last_used_paths), on_error="omit")
+        last_used = dict()
+        for path, data in last_used_data.items():
+            try:
+                last_used[last_used_paths[path]] = float(data)
+            except (KeyError, ValueError):  # pragma: no cover
+                pass
+        return [
+            ResultsCacheEntry(
+                name=name,
+                key=key,
+                nbytes=n,
+                last_used=last_used.get((name, key), 0.0),
+            )
+            for (name, key), n in nbytes.items()
+        ]
+
+    def delete(self, *, name: str, key: str):
+        try:
+            self._fs.rm(self._entry_path(name, key), recursive=True)
+        except FileNotFoundError:
+            pass
+
+
+class MemoryResultsCacheBackend(ResultsCacheBackend):
+    """Store results in memory within the current process. Useful for
+    interactive sessions where results should not persist, and for testing.
+    Locks are exclusive within the current process."""
+
+    def __init__(self):
+        self._entries: Dict[
+            Tuple[str, str], Tuple[Dict[str, np.ndarray], float]
+        ] = dict()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "<memory>"
+
+    def __repr__(self):
+        return f"MemoryResultsCacheBackend(<{id(self):#x}>)"
+
+    def load(self, *, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get((name, key))
+        if entry is None:
+            return None
+        return _copy_results(entry[0])
+
+    @contextmanager
+    def open(self, *, name: str, key: str) -> Iterator[Optional[Mapping[str, Any]]]:
+        # N.B., no need to copy, readers must not modify the arrays.
+        with self._lock:
+            entry = self._entries.get((name, key))
+        yield None if entry is None else entry[0]
+
+    def save(
+        self,
+        *,
+        name: str,
+        key: str,
+        params_json: str,
+        results: Mapping[str, np.ndarray],
+    ):
+        results = _copy_results(results)
+        with self._lock:
+            self._entries[(name, key)] = (results, time.time())
+
+    def touch(self, *, name: str, key: str):
+        with self._lock:
+            entry = self._entries.get((name, key))
+            if entry is not None:
+                self._entries[(name, key)] = (entry[0], time.time())
+
+    def entries(self) -> List[ResultsCacheEntry]:
+        with self._lock:
+            return [
+                ResultsCacheEntry(
+                    name=name,
+                    key=key,
+                    nbytes=_results_nbytes(results),
+                    last_used=last_used,
+                )
+                for (name, key), (results, last_used) in self._entries.items()
+            ]
+
+    def delete(self, *, name: str, key: str):
+        with self._lock:
+            self._entries.pop((name, key), None)
+
+
+def _init_results_cache_backend(
+    results_cache: Union[str, Path, ResultsCacheBackend],
+    storage_options: Optional[Mapping[str, Any]] = None,
+) -> ResultsCacheBackend:
+    """Set up a results cache backend from a local path or URL."""
+    if isinstance(results_cache, ResultsCacheBackend):
+        return results_cache
+    if isinstance(results_cache, Path):
+        return LocalResultsCacheBackend(results_cache)
+    if "://" not in results_cache:
+        return LocalResultsCacheBackend(results_cache)
+    if results_cache.startswith("file://"):
+        # Use the local backend to support locking across processes.
+        fs, path = url_to_fs(results_cache)
+        return LocalResultsCacheBackend(path)
+    return FsspecResultsCacheBackend(results_cache, **(storage_options or dict()))
+
+
+class ResultsCache:
+    """Tiered store for the results of longer-running computations.
+
+    Results are held as a mapping of names to numpy arrays. Each entry is
+    identified by an analysis name and a key derived from the analysis
+    parameters, and is stored via a backend, by default in a directory on the
+    local file system where each entry is a zipped zarr file. A bounded
+    in-memory tier of decoded arrays sits in front of the backend, so that
+    repeated lookups within the same session do not need to read and
+    decompress data again.
+
+    The backend store is safe for concurrent use by multiple processes.
+    Entries are published atomically, and advisory locks allow one worker to
+    wait for another worker computing the same results rather than
+    duplicating the computation. For the local backend this works across
+    processes and hosts sharing a network file system.
+
+    The backend store can optionally be constrained by a total size budget,
+    by a maximum entry age, and by per-analysis size quotas. When any of these
+    constraints are exceeded, the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    backend : str or Path or ResultsCacheBackend
+        Where to store results. A path to a directory on the local file
+        system, or any URL supported by fsspec, or a backend instance.
+    max_size : int or str, optional
+        Maximum total size of the backend store, either as a number of bytes
+        or a string like "100GB".
+    max_age : float, optional
+        Maximum time in seconds since an entry was last used, after which the
+        entry will be evicted.
+    quotas : dict, optional
+        Maximum size of the backend store for individual analyses, keyed by
+        analysis name.
+    memory_size : int or str, optional
+        Maximum size of the in-memory tier. Set to 0 to disable.
+    lock_timeout : float, optional
+        Maximum time in seconds to wait for another worker computing the same
+        results. If not given, wait indefinitely.
+    storage_options : dict, optional
+        Passed through to fsspec if `backend` is a URL.
+
+    """
+
+    def __init__(
+        self,
+        backend: Union[str, Path, ResultsCacheBackend],
+        *,
+        max_size: Optional[size_type] = None,
+        max_age: Optional[float] = None,
+        quotas: Optional[Mapping[str, size_type]] = None,
+        memory_size: Optional[size_type] = DEFAULT_MEMORY_SIZE,
+        lock_timeout: Optional[float] = None,
+        storage_options: Optional[Mapping[str, Any]] = None,
+    ):
+        self._backend = _init_results_cache_backend(
+            backend, storage_options=storage_options
+        )
+        self._max_size = _parse_size(max_size)
+        self._max_age = max_age
+        self._quotas: Dict[str, int] = {
+            name: int(_parse_size(size))  # type: ignore
+            for name, size in (quotas or dict()).items()
+        }
+        if isinstance(self._backend, MemoryResultsCacheBackend):
+            # Results are already held in memory.
+            memory_size = 0
+        self._memory = _ResultsMemoryCache(max_size=_parse_size(memory_size) or 0)
+        self._lock_timeout = lock_timeout
+
+    @property
+    def backend(self) -> ResultsCacheBackend:
+        return self._backend
+
+    def __str__(self):
+        return str(self._backend)
+
+    def __repr__(self):
+        return f"ResultsCache({self._backend!r})"
+
+    def get(
+        self,
+        *,
+        name: str,
+        key: str,
+        lock: Optional[ResultsCacheLock] = None,
+    ) -> Mapping[str, np.ndarray]:
+        results = self._read(name=name, key=key)
+        if results is not None:
+            return results
+
+        if lock is not None and not lock.held:
+            # Wait for any other worker computing the same results. If they
+            # finish while we are waiting, their results can be used. If we
+            # hold the lock when raising a cache miss below, other workers
+            # will wait for us instead.
+            lock.acquire()
+            results = self._read(name=name, key=key)
+            if results is not None:
+                return results
+
+        raise CacheMiss
+
+    @contextmanager
+    def open(
+        self,
+        *,
+        name: str,
+        key: str,
+        lock: Optional[ResultsCacheLock] = None,
+    ) -> Iterator[Mapping[str, Any]]:
+        """Like get(), but read results lazily where the backend supports it,
+        and do not add them to the in-memory tier. Useful for large results
+        which the caller will copy elsewhere in blocks. The arrays provided
+        must not be modified, and are only valid within the context."""
+        with ExitStack() as stack:
+            results = self._open(stack, name=name, key=key)
+            if results is None and lock is not None and not lock.held:
+                # Wait for any other worker computing the same results, see
+                # get().
+                lock.acquire()
+                results = self._open(stack, name=name, key=key)
+            if results is None:
+                raise CacheMiss
+            yield results
+
+    def set(
+        self,
+        *,
+        name: str,
+        key: str,
+        params_json: str,
+        results: Mapping[str, np.ndarray],
+    ):
+        self._backend.save(name=name, key=key, params_json=params_json, results=results)
+        self._memory.set(name, key, results)
+
+        if self._max_size is not None or self._max_age is not None or self._quotas:
+            self.evict()
+
+    def lock(self, *, name: str, key: str) -> ResultsCacheLock:
+        """Create an advisory lock for a single entry, which can be used to
+        ensure only one worker computes the results for that entry."""
+        return self._backend.lock(name=name, key=key, timeout=self._lock_timeout)
+
+    def _read(self, *, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        # Check the in-memory tier first.
+        results = self._memory.get(name, key)
+        if results is not None:
+            return results
+
+        try:
+            results = self._backend.load(name=name, key=key)
+        except Exception as e:
+            # The entry may be truncated or otherwise corrupted, e.g., if it
+            # was written by an older version of this package which did not
+            # write files atomically. Treat as a cache miss, so that results
+            # will be recomputed and the entry replaced.
+            warnings.warn(
+                f"Ignoring corrupt results cache entry {name}/{key} in {self}: {e!r}",
+                stacklevel=3,
+            )
+            return None
+        if results is None:
+            return None
+
+        self._backend.touch(name=name, key=key)
+        self._memory.set(name, key, results)
+        return results
+
+    def _open(
+        self, stack: ExitStack, *, name: str, key: str
+    ) -> Optional[Mapping[str, Any]]:
+        in_memory = self._memory.get(name, key, copy=False)
+        if in_memory is not None:
+            return in_memory
+
+        try:
+            results = stack.enter_context(self._backend.open(name=name, key=key))
+        except Exception as e:
+            # Treat corrupt entries as a cache miss, see _read().
+            warnings.warn(
+                f"Ignoring corrupt results cache entry {name}/{key} in {self}: {e!r}",
+                stacklevel=4,
+            )
+            return None
+        if results is None:
+            return None
+
+        self._backend.touch(name=name, key=key)
+        return results
+
+    def entries(self) -> List[ResultsCacheEntry]:
+        """List all entries in the backend store, least recently used first."""
+        entries = self._backend.entries()
+        entries.sort(key=lambda e: e.last_used)
+        return entries
+
+    def evict(self) -> List[ResultsCacheEntry]:
+        """Evict entries from the backend store until all constraints are
+        satisfied, returning the entries that were evicted."""
+        entries = self.entries()
+        evicted = []
+
+        # Evict entries which have not been used recently enough.
+        if self._max_age is not None:
+            cutoff = time.time() - self._max_age
+            evicted.extend([e for e in entries if e.last_used < cutoff])
+            entries = [e for e in entries if e.last_used >= cutoff]
+
+        # Evict least recently used entries for analyses over quota.
+        for quota_name, quota in self._quotas.items():
+            matching = [e for e in entries if _match_quota(e.name, quota_name)]
+            total = sum(e.nbytes for e in matching)
+            for e in matching:
+                if total <= quota:
+                    break
+                evicted.append(e)
+                entries.remove(e)
+                total -= e.nbytes
+
+        # Evict least recently used entries until within the total budget.
+        if self._max_size is not None:
+            total = sum(e.nbytes for e in entries)
+            while entries and total > self._max_size:
+                e = entries.pop(0)
+                evicted.append(e)
+                total -= e.nbytes
+
+        for e in evicted:
+            self._delete(e.name, e.key)
+
+        return evicted
+
+    def clear(self):
+        """Remove all entries from both the in-memory tier and backend store."""
+        self._memory.clear()
+        for e in self.entries():
+            self._delete(e.name, e.key)
+
+    def _delete(self, name: str, key: str):
+        self._memory.discard(name, key)
+        self._backend.delete(name=name, key=key)
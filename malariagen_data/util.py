@@ -1,16 +1,31 @@
 import hashlib
 import json
 import logging
+import os
 import re
 import sys
+import time
 import warnings
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from math import prod
 from functools import wraps
 from inspect import getcallargs
 from textwrap import dedent, fill
-from typing import IO, Dict, Hashable, List, Mapping, Optional, Tuple, Union, Callable
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.parse import unquote_plus
 from numpy.testing import assert_allclose, assert_array_equal
 
@@ -74,7 +89,7 @@ gff3_cols = (
 )
 
 
-def _read_gff3(buf, compression="gzip"):
+def _read_gff3(buf, compression="gzip", parse_attributes=True):
     # read as dataframe
     df = pd.read_csv(
         buf,
@@ -86,36 +101,309 @@ def _read_gff3(buf, compression="gzip"):
     )
 
     # parse attributes
-    df["attributes"] = df["attributes"].apply(_gff3_parse_attributes)
+    if parse_attributes:
+        df["attributes"] = df["attributes"].apply(_gff3_parse_attributes)
 
     return df
 
 
-def _unpack_gff3_attributes(df: pd.DataFrame, attributes: Tuple[str, ...]):
+def _gather_strings(
+    buf: np.ndarray, starts: np.ndarray, stops: np.ndarray
+) -> List[str]:
+    """Extract many substrings from a buffer of UTF-8 encoded text, given the
+    start and stop byte offsets of each substring, which must not contain
+    newlines. All substrings are gathered into a single newline-delimited
+    buffer, which is then decoded and split in one pass."""
+    lengths = stops - starts
+    if lengths.size == 0:
+        return []
+    ends = np.cumsum(lengths + 1)
+    shift = np.repeat(ends - lengths - 1 - starts, lengths + 1)
+    loc_char = np.ones(ends[-1], dtype=bool)
+    loc_char[ends - 1] = False
+    out = np.full(ends[-1], ord("\n"), dtype=np.uint8)
+    out[loc_char] = buf[np.flatnonzero(loc_char) - shift[loc_char]]
+    return out.tobytes().decode("utf-8").split("\n")[:-1]
+
+
+def _gff3_attributes_table(attributes: pd.Series) -> pd.DataFrame:
+    """Parse GFF3 attributes strings ('key=value' pairs delimited by ';') into
+    a long table with one row per attribute, with columns "row" (the position
+    of the feature), "key" (categorical) and "value". Equivalent to applying
+    `_gff3_parse_attributes()` to each string, but vectorised over the bytes
+    of all strings at once."""
+
+    # Locate fields, tracking the feature row via newline separators.
+    text = "\n".join(attributes.fillna("")) + "\n"
+    buf = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    loc_sep = np.flatnonzero((buf == ord(";")) | (buf == ord("\n")))
+    starts = np.concatenate([[0], loc_sep[:-1] + 1])
+    stops = loc_sep
+    rows = np.cumsum(np.concatenate([[0], buf[loc_sep[:-1]] == ord("\n")]))
+    loc_field = stops > starts
+    starts, stops, rows = starts[loc_field], stops[loc_field], rows[loc_field]
+
+    # Locate the first "=" within each field, which delimits key and value.
+    loc_eq = np.flatnonzero(buf == ord("="))
+    eq = np.append(loc_eq, buf.size)[np.searchsorted(loc_eq, starts)]
+    has_eq = eq < stops
+    keys = _gather_strings(buf, starts, np.where(has_eq, eq, stops))
+    value_starts = np.where(has_eq, eq + 1, stops)
+    values = _gather_strings(buf, value_starts, stops)
+
+    # Unquote and strip keys, visiting only the unique keys.
+    key_codes, key_uniques = pd.factorize(np.array(keys, dtype=object))
+    key_names = np.array([unquote_plus(k).strip() for k in key_uniques], dtype=object)
+    key_cat = pd.Categorical(key_names[key_codes])
+
+    # Strip values, visiting only values with whitespace at either end.
+    is_space = np.zeros(256, dtype=bool)
+    is_space[list(b" \t\r\f\v")] = True
+    loc_strip = (stops > value_starts) & (
+        is_space[buf[np.minimum(value_starts, buf.size - 1)]] | is_space[buf[stops - 1]]
+    )
+    for i in np.flatnonzero(loc_strip):
+        values[i] = values[i].strip()
+
+    # Unquote all values at once. N.B., values cannot contain newlines, so
+    # these are used as delimiters, and any encoded newlines are protected.
+    values_text = "\n".join(values)
+    if "%" in values_text or "+" in values_text:
+        values_text = values_text.replace("%0A", "\x00").replace("%0a", "\x00")
+        values_text = unquote_plus(values_text)
+        values = values_text.split("\n")
+        if "\x00" in values_text:
+            values = [v.replace("\x00", "\n") for v in values]
+    values_array = np.array(values, dtype=object)
+
+    # N.B., fields without a value are not strictly kosher, treat as flags.
+    values_array[~has_eq] = True
+
+    return pd.DataFrame(
+        {
+            "row": rows.astype(np.int64),
+            "key": key_cat,
+            "value": values_array,
+        }
+    )
+
+
+def _unpack_gff3_attributes(
+    df: pd.DataFrame,
+    attributes: Tuple[str, ...],
+    table: Optional[pd.DataFrame] = None,
+):
     df = df.copy()
 
+    if table is None:
+        if len(df) > 0 and isinstance(df["attributes"].iloc[0], dict):
+            # Attributes have already been parsed into dictionaries.
+            table = pd.DataFrame(
+                [
+                    (row, key, value)
+                    for row, a in enumerate(df["attributes"])
+                    for key, value in a.items()
+                ],
+                columns=["row", "key", "value"],
+            )
+            table["key"] = pd.Categorical(table["key"])
+        else:
+            table = _gff3_attributes_table(df["attributes"])
+
     # discover all attribute keys
-    all_attributes = set()
-    for a in df["attributes"]:
-        all_attributes.update(a.keys())
-    all_attributes_sorted = tuple(sorted(all_attributes))
+    key_codes = table["key"].cat.codes.to_numpy()
+    all_attributes_sorted = tuple(sorted(table["key"].cat.categories))
 
     # handle request for all attributes
     if attributes == ("*",):
         attributes = all_attributes_sorted
 
     # unpack attributes into columns
+    rows = table["row"].to_numpy()
+    values = table["value"].to_numpy()
     for key in attributes:
         if key not in all_attributes_sorted:
             raise ValueError(
                 f"'{key}' not in attributes set. Options {all_attributes_sorted}"
             )
-        df[key] = df["attributes"].apply(lambda v: v.get(key, np.nan))
-    del df["attributes"]
+        loc_key = key_codes == table["key"].cat.categories.get_loc(key)
+        column = np.full(len(df), np.nan, dtype=object)
+        column[rows[loc_key]] = values[loc_key]
+        df[key] = column
+    if "attributes" in df.columns:
+        del df["attributes"]
 
     return df
 
 
+def _gff3_attributes_dicts(n_features: int, table: pd.DataFrame) -> List[dict]:
+    """Convert a long table of GFF3 attributes into one dictionary per
+    feature, as returned by `_gff3_parse_attributes()`."""
+    dicts: List[dict] = [dict() for _ in range(n_features)]
+    for row, key, value in zip(table["row"], table["key"], table["value"]):
+        dicts[row][key] = value
+    return dicts
+
+
+def _strings_to_arrays(values) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode strings, possibly with missing values, as integer codes and a
+    buffer of the unique strings separated by null characters, suitable for
+    storing in the results cache."""
+    codes, uniques = pd.factorize(values)
+    buf = "\x00".join(uniques).encode("utf-8")
+    return codes.astype(np.int32), np.frombuffer(buf, dtype=np.uint8)
+
+
+def _arrays_to_strings(codes: np.ndarray, buf: np.ndarray) -> np.ndarray:
+    """Decode strings encoded by `_strings_to_arrays()`."""
+    strings = bytes(buf).decode("utf-8").split("\x00")
+    # N.B., missing values have code -1, which selects the last element.
+    uniques = np.empty(len(strings) + 1, dtype=object)
+    uniques[:-1] = strings
+    uniques[-1] = np.nan
+    return uniques[codes]
+
+
+def _gff3_to_arrays(df: pd.DataFrame, table: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Convert GFF3 features (without the attributes column) and a long table
+    of attributes into arrays, suitable for storing in the results cache."""
+    results: Dict[str, np.ndarray] = dict()
+    for c in gff3_cols[:-1]:
+        x = df[c].to_numpy()
+        if x.dtype == object:
+            results[f"{c}_codes"], results[f"{c}_strings"] = _strings_to_arrays(x)
+        else:
+            results[c] = x
+    results["attribute_row"] = table["row"].to_numpy()
+    key_codes, key_strings = _strings_to_arrays(table["key"].astype(object))
+    results["attribute_key_codes"] = key_codes
+    results["attribute_key_strings"] = key_strings
+    values = table["value"].to_numpy()
+    loc_flag = np.array([v is True for v in values], dtype=bool)
+    values = np.where(loc_flag, "", values)
+    value_codes, value_strings = _strings_to_arrays(values)
+    results["attribute_value_codes"] = value_codes
+    results["attribute_value_strings"] = value_strings
+    results["attribute_flag"] = loc_flag
+    return results
+
+
+def _arrays_to_gff3(
+    results: Mapping[str, np.ndarray],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Convert arrays created by `_gff3_to_arrays()` back into GFF3 features
+    and a long table of attributes."""
+    data = dict()
+    for c in gff3_cols[:-1]:
+        if c in results:
+            data[c] = results[c]
+        else:
+            data[c] = _arrays_to_strings(results[f"{c}_codes"], results[f"{c}_strings"])
+    df = pd.DataFrame(data)
+    values = _arrays_to_strings(
+        results["attribute_value_codes"], results["attribute_value_strings"]
+    )
+    values[results["attribute_flag"]] = True
+    table = pd.DataFrame(
+        {
+            "row": results["attribute_row"],
+            "key": pd.Categorical(
+                _arrays_to_strings(
+                    results["attribute_key_codes"], results["attribute_key_strings"]
+                )
+            ),
+            "value": values,
+        }
+    )
+    return df, table
+
+
+class _GenomeFeaturesIndex:
+    """Index of genome features supporting fast lookup of the features
+    overlapping a genome region, the features with a given ID, and the children
+    of a given parent feature.
+
+    Features are sorted by contig and start position, so that the features for
+    each contig form a contiguous partition. Within each partition a running
+    maximum of end positions is also sorted, so the features overlapping an
+    interval can be located by binary search. Children are located via a
+    compressed sparse row (CSR) index from parent ID to feature rows."""
+
+    def __init__(self, df: pd.DataFrame):
+        # N.B., sorting on multiple columns is stable, so features with the same
+        # start position stay in the order they appear in the GFF.
+        order = np.lexsort((df["start"].to_numpy(), df["contig"].to_numpy()))
+        self.df = df.iloc[order].reset_index(drop=True)
+        self._starts = self.df["start"].to_numpy()
+        self._ends = self.df["end"].to_numpy()
+
+        # Locate the partition for each contig.
+        contigs = self.df["contig"].to_numpy()
+        bounds = np.concatenate(
+            [[0], np.flatnonzero(contigs[1:] != contigs[:-1]) + 1, [len(contigs)]]
+        )
+        self._partitions: Dict[str, Tuple[int, int]] = dict()
+        self._max_ends = np.empty_like(self._ends)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop > start:
+                self._partitions[contigs[start]] = (start, stop)
+                np.maximum.accumulate(
+                    self._ends[start:stop], out=self._max_ends[start:stop]
+                )
+
+        # Index feature IDs.
+        self._ids: Optional[pd.Index] = None
+        if "ID" in self.df.columns:
+            self._ids = pd.Index(self.df["ID"])
+
+        # Index children by parent ID. Features may have multiple parents.
+        # See also https://github.com/malariagen/malariagen-data-python/issues/334
+        self._parents: Optional[pd.Index] = None
+        if "Parent" in self.df.columns:
+            parents = self.df["Parent"].str.split(",").explode().dropna()
+            codes, uniques = pd.factorize(parents)
+            rows = parents.index.to_numpy()
+            # Keep children of each parent in the order they appear in the GFF.
+            loc_sort = np.lexsort((order[rows], codes))
+            self._child_rows = rows[loc_sort]
+            self._child_indptr = np.concatenate(
+                [[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))]
+            )
+            self._parents = pd.Index(uniques)
+
+    def locate_overlapping(
+        self, contig: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> np.ndarray:
+        """Locate rows of features on the given contig overlapping the interval
+        from `start` to `end` inclusive, in order of start position."""
+        try:
+            lo, hi = self._partitions[contig]
+        except KeyError:
+            return np.array([], dtype=np.intp)
+        if end is not None:
+            hi = lo + int(np.searchsorted(self._starts[lo:hi], end, side="right"))
+        if start is None:
+            return np.arange(lo, hi)
+        lo += int(np.searchsorted(self._max_ends[lo:hi], start, side="left"))
+        return lo + np.flatnonzero(self._ends[lo:hi] >= start)
+
+    def locate_id(self, feature_id: str) -> np.ndarray:
+        """Locate rows of features with the given ID."""
+        if self._ids is None:
+            raise ValueError("Feature IDs are not indexed.")
+        loc = self._ids.get_indexer_for([feature_id])
+        return loc[loc >= 0]
+
+    def locate_children(self, parent: str) -> np.ndarray:
+        """Locate rows of features which are children of the given parent."""
+        if self._parents is None:
+            raise ValueError("Feature parents are not indexed.")
+        code = self._parents.get_indexer([parent])[0]
+        if code < 0:
+            return np.array([], dtype=np.intp)
+        return self._child_rows[self._child_indptr[code] : self._child_indptr[code + 1]]
+
+
 class SafeStore(BaseStore):
     """This class wraps any zarr store and ensures that missing chunks
     will not get automatically filled but will raise an exception. There
@@ -281,7 +569,7 @@ def _da_from_zarr(
     return d
 
 
-def _dask_compress_dataset(ds, indexer, dim):
+def _dask_compress_dataset(ds, indexer, dim, empty_chunks="drop"):
     """Temporary workaround for memory issues when attempting to
     index a xarray dataset with a Boolean array.
 
@@ -292,6 +580,9 @@ def _dask_compress_dataset(ds, indexer, dim):
     ds : xarray.Dataset
     indexer : str
     dim : str
+    empty_chunks : {"rechunk", "drop"}
+        How to deal with chunks which are empty after compressing, see
+        `_da_compress()`.
 
     Returns
     -------
@@ -314,16 +605,24 @@ def _dask_compress_dataset(ds, indexer, dim):
         assert isinstance(indexer, np.ndarray)
         indexer_computed = indexer
 
+    # N.B., variables usually share the same chunks, so share the chunked
+    # indexer and new chunk sizes between variables.
+    plan_cache: Dict = dict()
+
     coords = dict()
     for k in ds.coords:
         a = ds[k]
-        v = _dask_compress_dataarray(a, indexer, indexer_computed, dim)
+        v = _dask_compress_dataarray(
+            a, indexer, indexer_computed, dim, empty_chunks, plan_cache
+        )
         coords[k] = (a.dims, v)
 
     data_vars = dict()
     for k in ds.data_vars:
         a = ds[k]
-        v = _dask_compress_dataarray(a, indexer, indexer_computed, dim)
+        v = _dask_compress_dataarray(
+            a, indexer, indexer_computed, dim, empty_chunks, plan_cache
+        )
         data_vars[k] = (a.dims, v)
 
     attrs = ds.attrs.copy()
@@ -331,7 +630,9 @@ def _dask_compress_dataset(ds, indexer, dim):
     return xr.Dataset(data_vars=data_vars, coords=coords, attrs=attrs)
 
 
-def _dask_compress_dataarray(a, indexer, indexer_computed, dim):
+def _dask_compress_dataarray(
+    a, indexer, indexer_computed, dim, empty_chunks="drop", plan_cache=None
+):
     try:
         # find the axis for the given dimension
         axis = a.dims.index(dim)
@@ -349,6 +650,8 @@ def _dask_compress_dataarray(a, indexer, indexer_computed, dim):
                 data=a.data,
                 axis=axis,
                 indexer_computed=indexer_computed,
+                empty_chunks=empty_chunks,
+                plan_cache=plan_cache,
             )
         else:
             v = np.compress(indexer_computed, data, axis=axis)
@@ -356,72 +659,119 @@ def _dask_compress_dataarray(a, indexer, indexer_computed, dim):
     return v
 
 
+def _compress_chunk_sizes(
+    indexer_computed: np.ndarray, chunks: Tuple[int, ...]
+) -> Tuple[int, ...]:
+    """Compute the size of each chunk after compressing an array with the
+    given chunks along one axis, using a vectorised sum over chunks."""
+    chunk_sizes = np.asarray(chunks, dtype=np.int64)
+    chunk_starts = np.cumsum(chunk_sizes) - chunk_sizes
+    new_sizes = np.zeros(len(chunk_sizes), dtype=np.int64)
+    # N.B., np.add.reduceat() gives the value at the index for zero-length
+    # chunks, and requires indices within bounds, so skip these.
+    loc_nonempty = chunk_sizes > 0
+    if np.any(loc_nonempty):
+        new_sizes[loc_nonempty] = np.add.reduceat(
+            indexer_computed, chunk_starts[loc_nonempty], dtype=np.int64
+        )
+    return tuple(new_sizes.tolist())
+
+
 def _da_compress(
     indexer: da.Array | np.ndarray,
     data: da.Array,
     axis: int,
     indexer_computed: Optional[np.ndarray] = None,
+    empty_chunks: str = "drop",
+    plan_cache: Optional[Dict] = None,
 ):
-    """Wrapper for dask.array.compress() which computes chunk sizes faster."""
+    """Wrapper for dask.array.compress() which computes chunk sizes faster.
+
+    Chunks which are empty after compressing break some reductions, and so
+    are removed. If `empty_chunks` is "rechunk", every input block is
+    compressed and the output is then rechunked to remove empty chunks. If
+    `empty_chunks` is "drop", input blocks which would be empty after
+    compressing are dropped before compressing, which avoids creating tasks
+    for them. Both give the same output values and chunks.
+
+    If given, `plan_cache` is a dict used to share the chunked indexer and
+    the new chunk sizes when compressing multiple arrays with the same
+    indexer, e.g., variables in a dataset.
+    """
 
     # Sanity checks.
     assert indexer.ndim == 1
     assert indexer.dtype == bool
     assert indexer.shape[0] == data.shape[axis]
+    assert empty_chunks in {"rechunk", "drop"}
 
     # Useful variables.
     old_chunks = data.chunks
     axis_old_chunks = old_chunks[axis]
 
-    # Load the indexer temporarily for chunk size computations.
-    if indexer_computed is None:
-        assert isinstance(indexer, da.Array)
-        indexer_computed = indexer.compute()
+    if plan_cache is not None and axis_old_chunks in plan_cache:
+        indexer, axis_new_chunks = plan_cache[axis_old_chunks]
 
-    # Ensure indexer and data are chunked in the same way.
-    if isinstance(indexer, da.Array):
-        indexer = indexer.rechunk((axis_old_chunks,))
     else:
-        indexer = da.from_array(indexer, chunks=(axis_old_chunks,))
+        # Load the indexer temporarily for chunk size computations.
+        if indexer_computed is None:
+            if isinstance(indexer, da.Array):
+                indexer_computed = indexer.compute()
+            else:
+                indexer_computed = np.asarray(indexer)
+
+        # Ensure indexer and data are chunked in the same way.
+        if isinstance(indexer, da.Array):
+            indexer = indexer.rechunk((axis_old_chunks,))
+        else:
+            indexer = da.from_array(indexer, chunks=(axis_old_chunks,))
+
+        # Need to compute chunks sizes in order to know dimension sizes;
+        # would normally do v.compute_chunk_sizes() but that is slow for
+        # multidimensional arrays, so hack something more efficient.
+        axis_new_chunks = _compress_chunk_sizes(indexer_computed, axis_old_chunks)
+
+        if plan_cache is not None:
+            plan_cache[axis_old_chunks] = indexer, axis_new_chunks
+
+    # Deal with empty chunks, they break reductions.
+    # Possibly related to https://github.com/dask/dask/issues/10327
+    # and https://github.com/dask/dask/issues/2794
+    loc_nonzero = [i for i, x in enumerate(axis_new_chunks) if x > 0]
+    if empty_chunks == "drop" and 0 < len(loc_nonzero) < len(axis_new_chunks):
+        # Select only the input blocks which retain at least one element,
+        # before compressing, so no tasks are created for empty blocks.
+        data = data.blocks[
+            tuple([loc_nonzero if i == axis else slice(None) for i in range(data.ndim)])
+        ]
+        assert isinstance(indexer, da.Array)
+        indexer = indexer.blocks[loc_nonzero]
+        axis_new_chunks = tuple([axis_new_chunks[i] for i in loc_nonzero])
+        old_chunks = data.chunks
 
     # Apply the indexing operation.
     v = da.compress(indexer, data, axis=axis)
-
-    # Need to compute chunks sizes in order to know dimension sizes;
-    # would normally do v.compute_chunk_sizes() but that is slow for
-    # multidimensional arrays, so hack something more efficient.
-    axis_new_chunks_list = []
-    slice_start = 0
-    need_rechunk = False
-    for old_chunk_size in axis_old_chunks:
-        slice_stop = slice_start + old_chunk_size
-        new_chunk_size = int(np.sum(indexer_computed[slice_start:slice_stop]))
-        if new_chunk_size == 0:
-            need_rechunk = True
-        axis_new_chunks_list.append(new_chunk_size)
-        slice_start = slice_stop
-    axis_new_chunks = tuple(axis_new_chunks_list)
     new_chunks = tuple(
         [axis_new_chunks if i == axis else c for i, c in enumerate(old_chunks)]
     )
     v._chunks = new_chunks
 
-    # Deal with empty chunks, they break reductions.
-    # Possibly related to https://github.com/dask/dask/issues/10327
-    # and https://github.com/dask/dask/issues/2794
-    if need_rechunk:
-        axis_new_chunks_nonzero = tuple([x for x in axis_new_chunks if x > 0])
+    if 0 in axis_new_chunks:
         # Edge case, all chunks empty:
-        if len(axis_new_chunks_nonzero) == 0:
+        if len(loc_nonzero) == 0:
             # Not much we can do about this, no data.
-            axis_new_chunks_nonzero = (0,)
-        new_chunks_nonzero = tuple(
-            [
-                axis_new_chunks_nonzero if i == axis else c
-                for i, c in enumerate(new_chunks)
-            ]
-        )
-        v = v.rechunk(new_chunks_nonzero)
+            v = v.rechunk(
+                tuple([(0,) if i == axis else c for i, c in enumerate(new_chunks)])
+            )
+        else:
+            axis_new_chunks_nonzero = tuple([axis_new_chunks[i] for i in loc_nonzero])
+            new_chunks_nonzero = tuple(
+                [
+                    axis_new_chunks_nonzero if i == axis else c
+                    for i, c in enumerate(new_chunks)
+                ]
+            )
+            v = v.rechunk(new_chunks_nonzero)
 
     return v
 
@@ -593,7 +943,15 @@ def _prep_geneset_attributes_arg(attributes):
 
 
 def _handle_region_feature(resource, region):
-    if hasattr(resource, "genome_features"):
+    if hasattr(resource, "_genome_features_index"):
+        # Look up the feature ID via the index, avoiding a scan of all features.
+        index = resource._genome_features_index(attributes=("ID",))
+        loc = index.locate_id(region)
+        if len(loc) > 0:
+            # the region is a feature ID
+            feature = index.df.iloc[loc[0]]
+            return Region(feature.contig, int(feature.start), int(feature.end))
+    elif hasattr(resource, "genome_features"):
         gene_annotation = resource.genome_features(attributes=["ID"])
         results = gene_annotation.query(f"ID == '{region}'")
         if not results.empty:
@@ -1185,22 +1543,286 @@ def _true_runs(a):
     return np.array(starts, dtype=np.int64), np.array(stops, dtype=np.int64)
 
 
+@numba.njit(nogil=True)
+def _count_alleles_cohorts(gt, loc_variants, loc_samples, cohort_bounds, max_allele):
+    """Count alleles for multiple cohorts for a subset of variants within a
+    block of genotype calls with shape (n_variants, n_samples, ploidy). Samples
+    for cohort `c` are given by `loc_samples[cohort_bounds[c]:cohort_bounds[c +
+    1]]`. Missing calls and alleles greater than `max_allele` are not counted.
+    Releases the GIL, so blocks can be processed concurrently by multiple
+    threads."""
+    n_cohorts = cohort_bounds.shape[0] - 1
+    n_alleles = max_allele + 1
+    ploidy = gt.shape[2]
+    ac = np.zeros((n_cohorts, loc_variants.shape[0], n_alleles), dtype=np.int32)
+    for c in range(n_cohorts):
+        for i in range(loc_variants.shape[0]):
+            v = loc_variants[i]
+            for j in range(cohort_bounds[c], cohort_bounds[c + 1]):
+                s = loc_samples[j]
+                for k in range(ploidy):
+                    a = gt[v, s, k]
+                    if 0 <= a <= max_allele:
+                        ac[c, i, a] += 1
+    return ac
+
+
+def _genotype_chunk_tasks(
+    *,
+    gt_z: zarr.core.Array,
+    loc_variants: np.ndarray,
+    loc_samples: List[np.ndarray],
+    out_offset: int,
+) -> Iterator[Tuple]:
+    """Generate tasks for counting alleles in each native chunk of a zarr array
+    of genotype calls which contains any of the selected variants and samples.
+    Variants are given as sorted indices, and variants outside the bounds of
+    the array are ignored. Samples are given as sorted indices for each cohort.
+    Each task is a tuple of (zarr array, selection, variant indices within the
+    selection, sample indices within the selection, cohort bounds, output
+    row), see also `_count_alleles_cohorts()`."""
+    chunk_variants, chunk_samples = gt_z.chunks[:2]
+
+    # Only consider variants within the bounds of this array.
+    i_start = np.searchsorted(loc_variants, 0)
+    i_stop = np.searchsorted(loc_variants, gt_z.shape[0])
+    loc_samples_union = np.unique(np.concatenate(loc_samples))
+    if i_stop <= i_start or loc_samples_union.size == 0:
+        return
+
+    # Group selected samples by chunk, locating samples for each cohort
+    # relative to the start of the selection within the chunk.
+    sample_chunks = []
+    sample_chunk_index = loc_samples_union // chunk_samples
+    for m in np.unique(sample_chunk_index):
+        loc_in_chunk = loc_samples_union[sample_chunk_index == m]
+        s_lo, s_hi = loc_in_chunk[0], loc_in_chunk[-1] + 1
+        loc_s = [loc[(loc >= s_lo) & (loc < s_hi)] - s_lo for loc in loc_samples]
+        cohort_bounds = np.cumsum([0] + [loc.size for loc in loc_s])
+        sample_chunks.append((slice(s_lo, s_hi), np.concatenate(loc_s), cohort_bounds))
+
+    # Group selected variants by chunk.
+    _, v_starts = np.unique(
+        loc_variants[i_start:i_stop] // chunk_variants, return_index=True
+    )
+    v_bounds = np.append(v_starts + i_start, i_stop)
+
+    for a, b in zip(v_bounds[:-1], v_bounds[1:]):
+        loc_v = loc_variants[a:b]
+        v_lo = loc_v[0]
+        v_slice = slice(v_lo, loc_v[-1] + 1)
+        for s_slice, loc_s, cohort_bounds in sample_chunks:
+            yield (
+                gt_z,
+                (v_slice, s_slice),
+                loc_v - v_lo,
+                loc_s,
+                cohort_bounds,
+                out_offset + a,
+            )
+
+
+def _threaded_map(
+    func: Callable, tasks: Iterable, max_workers: Optional[int] = None
+) -> Iterator:
+    """Apply a function to tasks using a pool of threads, yielding results
+    in order. Tasks are consumed lazily and only a bounded number of results
+    are pending at any time, so memory usage stays bounded even for a very
+    large number of tasks."""
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    max_pending = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: deque = deque()
+        for task in tasks:
+            pending.append(executor.submit(func, task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Approximate amount of data for a tile of pairwise comparisons which should
+# fit in the CPU cache.
+_PDIST_TILE_NBYTES = 2**19
+
+
+def _pdist_tiles(n_obs, row_nbytes, row_start=0, row_stop=None):
+    """Split the upper triangle of a pairwise distance matrix into square tiles,
+    sized such that the rows for a tile fit in the CPU cache. Returns the tile
+    size and an array of the first row index of each tile along both axes.
+    Tiles may be restricted to a range of rows of the distance matrix."""
+    tile_size = _PDIST_TILE_NBYTES // (2 * max(row_nbytes, 1))
+    tile_size = int(min(max(tile_size, 8), 256))
+    if row_stop is None:
+        row_stop = n_obs
+    tiles = [
+        (i_start, j_start)
+        for i_start in range(row_start, row_stop, tile_size)
+        for j_start in range(i_start, n_obs, tile_size)
+    ]
+    return tile_size, np.array(tiles, dtype=np.int64).reshape((-1, 2))
+
+
+# Maximum number of pairwise distances to compute at a time when writing to
+# an array which is not held in memory, e.g., a zarr array.
+_PDIST_BLOCK_NPAIRS = 2**24
+
+
+def _condensed_offset(i, n):
+    """Index within a condensed distance matrix of the first pair in row i."""
+    return n * i - i * (i + 1) // 2
+
+
+def _pdist_row_blocks(n_obs, max_pairs):
+    """Split the rows of a pairwise distance matrix into blocks of consecutive
+    rows with roughly `max_pairs` pairs each. Each block of rows corresponds to
+    a contiguous slice of the condensed distance matrix."""
+    row_start = 0
+    while row_start < n_obs - 1:
+        row_stop = row_start + 1
+        n_pairs = n_obs - 1 - row_start
+        while row_stop < n_obs - 1 and n_pairs + n_obs - 1 - row_stop <= max_pairs:
+            n_pairs += n_obs - 1 - row_stop
+            row_stop += 1
+        yield row_start, row_stop
+        row_start = row_stop
+
+
+def _pdist_condensed(compute, n_obs, dtype, out=None):
+    """Compute a condensed pairwise distance matrix.
+
+    The `compute` function is called with a range of rows of the distance
+    matrix and an array to store the condensed distances for those rows. If
+    `out` is not given, a new array is allocated. If `out` is a numpy array,
+    including a memory-mapped array, distances are written into it directly.
+    Otherwise, e.g., for a zarr array, distances are computed in blocks of
+    rows, so that the whole matrix is never held in memory."""
+    n_pairs = (n_obs * (n_obs - 1)) // 2
+    if out is None:
+        out = np.zeros(n_pairs, dtype=dtype)
+    if out.shape != (n_pairs,):
+        raise ValueError(f"Output array has shape {out.shape}, expected ({n_pairs},).")
+    if isinstance(out, np.ndarray):
+        compute(0, n_obs, out)
+    else:
+        for row_start, row_stop in _pdist_row_blocks(n_obs, _PDIST_BLOCK_NPAIRS):
+            k_start = _condensed_offset(row_start, n_obs)
+            k_stop = _condensed_offset(row_stop, n_obs)
+            block = np.zeros(k_stop - k_start, dtype=out.dtype)
+            compute(row_start, row_stop, block)
+            out[k_start:k_stop] = block
+    return out
+
+
+def _open_condensed_distances(path, n_obs, dtype):
+    """Create an array on disk to store a condensed pairwise distance matrix.
+    If the path ends with ".zarr" a zarr array is created, otherwise a numpy
+    memory-mapped array is created in ".npy" format."""
+    n_pairs = (n_obs * (n_obs - 1)) // 2
+    if str(path).rstrip("/").endswith(".zarr"):
+        return zarr.open_array(
+            str(path),
+            mode="w",
+            shape=(n_pairs,),
+            dtype=dtype,
+            chunks=(min(max(n_pairs, 1), _PDIST_BLOCK_NPAIRS),),
+        )
+    return np.lib.format.open_memmap(
+        str(path), mode="w+", dtype=dtype, shape=(n_pairs,)
+    )
+
+
+def _copy_condensed_distances(src, dst):
+    """Copy a condensed distance matrix into another array, e.g., one created
+    by _open_condensed_distances(), in blocks, so only one block of the source
+    array is loaded into memory at a time."""
+    n_pairs = src.shape[0]
+    for start in range(0, n_pairs, _PDIST_BLOCK_NPAIRS):
+        stop = min(start + _PDIST_BLOCK_NPAIRS, n_pairs)
+        dst[start:stop] = src[start:stop]
+    return dst
+
+
+@numba.njit(nogil=True)
+def _popcount64(x):
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + (
+        (x >> np.uint64(2)) & np.uint64(0x3333333333333333)
+    )
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def _pack_bits(X):
+    """Pack rows of an array of zeros and ones into 64-bit words."""
+    packed = np.packbits(X.astype(bool), axis=1)
+    n_words = -(-packed.shape[1] // 8)
+    out = np.zeros((X.shape[0], n_words * 8), dtype=np.uint8)
+    out[:, : packed.shape[1]] = packed
+    return out.view(np.uint64)
+
+
+@numba.njit(parallel=True)
+def _pdist_packed_hamming(P, tiles, tile_size, row_stop, k_offset, out):
+    n_obs = P.shape[0]
+    n_words = P.shape[1]
+    for t in numba.prange(tiles.shape[0]):
+        i_start = tiles[t, 0]
+        j_start = tiles[t, 1]
+        for i in range(i_start, min(i_start + tile_size, row_stop)):
+            x = P[i]
+            for j in range(max(i + 1, j_start), min(j_start + tile_size, n_obs)):
+                y = P[j]
+                d = np.uint64(0)
+                for k in range(n_words):
+                    d += _popcount64(x[k] ^ y[k])
+                out[_square_to_condensed(i, j, n_obs) - k_offset] = d
+
+
 @numba.njit(parallel=True)
-def _pdist_abs_hamming(X):
+def _pdist_tiled_hamming(X, tiles, tile_size, row_stop, k_offset, out):
     n_obs = X.shape[0]
     n_ftr = X.shape[1]
-    out = np.zeros((n_obs, n_obs), dtype=np.int32)
-    for i in range(n_obs):
-        x = X[i]
-        for j in numba.prange(i + 1, n_obs):
-            y = X[j]
-            d = 0
-            for k in range(n_ftr):
-                if x[k] != y[k]:
-                    d += 1
-            out[i, j] = d
-            out[j, i] = d
-    return out
+    for t in numba.prange(tiles.shape[0]):
+        i_start = tiles[t, 0]
+        j_start = tiles[t, 1]
+        for i in range(i_start, min(i_start + tile_size, row_stop)):
+            x = X[i]
+            for j in range(max(i + 1, j_start), min(j_start + tile_size, n_obs)):
+                y = X[j]
+                d = 0
+                for k in range(n_ftr):
+                    if x[k] != y[k]:
+                        d += 1
+                out[_square_to_condensed(i, j, n_obs) - k_offset] = d
+
+
+def _pdist_abs_hamming(X, out=None):
+    """Compute the number of differences between all pairs of rows in X,
+    returned as a condensed distance matrix. If X only contains zeros and
+    ones, e.g., haplotypes at biallelic sites, rows are bit-packed so that
+    differences can be counted for 64 features at a time. Distances are
+    written into `out` if given, see also `_pdist_condensed()`."""
+    n_obs = X.shape[0]
+    if np.all((X == 0) | (X == 1)):
+        X = _pack_bits(X)
+        kernel = _pdist_packed_hamming
+    else:
+        kernel = _pdist_tiled_hamming
+
+    def compute(row_start, row_stop, block):
+        tile_size, tiles = _pdist_tiles(n_obs, X[:1].nbytes, row_start, row_stop)
+        kernel(
+            X,
+            tiles,
+            tile_size,
+            row_stop,
+            _condensed_offset(row_start, n_obs),
+            block,
+        )
+
+    return _pdist_condensed(compute, n_obs, dtype=np.int32, out=out)
 
 
 @numba.njit
@@ -1213,7 +1835,6 @@ def _square_to_condensed(i, j, n):
     return n * j - j * (j + 1) // 2 + i - 1 - j
 
 
-@numba.njit(parallel=True)
 def _multiallelic_diplotype_pdist(X, metric):
     """Optimised implementation of pairwise distance between diplotypes.
 
@@ -1226,28 +1847,131 @@ def _multiallelic_diplotype_pdist(X, metric):
     diplotypes. This can be a numba jitted function.
 
     """
+    # Allele counts for a diploid sample fit in 8 bits.
+    X = np.ascontiguousarray(X, dtype=np.int8)
+    tile_size, tiles = _pdist_tiles(X.shape[0], X[:1].nbytes)
+    return _multiallelic_diplotype_pdist_tiled(X, metric, tiles, tile_size)
+
+
+@numba.njit(parallel=True)
+def _multiallelic_diplotype_pdist_tiled(X, metric, tiles, tile_size):
     n_samples = X.shape[0]
     n_pairs = (n_samples * (n_samples - 1)) // 2
     out = np.zeros(n_pairs, dtype=np.float32)
 
-    # Loop over samples, first in pair.
-    for i in range(n_samples):
-        x = X[i, :, :]
+    # Loop over tiles of pairs of samples in parallel. Each tile covers a block
+    # of rows and a block of columns of the upper triangle of the distance
+    # matrix, so that diplotypes are reused while in the CPU cache.
+    for t in numba.prange(tiles.shape[0]):
+        i_start = tiles[t, 0]
+        j_start = tiles[t, 1]
+        for i in range(i_start, min(i_start + tile_size, n_samples)):
+            x = X[i, :, :]
+            for j in range(max(i + 1, j_start), min(j_start + tile_size, n_samples)):
+                y = X[j, :, :]
 
-        # Loop over observations again, second in pair.
-        for j in numba.prange(i + 1, n_samples):
-            y = X[j, :, :]
+                # Compute distance for the current pair.
+                d = metric(x, y)
 
-            # Compute distance for the current pair.
-            d = metric(x, y)
+                # Store result for the current pair.
+                k = _square_to_condensed(i, j, n_samples)
+                out[k] = d
 
-            # Store result for the current pair.
-            k = _square_to_condensed(i, j, n_samples)
-            out[k] = d
+    return out
+
+
+@numba.njit(parallel=True)
+def _multiallelic_diplotype_pdist_int(
+    X, is_called, site_norm, squared, tiles, tile_size
+):
+    n_samples = X.shape[0]
+    n_features = X.shape[1]
+    n_sites = is_called.shape[1]
+    n_pairs = (n_samples * (n_samples - 1)) // 2
+    out = np.zeros(n_pairs, dtype=np.float32)
+
+    # Total distance from an uncalled genotype, for each sample.
+    total_norm = np.zeros(n_samples, dtype=np.int64)
+    for i in range(n_samples):
+        for k in range(n_sites):
+            total_norm[i] += site_norm[i, k]
+
+    for t in numba.prange(tiles.shape[0]):
+        i_start = tiles[t, 0]
+        j_start = tiles[t, 1]
+        for i in range(i_start, min(i_start + tile_size, n_samples)):
+            x, cx, nx = X[i], is_called[i], site_norm[i]
+            for j in range(max(i + 1, j_start), min(j_start + tile_size, n_samples)):
+                y, cy, ny = X[j], is_called[j], site_norm[j]
+
+                # Distance over all sites.
+                distance = 0
+                if squared:
+                    for k in range(n_features):
+                        z = np.int32(x[k]) - np.int32(y[k])
+                        distance += z * z
+                else:
+                    for k in range(n_features):
+                        distance += abs(np.int32(x[k]) - np.int32(y[k]))
+
+                # Remove the distance at sites where only one sample has a
+                # called genotype. N.B., allele counts for an uncalled genotype
+                # are all zero, so the distance at these sites is the norm of
+                # the called genotype.
+                n_sites_called = 0
+                x_both_called = 0
+                y_both_called = 0
+                for k in range(n_sites):
+                    n_sites_called += np.int32(cx[k]) * np.int32(cy[k])
+                    x_both_called += np.int32(cy[k]) * np.int32(nx[k])
+                    y_both_called += np.int32(cx[k]) * np.int32(ny[k])
+                distance -= total_norm[i] - x_both_called
+                distance -= total_norm[j] - y_both_called
+
+                k = _square_to_condensed(i, j, n_samples)
+                if n_sites_called > 0:
+                    out[k] = np.float32(distance) / np.float32(n_sites_called)
+                else:
+                    out[k] = np.nan
 
     return out
 
 
+def _multiallelic_diplotype_pairwise_distances(X, metric):
+    """Compute the mean cityblock or mean squared euclidean distance between
+    all pairs of diplotypes, given as genotype allele counts with axes in the
+    order (n_samples, n_sites, n_alleles). Returns a condensed distance matrix.
+
+    N.B., the per-pair metric functions accumulate distances as 32-bit floats,
+    which is exact for sums of small integers up to 2**24. Within that limit,
+    distances are accumulated here as integers, which is much faster, giving
+    identical results."""
+    if metric == "cityblock":
+        squared, max_site_distance = False, 4
+        metric_func = _multiallelic_diplotype_mean_cityblock
+    elif metric == "sqeuclidean":
+        squared, max_site_distance = True, 8
+        metric_func = _multiallelic_diplotype_mean_sqeuclidean
+    else:
+        raise ValueError("Unsupported metric.")
+
+    X = np.ascontiguousarray(X, dtype=np.int8)
+    if X.shape[1] * max_site_distance >= 2**24 or np.any(X < 0) or np.any(X > 2):
+        return _multiallelic_diplotype_pdist(X, metric=metric_func)
+
+    is_called = np.any(X > 0, axis=2).astype(np.int8)
+    site_norm = np.sum(X * X if squared else X, axis=2, dtype=np.int8)
+    tile_size, tiles = _pdist_tiles(X.shape[0], X[:1].nbytes)
+    return _multiallelic_diplotype_pdist_int(
+        X.reshape((X.shape[0], -1)),
+        is_called,
+        site_norm,
+        squared,
+        tiles,
+        tile_size,
+    )
+
+
 @numba.njit
 def _multiallelic_diplotype_mean_cityblock(x, y):
     """Compute the mean cityblock distance between two diplotypes x and y. The
@@ -1484,6 +2208,96 @@ def _dask_apply_allele_mapping(v, mapping, max_allele):
     return out
 
 
+def _biallelic_snp_conditions(ac, *, n_haps, max_missing_an, min_minor_ac):
+    """Locate biallelic SNPs meeting conditions on missingness and minor allele
+    count, given allele counts for the two observed alleles, with shape
+    (n_variants, 2). Returns None if there are no conditions."""
+    if max_missing_an is None and min_minor_ac is None:
+        return None
+
+    loc_out = np.ones(ac.shape[0], dtype=bool)
+    an = ac.sum(axis=1)
+
+    # Apply missingness condition.
+    if max_missing_an is not None:
+        an_missing = n_haps - an
+        if isinstance(max_missing_an, float):
+            an_missing_frac = an_missing / an
+            loc_missing = an_missing_frac <= max_missing_an
+        else:
+            loc_missing = an_missing <= max_missing_an
+        loc_out &= loc_missing
+
+    # Apply minor allele count condition.
+    if min_minor_ac is not None:
+        ac_minor = ac.min(axis=1)
+        if isinstance(min_minor_ac, float):
+            ac_minor_frac = ac_minor / an
+            loc_minor = ac_minor_frac >= min_minor_ac
+        else:
+            loc_minor = ac_minor >= min_minor_ac
+        loc_out &= loc_minor
+
+    return loc_out
+
+
+def _thin_snps(n_variants, *, n_snps, thin_offset):
+    """Obtain a slice to thin SNPs to approximately meet a target number of
+    SNPs, or None if no thinning is needed. Raises ValueError if there are not
+    enough SNPs."""
+    if n_snps is None:
+        return None
+    if n_variants > (n_snps * 2):
+        thin_step = n_variants // n_snps
+        return slice(thin_offset, None, thin_step)
+    elif n_variants < n_snps:
+        raise ValueError("Not enough SNPs.")
+    return None
+
+
+def _locate_biallelic_snps(ac, *, n_haps, max_missing_an, min_minor_ac):
+    """Locate biallelic SNPs meeting conditions on missingness and minor allele
+    count, given allele counts with shape (n_variants, n_alleles). Returns the
+    indices of the selected SNPs, and the indices of the two observed alleles
+    at each selected SNP, which become the reference and alternate alleles."""
+    loc_bi = allel.AlleleCountsArray(ac).is_biallelic()
+    ac_bi = ac[loc_bi]
+    indices = np.nonzero(loc_bi)[0]
+    observed = ac_bi > 0
+
+    # N.B., the two observed alleles in order, equivalent to the mapping
+    # from `_trim_alleles()`.
+    alleles = np.zeros((indices.size, 2), dtype=np.int8)
+    alleles[:, 0] = np.argmax(observed, axis=1)
+    alleles[:, 1] = observed.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+
+    loc_out = _biallelic_snp_conditions(
+        np.take_along_axis(ac_bi, alleles.astype(np.intp), axis=1),
+        n_haps=n_haps,
+        max_missing_an=max_missing_an,
+        min_minor_ac=min_minor_ac,
+    )
+    if loc_out is not None:
+        indices = indices[loc_out]
+        alleles = alleles[loc_out]
+    return indices, alleles
+
+
+def _biallelic_genotype_counts(gt, alleles, *, ref=False):
+    """Count the number of alternate alleles in each genotype call at biallelic
+    SNPs, where `alleles` gives the indices of the reference and alternate
+    alleles. Missing calls are counted as zero, as for the `to_n_alt()` method
+    of scikit-allel genotype arrays. If `ref` is true, instead count the number
+    of reference alleles, with missing calls given as -127, as for the
+    `to_n_ref(fill=-127)` method."""
+    if ref:
+        gn = np.sum(gt == alleles[:, 0, np.newaxis, np.newaxis], axis=2, dtype=np.int8)
+        gn[np.any(gt < 0, axis=2)] = -127
+    else:
+        gn = np.sum(gt == alleles[:, 1, np.newaxis, np.newaxis], axis=2, dtype=np.int8)
+    return gn
+
+
 def _genotype_array_map_alleles(gt, mapping):
     # Transform genotype calls via an allele mapping.
     # N.B., scikit-allel does not handle empty blocks well, so we
@@ -1582,6 +2396,513 @@ def _haplotype_frequencies(h):
     return freqs, counts, nobs
 
 
+def _moving_window_bounds(n, size, start=0, stop=None, step=None):
+    """Compute the start and stop indices of moving windows over `n` items,
+    as an array of shape (n_windows, 2). Windows are the same as those
+    generated by `allel.index_windows()`."""
+    if stop is None:
+        stop = n
+    if step is None:
+        step = size
+    starts = np.arange(start, stop - size + 1, step, dtype=np.int64)
+    return np.column_stack([starts, starts + size])
+
+
+@numba.njit(nogil=True)
+def _prefix_hashes(x, boundaries, h):
+    # Compute the DJBX33A hash of each column of `x`, accumulated over rows
+    # and without the initial value, at each of the given row boundaries,
+    # which must be sorted. This is a single pass over the input array, and
+    # the hash of any window of rows can then be computed from the prefix
+    # hashes at the window start and stop, see _window_hashes() below. The
+    # running hashes `h` are updated in place, so that the hashes can be
+    # accumulated over consecutive blocks of rows.
+    m = x.shape[0]
+    n = x.shape[1]
+    n_boundaries = boundaries.shape[0]
+    out = np.empty((n_boundaries, n), dtype=np.int64)
+    b = 0
+    for i in range(m + 1):
+        while b < n_boundaries and boundaries[b] == i:
+            out[b] = h
+            b += 1
+        if i == m:
+            break
+        for j in range(n):
+            h[j] = h[j] * 33 + x[i, j]
+    return out
+
+
+@numba.njit(nogil=True)
+def _window_hashes(prefix, i, j, power):
+    # Compute the hash of each column within a window, identical to the
+    # value _hash_columns() would compute for the window, where `i` and `j`
+    # index the prefix hashes at the window start and stop, and `power` is
+    # 33 to the power of the window size. N.B., integer overflow wraps, so
+    # this is exact in modular arithmetic.
+    return 5381 * power + prefix[j] - prefix[i] * power
+
+
+@numba.njit(nogil=True)
+def _sorted_hash_counts(hashes):
+    # Count distinct hash values, returning counts in descending order.
+    h = np.sort(hashes)
+    counts = np.empty(h.shape[0], dtype=np.int64)
+    k = 0
+    c = 1
+    for i in range(1, h.shape[0]):
+        if h[i] == h[i - 1]:
+            c += 1
+        else:
+            counts[k] = c
+            k += 1
+            c = 1
+    if h.shape[0] > 0:
+        counts[k] = c
+        k += 1
+    return np.sort(counts[:k])[::-1]
+
+
+def _moving_garud_h_windows(prefix, loc_start, loc_stop, power, n_pooled):
+    n_windows = loc_start.shape[0]
+    n = prefix.shape[1]
+    out = np.empty(n_windows, dtype=np.float64)
+    for w in numba.prange(n_windows):
+        hashes = _window_hashes(prefix, loc_start[w], loc_stop[w], power)
+        counts = _sorted_hash_counts(hashes)
+        pooled = 0.0
+        rest = 0.0
+        for k in range(counts.shape[0]):
+            f = counts[k] / n
+            if k < n_pooled:
+                pooled += f
+            else:
+                rest += f**2
+        out[w] = pooled**2 + rest
+    return out
+
+
+# N.B., compile both a parallel version, for computing a single window size,
+# and a serial version which releases the GIL, for computing multiple window
+# sizes concurrently in a pool of threads. Launching parallel kernels from
+# multiple threads is not safe with all numba threading layers.
+_moving_garud_h_kernel = numba.njit(parallel=True)(_moving_garud_h_windows)
+_moving_garud_h_kernel_nogil = numba.njit(nogil=True)(_moving_garud_h_windows)
+
+
+@numba.njit(parallel=True)
+def _moving_h1x_kernel(prefix_a, prefix_b, loc_start, loc_stop, power):
+    n_windows = loc_start.shape[0]
+    na = prefix_a.shape[1]
+    nb = prefix_b.shape[1]
+    out = np.empty(n_windows, dtype=np.float64)
+    for w in numba.prange(n_windows):
+        ha = np.sort(_window_hashes(prefix_a, loc_start[w], loc_stop[w], power))
+        hb = np.sort(_window_hashes(prefix_b, loc_start[w], loc_stop[w], power))
+        # Merge sorted hashes, summing the product of frequencies of
+        # haplotypes found in both cohorts.
+        total = 0.0
+        i = 0
+        j = 0
+        while i < na and j < nb:
+            if ha[i] < hb[j]:
+                i += 1
+            elif ha[i] > hb[j]:
+                j += 1
+            else:
+                v = ha[i]
+                ca = 0
+                while i < na and ha[i] == v:
+                    ca += 1
+                    i += 1
+                cb = 0
+                while j < nb and hb[j] == v:
+                    cb += 1
+                    j += 1
+                total += (ca / na) * (cb / nb)
+        out[w] = total
+    return out
+
+
+def _hash_power(size):
+    # Compute 33 to the power of `size` as a wrapped 64-bit signed integer.
+    p = pow(33, int(size), 2**64)
+    return np.int64(p - 2**64 if p >= 2**63 else p)
+
+
+def _moving_hash_prefixes(x, windows):
+    """Compute prefix hashes of the columns of `x` at all boundaries of the
+    given sets of windows, in a single pass over `x`. Returns the prefix
+    hashes and, for each set of windows, the indices of the prefix hashes
+    at the start and stop of each window."""
+    x = np.ascontiguousarray(x)
+    boundaries = np.unique(
+        np.concatenate([np.zeros(0, dtype=np.int64)] + [w.ravel() for w in windows])
+    )
+    prefix = _prefix_hashes(x, boundaries, np.zeros(x.shape[1], dtype=np.int64))
+    locs = [
+        (
+            np.searchsorted(boundaries, w[:, 0]),
+            np.searchsorted(boundaries, w[:, 1]),
+        )
+        for w in windows
+    ]
+    return prefix, locs
+
+
+def _moving_garud_h(x, sizes, n_pooled, step=None, timings=None):
+    """Compute Garud's H statistic in moving windows of each of the given
+    sizes, in a single pass over the data, where the frequencies of the
+    `n_pooled` most common haplotypes are pooled, i.e., 1 for H1, 2 for H12
+    or 3 for G123. The input is an array of shape (n_variants, n_haplotypes),
+    and for diplotypes both alleles can be combined into a single int16 for
+    each genotype call. Windows are as for `allel.moving_statistic()` and
+    results match applying the statistic to each window. Returns a list of
+    arrays, one for each window size.
+
+    Prefix hashes are computed once for the boundaries of all windows and
+    shared between window sizes, which are then computed concurrently. If
+    `timings` is a dict, the time taken to compute each window size, in
+    seconds, is stored under the window size."""
+    windows = [
+        _moving_window_bounds(x.shape[0], size=size, step=step) for size in sizes
+    ]
+    prefix, locs = _moving_hash_prefixes(x, windows)
+
+    def compute(task, kernel=_moving_garud_h_kernel_nogil):
+        size, (loc_start, loc_stop) = task
+        before = time.time()
+        out = kernel(prefix, loc_start, loc_stop, _hash_power(size), n_pooled)
+        return out, time.time() - before
+
+    tasks = list(zip(sizes, locs))
+    if len(tasks) == 1:
+        # N.B., launch the parallel kernel from the calling thread.
+        computed = iter([compute(tasks[0], kernel=_moving_garud_h_kernel)])
+    else:
+        computed = _threaded_map(compute, tasks)
+
+    results = []
+    for size, (out, elapsed) in zip(sizes, computed):
+        if timings is not None:
+            timings[size] = elapsed
+        results.append(out)
+    return results
+
+
+class _MovingGarudHStream:
+    """Compute Garud's H statistic in moving windows over the rows of a
+    sequence of blocks, e.g., chunks of haplotypes read in order along a
+    contig, which are passed to `update()` one at a time. Only the running
+    hashes and the prefix hashes for windows in progress are held between
+    blocks, so memory usage is bounded by the block size rather than the
+    total number of rows. Results are identical to `_moving_garud_h()`
+    applied to the concatenated blocks."""
+
+    def __init__(self, size, n_pooled, step=None):
+        self._size = size
+        self._step = size if step is None else step
+        self._n_pooled = n_pooled
+        self._power = _hash_power(size)
+        self._h = None
+        self._prefixes: Dict[int, np.ndarray] = dict()
+        self._out: List[np.ndarray] = []
+        self._k_next = 0
+        self._offset = 0
+
+    def update(self, x):
+        size, step, offset = self._size, self._step, self._offset
+        x = np.ascontiguousarray(x)
+        if self._h is None:
+            self._h = np.zeros(x.shape[1], dtype=np.int64)
+        stop = offset + x.shape[0]
+
+        # Find window boundaries within this block.
+        k = np.arange(max(0, -(-(offset - size) // step)), -(-stop // step))
+        bounds = np.concatenate([k * step, k * step + size])
+        bounds = np.unique(bounds[(bounds >= offset) & (bounds < stop)])
+
+        prefix = _prefix_hashes(x, bounds - offset, self._h)
+        self._prefixes.update(zip(bounds.tolist(), prefix))
+        self._offset = stop
+        self._flush(stop - 1)
+
+    def result(self):
+        # Record the prefix hashes at the end of the final block.
+        if self._h is not None:
+            self._prefixes[self._offset] = self._h.copy()
+        self._flush(self._offset)
+        if not self._out:
+            return np.zeros(0, dtype=np.float64)
+        return np.concatenate(self._out)
+
+    def _flush(self, limit):
+        # Compute windows which stop at or before `limit`.
+        size, step = self._size, self._step
+        k_stop = (limit - size) // step + 1 if limit >= size else 0
+        if k_stop > self._k_next:
+            k = np.arange(self._k_next, k_stop, dtype=np.int64)
+            starts, stops = k * step, k * step + size
+            bounds = np.unique(np.concatenate([starts, stops]))
+            prefix = np.stack([self._prefixes[b] for b in bounds.tolist()])
+            self._out.append(
+                _moving_garud_h_kernel(
+                    prefix,
+                    np.searchsorted(bounds, starts),
+                    np.searchsorted(bounds, stops),
+                    self._power,
+                    self._n_pooled,
+                )
+            )
+            self._k_next = k_stop
+
+        # Discard prefix hashes which are no longer needed.
+        for b in [b for b in self._prefixes if b < self._k_next * step]:
+            del self._prefixes[b]
+
+
+def _moving_garud_h_stream(blocks, size, n_pooled, step=None):
+    """Compute Garud's H statistic in moving windows over the rows of an
+    iterable of blocks, see `_MovingGarudHStream`."""
+    stream = _MovingGarudHStream(size=size, n_pooled=n_pooled, step=step)
+    for x in blocks:
+        stream.update(x)
+    return stream.result()
+
+
+def _moving_joint_haplotype_frequency(ha, hb, size, start=0, stop=None, step=None):
+    """Compute the sum of joint haplotype frequencies between two cohorts
+    in moving windows, i.e., H1X. The input arrays have shape (n_variants,
+    n_haplotypes) with the same variants."""
+    assert ha.shape[0] == hb.shape[0]
+    windows = _moving_window_bounds(
+        ha.shape[0], size=size, start=start, stop=stop, step=step
+    )
+    prefix_a, ((loc_start, loc_stop),) = _moving_hash_prefixes(ha, [windows])
+    prefix_b, _ = _moving_hash_prefixes(hb, [windows])
+    return _moving_h1x_kernel(
+        prefix_a, prefix_b, loc_start, loc_stop, _hash_power(size)
+    )
+
+
+def _ehh_scan_segment(
+    scan, arrays, gaps, pos, *, start, stop, follows_gap, skip, max_gap, include_edges
+):
+    # Initially extend the segment backwards by the segment size, but not
+    # beyond max_gap base pairs.
+    offset = max(0, start - (stop - start))
+    if max_gap is not None and max_gap > 0:
+        offset = max(offset, int(np.searchsorted(pos, pos[start] - max_gap)))
+    offset = max(0, min(offset, start - 1))
+
+    values = None
+    end = stop
+    while True:
+        # N.B., values for a variant only depend on preceding variants, so
+        # only scan up to the last variant which is not yet exact.
+        x = scan(
+            [a[offset:end] for a in arrays],
+            gaps[offset : end - 1],
+            include_edges=include_edges if offset == 0 else False,
+        )
+        x = tuple(v[start - offset :] for v in x)
+        if values is None:
+            values = x
+        else:
+            for v, y in zip(values, x):
+                v[: end - start] = y
+        if offset == 0:
+            return values
+
+        # A NaN value is inexact if the scan may have reached the start of the
+        # extended segment, i.e., there is no large gap in between.
+        no_gap = follows_gap[start:end] <= offset
+        inexact = np.zeros(end - start, dtype=bool)
+        for v, k in zip(values, skip):
+            inexact |= np.isnan(v[: end - start]) & no_gap & ~k[start:end]
+        if not np.any(inexact):
+            return values
+
+        # Double the margin and try again.
+        end = start + int(np.nonzero(inexact)[0][-1]) + 1
+        offset = max(0, start - 2 * (start - offset))
+
+
+def _segmented_ehh_scan(
+    scan,
+    arrays,
+    gaps,
+    pos,
+    *,
+    segment_size,
+    max_gap,
+    include_edges,
+    skip,
+    use_threads,
+):
+    """Run a forward EHH scan, e.g., `allel.opt.stats.ihh01_scan`, over
+    segments of variants in parallel, giving identical results to a single
+    scan over all variants.
+
+    A forward scan computes values for each variant by integrating EHH back
+    towards the start of the data, until EHH decays below `min_ehh`. A value
+    computed within a segment is therefore exact if the scan stops before
+    reaching the start of the segment, which is the case if the value is not
+    NaN, or if the scan would have hit a gap larger than `max_gap` first. Each
+    segment is extended backwards by a margin, initially the segment size but
+    no more than `max_gap` base pairs, and the margin is doubled until all
+    values are exact. The
+    `skip` masks flag values which are NaN regardless, e.g., because of low
+    minor allele frequency."""
+    n_variants = len(pos)
+    if n_variants == 0:
+        return scan(arrays, gaps, include_edges=include_edges)
+
+    # For each variant, the index of the last variant following a gap larger
+    # than max_gap, at or before the variant.
+    follows_gap = np.full(n_variants, -1, dtype=np.int64)
+    loc_gap = np.nonzero(gaps < 0)[0] + 1
+    follows_gap[loc_gap] = loc_gap
+    follows_gap = np.maximum.accumulate(follows_gap)
+
+    def compute_segment(start):
+        return _ehh_scan_segment(
+            scan,
+            arrays,
+            gaps,
+            pos,
+            start=start,
+            stop=min(start + segment_size, n_variants),
+            follows_gap=follows_gap,
+            skip=skip,
+            max_gap=max_gap,
+            include_edges=include_edges,
+        )
+
+    starts = range(0, n_variants, segment_size)
+    if use_threads:
+        # N.B., the scans release the GIL, so threads avoid the cost of
+        # copying haplotypes to other processes.
+        results = list(_threaded_map(compute_segment, starts))
+    else:
+        results = list(map(compute_segment, starts))
+
+    return tuple(np.concatenate(v) for v in zip(*results))
+
+
+def _segmented_ehh_scans(scan, arrays, pos, skip, *, map_pos, gap_scale, **kwargs):
+    """Run forward and reverse EHH scans over segments of variants, returning
+    the sum of forward and reverse values for each variant."""
+    from allel.stats.selection import compute_ihh_gaps  # type: ignore
+
+    gaps = compute_ihh_gaps(pos, map_pos, gap_scale, kwargs["max_gap"], None)
+    fwd = _segmented_ehh_scan(scan, arrays, gaps, pos, skip=skip, **kwargs)
+    rev = _segmented_ehh_scan(
+        scan,
+        [a[::-1] for a in arrays],
+        gaps[::-1],
+        -pos[::-1],
+        skip=[k[::-1] for k in skip],
+        **kwargs,
+    )
+    return tuple(f + r[::-1] for f, r in zip(fwd, rev))
+
+
+def _segmented_ihs(
+    h,
+    pos,
+    *,
+    map_pos=None,
+    min_ehh=0.05,
+    min_maf=0.05,
+    include_edges=False,
+    gap_scale=20000,
+    max_gap=200000,
+    segment_size=10_000,
+    use_threads=True,
+):
+    """Compute the unstandardized iHS score for each variant, as
+    `allel.ihs()`, computing segments of variants in parallel."""
+    from allel.opt.stats import ihh01_scan  # type: ignore
+
+    h = np.ascontiguousarray(h, dtype="i1")
+    pos = np.asarray(pos)
+
+    def scan(arrays, gaps, include_edges):
+        return ihh01_scan(
+            arrays[0],
+            gaps,
+            min_maf=min_maf,
+            min_ehh=min_ehh,
+            include_edges=include_edges,
+        )
+
+    # Values which are NaN because of low minor allele frequency, or where
+    # there are fewer than two haplotypes carrying the allele.
+    ac0 = np.count_nonzero(h == 0, axis=1)
+    ac1 = np.count_nonzero(h == 1, axis=1)
+    low_maf = np.minimum(ac0, ac1) / h.shape[1] < min_maf
+    skip = [low_maf | (ac0 < 2), low_maf | (ac1 < 2)]
+
+    ihh0, ihh1 = _segmented_ehh_scans(
+        scan,
+        [h],
+        pos,
+        skip,
+        map_pos=map_pos,
+        gap_scale=gap_scale,
+        max_gap=max_gap,
+        include_edges=include_edges,
+        segment_size=segment_size,
+        use_threads=use_threads,
+    )
+    return np.log(ihh1 / ihh0)
+
+
+def _segmented_xpehh(
+    h1,
+    h2,
+    pos,
+    *,
+    map_pos=None,
+    min_ehh=0.05,
+    include_edges=False,
+    gap_scale=20000,
+    max_gap=200000,
+    segment_size=10_000,
+    use_threads=True,
+):
+    """Compute the unstandardized XP-EHH score for each variant, as
+    `allel.xpehh()`, computing segments of variants in parallel."""
+    from allel.opt.stats import ihh_scan  # type: ignore
+
+    h1 = np.ascontiguousarray(h1, dtype="i1")
+    h2 = np.ascontiguousarray(h2, dtype="i1")
+    pos = np.asarray(pos)
+
+    def scan(arrays, gaps, include_edges):
+        return tuple(
+            ihh_scan(h, gaps, min_ehh=min_ehh, include_edges=include_edges)
+            for h in arrays
+        )
+
+    skip = [np.zeros(len(pos), dtype=bool)] * 2
+
+    ihh1, ihh2 = _segmented_ehh_scans(
+        scan,
+        [h1, h2],
+        pos,
+        skip,
+        map_pos=map_pos,
+        gap_scale=gap_scale,
+        max_gap=max_gap,
+        include_edges=include_edges,
+        segment_size=segment_size,
+        use_threads=use_threads,
+    )
+    return np.log(ihh1 / ihh2)
+
+
 def _distributed_client():
     from distributed import get_client
 
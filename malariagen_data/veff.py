@@ -1,6 +1,8 @@
 import collections
 import operator
 
+import numpy as np
+
 from Bio.Seq import Seq  # type: ignore
 
 VariantEffect = collections.namedtuple(
@@ -58,19 +60,26 @@ class Annotator(object):
         # index features by parent ID
         self._idx_parent_id = self._genome_features_cache.set_index("Parent")
 
+        # cache transcript structures
+        self._transcript_cache = dict()
+
     def get_feature(self, feature_id):
         return self._idx_feature_id.loc[feature_id]
 
     def get_children(self, feature_id):
         return self._idx_parent_id.loc[feature_id]
 
-    def get_ref_seq(self, chrom, start, stop):
-        """Accepts 1-based coords."""
+    def get_contig_seq(self, chrom):
         try:
             seq = self._genome_cache[chrom]
         except KeyError:
             seq = self._genome[chrom][:]
             self._genome_cache[chrom] = seq
+        return seq
+
+    def get_ref_seq(self, chrom, start, stop):
+        """Accepts 1-based coords."""
+        seq = self.get_contig_seq(chrom)
         ref_seq = seq[start - 1 : stop]
         ref_seq = ref_seq.tobytes().decode()
         return ref_seq
@@ -89,14 +98,17 @@ class Annotator(object):
 
         return ref_start, ref_stop
 
-    def get_effects(self, transcript, variants, progress=None):
+    def get_transcript_model(self, transcript):
+        """Obtain the structure of a transcript, with coordinate arrays
+        precomputed for vectorised effect annotation."""
+        try:
+            return self._transcript_cache[transcript]
+        except KeyError:
+            pass
+
         children = self.get_children(transcript).sort_values("start")
         feature = self.get_feature(transcript)
 
-        # make sure all alleles are uppercase
-        variants.ref_allele = variants.ref_allele.str.upper()
-        variants.alt_allele = variants.alt_allele.str.upper()
-
         # get transcript children
         cdss = list(children[children.type == "CDS"].itertuples())
         exons = list(children[children.type == "exon"].itertuples())
@@ -104,19 +116,80 @@ class Annotator(object):
         utr3 = list(children[children.type == "three_prime_UTR"].itertuples())
         introns = [(x.end + 1, y.start - 1) for x, y in zip(exons[:-1], exons[1:])]
 
-        effect_values = []
-        impact_values = []
-        ref_codon_values = []
-        alt_codon_values = []
-        aa_pos_values = []
-        ref_aa_values = []
-        alt_aa_values = []
-        aa_change_values = []
+        # map each CDS to its offset within the coding sequence, following
+        # the same ordering rules as _get_coding_position
+        cds_starts = np.array([f.start for f in cdss], dtype=np.int64)
+        cds_ends = np.array([f.end for f in cdss], dtype=np.int64)
+        cds_lengths = cds_ends - cds_starts + 1
+        if feature.strand == "+":
+            order = np.argsort(cds_starts, kind="stable")
+            keys = cds_starts
+        else:
+            order = np.argsort(-cds_ends, kind="stable")
+            keys = cds_ends
+        cumulative = np.concatenate([[0], np.cumsum(cds_lengths[order])])
+        sorted_keys = keys[order]
+        cds_offsets = np.array(
+            [cumulative[np.flatnonzero(sorted_keys == k)[0]] for k in keys],
+            dtype=np.int64,
+        )
+
+        model = _TranscriptModel(
+            contig=feature.contig,
+            start=feature.start,
+            end=feature.end,
+            strand=feature.strand,
+            cdss=cdss,
+            utr5=utr5,
+            utr3=utr3,
+            introns=introns,
+            cds_starts=cds_starts,
+            cds_ends=cds_ends,
+            cds_offsets=cds_offsets,
+        )
+        self._transcript_cache[transcript] = model
+        return model
+
+    def get_effects(self, transcript, variants, progress=None):
+        model = self.get_transcript_model(transcript)
+
+        # make sure all alleles are uppercase
+        variants.ref_allele = variants.ref_allele.str.upper()
+        variants.alt_allele = variants.alt_allele.str.upper()
+
+        # SNPs are annotated with array operations, anything else falls
+        # back to annotating one variant at a time
+        loc_snp = (
+            (variants.ref_allele.str.len() == 1) & (variants.alt_allele.str.len() == 1)
+        ).to_numpy()
+        values = {
+            field: np.full(len(variants), None, dtype=object)
+            for field in _effect_fields
+        }
+        if np.any(loc_snp):
+            snp_values = self._get_snp_effects(
+                model=model,
+                pos=variants.position.to_numpy()[loc_snp],
+                ref=variants.ref_allele.to_numpy()[loc_snp],
+                alt=variants.alt_allele.to_numpy()[loc_snp],
+            )
+            for field, field_values in snp_values.items():
+                values[field][loc_snp] = field_values
+        if not np.all(loc_snp):
+            other_values = self._get_variant_effects(
+                model=model, variants=variants[~loc_snp], progress=progress
+            )
+            for field, field_values in other_values.items():
+                values[field][~loc_snp] = field_values
+
+        variants["transcript"] = transcript
+        for field in _effect_fields:
+            variants[field] = values[field].tolist()
+
+        return variants
 
-        feature_contig = feature.contig
-        feature_start = feature.start
-        feature_stop = feature.end
-        feature_strand = feature.strand
+    def _get_variant_effects(self, model, variants, progress=None):
+        values = {field: [] for field in _effect_fields}
 
         variant_iterator = variants.itertuples(index=True)
         if progress:
@@ -126,7 +199,7 @@ class Annotator(object):
 
         for row in variant_iterator:
             # some parameters
-            chrom = feature_contig
+            chrom = model.contig
             pos = row.position
             ref = row.ref_allele
             alt = row.alt_allele
@@ -143,41 +216,239 @@ class Annotator(object):
                 vlen=len(alt) - len(ref),
                 ref_start=ref_start,
                 ref_stop=ref_stop,
-                strand=feature_strand,
+                strand=model.strand,
             )
 
             # reference allele falls within current transcript
-            assert feature_start <= ref_start <= ref_stop <= feature_stop
+            assert model.start <= ref_start <= ref_stop <= model.end
 
             effect = _get_within_transcript_effect(
                 ann=self,
                 base_effect=base_effect,
-                cdss=cdss,
-                utr5=utr5,
-                utr3=utr3,
-                introns=introns,
+                cdss=model.cdss,
+                utr5=model.utr5,
+                utr3=model.utr3,
+                introns=model.introns,
             )
 
-            effect_values.append(effect.effect)
-            impact_values.append(effect.impact)
-            ref_codon_values.append(effect.ref_codon)
-            alt_codon_values.append(effect.alt_codon)
-            aa_pos_values.append(effect.aa_pos)
-            ref_aa_values.append(effect.ref_aa)
-            alt_aa_values.append(effect.alt_aa)
-            aa_change_values.append(effect.aa_change)
+            for field in _effect_fields:
+                values[field].append(getattr(effect, field))
+
+        return values
+
+    def _get_snp_effects(self, model, pos, ref, alt):
+        pos = np.asarray(pos, dtype=np.int64)
+        n = len(pos)
+        ref_bytes = np.asarray(ref, dtype="S1").view(np.uint8)
+        alt_bytes = np.asarray(alt, dtype="S1").view(np.uint8)
+
+        # check the reference alleles match the reference sequence
+        seq = self.get_contig_seq(model.contig)
+        ref_seq = _lower(seq[pos - 1])
+        loc_bad = ref_seq != _lower(ref_bytes)
+        if np.any(loc_bad):
+            i = np.flatnonzero(loc_bad)[0]
+            expected = bytes(ref_seq[i : i + 1]).decode()
+            found = bytes(_lower(ref_bytes[i : i + 1])).decode()
+            raise AssertionError(
+                "reference allele does not match reference sequence, "
+                f"expected {expected!r}, found {found!r}"
+            )
 
-        variants["transcript"] = transcript
-        variants["effect"] = effect_values
-        variants["impact"] = impact_values
-        variants["ref_codon"] = ref_codon_values
-        variants["alt_codon"] = alt_codon_values
-        variants["aa_pos"] = aa_pos_values
-        variants["ref_aa"] = ref_aa_values
-        variants["alt_aa"] = alt_aa_values
-        variants["aa_change"] = aa_change_values
+        # reference alleles fall within current transcript
+        assert np.all((model.start <= pos) & (pos <= model.end))
 
-        return variants
+        # work through features in reverse order of precedence, so that
+        # CDS effects override intron effects which override UTR effects
+        effect = np.full(n, "TRANSCRIPT", dtype=object)
+        impact = np.full(n, "MODIFIER", dtype=object)
+
+        i_utr3 = _first_containing(
+            pos, [x.start for x in model.utr3], [x.end for x in model.utr3]
+        )
+        effect[i_utr3 >= 0] = "THREE_PRIME_UTR"
+        impact[i_utr3 >= 0] = "LOW"
+
+        i_utr5 = _first_containing(
+            pos, [x.start for x in model.utr5], [x.end for x in model.utr5]
+        )
+        effect[i_utr5 >= 0] = "FIVE_PRIME_UTR"
+        impact[i_utr5 >= 0] = "LOW"
+
+        intron_starts = np.array([x[0] for x in model.introns], dtype=np.int64)
+        intron_stops = np.array([x[1] for x in model.introns], dtype=np.int64)
+        i_intron = _first_containing(pos, intron_starts, intron_stops)
+        loc_intron = i_intron >= 0
+        if np.any(loc_intron):
+            intron_pos = pos[loc_intron]
+            intron_start = intron_starts[i_intron[loc_intron]]
+            intron_stop = intron_stops[i_intron[loc_intron]]
+            if model.strand == "+":
+                intron_5prime_dist = intron_pos - (intron_start - 1)
+                intron_3prime_dist = intron_pos - (intron_stop + 1)
+            else:
+                intron_5prime_dist = (intron_stop + 1) - intron_pos
+                intron_3prime_dist = (intron_start - 1) - intron_pos
+            intron_min_dist = np.minimum(intron_5prime_dist, -intron_3prime_dist)
+            effect[loc_intron] = np.select(
+                [intron_min_dist <= 2, intron_min_dist <= 7],
+                ["SPLICE_CORE", "SPLICE_REGION"],
+                "INTRONIC",
+            )
+            impact[loc_intron] = np.select(
+                [intron_min_dist <= 2, intron_min_dist <= 7],
+                ["HIGH", "MODERATE"],
+                "MODIFIER",
+            )
+
+        values = {
+            "effect": effect,
+            "impact": impact,
+            "ref_codon": np.full(n, None, dtype=object),
+            "alt_codon": np.full(n, None, dtype=object),
+            "aa_pos": np.full(n, None, dtype=object),
+            "ref_aa": np.full(n, None, dtype=object),
+            "alt_aa": np.full(n, None, dtype=object),
+            "aa_change": np.full(n, None, dtype=object),
+        }
+
+        i_cds = _first_containing(pos, model.cds_starts, model.cds_ends)
+        loc_cds = i_cds >= 0
+        if not np.any(loc_cds):
+            return values
+
+        # locate variants within the coding sequence
+        cds_pos = pos[loc_cds]
+        i_cds = i_cds[loc_cds]
+        if model.strand == "+":
+            ref_cds_start = model.cds_offsets[i_cds] + (
+                cds_pos - model.cds_starts[i_cds]
+            )
+        else:
+            ref_cds_start = model.cds_offsets[i_cds] + (model.cds_ends[i_cds] - cds_pos)
+        phase = ref_cds_start % 3
+
+        # build codons on the forward strand, with the variant allele in
+        # upper case and the surrounding reference sequence in lower case
+        if model.strand == "+":
+            codon_start = cds_pos - phase
+        else:
+            codon_start = cds_pos - 2 + phase
+        codon_index = (codon_start - 1)[:, None] + np.arange(3)
+        ref_codons = _lower(seq[codon_index])
+        alt_codons = ref_codons.copy()
+        rows = np.arange(len(cds_pos))
+        cols = cds_pos - codon_start
+        ref_codons[rows, cols] = ref_bytes[loc_cds]
+        alt_codons[rows, cols] = alt_bytes[loc_cds]
+        if model.strand == "-":
+            ref_codons = _complement(ref_codons[:, ::-1])
+            alt_codons = _complement(alt_codons[:, ::-1])
+
+        # translate codons
+        ref_codons = _codon_strings(ref_codons)
+        alt_codons = _codon_strings(alt_codons)
+        ref_aa = _translate(ref_codons)
+        alt_aa = _translate(alt_codons)
+        aa_pos = (ref_cds_start // 3) + 1
+
+        effect[loc_cds] = np.select(
+            [
+                ref_aa == alt_aa,
+                (ref_aa == "M") & (ref_cds_start == 0),
+                ref_aa == "*",
+                alt_aa == "*",
+            ],
+            ["SYNONYMOUS_CODING", "START_LOST", "STOP_LOST", "STOP_GAINED"],
+            "NON_SYNONYMOUS_CODING",
+        )
+        impact[loc_cds] = np.select(
+            [
+                ref_aa == alt_aa,
+                (ref_aa == "M") & (ref_cds_start == 0),
+                ref_aa == "*",
+                alt_aa == "*",
+            ],
+            ["LOW", "HIGH", "HIGH", "HIGH"],
+            "MODERATE",
+        )
+        values["ref_codon"][loc_cds] = ref_codons
+        values["alt_codon"][loc_cds] = alt_codons
+        values["aa_pos"][loc_cds] = aa_pos
+        values["ref_aa"][loc_cds] = ref_aa
+        values["alt_aa"][loc_cds] = alt_aa
+        values["aa_change"][loc_cds] = np.char.add(
+            np.char.add(ref_aa, aa_pos.astype(str)), alt_aa
+        )
+
+        return values
+
+
+_effect_fields = (
+    "effect",
+    "impact",
+    "ref_codon",
+    "alt_codon",
+    "aa_pos",
+    "ref_aa",
+    "alt_aa",
+    "aa_change",
+)
+
+
+_TranscriptModel = collections.namedtuple(
+    "_TranscriptModel",
+    (
+        "contig",
+        "start",
+        "end",
+        "strand",
+        "cdss",
+        "utr5",
+        "utr3",
+        "introns",
+        "cds_starts",
+        "cds_ends",
+        "cds_offsets",
+    ),
+)
+
+
+def _first_containing(pos, starts, ends):
+    """Find the index of the first feature containing each position, or -1
+    where no feature contains the position."""
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return np.full(len(pos), -1, dtype=np.int64)
+    loc = (starts[None, :] <= pos[:, None]) & (ends[None, :] >= pos[:, None])
+    return np.where(np.any(loc, axis=1), np.argmax(loc, axis=1), -1)
+
+
+def _lower(a):
+    """Convert ASCII bytes to lower case."""
+    a = np.asarray(a).view(np.uint8)
+    return np.where((a >= 65) & (a <= 90), a + 32, a).astype(np.uint8)
+
+
+def _complement(a):
+    """Complement nucleotides held as ASCII bytes, preserving case."""
+    table = np.arange(256, dtype=np.uint8)
+    for b in np.unique(a):
+        table[b] = ord(str(Seq(chr(b)).complement()))
+    return table[a]
+
+
+def _codon_strings(a):
+    return np.ascontiguousarray(a).view("S3").ravel().astype("U3")
+
+
+def _translate(codons):
+    unique_codons, inverse = np.unique(codons, return_inverse=True)
+    unique_aas = np.array(
+        [str(Seq(codon).translate()) for codon in unique_codons], dtype="U1"
+    )
+    return unique_aas[inverse.ravel()]
 
 
 def _get_within_transcript_effect(ann, base_effect, cdss, utr5, utr3, introns):
@@ -1,3 +1,6 @@
+import threading
+import time
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -8,6 +11,8 @@ from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
 from malariagen_data import adir1 as _adir1
 from malariagen_data.anoph.base import AnophelesBase
+from malariagen_data.results_cache import MemoryResultsCacheBackend
+from malariagen_data.util import CacheMiss
 
 
 @pytest.fixture
@@ -256,3 +261,69 @@ def test_lookup_study(fixture, api):
 
     with pytest.raises(ValueError):
         api.lookup_study("foobar")
+
+
+@pytest.mark.parametrize("backend", ["local", "memory"])
+def test_results_cache(ag3_sim_fixture, tmp_path, backend):
+    if backend == "local":
+        results_cache = tmp_path.as_posix()
+    else:
+        results_cache = MemoryResultsCacheBackend()
+    api = AnophelesBase(
+        url=ag3_sim_fixture.url,
+        public_url=ag3_sim_fixture.url,
+        config_path=_ag3.CONFIG_PATH,
+        major_version_number=_ag3.MAJOR_VERSION_NUMBER,
+        major_version_path=_ag3.MAJOR_VERSION_PATH,
+        pre=True,
+        results_cache=results_cache,
+        results_cache_options=dict(quotas={"foo": 1}),
+    )
+    params = dict(x=1)
+    results = dict(y=np.arange(10))
+    with pytest.raises(CacheMiss):
+        api.results_cache_get(name="bar_v1", params=params)
+    api.results_cache_set(name="bar_v1", params=params, results=results)
+    np.testing.assert_array_equal(
+        api.results_cache_get(name="bar_v1", params=params)["y"], results["y"]
+    )
+
+    # Results for an analysis over quota are evicted from the backend store.
+    api.results_cache_set(name="foo_v1", params=params, results=results)
+    names = [e.name for e in api._results_cache_store.entries()]
+    assert names == ["anophelesbase_bar_v1"]
+    assert api.results_cache_evict() == []
+
+
+def test_results_cache_lock_threads(ag3_sim_fixture, tmp_path):
+    api = AnophelesBase(
+        url=ag3_sim_fixture.url,
+        public_url=ag3_sim_fixture.url,
+        config_path=_ag3.CONFIG_PATH,
+        major_version_number=_ag3.MAJOR_VERSION_NUMBER,
+        major_version_path=_ag3.MAJOR_VERSION_PATH,
+        pre=True,
+        results_cache=tmp_path.as_posix(),
+    )
+    params = dict(x=1)
+    results = dict(y=np.arange(10))
+    n_computed = []
+
+    def worker():
+        with api.results_cache_lock(name="foo_v1", params=params):
+            # Re-entrant use within the same thread does not block.
+            with api.results_cache_lock(name="foo_v1", params=params):
+                try:
+                    api.results_cache_get(name="foo_v1", params=params)
+                except CacheMiss:
+                    time.sleep(0.5)
+                    n_computed.append(1)
+                    api.results_cache_set(name="foo_v1", params=params, results=results)
+
+    # Threads sharing the same instance are kept apart, so only one computes.
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(n_computed) == 1
@@ -3,12 +3,15 @@ import random
 import numpy as np
 import plotly.graph_objects as go  # type: ignore
 import pytest
+import zarr  # type: ignore
+from numpy.testing import assert_array_equal
 from pytest_cases import parametrize_with_cases
 
 from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
 from malariagen_data import adir1 as _adir1
 from malariagen_data.anoph.distance import AnophelesDistanceAnalysis
+from malariagen_data.results_cache import LocalResultsCacheBackend, _ResultsMemoryCache
 from malariagen_data.anoph import pca_params
 
 
@@ -161,6 +164,87 @@ def test_biallelic_diplotype_pairwise_distance_with_metric(
         )
 
 
+@parametrize_with_cases("fixture,api", cases=".")
+def test_biallelic_diplotype_pairwise_distance_with_dist_path(
+    fixture, api: AnophelesDistanceAnalysis, tmp_path
+):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    data_params = dict(
+        region=random.choice(api.contigs),
+        sample_sets=random.sample(all_sample_sets, 2),
+        site_mask=random.choice((None,) + api.site_mask_ids),
+        min_minor_ac=pca_params.min_minor_ac_default,
+        max_missing_an=pca_params.max_missing_an_default,
+    )
+    ds = api.biallelic_snp_calls(**data_params)
+    params = dict(
+        n_snps=random.randint(4, ds.sizes["variants"]),
+        metric=random.choice(["cityblock", "euclidean"]),
+        **data_params,
+    )
+
+    # Write distances to a memory-mapped array, when computing.
+    dist_mm, samples, _ = api.biallelic_diplotype_pairwise_distances(
+        dist_path=(tmp_path / "dist.npy").as_posix(), **params
+    )
+    assert isinstance(dist_mm, np.memmap)
+    dist, samples_cached, _ = api.biallelic_diplotype_pairwise_distances(**params)
+    assert not isinstance(dist, np.memmap)
+    assert_array_equal(samples_cached, samples)
+    assert_array_equal(dist, dist_mm)
+    assert_array_equal(np.load(tmp_path / "dist.npy"), dist)
+
+    # Write distances to a zarr array, when retrieved from the cache.
+    dist_zarr, _, _ = api.biallelic_diplotype_pairwise_distances(
+        dist_path=(tmp_path / "dist.zarr").as_posix(), **params
+    )
+    assert_array_equal(zarr.open_array(tmp_path / "dist.zarr", mode="r")[:], dist)
+    assert_array_equal(dist_zarr[:], dist)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_biallelic_diplotype_pairwise_distance_with_dist_path_cached(
+    fixture, api: AnophelesDistanceAnalysis, tmp_path, monkeypatch
+):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    data_params = dict(
+        region=random.choice(api.contigs),
+        sample_sets=random.sample(all_sample_sets, 2),
+        site_mask=random.choice((None,) + api.site_mask_ids),
+        min_minor_ac=pca_params.min_minor_ac_default,
+        max_missing_an=pca_params.max_missing_an_default,
+    )
+    ds = api.biallelic_snp_calls(**data_params)
+    params = dict(
+        n_snps=random.randint(4, ds.sizes["variants"]),
+        metric=random.choice(["cityblock", "euclidean"]),
+        **data_params,
+    )
+
+    # Fill the cache, then drop the in-memory tier so the results must be
+    # read from the cache directory.
+    dist, samples, n_snps_used = api.biallelic_diplotype_pairwise_distances(**params)
+    assert api._results_cache_store is not None
+    api._results_cache_store._memory.clear()
+
+    # Cached distances are streamed into the memory-mapped array, without
+    # loading all results into memory.
+    def fail(*args, **kwargs):
+        raise AssertionError("results loaded into memory")
+
+    with monkeypatch.context() as m:
+        m.setattr(_ResultsMemoryCache, "set", fail)
+        m.setattr(LocalResultsCacheBackend, "load", fail)
+        dist_mm, samples_mm, n_snps_mm = api.biallelic_diplotype_pairwise_distances(
+            dist_path=(tmp_path / "dist.npy").as_posix(), **params
+        )
+    assert isinstance(dist_mm, np.memmap)
+    assert dist_mm.filename == (tmp_path / "dist.npy").as_posix()
+    assert_array_equal(dist_mm, dist)
+    assert_array_equal(samples_mm, samples)
+    assert n_snps_mm == n_snps_used
+
+
 def check_njt(*, api, data_params, metric, algorithm):
     # Check available data.
     ds = api.biallelic_snp_calls(**data_params)
@@ -232,6 +232,74 @@ def test_g123_gwss_with_bad_sites(fixture, api: AnophelesG123Analysis):
         api.g123_gwss(**g123_params)
 
 
+@parametrize_with_cases("fixture,api", cases=".")
+def test_g123_gwss_multi(fixture, api: AnophelesG123Analysis):
+    # Set up test parameters.
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    # N.B., some datasets have a single country, so split samples at random.
+    all_sample_ids = api.sample_metadata()["sample_id"].to_list()
+    random.shuffle(all_sample_ids)
+    n = len(all_sample_ids) // 2
+    cohorts = {
+        "cohort1": f"sample_id in {all_sample_ids[:n]}",
+        "cohort2": f"sample_id in {all_sample_ids[n:]}",
+    }
+    window_size = {
+        "cohort1": random.randint(100, 500),
+        "cohort2": random.randint(100, 500),
+    }
+    contig = random.choice(api.contigs)
+    sites = random.choice(("all", "segregating") + api.phasing_analysis_ids)
+    site_mask = random.choice(api.site_mask_ids)
+
+    # Run function under test.
+    results = api.g123_gwss_multi(
+        contig=contig,
+        cohorts=cohorts,
+        window_size=window_size,
+        sites=sites,
+        site_mask=site_mask,
+        sample_sets=all_sample_sets,
+        min_cohort_size=1,
+        max_cohort_size=None,
+    )
+    assert list(results) == list(cohorts)
+
+    for cohort_label, cohort_query in cohorts.items():
+        x, g123 = results[cohort_label]
+        assert x.shape == g123.shape
+
+        # Results are the same as computing each cohort separately.
+        name, params = api._prep_g123_gwss_params(
+            contig=contig,
+            sites=sites,
+            site_mask=site_mask,
+            window_size=window_size[cohort_label],
+            sample_sets=all_sample_sets,
+            sample_query=cohort_query,
+            sample_query_options=None,
+            min_cohort_size=1,
+            max_cohort_size=None,
+            random_seed=42,
+        )
+        expected = api._g123_gwss(inline_array=True, chunks="native", **params)
+        np.testing.assert_array_equal(x, expected["x"])
+        np.testing.assert_array_equal(g123, expected["g123"])
+
+        # Single cohort results are cached under the same key.
+        x_single, g123_single = api.g123_gwss(
+            contig=contig,
+            window_size=window_size[cohort_label],
+            sites=sites,
+            site_mask=site_mask,
+            sample_sets=all_sample_sets,
+            sample_query=cohort_query,
+            min_cohort_size=1,
+            max_cohort_size=None,
+        )
+        np.testing.assert_array_equal(g123_single, g123)
+
+
 @parametrize_with_cases("fixture,api", cases=".")
 def test_g123_calibration(fixture, api: AnophelesG123Analysis):
     # Skip if this dataset has no phasing analyses (e.g., Adir1, Amin1).
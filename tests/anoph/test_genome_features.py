@@ -8,6 +8,7 @@ from pytest_cases import parametrize_with_cases
 from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
 from malariagen_data import adir1 as _adir1
+from malariagen_data.anoph import genome_features
 from malariagen_data.anoph.genome_features import AnophelesGenomeFeaturesData
 from malariagen_data.util import Region, _resolve_region
 
@@ -157,6 +158,72 @@ def test_genome_features_region_string(fixture, api: AnophelesGenomeFeaturesData
                 assert (df_gf["start"] <= r.end).all()
 
 
+@parametrize_with_cases("fixture,api", cases=".")
+def test_genome_features_region_index(fixture, api: AnophelesGenomeFeaturesData):
+    # Compare region queries via the index with queries over all features.
+    df_all = api.genome_features()
+    for _ in range(5):
+        region = fixture.random_region_str()
+        r = _resolve_region(api, region)
+        assert isinstance(r, Region)
+        df_expected = df_all.query(
+            f"contig == '{r.contig}' and start <= {r.end} and end >= {r.start}"
+        ).reset_index(drop=True)
+        df = api.genome_features(region=region)
+        assert_frame_equal(df, df_expected)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_genome_feature_children(fixture, api: AnophelesGenomeFeaturesData):
+    df_all = api.genome_features(attributes=["ID", "Parent"])
+    df_exploded = df_all.assign(Parent=df_all["Parent"].str.split(",")).explode(
+        "Parent"
+    )
+    df_transcripts = df_all.query("type == 'mRNA'")
+    for transcript in np.random.choice(df_transcripts["ID"].values, size=5):
+        df_children = api.genome_feature_children(
+            parent=transcript, attributes=["ID", "Parent"]
+        )
+        df_expected = df_exploded.query(f"Parent == '{transcript}'")
+        assert len(df_children) > 0
+        assert (df_children["Parent"] == transcript).all()
+        assert_frame_equal(
+            df_children.sort_values(["start", "end", "type"]).reset_index(drop=True),
+            df_expected.sort_values(["start", "end", "type"]).reset_index(drop=True),
+        )
+
+
+def test_genome_features_results_cache(ag3_sim_fixture, tmp_path, monkeypatch):
+    def make_api():
+        return AnophelesGenomeFeaturesData(
+            url=ag3_sim_fixture.url,
+            public_url=ag3_sim_fixture.url,
+            config_path=_ag3.CONFIG_PATH,
+            major_version_number=_ag3.MAJOR_VERSION_NUMBER,
+            major_version_path=_ag3.MAJOR_VERSION_PATH,
+            pre=True,
+            gff_gene_type="gene",
+            gff_gene_name_attribute="Name",
+            gff_default_attributes=("ID", "Parent", "Name", "description"),
+            results_cache=(tmp_path / "results_cache").as_posix(),
+        )
+
+    # Parse the GFF3 file, saving parsed data to the results cache.
+    api = make_api()
+    df_expected = api.genome_features()
+    df_expected_none = api.genome_features(attributes=None)
+
+    # Load parsed data from the results cache in a new instance, without
+    # reading the GFF3 file.
+    def fail(*args, **kwargs):
+        raise AssertionError("GFF3 file should not be read.")
+
+    monkeypatch.setattr(genome_features, "_read_gff3", fail)
+    api = make_api()
+    assert_frame_equal(api.genome_features(), df_expected)
+    assert_frame_equal(api.genome_features(attributes=None), df_expected_none)
+
+
 @parametrize_with_cases("fixture,api", cases=".")
 def test_plot_genes(fixture, api: AnophelesGenomeFeaturesData):
     for contig in fixture.contigs:
@@ -2,11 +2,12 @@ import random
 import pytest
 from pytest_cases import parametrize_with_cases
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_array_equal
 import bokeh.models
 
 from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
+from malariagen_data.anoph import h12_params as _h12_params
 from malariagen_data.anoph.h12 import AnophelesH12Analysis, _haplotype_frequencies
 
 
@@ -159,6 +160,35 @@ def check_h12_gwss(*, api, h12_params):
 
 
 def check_h12_gwss_multi(*, api, h12_params):
+    # Run main gwss function under test.
+    results = api.h12_gwss_multi(**h12_params)
+    cohorts = h12_params["cohorts"]
+    assert list(results) == list(cohorts)
+
+    for cohort_label, cohort_query in cohorts.items():
+        x, h12, contigs = results[cohort_label]
+        assert x.shape == h12.shape == contigs.shape
+
+        # Results are the same as computing each cohort separately.
+        window_size = h12_params["window_size"]
+        if isinstance(window_size, dict):
+            window_size = window_size[cohort_label]
+        name, params = api._prep_h12_gwss_params(
+            contig=h12_params["contig"],
+            analysis=h12_params.get("analysis", api._default_phasing_analysis),
+            window_size=window_size,
+            sample_sets=h12_params["sample_sets"],
+            sample_query=cohort_query,
+            sample_query_options=None,
+            cohort_size=_h12_params.cohort_size_default,
+            min_cohort_size=h12_params["min_cohort_size"],
+            max_cohort_size=_h12_params.max_cohort_size_default,
+            random_seed=42,
+        )
+        expected = api._h12_gwss(inline_array=True, chunks="native", **params)
+        assert_array_equal(x, expected["x"])
+        assert_array_equal(h12, expected["h12"])
+
     fig = api.plot_h12_gwss_multi_overlay(**h12_params, show=False)
     assert isinstance(fig, bokeh.models.GridPlot)
     fig = api.plot_h12_gwss_multi_panel(**h12_params, show=False)
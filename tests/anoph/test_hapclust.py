@@ -1,5 +1,8 @@
 import random
+
+import numpy as np
 import pytest
+from numpy.testing import assert_array_equal
 from pytest_cases import parametrize_with_cases
 
 from malariagen_data import af1 as _af1
@@ -96,3 +99,38 @@ def test_plot_haplotype_clustering(fixture, api: AnophelesHapClustAnalysis):
 
     # Run checks.
     api.plot_haplotype_clustering(**hapclust_params)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_haplotype_pairwise_distances_with_dist_path(
+    fixture, api: AnophelesHapClustAnalysis, tmp_path
+):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    params = dict(
+        region=fixture.random_region_str(region_size=5000),
+        sample_sets=[random.choice(all_sample_sets)],
+    )
+
+    # Write distances to a zarr array, when computing.
+    dist_zarr, phased_samples, n_snps = api.haplotype_pairwise_distances(
+        dist_path=(tmp_path / "dist.zarr").as_posix(), **params
+    )
+    n_haps = 2 * len(phased_samples)
+    assert dist_zarr.shape == (n_haps * (n_haps - 1) // 2,)
+
+    # Results were saved to the cache, in condensed form.
+    dist, _, _ = api.haplotype_pairwise_distances(**params)
+    assert isinstance(dist, np.ndarray)
+    assert_array_equal(dist_zarr[:], dist)
+
+    # Write distances to a memory-mapped array, when retrieved from the cache.
+    dist_mm, _, _ = api.haplotype_pairwise_distances(
+        dist_path=(tmp_path / "dist.npy").as_posix(), **params
+    )
+    assert isinstance(dist_mm, np.memmap)
+    assert_array_equal(np.load(tmp_path / "dist.npy"), dist)
+
+    # Plot using distances written to disk.
+    api.plot_haplotype_clustering(
+        dist_path=(tmp_path / "dist.npy").as_posix(), show=False, **params
+    )
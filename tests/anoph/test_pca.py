@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import plotly.graph_objects as go  # type: ignore
 import pytest
+from numpy.testing import assert_allclose
 from pytest_cases import parametrize_with_cases
 
 
@@ -11,7 +12,12 @@ from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
 from malariagen_data import adir1 as _adir1
 
-from malariagen_data.anoph.pca import AnophelesPca
+from malariagen_data.anoph.pca import (
+    AnophelesPca,
+    _exact_pca,
+    _pca_blocks,
+    _randomized_pca,
+)
 from malariagen_data.anoph import pca_params
 
 
@@ -313,3 +319,101 @@ def test_pca_fit_exclude_samples(fixture, api: AnophelesPca):
         len(pca_df.query(f"sample_id in {exclude_samples} and not pca_fit"))
         == n_samples_excluded
     )
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_pca_algorithm(fixture, api: AnophelesPca):
+    # Parameters for selecting input data.
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    data_params = dict(
+        region=random.choice(api.contigs),
+        sample_sets=random.sample(all_sample_sets, 2),
+        site_mask=random.choice((None,) + api.site_mask_ids),
+    )
+    ds = api.biallelic_snp_calls(
+        min_minor_ac=pca_params.min_minor_ac_default,
+        max_missing_an=pca_params.max_missing_an_default,
+        **data_params,
+    )
+    samples = ds["sample_id"].values.tolist()
+    n_samples = ds.sizes["samples"]
+    n_snps = random.randint(4, ds.sizes["variants"])
+    n_components = random.randint(2, min(n_samples, n_snps, 10))
+    fit_exclude_samples = random.choice([None, random.sample(samples, 3)])
+
+    results = dict()
+    for algorithm in "randomized", "incremental":
+        pca_df, pca_evr = api.pca(
+            n_snps=n_snps,
+            n_components=n_components,
+            fit_exclude_samples=fit_exclude_samples,
+            algorithm=algorithm,
+            chunks=random.choice(["native", 1000]),
+            **data_params,
+        )
+        assert len(pca_df) == n_samples
+        assert f"PC{n_components}" in pca_df.columns
+        assert f"PC{n_components+1}" not in pca_df.columns
+        assert pca_evr.shape == (n_components,)
+        assert np.all(np.diff(pca_evr) <= 0)
+        assert pca_df["pca_fit"].sum() == n_samples - len(fit_exclude_samples or [])
+        results[algorithm] = pca_df, pca_evr
+
+    # Reading chunks incrementally does not change the results. N.B., compare
+    # inner products between samples, which do not depend on the signs of
+    # components, or on rotation within components with similar variance.
+    pcs = [f"PC{i+1}" for i in range(n_components)]
+    df_randomized, evr_randomized = results["randomized"]
+    df_incremental, evr_incremental = results["incremental"]
+    assert_allclose(evr_incremental, evr_randomized, rtol=1e-6)
+    x_randomized = df_randomized[pcs].values
+    x_incremental = df_incremental[pcs].values
+    gram_randomized = x_randomized @ x_randomized.T
+    assert_allclose(
+        x_incremental @ x_incremental.T,
+        gram_randomized,
+        atol=1e-4 * np.abs(gram_randomized).max(),
+    )
+
+
+@pytest.mark.parametrize("fit_exclude", [False, True])
+def test_randomized_pca(fit_exclude):
+    # Simulate diplotypes for samples from three populations.
+    rng = np.random.default_rng(42)
+    n_samples, n_snps = 200, 5000
+    freqs = rng.random((n_snps, 3)) * 0.8 + 0.1
+    populations = rng.integers(0, 3, size=n_samples)
+    gn = rng.binomial(2, freqs[:, populations]).astype("i1")
+    gn[:100] = 1
+    loc_fit = rng.random(n_samples) < 0.8 if fit_exclude else None
+
+    expected_coords, expected_evr = _exact_pca(gn, loc_fit=loc_fit, n_components=5)
+    coords, evr = _randomized_pca(
+        lambda: _pca_blocks(gn),
+        loc_fit=np.ones(n_samples, dtype=bool) if loc_fit is None else loc_fit,
+        n_components=5,
+        random_seed=42,
+    )
+    assert coords.shape == expected_coords.shape
+    assert evr.shape == expected_evr.shape
+
+    # Components reflecting population structure are found accurately.
+    assert_allclose(evr[:2], expected_evr[:2], rtol=1e-4)
+    # N.B., the exact algorithm scales diplotypes as 16-bit floats, so allow
+    # for small differences relative to the magnitude of the coordinates.
+    atol = 1e-3 * np.abs(expected_coords).max()
+    assert_allclose(np.abs(coords[:, :2]), np.abs(expected_coords[:, :2]), atol=atol)
+
+    # With few samples, all components are found accurately.
+    gn = gn[:, :12]
+    loc_fit = None if loc_fit is None else loc_fit[:12]
+    expected_coords, expected_evr = _exact_pca(gn, loc_fit=loc_fit, n_components=5)
+    coords, evr = _randomized_pca(
+        lambda: _pca_blocks(gn),
+        loc_fit=np.ones(12, dtype=bool) if loc_fit is None else loc_fit,
+        n_components=5,
+        random_seed=42,
+    )
+    assert_allclose(evr, expected_evr, rtol=1e-4)
+    atol = 1e-3 * np.abs(expected_coords).max()
+    assert_allclose(np.abs(coords), np.abs(expected_coords), atol=atol)
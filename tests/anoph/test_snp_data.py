@@ -20,7 +20,9 @@ from malariagen_data import amin1 as _amin1
 
 
 from malariagen_data.anoph.base_params import DEFAULT
+from malariagen_data.anoph import snp_data
 from malariagen_data.anoph.snp_data import AnophelesSnpData
+from malariagen_data.util import Region, _locate_region, _parse_single_region
 
 
 @pytest.fixture
@@ -322,6 +324,122 @@ def test_snp_sites_with_virtual_contigs(ag3_sim_api, chrom):
     assert np.all(pos <= stop)
 
 
+def check_locate_snp_sites_region(api: AnophelesSnpData, contig):
+    pos = api.snp_sites(region=contig, field="POS").compute()
+    bounds, pos_min, pos_max = api._snp_sites_index(contig=contig)
+    assert bounds[0] == 0
+    assert bounds[-1] == pos.shape[0]
+    assert_array_equal(pos_min, pos[bounds[:-1]])
+    assert_array_equal(pos_max, pos[bounds[1:] - 1])
+
+    # Include regions with boundaries at the edges of chunks, and regions
+    # outside the range of positions.
+    edges = np.concatenate([pos_min, pos_max])
+    starts = [1, pos[-1] + 1] + random.sample(list(edges), min(5, len(edges)))
+    stops = [pos[0] - 1, pos[-1] + 1] + random.sample(list(edges), min(5, len(edges)))
+    starts += list(np.random.randint(low=1, high=pos[-1], size=5))
+    stops += list(np.random.randint(low=1, high=pos[-1], size=5))
+    for start, stop in product(starts, stops):
+        region = Region(contig, int(start), int(stop))
+        loc_actual = api._locate_snp_sites_region(region=region)
+        loc_expected = _locate_region(region, pos)
+        assert_array_equal(pos[loc_actual], pos[loc_expected])
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_locate_snp_sites_region(fixture, api: AnophelesSnpData):
+    contig = fixture.random_contig()
+    check_locate_snp_sites_region(api, contig)
+
+    # The index is persisted in the results cache.
+    api._cache_snp_sites_index.clear()
+    results = api.results_cache_get(
+        name="snp_sites_index_v1",
+        params=dict(
+            contig=contig,
+            n_sites=api.open_snp_sites()[f"{contig}/variants/POS"].shape[0],
+            chunk_size=api.open_snp_sites()[f"{contig}/variants/POS"].chunks[0],
+        ),
+    )
+    bounds, _, _ = api._snp_sites_index(contig=contig)
+    assert_array_equal(bounds, results["bounds"])
+
+
+@pytest.mark.parametrize("chrom", ["2RL", "3RL"])
+def test_locate_snp_sites_region_with_virtual_contigs(ag3_sim_api, chrom):
+    check_locate_snp_sites_region(ag3_sim_api, chrom)
+
+
+def check_locate_sites(api: AnophelesSnpData, region: str):
+    r = _parse_single_region(api, region)
+    masks = list(api.site_mask_ids)
+    filters = [api.site_filters(region=region, mask=m).compute() for m in masks]
+    n_sites = api.snp_sites(region=region, field="POS").shape[0]
+
+    # No masks selects all sites.
+    loc = api._locate_sites(region=r)
+    assert loc.dtype == bool
+    assert loc.shape == (n_sites,)
+    assert np.all(loc)
+
+    # Single mask.
+    for m, f in zip(masks, filters):
+        assert_array_equal(api._locate_sites(region=r, site_masks=[m]), f)
+
+    # Combined masks.
+    loc_and = api._locate_sites(region=r, site_masks=masks, how="and")
+    assert_array_equal(loc_and, np.logical_and.reduce(filters))
+    loc_or = api._locate_sites(region=r, site_masks=masks, how="or")
+    assert_array_equal(loc_or, np.logical_or.reduce(filters))
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_locate_sites(fixture, api: AnophelesSnpData):
+    contig = fixture.random_contig()
+    for region in [contig, fixture.random_region_str()]:
+        check_locate_sites(api, region)
+
+    # Bitmaps are persisted in the results cache.
+    mask = api.site_mask_ids[0]
+    bits = api._site_bitmap(contig=contig, site_mask=mask)
+    assert bits.dtype == np.uint8
+    api._cache_site_bitmaps.clear()
+    results = api.results_cache_get(
+        name="site_bitmap_v1",
+        params=dict(
+            contig=contig,
+            site_mask=mask,
+            site_class=None,
+            n_sites=api.open_snp_sites()[f"{contig}/variants/POS"].shape[0],
+        ),
+    )
+    assert_array_equal(results["bits"], bits)
+
+
+@pytest.mark.parametrize("chrom", ["2RL", "3RL"])
+def test_locate_sites_with_virtual_contigs(ag3_sim_api, chrom):
+    api = ag3_sim_api
+    check_locate_sites(api, chrom)
+    seq = api.genome_sequence(region=chrom)
+    start, stop = sorted(np.random.randint(low=1, high=len(seq), size=2))
+    check_locate_sites(api, f"{chrom}:{start:,}-{stop:,}")
+
+
+def test_locate_sites_with_site_class(ag3_sim_api):
+    api = ag3_sim_api
+    r = _parse_single_region(api, "3L")
+    loc_cls = api._compute_site_class(contig="3L", site_class="CDS_DEG_4")
+    loc_mask = api.site_filters(region="3L", mask="gamb_colu").compute()
+    loc = api._locate_sites(
+        region=r, site_masks=["gamb_colu"], site_classes=["CDS_DEG_4"]
+    )
+    assert_array_equal(loc, loc_cls & loc_mask)
+    loc = api._locate_sites(
+        region=r, site_masks=["gamb_colu"], site_classes=["CDS_DEG_4"], how="or"
+    )
+    assert_array_equal(loc, loc_cls | loc_mask)
+
+
 @parametrize_with_cases("fixture,api", cases=".")
 def test_open_site_annotations(fixture, api):
     root = api.open_site_annotations()
@@ -991,6 +1109,57 @@ def test_snp_calls_with_virtual_contigs(ag3_sim_api, chrom):
     assert_array_equal(pos, ds_region["variant_position"].values)
 
 
+def check_snp_calls_at_positions(api: AnophelesSnpData, contig, site_mask):
+    pos = api.snp_sites(region=contig, field="POS").compute()
+    n = min(20, len(pos))
+    targets = np.sort(np.random.choice(pos, size=n, replace=False))
+    # Include some positions which are not SNP sites, and out of order.
+    missing = np.setdiff1d(np.arange(1, pos[-1] + 10), pos)[:5]
+    positions = np.concatenate([targets[::-1], missing, [pos[-1] + 1000]])
+
+    ds = api.snp_calls_at_positions(
+        contig=contig, positions=positions, site_mask=site_mask
+    )
+    ds_contig = api.snp_calls(region=contig, site_mask=site_mask)
+    loc = np.isin(ds_contig["variant_position"].values, targets)
+    expected = ds_contig.isel(variants=np.nonzero(loc)[0])
+    assert isinstance(ds, xr.Dataset)
+    assert set(ds.data_vars) == set(ds_contig.data_vars)
+    assert set(ds.coords) == set(ds_contig.coords)
+    assert ds.sizes["variants"] == np.count_nonzero(loc)
+    assert ds.attrs == ds_contig.attrs
+    for f in ds.variables:
+        assert ds[f].dims == expected[f].dims
+        assert ds[f].shape == expected[f].shape
+        # N.B., other call arrays are empty in the simulated data.
+        if (
+            str(f).startswith("variant_")
+            or str(f).startswith("sample_")
+            or f
+            in {
+                "call_genotype",
+                "call_genotype_mask",
+            }
+        ):
+            assert_array_equal(ds[f].values, expected[f].values)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_snp_calls_at_positions(fixture, api: AnophelesSnpData):
+    contig = fixture.random_contig()
+    for site_mask in [None, random.choice(api.site_mask_ids)]:
+        check_snp_calls_at_positions(api, contig=contig, site_mask=site_mask)
+
+    # Positions which are not SNP sites.
+    ds = api.snp_calls_at_positions(contig=contig, positions=[0])
+    assert ds.sizes["variants"] == 0
+
+
+@pytest.mark.parametrize("chrom", ["2RL", "3RL"])
+def test_snp_calls_at_positions_with_virtual_contigs(ag3_sim_api, chrom):
+    check_snp_calls_at_positions(ag3_sim_api, contig=chrom, site_mask=None)
+
+
 def check_snp_allele_counts(
     *,
     api,
@@ -1163,6 +1332,116 @@ def test_snp_allele_counts_with_sample_query_options_param(
         )
 
 
+def check_snp_allele_counts_stream(api: AnophelesSnpData, **kwargs):
+    # Compare streaming engine with a dask computation over SNP calls.
+    ac = api.snp_allele_counts(engine="stream", **kwargs)
+    ds = api.snp_calls(**kwargs)
+    gt = allel.GenotypeDaskArray(ds["call_genotype"].data)
+    ac_expected = gt.count_alleles(max_allele=3).compute()
+    assert ac.dtype == ac_expected.dtype
+    assert_array_equal(ac, ac_expected)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_snp_allele_counts_stream(fixture, api: AnophelesSnpData):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    sample_sets = random.sample(all_sample_sets, min(2, len(all_sample_sets)))
+    site_mask = random.choice((None,) + api.site_mask_ids)
+
+    # Parametrize region.
+    parametrize_region = [
+        fixture.random_contig(),
+        fixture.random_region_str(),
+        [fixture.random_region_str(), fixture.random_region_str()],
+    ]
+    for region in parametrize_region:
+        check_snp_allele_counts_stream(
+            api, region=region, sample_sets=sample_sets, site_mask=site_mask
+        )
+
+    # Parametrize sample selection.
+    region = fixture.random_region_str()
+    n_samples = len(api.sample_metadata(sample_sets=sample_sets))
+    sample_indices = sorted(random.sample(range(n_samples), n_samples // 2))
+    parametrize_sample_selection: list = [
+        dict(sample_indices=sample_indices),
+        dict(max_cohort_size=n_samples // 3, random_seed=random.randint(0, 100)),
+        dict(sample_indices=sample_indices, max_cohort_size=n_samples // 4),
+    ]
+    for params in parametrize_sample_selection:
+        check_snp_allele_counts_stream(
+            api, region=region, sample_sets=sample_sets, site_mask=site_mask, **params
+        )
+
+
+@pytest.mark.parametrize("chrom", ["2RL", "3RL"])
+def test_snp_allele_counts_stream_with_virtual_contigs(
+    ag3_sim_api: AnophelesSnpData, chrom
+):
+    api = ag3_sim_api
+    check_snp_allele_counts_stream(api, region=chrom)
+    check_snp_allele_counts_stream(api, region=chrom, site_mask="gamb_colu")
+
+
+@pytest.mark.parametrize("site_class", ["CDS_DEG_4", "INTERGENIC"])
+def test_snp_allele_counts_stream_with_site_class(
+    ag3_sim_api: AnophelesSnpData, site_class
+):
+    check_snp_allele_counts_stream(
+        ag3_sim_api, region="3L", site_class=site_class, site_mask="gamb_colu_arab"
+    )
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+@pytest.mark.parametrize("engine", ["dask", "stream"])
+def test_snp_allele_counts_multi(fixture, api: AnophelesSnpData, engine):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    sample_sets = random.sample(all_sample_sets, min(2, len(all_sample_sets)))
+    site_mask = random.choice((None,) + api.site_mask_ids)
+    region = random.choice([fixture.random_contig(), fixture.random_region_str()])
+
+    # Set up some cohorts, including overlapping cohorts.
+    df_samples = api.sample_metadata(sample_sets=sample_sets)
+    countries = df_samples["country"].dropna().unique().tolist()
+    cohorts = {c: f"country == '{c}'" for c in countries}
+    cohorts["all"] = f"country in {countries}"
+
+    ac = api.snp_allele_counts_multi(
+        region=region,
+        cohorts=cohorts,
+        sample_sets=sample_sets,
+        site_mask=site_mask,
+        engine=engine,
+    )
+    assert isinstance(ac, np.ndarray)
+    assert ac.ndim == 3
+    assert ac.shape[0] == len(cohorts)
+    assert ac.shape[2] == 4
+
+    # Results should be identical to computing each cohort separately.
+    for i, query in enumerate(cohorts.values()):
+        ac_expected = api.snp_allele_counts(
+            region=region,
+            sample_sets=sample_sets,
+            sample_query=query,
+            site_mask=site_mask,
+            engine="dask",
+        )
+        assert_array_equal(ac[i], ac_expected)
+
+    # Check with downsampling.
+    ac = api.snp_allele_counts_multi(
+        region=region,
+        cohorts=cohorts,
+        sample_sets=sample_sets,
+        site_mask=site_mask,
+        max_cohort_size=2,
+        random_seed=random.randint(0, 100),
+        engine=engine,
+    )
+    assert np.all(ac.sum(axis=2) <= 4)
+
+
 def _check_is_accessible(api: AnophelesSnpData, region, mask):
     is_accessible = api.is_accessible(region=region, site_mask=mask)
     assert isinstance(is_accessible, np.ndarray)
@@ -1701,3 +1980,122 @@ def test_biallelic_snp_calls_and_diplotypes_with_conditions_fractional(
             max_missing_an=max_missing_an,
             n_snps=n_snps_available + 10,
         )
+
+
+def check_biallelic_genotypes_stream(
+    api: AnophelesSnpData,
+    *,
+    region,
+    sample_sets,
+    site_mask,
+    min_minor_ac,
+    max_missing_an,
+    n_snps=None,
+    ref=False,
+):
+    # Compare streaming engine with a dask computation over biallelic SNP calls.
+    results = api._biallelic_genotypes_stream(
+        region=region,
+        sample_sets=api._prep_sample_sets_param(sample_sets=sample_sets),
+        sample_indices=None,
+        site_mask=site_mask,
+        site_class=None,
+        cohort_size=None,
+        min_cohort_size=None,
+        max_cohort_size=None,
+        random_seed=42,
+        max_missing_an=max_missing_an,
+        min_minor_ac=min_minor_ac,
+        n_snps=n_snps,
+        thin_offset=0,
+        ref=ref,
+    )
+    ds = api.biallelic_snp_calls(
+        region=region,
+        sample_sets=sample_sets,
+        site_mask=site_mask,
+        min_minor_ac=min_minor_ac,
+        max_missing_an=max_missing_an,
+        n_snps=n_snps,
+    )
+    gt = allel.GenotypeDaskArray(ds["call_genotype"].data)
+    if ref:
+        gn_expected = gt.to_n_ref(fill=-127).compute()
+    else:
+        gn_expected = gt.to_n_alt().compute()
+    assert results["gn"].dtype == np.int8
+    assert_array_equal(results["gn"], gn_expected)
+    assert_array_equal(results["samples"], ds["sample_id"].values)
+
+    # Check selected SNPs and alleles.
+    ds_all = api.snp_calls(region=region, sample_sets=sample_sets, site_mask=site_mask)
+    ds_sel = ds_all.isel(variants=results["variant_index"])
+    assert_array_equal(ds_sel["variant_position"].values, ds["variant_position"].values)
+    alleles = np.take_along_axis(
+        ds_sel["variant_allele"].values,
+        results["alleles"].astype(np.intp),
+        axis=1,
+    )
+    assert_array_equal(alleles, ds["variant_allele"].values)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_biallelic_genotypes_stream(fixture, api: AnophelesSnpData, monkeypatch):
+    all_sample_sets = api.sample_sets()["sample_set"].to_list()
+    sample_sets = random.sample(all_sample_sets, min(2, len(all_sample_sets)))
+    site_mask = random.choice((None,) + api.site_mask_ids)
+    params = dict(
+        sample_sets=sample_sets,
+        site_mask=site_mask,
+        min_minor_ac=random.randint(1, 3),
+        max_missing_an=random.randint(5, 10),
+    )
+
+    # Parametrize region.
+    parametrize_region = [
+        fixture.random_contig(),
+        [fixture.random_region_str(), fixture.random_region_str()],
+    ]
+    for region in parametrize_region:
+        check_biallelic_genotypes_stream(api, region=region, **params)
+        check_biallelic_genotypes_stream(api, region=region, ref=True, **params)
+
+    # Thin SNPs, counting alleles in a single pass, with and without buffering
+    # genotype allele counts, then using cached allele counts.
+    region = fixture.random_contig()
+    with monkeypatch.context() as m:
+        m.setattr(api, "_results_cache_store", None)
+        check_biallelic_genotypes_stream(api, region=region, n_snps=10, **params)
+        m.setattr(snp_data, "_BIALLELIC_BUFFER_NBYTES", 0)
+        check_biallelic_genotypes_stream(api, region=region, n_snps=10, **params)
+    check_biallelic_genotypes_stream(api, region=region, n_snps=10, **params)
+
+
+def test_snp_calls_dataset_cache(ag3_sim_api: AnophelesSnpData):
+    api = ag3_sim_api
+    contig = random.choice(api.contigs)
+    contig_size = api.genome_sequence(region=contig).shape[0]
+    regions = [f"{contig}:{i * 10_000 + 1}-{(i + 1) * 10_000}" for i in range(3)]
+    assert (len(regions) * 10_000) < contig_size
+
+    # Alternate between several regions, SNP calls are only built once each.
+    for region in regions:
+        api.snp_calls(region=region)
+    stats_before = api.dataset_cache_stats()
+    for region in regions:
+        ds = api.snp_calls(region=region)
+        assert isinstance(ds, xr.Dataset)
+    stats_after = api.dataset_cache_stats()
+    assert stats_after.misses == stats_before.misses
+    assert stats_after.hits - stats_before.hits >= len(regions)
+
+    # Cached datasets are not affected by changes to returned datasets.
+    ds = api.snp_calls(region=regions[0])
+    del ds["call_genotype"]
+    assert "call_genotype" in api.snp_calls(region=regions[0])
+
+    # Invalidate cached datasets.
+    api.dataset_cache_clear()
+    misses = api.dataset_cache_stats().misses
+    api.snp_calls(region=regions[0])
+    assert api.dataset_cache_stats().misses > misses
@@ -1,5 +1,6 @@
 import random
 
+import allel  # type: ignore
 import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
@@ -7,12 +8,14 @@ import pytest
 from pytest_cases import parametrize_with_cases, case
 from pytest_cases import filters as ft
 import xarray as xr
+import zarr  # type: ignore
 from numpy.testing import assert_allclose, assert_array_equal
 
 from malariagen_data import af1 as _af1
 from malariagen_data import ag3 as _ag3
 from malariagen_data import adir1 as _adir1
 from malariagen_data import amin1 as _amin1
+from malariagen_data import veff
 
 
 from malariagen_data.anoph.snp_frq import AnophelesSnpFrequencyAnalysis
@@ -221,6 +224,127 @@ def test_snp_effects(fixture, api: AnophelesSnpFrequencyAnalysis):
     assert np.all(df_aa["aa_change"] == expected_aa_change)
 
 
+@parametrize_with_cases("fixture,api", cases=".")
+def test_snp_effects_vectorised(fixture, api: AnophelesSnpFrequencyAnalysis):
+    # Pick a random transcript.
+    transcript = random_transcript(api=api)
+
+    # Set up all possible SNPs, plus some indels which will be annotated
+    # one variant at a time.
+    df_snps = api.snp_effects(transcript=transcript.name).iloc[:, :4]
+    ann = api._snp_effect_annotator()
+    positions = np.arange(transcript["start"], transcript["end"] - 2)
+    positions = np.random.choice(positions, size=min(20, len(positions)))
+    refs = [
+        ann.get_ref_seq(transcript["contig"], pos, pos + 2).upper() for pos in positions
+    ]
+    df_indels = pd.DataFrame(
+        {
+            "contig": transcript["contig"],
+            "position": np.concatenate([positions, positions]),
+            "ref_allele": refs + [ref[0] for ref in refs],
+            "alt_allele": [ref[0] for ref in refs] + [ref[0] + "ACG" for ref in refs],
+        }
+    )
+    df_variants = pd.concat([df_snps, df_indels], ignore_index=True)
+
+    # Compute effects.
+    df_effects = ann.get_effects(
+        transcript=transcript.name, variants=df_variants.copy()
+    )
+
+    # Compare with annotating every variant one at a time.
+    model = ann.get_transcript_model(transcript.name)
+    expected = ann._get_variant_effects(model=model, variants=df_variants)
+    df_expected = df_variants.assign(transcript=transcript.name)
+    for field, values in expected.items():
+        df_expected[field] = values
+    assert_frame_equal(df_effects, df_expected)
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_snp_effects_table(fixture, api: AnophelesSnpFrequencyAnalysis, monkeypatch):
+    # Pick a random transcript.
+    transcript = random_transcript(api=api)
+
+    # Pick a random site mask.
+    site_mask = random.choice(api.site_mask_ids + (None,))
+
+    # Compute effects with the annotator directly.
+    ds_snp = api.snp_variants(region=transcript.name, site_mask=site_mask)
+    df_expected = api._snp_df_melt(ds_snp=ds_snp)
+    ann = api._snp_effect_annotator()
+    ann.get_effects(transcript=transcript.name, variants=df_expected)
+
+    # Compute effects via the effects table.
+    df = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+    assert_frame_equal(df, df_expected)
+
+    # Effects should now be obtained from the effects table, held in memory
+    # or in the results cache, without annotating again.
+    def fail(*args, **kwargs):
+        raise AssertionError("Effects should not be annotated again.")
+
+    monkeypatch.setattr(veff.Annotator, "get_effects", fail)
+    df = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+    assert_frame_equal(df, df_expected)
+    api.dataset_cache_clear()
+    df = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+    assert_frame_equal(df, df_expected)
+    df = api.snp_allele_frequencies(
+        transcript=transcript.name,
+        cohorts="admin1_year",
+        min_cohort_size=1,
+        drop_invariant=False,
+    )
+    assert len(df) == len(api.snp_effects(transcript=transcript.name))
+
+
+@parametrize_with_cases("fixture,api", cases=".")
+def test_snp_effects_store(
+    fixture, api: AnophelesSnpFrequencyAnalysis, tmp_path, monkeypatch
+):
+    # Pick a random transcript.
+    transcript = random_transcript(api=api)
+    contig = transcript["contig"]
+
+    # Pick a random site mask.
+    site_mask = random.choice(api.site_mask_ids + (None,))
+
+    # Compute effects without a store.
+    df_expected = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+
+    # Build a store for the contig.
+    path = (tmp_path / "snp_effects.zarr").as_posix()
+    root = api.build_snp_effects_store(path=path, contigs=contig, n_workers=2)
+    assert isinstance(root, zarr.hierarchy.Group)
+    assert contig in root
+    n_sites = root[contig]["sites_stop"][:] - root[contig]["sites_start"][:]
+    assert root[contig]["effect"].shape == (n_sites.sum(), 3)
+    assert root[contig]["position"].shape == (n_sites.sum(),)
+    assert root[contig]["alt_allele"].shape == (n_sites.sum(), 3)
+
+    # Effects should now be read from the store, without accessing the SNP
+    # sites.
+    block = api._snp_effects_from_store(transcript=transcript.name, contig=contig)
+    assert block is not None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("SNP sites should not be accessed.")
+
+    with monkeypatch.context() as m:
+        m.setattr(AnophelesSnpFrequencyAnalysis, "snp_variants", fail)
+        m.setattr(AnophelesSnpFrequencyAnalysis, "snp_sites", fail)
+        df = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+    assert_frame_equal(df, df_expected)
+
+    # Open the store again.
+    root = api.open_snp_effects_store(path=path)
+    assert isinstance(root, zarr.hierarchy.Group)
+    df = api.snp_effects(transcript=transcript.name, site_mask=site_mask)
+    assert_frame_equal(df, df_expected)
+
+
 def check_frequency(x):
     loc_nan = np.isnan(x)
     assert np.all(x[~loc_nan] >= 0)
@@ -797,6 +921,45 @@ def test_allele_frequencies_without_effects(
     )
 
 
+@parametrize_with_cases("fixture,api", cases=".")
+def test_allele_frequencies_counts(fixture, api: AnophelesSnpFrequencyAnalysis):
+    # Pick test parameters at random.
+    sample_sets = None  # all sample sets
+    site_mask = random.choice(api.site_mask_ids + (None,))
+    transcript = random_transcript(api=api)
+
+    # Create overlapping cohorts.
+    df_samples = api.sample_metadata(sample_sets=sample_sets)
+    countries = df_samples["country"].unique().tolist()
+    cohorts = {country: f"country == '{country}'" for country in countries}
+    cohorts["all"] = f"country in {countries}"
+
+    # Run the function under test.
+    df_snp = api.snp_allele_frequencies(
+        transcript=transcript.name,
+        cohorts=cohorts,
+        min_cohort_size=0,
+        site_mask=site_mask,
+        sample_sets=sample_sets,
+        drop_invariant=False,
+        effects=False,
+        include_counts=True,
+    )
+
+    # Compare with counting alleles separately for each cohort.
+    ds_snp = api.snp_calls(
+        region=transcript.name, site_mask=site_mask, sample_sets=sample_sets
+    )
+    gt = allel.GenotypeArray(ds_snp["call_genotype"].values)
+    for cohort, query in cohorts.items():
+        loc_cohort = df_samples.eval(query).values
+        ac = gt.compress(loc_cohort, axis=1).count_alleles(max_allele=3)
+        assert_array_equal(df_snp["count_" + cohort].values, ac[:, 1:].flatten())
+        assert_array_equal(
+            df_snp["nobs_" + cohort].values, np.repeat(ac.sum(axis=1), 3)
+        )
+
+
 @parametrize_with_cases("fixture,api", cases=".")
 def test_allele_frequencies_with_bad_transcript(
     fixture,
@@ -130,6 +130,25 @@ def test_ihs_gwss():
     assert_allclose(ihs[:, 2][100], 2.3467595962486327)
 
 
+def test_ihs_gwss_segment_size():
+    ag3 = setup_ag3(cohorts_analysis="20230516")
+    params = dict(
+        contig="3L",
+        analysis="gamb_colu",
+        sample_query="country == 'Ghana'",
+        sample_sets="3.0",
+        window_size=1000,
+        max_cohort_size=20,
+    )
+
+    x, ihs = ag3.ihs_gwss(**params)
+    x_seg, ihs_seg = ag3.ihs_gwss(segment_size=20_000, **params)
+
+    # Results should be identical whether or not the contig is segmented.
+    np.testing.assert_array_equal(x_seg, x)
+    np.testing.assert_array_equal(ihs_seg, ihs)
+
+
 def test_xpehh_gwss():
     ag3 = setup_ag3(cohorts_analysis="20230516")
     cohort1_query = "country == 'Ghana'"
@@ -161,6 +180,26 @@ def test_xpehh_gwss():
     assert_allclose(xpehh[:, 2][100], 0.4817561326426265)
 
 
+def test_xpehh_gwss_segment_size():
+    ag3 = setup_ag3(cohorts_analysis="20230516")
+    params = dict(
+        contig="3L",
+        analysis="gamb_colu",
+        cohort1_query="country == 'Ghana'",
+        cohort2_query="country == 'Angola'",
+        sample_sets="3.0",
+        window_size=1000,
+        max_cohort_size=20,
+    )
+
+    x, xpehh = ag3.xpehh_gwss(**params)
+    x_seg, xpehh_seg = ag3.xpehh_gwss(segment_size=20_000, **params)
+
+    # Results should be identical whether or not the contig is segmented.
+    np.testing.assert_array_equal(x_seg, x)
+    np.testing.assert_array_equal(xpehh_seg, xpehh)
+
+
 @pytest.mark.parametrize(
     "inversion",
     ["2La", "2Rb", "2Rc_col", "X_x"],
@@ -0,0 +1,124 @@
+import gc
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from malariagen_data.dataset_cache import DatasetCache, _dataset_nbytes
+
+
+class _Owner:
+    pass
+
+
+def _dataset(n=1000):
+    return xr.Dataset(
+        {"x": (("variants",), da.zeros(n, chunks=100))},
+        coords={"pos": (("variants",), np.arange(n))},
+    )
+
+
+def test_get_or_build():
+    cache = DatasetCache()
+    owner = _Owner()
+    token = cache.register(owner)
+    n_built = []
+
+    def build():
+        n_built.append(1)
+        return _dataset()
+
+    ds1 = cache.get_or_build(token, ("foo", 1), build)
+    ds2 = cache.get_or_build(token, ("foo", 1), build)
+    assert len(n_built) == 1
+    xr.testing.assert_identical(ds1, ds2)
+
+    # Modifying returned datasets does not affect cached datasets.
+    ds1["y"] = ds1["x"] + 1
+    assert "y" not in cache.get_or_build(token, ("foo", 1), build)
+
+    # Different keys and owners do not collide.
+    cache.get_or_build(token, ("foo", 2), build)
+    cache.get_or_build(cache.register(_Owner()), ("foo", 1), build)
+    assert len(n_built) == 3
+
+    stats = cache.stats()
+    assert stats.hits == 2
+    assert stats.misses == 3
+
+
+def test_mapping_of_arrays():
+    cache = DatasetCache()
+    owner = _Owner()
+    token = cache.register(owner)
+    table = {"pos": np.arange(1000), "ref": np.zeros(1000, dtype="U1")}
+    assert _dataset_nbytes(table) == table["pos"].nbytes + table["ref"].nbytes
+
+    t1 = cache.get_or_build(token, ("table", 1), lambda: table)
+    assert cache.stats().nbytes == _dataset_nbytes(table)
+
+    # Modifying returned mappings does not affect cached mappings.
+    t1["alt"] = np.ones(1000, dtype="U1")
+    assert "alt" not in cache.get_or_build(token, ("table", 1), lambda: table)
+
+
+def test_unhashable_key():
+    cache = DatasetCache()
+    token = cache.register(_Owner())
+    cache.get_or_build(token, ("foo", {"a": 1}), _dataset)
+    cache.get_or_build(token, ("foo", {"a": 1}), _dataset)
+    stats = cache.stats()
+    assert stats.misses == 2
+    assert stats.n_entries == 0
+
+
+def test_bounded_by_size():
+    nbytes = _dataset_nbytes(_dataset())
+    assert nbytes > 8000
+    cache = DatasetCache(max_size=int(nbytes * 2.5))
+    token = cache.register(_Owner())
+    for key in "abc":
+        cache.get_or_build(token, key, _dataset)
+    stats = cache.stats()
+    assert stats.n_entries == 2
+    assert stats.evictions == 1
+    assert stats.nbytes == nbytes * 2
+
+    # Least recently used entry was evicted.
+    cache.get_or_build(token, "b", _dataset)
+    assert cache.stats().hits == 1
+    cache.get_or_build(token, "a", _dataset)
+    assert cache.stats().hits == 1
+
+    # Reducing capacity evicts entries.
+    cache.max_size = "1B"
+    assert cache.stats().n_entries == 0
+
+    # Entries larger than the capacity are not cached.
+    cache.get_or_build(token, "a", _dataset)
+    assert cache.stats().n_entries == 0
+
+
+def test_invalidate():
+    cache = DatasetCache()
+    owner1, owner2 = _Owner(), _Owner()
+    token1 = cache.register(owner1)
+    token2 = cache.register(owner2)
+    cache.get_or_build(token1, "a", _dataset)
+    cache.get_or_build(token2, "a", _dataset)
+    cache.invalidate(token1)
+    assert cache.stats().n_entries == 1
+    cache.invalidate()
+    assert cache.stats().n_entries == 0
+    assert cache.stats().nbytes == 0
+
+
+def test_owner_garbage_collected():
+    cache = DatasetCache()
+    owner = _Owner()
+    token = cache.register(owner)
+    cache.get_or_build(token, "a", _dataset)
+    assert cache.stats().n_entries == 1
+    del owner
+    gc.collect()
+    assert cache.stats().n_entries == 0
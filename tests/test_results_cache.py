@@ -0,0 +1,354 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from malariagen_data.results_cache import (
+    FsspecResultsCacheBackend,
+    LocalResultsCacheBackend,
+    MemoryResultsCacheBackend,
+    ResultsCache,
+)
+from malariagen_data.util import CacheMiss
+
+
+def _results(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return dict(
+        ac=rng.integers(0, 100, size=(n, 4), dtype=np.int32),
+        pos=np.arange(n, dtype=np.int64),
+    )
+
+
+def _backdate(cache, name, key, seconds):
+    t = time.time() - seconds
+    backend = cache.backend
+    if isinstance(backend, LocalResultsCacheBackend):
+        for f in (backend.path / name / key).iterdir():
+            os.utime(f, (t, t))
+    elif isinstance(backend, FsspecResultsCacheBackend):
+        path = f"{backend._entry_path(name, key)}/last_used"
+        backend._fs.pipe_file(path, repr(t).encode())
+    else:
+        results, _ = backend._entries[(name, key)]
+        backend._entries[(name, key)] = (results, t)
+
+
+@pytest.fixture(params=["local", "fsspec", "memory"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        yield LocalResultsCacheBackend(tmp_path)
+    elif request.param == "fsspec":
+        url = f"memory://{tmp_path.name}"
+        yield FsspecResultsCacheBackend(url)
+        backend = FsspecResultsCacheBackend(url)
+        if backend._fs.exists(backend._root):
+            backend._fs.rm(backend._root, recursive=True)
+    else:
+        yield MemoryResultsCacheBackend()
+
+
+def test_get_set(tmp_path):
+    cache = ResultsCache(tmp_path)
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="a")
+    results = _results()
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+    assert (tmp_path / "foo_v1" / "a" / "results.zarr.zip").exists()
+    assert (tmp_path / "foo_v1" / "a" / "params.json").exists()
+    cached = cache.get(name="foo_v1", key="a")
+    assert set(cached) == set(results)
+    for k in results:
+        assert_array_equal(cached[k], results[k])
+
+
+def test_memory_tier(tmp_path):
+    cache = ResultsCache(tmp_path)
+    results = _results()
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+
+    # Results are served from memory, even if removed from disk.
+    (tmp_path / "foo_v1" / "a" / "results.zarr.zip").unlink()
+    cached = cache.get(name="foo_v1", key="a")
+    assert_array_equal(cached["ac"], results["ac"])
+
+    # Modifying returned arrays does not affect cached results.
+    cached["ac"][:] = -1
+    results["ac"][:] = -2
+    assert np.all(cache.get(name="foo_v1", key="a")["ac"] >= 0)
+
+
+def test_memory_tier_bounded(tmp_path):
+    results = _results()
+    nbytes = sum(a.nbytes for a in results.values())
+    cache = ResultsCache(tmp_path, memory_size=int(nbytes * 1.5))
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+    cache.set(name="foo_v1", key="b", params_json="{}", results=results)
+    assert cache._memory.nbytes == nbytes
+
+    # Least recently used entry has been dropped from memory, but is still
+    # available from disk.
+    (tmp_path / "foo_v1" / "b" / "results.zarr.zip").unlink()
+    cache.get(name="foo_v1", key="a")
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="b")
+
+    # Memory tier can be disabled.
+    cache = ResultsCache(tmp_path, memory_size=0)
+    cache.set(name="foo_v1", key="c", params_json="{}", results=results)
+    assert cache._memory.nbytes == 0
+
+
+def test_open(backend):
+    cache = ResultsCache(backend)
+    with pytest.raises(CacheMiss):
+        with cache.open(name="foo_v1", key="a"):
+            pass
+    results = _results()
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+
+    # Results are read from the backend without being added to memory.
+    cache = ResultsCache(backend)
+    with cache.open(name="foo_v1", key="a") as cached:
+        assert sorted(cached) == ["ac", "pos"]
+        assert_array_equal(cached["ac"][:10], results["ac"][:10])
+        assert_array_equal(cached["pos"][...], results["pos"])
+    assert cache._memory.nbytes == 0
+
+
+def test_backends(backend):
+    cache = ResultsCache(backend)
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="a")
+    results = _results()
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+    cache.set(name="bar_v1", key="b", params_json="{}", results=results)
+
+    # Results can be read back by a new cache using the same backend.
+    cache = ResultsCache(backend)
+    cached = cache.get(name="foo_v1", key="a")
+    assert set(cached) == set(results)
+    for k in results:
+        assert_array_equal(cached[k], results[k])
+    entries = cache.entries()
+    assert sorted((e.name, e.key) for e in entries) == [
+        ("bar_v1", "b"),
+        ("foo_v1", "a"),
+    ]
+    assert all(e.nbytes > 0 for e in entries)
+
+    cache.clear()
+    assert cache.entries() == []
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="a")
+
+
+def test_fsspec_url(tmp_path):
+    # Local file URLs use the local backend, other URLs use fsspec.
+    cache = ResultsCache(tmp_path.as_uri())
+    assert isinstance(cache.backend, LocalResultsCacheBackend)
+    assert cache.backend.path == tmp_path.resolve()
+    url = f"memory://{tmp_path.name}"
+    cache = ResultsCache(url)
+    assert isinstance(cache.backend, FsspecResultsCacheBackend)
+    assert str(cache) == url
+    cache.set(name="foo_v1", key="a", params_json="{}", results=_results())
+    fs = cache.backend._fs
+    files = sorted(p.rsplit("/", 1)[1] for p in fs.find(url))
+    assert files == ["last_used", "params.json", "results.zarr.zip"]
+    fs.rm(url, recursive=True)
+
+
+def test_evict_max_size(backend):
+    cache = ResultsCache(backend, memory_size=0)
+    for i, key in enumerate("abc"):
+        cache.set(name="foo_v1", key=key, params_json="{}", results=_results())
+        _backdate(cache, "foo_v1", key, 100 - i)
+    entry_size = cache.entries()[0].nbytes
+
+    # Using an entry makes it most recently used.
+    cache.get(name="foo_v1", key="a")
+    assert [e.key for e in cache.entries()] == ["b", "c", "a"]
+
+    cache = ResultsCache(backend, memory_size=0, max_size=int(entry_size * 2.5))
+    evicted = cache.evict()
+    assert [e.key for e in evicted] == ["b"]
+    assert [e.key for e in cache.entries()] == ["c", "a"]
+
+
+def test_evict_max_age(backend):
+    cache = ResultsCache(backend, memory_size=0, max_age=3600)
+    cache.set(name="foo_v1", key="a", params_json="{}", results=_results())
+    _backdate(cache, "foo_v1", "a", 7200)
+    cache.set(name="foo_v1", key="b", params_json="{}", results=_results())
+    assert [e.key for e in cache.entries()] == ["b"]
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="a")
+
+
+def test_evict_quotas(backend):
+    cache = ResultsCache(backend, memory_size=0)
+    for i, key in enumerate("abc"):
+        cache.set(name="foo_v2", key=key, params_json="{}", results=_results())
+        cache.set(name="bar_v1", key=key, params_json="{}", results=_results())
+        _backdate(cache, "foo_v2", key, 100 - i)
+    entry_size = cache.entries()[0].nbytes
+
+    cache = ResultsCache(backend, memory_size=0, quotas={"foo": entry_size})
+    cache.evict()
+    entries = cache.entries()
+    assert sorted(e.key for e in entries if e.name == "foo_v2") == ["c"]
+    assert sorted(e.key for e in entries if e.name == "bar_v1") == ["a", "b", "c"]
+
+
+def test_clear(tmp_path):
+    cache = ResultsCache(tmp_path)
+    cache.set(name="foo_v1", key="a", params_json="{}", results=_results())
+    cache.clear()
+    assert cache.entries() == []
+    with pytest.raises(CacheMiss):
+        cache.get(name="foo_v1", key="a")
+
+
+def test_set_atomic(tmp_path):
+    cache = ResultsCache(tmp_path)
+    cache.set(name="foo_v1", key="a", params_json="{}", results=_results())
+    files = sorted(f.name for f in (tmp_path / "foo_v1" / "a").iterdir())
+    assert files == ["params.json", "results.zarr.zip"]
+
+    # Temporary files are removed if writing fails.
+    with pytest.raises(Exception):
+        cache.set(
+            name="foo_v1", key="b", params_json="{}", results=dict(x=lambda: None)
+        )
+    files = sorted(f.name for f in (tmp_path / "foo_v1" / "b").iterdir())
+    assert files == ["params.json"]
+
+
+def test_get_corrupt(tmp_path):
+    cache = ResultsCache(tmp_path, memory_size=0)
+    results = _results()
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+
+    # Simulate a partially written file.
+    results_path = tmp_path / "foo_v1" / "a" / "results.zarr.zip"
+    data = results_path.read_bytes()
+    results_path.write_bytes(data[: len(data) // 2])
+    with pytest.warns(UserWarning, match="corrupt"):
+        with pytest.raises(CacheMiss):
+            cache.get(name="foo_v1", key="a")
+
+    # Recomputed results replace the corrupt file.
+    cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+    assert_array_equal(cache.get(name="foo_v1", key="a")["ac"], results["ac"])
+
+
+def test_lock_threads(backend):
+    cache = ResultsCache(backend)
+    results = _results()
+    n_computed = []
+
+    def worker():
+        lock = cache.lock(name="foo_v1", key="a")
+        try:
+            cache.get(name="foo_v1", key="a", lock=lock)
+        except CacheMiss:
+            time.sleep(0.5)
+            n_computed.append(1)
+            cache.set(name="foo_v1", key="a", params_json="{}", results=results)
+        finally:
+            lock.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Only one worker computed the results, the others waited.
+    assert len(n_computed) == 1
+    assert [e.name for e in cache.entries()] == ["foo_v1"]
+
+
+def test_lock_files_removed(tmp_path):
+    cache = ResultsCache(tmp_path, memory_size=0)
+    for key in "ab":
+        with cache.lock(name="foo_v1", key=key):
+            cache.set(name="foo_v1", key=key, params_json="{}", results=_results())
+    lock_paths = [tmp_path / ".locks" / "foo_v1" / f"{key}.lock" for key in "ab"]
+    assert all(p.exists() for p in lock_paths)
+
+    # Lock files are removed with the entries they belong to.
+    _backdate(cache, "foo_v1", "a", 7200)
+    cache = ResultsCache(tmp_path, memory_size=0, max_age=3600)
+    assert [e.key for e in cache.evict()] == ["a"]
+    assert not lock_paths[0].exists()
+    assert lock_paths[1].exists()
+
+    # Lock files are kept while the lock is held.
+    with cache.lock(name="foo_v1", key="b"):
+        cache.clear()
+        assert lock_paths[1].exists()
+    assert cache.entries() == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires fcntl")
+def test_lock_file_removed_before_locking(tmp_path, monkeypatch):
+    import fcntl
+
+    from malariagen_data import results_cache
+
+    cache = ResultsCache(tmp_path)
+    lock_path = tmp_path / ".locks" / "foo_v1" / "a.lock"
+    lockf = fcntl.lockf
+    calls = []
+
+    def lockf_after_delete(f, cmd):
+        # Simulate another process deleting the entry and its lock file after
+        # the lock file has been opened but before it is locked.
+        if not calls:
+            lock_path.unlink()
+        calls.append(cmd)
+        return lockf(f, cmd)
+
+    monkeypatch.setattr(results_cache.fcntl, "lockf", lockf_after_delete)
+    with cache.lock(name="foo_v1", key="a") as lock:
+        # The lock is held on the current lock file, not the removed one.
+        assert lock_path.exists()
+        assert os.fstat(lock._file.fileno()).st_ino == os.stat(lock_path).st_ino
+    assert calls.count(fcntl.LOCK_EX | fcntl.LOCK_NB) == 2
+
+
+def _hold_lock(path, acquired, release):
+    cache = ResultsCache(path)
+    with cache.lock(name="foo_v1", key="a"):
+        acquired.set()
+        release.wait(10)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires fcntl")
+def test_lock_processes(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    acquired = ctx.Event()
+    release = ctx.Event()
+    p = ctx.Process(target=_hold_lock, args=(tmp_path, acquired, release))
+    p.start()
+    try:
+        assert acquired.wait(60)
+        cache = ResultsCache(tmp_path, lock_timeout=0.1)
+        lock = cache.lock(name="foo_v1", key="a")
+        assert not lock.acquire()
+        assert not lock.held
+        release.set()
+        p.join(60)
+        assert lock.acquire()
+        assert lock.held
+        lock.release()
+    finally:
+        release.set()
+        p.join()
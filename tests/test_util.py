@@ -0,0 +1,431 @@
+import allel  # type: ignore
+import dask.array as da
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from numpy.testing import assert_allclose, assert_array_equal
+
+from malariagen_data.anoph.distance import _biallelic_diplotype_pairwise_distances
+from malariagen_data.anoph.g123 import _garud_g123, _moving_g123
+from malariagen_data.anoph.h12 import _garud_h12
+from malariagen_data.anoph.h1x import _h1x, _moving_h1x
+from malariagen_data.util import (
+    _GenomeFeaturesIndex,
+    _arrays_to_gff3,
+    _gff3_attributes_dicts,
+    _gff3_attributes_table,
+    _gff3_parse_attributes,
+    _gff3_to_arrays,
+    _compress_chunk_sizes,
+    _condensed_offset,
+    _copy_condensed_distances,
+    _da_compress,
+    _dask_compress_dataset,
+    _moving_garud_h,
+    _moving_garud_h_stream,
+    _moving_window_bounds,
+    _multiallelic_diplotype_mean_cityblock,
+    _multiallelic_diplotype_mean_sqeuclidean,
+    _multiallelic_diplotype_pairwise_distances,
+    _multiallelic_diplotype_pdist,
+    _open_condensed_distances,
+    _pdist_abs_hamming,
+    _pdist_row_blocks,
+    _segmented_ihs,
+    _segmented_xpehh,
+)
+
+
+@pytest.mark.parametrize(
+    "chunks", [(10, 10, 10), (7, 0, 13, 10), (30,), (5, 5, 5, 5, 5, 5, 0, 0)]
+)
+def test_compress_chunk_sizes(chunks):
+    indexer = np.random.default_rng(0).random(30) < 0.5
+    indexer[10:20] = False
+    expected = []
+    start = 0
+    for c in chunks:
+        expected.append(int(np.sum(indexer[start : start + c])))
+        start += c
+    assert _compress_chunk_sizes(indexer, chunks) == tuple(expected)
+
+
+def test_compress_chunk_sizes_empty():
+    indexer = np.zeros(0, dtype=bool)
+    assert _compress_chunk_sizes(indexer, (0,)) == (0,)
+
+
+@pytest.mark.parametrize("empty_chunks", ["rechunk", "drop"])
+@pytest.mark.parametrize("lazy_indexer", [False, True])
+def test_da_compress(empty_chunks, lazy_indexer):
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 100, size=(1000, 3))
+    indexer = rng.random(1000) < 0.2
+    indexer[200:600] = False
+    x = da.from_array(data, chunks=(50, 3))
+    ind = da.from_array(indexer, chunks=100) if lazy_indexer else indexer
+
+    v = _da_compress(ind, x, axis=0, empty_chunks=empty_chunks)
+    assert 0 not in v.chunks[0]
+    assert sum(v.chunks[0]) == np.count_nonzero(indexer)
+    assert_array_equal(v.compute(), data[indexer])
+    assert v.sum().compute() == data[indexer].sum()
+
+    # All chunks empty.
+    v = _da_compress(np.zeros(1000, dtype=bool), x, axis=0, empty_chunks=empty_chunks)
+    assert v.shape == (0, 3)
+    assert v.compute().shape == (0, 3)
+
+
+def test_da_compress_drop_skips_empty_blocks():
+    data = np.arange(1000)
+    indexer = np.zeros(1000, dtype=bool)
+    indexer[:100] = True
+    x = da.from_array(data, chunks=100)
+
+    v_drop = _da_compress(indexer, x, axis=0, empty_chunks="drop")
+    v_rechunk = _da_compress(indexer, x, axis=0, empty_chunks="rechunk")
+    assert v_drop.chunks == v_rechunk.chunks == ((100,),)
+    assert len(v_drop.__dask_graph__()) < len(v_rechunk.__dask_graph__())
+    assert_array_equal(v_drop.compute(), v_rechunk.compute())
+
+
+@pytest.mark.parametrize("empty_chunks", ["rechunk", "drop"])
+def test_dask_compress_dataset(empty_chunks):
+    rng = np.random.default_rng(0)
+    n = 1000
+    indexer = rng.random(n) < 0.3
+    indexer[:500] = False
+    ds = xr.Dataset(
+        {
+            "x": (("variants", "samples"), da.zeros((n, 4), chunks=(100, 2))),
+            "y": (("variants",), da.arange(n, chunks=100)),
+            "z": (("variants",), da.arange(n, chunks=250)),
+            "s": (("samples",), np.arange(4)),
+        },
+        coords={"pos": (("variants",), np.arange(n))},
+    )
+    ds_out = _dask_compress_dataset(
+        ds, indexer=indexer, dim="variants", empty_chunks=empty_chunks
+    )
+    assert ds_out.sizes["variants"] == np.count_nonzero(indexer)
+    assert_array_equal(ds_out["y"].values, np.arange(n)[indexer])
+    assert_array_equal(ds_out["z"].values, np.arange(n)[indexer])
+    assert_array_equal(ds_out["pos"].values, np.arange(n)[indexer])
+    assert_array_equal(ds_out["s"].values, np.arange(4))
+    assert ds_out["x"].values.shape == (np.count_nonzero(indexer), 4)
+
+
+def _random_haplotypes(rng, n_variants, n_haplotypes):
+    ht = (rng.random((n_variants, n_haplotypes)) < 0.05).astype("i1")
+    # Duplicate some haplotypes, so that there are haplotypes with
+    # frequency greater than 1.
+    ht[:, n_haplotypes // 2 :] = ht[:, : n_haplotypes - n_haplotypes // 2]
+    ht[rng.random(ht.shape) < 0.01] = -1
+    return ht
+
+
+@pytest.mark.parametrize("size,start,stop,step", [(10, 0, None, None), (7, 3, 95, 2)])
+def test_moving_window_bounds(size, start, stop, step):
+    x = np.arange(100)
+    expected = list(allel.index_windows(x, size, start, stop, step))
+    actual = _moving_window_bounds(len(x), size, start=start, stop=stop, step=step)
+    assert actual.shape == (len(expected), 2)
+    assert actual.tolist() == [list(w) for w in expected]
+
+
+@pytest.mark.parametrize("step", [None, 40])
+def test_moving_garud_h(step):
+    rng = np.random.default_rng(42)
+    ht = _random_haplotypes(rng, 2000, 40)
+    sizes = [100, 250, 3000]
+    timings: dict = dict()
+    actual = _moving_garud_h(ht, sizes=sizes, n_pooled=2, step=step, timings=timings)
+    assert len(actual) == len(sizes)
+    assert sorted(timings) == sizes
+    for size, h12 in zip(sizes, actual):
+        expected = allel.moving_statistic(ht, _garud_h12, size=size, step=step)
+        assert h12.shape == expected.shape
+        assert_allclose(h12, expected)
+
+        # Computing window sizes together gives identical results.
+        (h12_single,) = _moving_garud_h(ht, sizes=[size], n_pooled=2, step=step)
+        assert_array_equal(h12, h12_single)
+
+
+@pytest.mark.parametrize(
+    "size,step", [(100, None), (100, 30), (250, 400), (5000, None)]
+)
+def test_moving_garud_h_stream(size, step):
+    rng = np.random.default_rng(42)
+    ht = _random_haplotypes(rng, 3001, 40)
+    (expected,) = _moving_garud_h(ht, sizes=[size], n_pooled=2, step=step)
+    for cuts in [[], [1000, 1000, 2000], sorted(rng.choice(3000, 20) + 1)]:
+        blocks = np.split(ht, cuts)
+        actual = _moving_garud_h_stream(iter(blocks), size=size, n_pooled=2, step=step)
+        assert_array_equal(actual, expected)
+
+
+def test_moving_g123():
+    rng = np.random.default_rng(42)
+    gt = _random_haplotypes(rng, 2000, 60).reshape(2000, 30, 2)
+    (actual,) = _moving_g123(gt, window_sizes=[200])
+    expected = allel.moving_statistic(gt, _garud_g123, size=200)
+    assert_allclose(actual, expected)
+
+
+@pytest.mark.parametrize("step", [None, 30])
+def test_moving_h1x(step):
+    rng = np.random.default_rng(42)
+    ht = _random_haplotypes(rng, 2000, 50)
+    ha, hb = ht[:, :30], ht[:, 20:]
+    actual = _moving_h1x(ha, hb, size=100, step=step)
+    expected = np.array(
+        [_h1x(ha[i:j], hb[i:j]) for i, j in allel.index_windows(ha, 100, 0, None, step)]
+    )
+    assert_allclose(actual, expected)
+
+
+def _random_ehh_haplotypes(rng, n_variants, n_haplotypes):
+    # Haplotypes derived from a few founders, so that EHH decays slowly.
+    founders = (rng.random((n_variants, 8)) < 0.4).astype("i1")
+    ht = founders[:, rng.integers(0, 8, n_haplotypes)]
+    mutations = rng.random(ht.shape) < 0.03
+    ht[mutations] = 1 - ht[mutations]
+    return ht
+
+
+@pytest.mark.parametrize("include_edges", [False, True])
+@pytest.mark.parametrize("max_gap", [200_000, 5_000])
+@pytest.mark.parametrize("use_threads", [False, True])
+def test_segmented_ihs(include_edges, max_gap, use_threads):
+    rng = np.random.default_rng(42)
+    ht = _random_ehh_haplotypes(rng, 1500, 40)
+    pos = np.cumsum(rng.integers(1, 200, 1500))
+    pos[700:] += 300_000
+    for min_maf in [0, 0.05, 0.2]:
+        expected = allel.ihs(
+            ht,
+            pos,
+            min_maf=min_maf,
+            include_edges=include_edges,
+            max_gap=max_gap,
+            use_threads=False,
+        )
+        actual = _segmented_ihs(
+            ht,
+            pos,
+            min_maf=min_maf,
+            include_edges=include_edges,
+            max_gap=max_gap,
+            segment_size=137,
+            use_threads=use_threads,
+        )
+        assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("include_edges", [False, True])
+def test_segmented_xpehh(include_edges):
+    rng = np.random.default_rng(42)
+    ht1 = _random_ehh_haplotypes(rng, 1500, 40)
+    ht2 = _random_ehh_haplotypes(rng, 1500, 30)
+    pos = np.cumsum(rng.integers(1, 200, 1500))
+    expected = allel.xpehh(
+        ht1, ht2, pos, include_edges=include_edges, use_threads=False
+    )
+    actual = _segmented_xpehh(
+        ht1, ht2, pos, include_edges=include_edges, segment_size=250
+    )
+    assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("n_obs", [1, 2, 37, 300])
+def test_pdist_abs_hamming(n_obs):
+    rng = np.random.default_rng(42)
+    X = (rng.random((n_obs, 1001)) < 0.3).astype("i1")
+    triu = np.triu_indices(n_obs, k=1)
+    expected = (X[:, None, :] != X[None, :, :]).sum(axis=2)[triu]
+    actual = _pdist_abs_hamming(X)
+    assert actual.dtype == np.int32
+    assert_array_equal(actual, expected)
+
+    # Values other than zero and one.
+    X[X == 1] = 2
+    X[0, :10] = -1
+    expected = (X[:, None, :] != X[None, :, :]).sum(axis=2)[triu]
+    assert_array_equal(_pdist_abs_hamming(X), expected)
+
+
+@pytest.mark.parametrize("n_obs", [2, 3, 37, 300])
+@pytest.mark.parametrize("max_pairs", [1, 100, 10_000_000])
+def test_pdist_row_blocks(n_obs, max_pairs):
+    blocks = list(_pdist_row_blocks(n_obs, max_pairs))
+    assert blocks[0][0] == 0
+    assert blocks[-1][1] == n_obs - 1
+    for (_, stop), (start, _) in zip(blocks[:-1], blocks[1:]):
+        assert stop == start
+    for start, stop in blocks:
+        n_pairs = _condensed_offset(stop, n_obs) - _condensed_offset(start, n_obs)
+        assert n_pairs <= max_pairs or stop == start + 1
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".zarr"])
+def test_pdist_out_of_core(tmp_path, monkeypatch, suffix):
+    import malariagen_data.util
+
+    # Compute distances in several blocks of rows.
+    monkeypatch.setattr(malariagen_data.util, "_PDIST_BLOCK_NPAIRS", 1000)
+
+    rng = np.random.default_rng(42)
+    ht = (rng.random((300, 1001)) < 0.3).astype("i1")
+    out = _open_condensed_distances(tmp_path / f"ht{suffix}", 300, np.int32)
+    dist = _pdist_abs_hamming(ht, out=out)
+    assert dist is out
+    assert_array_equal(dist[:], _pdist_abs_hamming(ht))
+
+    gn = rng.integers(0, 3, size=(200, 5000), dtype="i1")
+    out = _open_condensed_distances(tmp_path / f"gn{suffix}", 200, np.float32)
+    dist = _biallelic_diplotype_pairwise_distances(gn, metric="euclidean", out=out)
+    assert dist is out
+    assert_array_equal(
+        dist[:], _biallelic_diplotype_pairwise_distances(gn, metric="euclidean")
+    )
+
+    with pytest.raises(ValueError):
+        _pdist_abs_hamming(ht[:10], out=out)
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".zarr"])
+def test_copy_condensed_distances(tmp_path, monkeypatch, suffix):
+    import malariagen_data.util
+
+    # Copy in several blocks, including a partial final block.
+    monkeypatch.setattr(malariagen_data.util, "_PDIST_BLOCK_NPAIRS", 1000)
+
+    rng = np.random.default_rng(42)
+    src = rng.random((300 * 299) // 2).astype(np.float32)
+    out = _open_condensed_distances(tmp_path / f"dist{suffix}", 300, np.float32)
+    dist = _copy_condensed_distances(src, out)
+    assert dist is out
+    assert_array_equal(dist[:], src)
+
+
+@pytest.mark.parametrize("n_obs", [2, 37, 300])
+@pytest.mark.parametrize("metric", ["cityblock", "sqeuclidean", "euclidean"])
+def test_biallelic_diplotype_pairwise_distances(n_obs, metric):
+    from scipy.spatial.distance import pdist  # type: ignore
+
+    rng = np.random.default_rng(42)
+    X = rng.integers(0, 3, size=(n_obs, 5000), dtype="i1")
+    expected = pdist(X, metric=metric).astype("f4")
+    actual = _biallelic_diplotype_pairwise_distances(X, metric=metric)
+    assert actual.dtype == np.float32
+    assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("n_obs", [2, 37, 300])
+@pytest.mark.parametrize(
+    "metric,metric_func",
+    [
+        ("cityblock", _multiallelic_diplotype_mean_cityblock),
+        ("sqeuclidean", _multiallelic_diplotype_mean_sqeuclidean),
+    ],
+)
+def test_multiallelic_diplotype_pairwise_distances(n_obs, metric, metric_func):
+    rng = np.random.default_rng(42)
+    X = np.zeros((n_obs, 1000, 4), dtype="i1")
+    for _ in range(2):
+        alleles = rng.integers(0, 4, size=(n_obs, 1000))
+        np.add.at(X, (*np.indices(alleles.shape), alleles), 1)
+    # Some missing genotypes.
+    X[rng.random((n_obs, 1000)) < 0.1] = 0
+    X[0] = 0
+    expected = _multiallelic_diplotype_pdist(X, metric=metric_func)
+    actual = _multiallelic_diplotype_pairwise_distances(X, metric=metric)
+    assert_array_equal(actual, expected)
+
+    # Compare a pair against the metric function directly.
+    assert_array_equal(actual[-1], metric_func(X[-2], X[-1]))
+    assert np.all(np.isnan(actual[: n_obs - 1]))
+
+
+def test_genome_features_index():
+    rng = np.random.default_rng(42)
+    n = 500
+    start = rng.integers(1, 10_000, size=n)
+    df = pd.DataFrame(
+        {
+            "contig": rng.choice(["2L", "2R", "X"], size=n),
+            "start": start,
+            # Include some long features spanning many others.
+            "end": start + rng.choice([0, 10, 100, 5_000], size=n),
+            "ID": [f"f{i}" for i in range(n)],
+        }
+    )
+    df["Parent"] = [
+        ",".join(rng.choice(df["ID"][:20], size=rng.integers(0, 3), replace=False))
+        or None
+        for _ in range(n)
+    ]
+    index = _GenomeFeaturesIndex(df)
+    assert_array_equal(
+        index.df["ID"], df.sort_values(["contig", "start"])["ID"].to_numpy()
+    )
+
+    # Check overlap queries against a brute force scan.
+    for contig in ["2L", "X", "3R"]:
+        for qstart, qend in [(None, None), (500, 2_000), (None, 100), (9_000, None)]:
+            expected = (index.df["contig"] == contig).to_numpy()
+            if qstart is not None:
+                expected &= index.df["end"].to_numpy() >= qstart
+            if qend is not None:
+                expected &= index.df["start"].to_numpy() <= qend
+            loc = index.locate_overlapping(contig=contig, start=qstart, end=qend)
+            assert_array_equal(loc, np.flatnonzero(expected))
+
+    # Check ID and children queries.
+    assert_array_equal(index.df["ID"].iloc[index.locate_id("f7")], ["f7"])
+    assert index.locate_id("foo").size == 0
+    df_exploded = df.assign(Parent=df["Parent"].str.split(",")).explode("Parent")
+    for parent in df["ID"][:20]:
+        loc = index.locate_children(parent)
+        expected = df_exploded.query(f"Parent == '{parent}'")["ID"]
+        assert index.df["ID"].iloc[loc].tolist() == expected.tolist()
+    assert index.locate_children("foo").size == 0
+
+
+def test_gff3_attributes_table():
+    attributes = pd.Series(
+        [
+            "ID=gene1;Name=foo;description=a+b%2C c",
+            "ID=rna1;Parent=gene1,gene2; Note = %20spaced ;flag",
+            np.nan,
+            "",
+            "ID=ünïcode%C3%A9;;description=x=y;Dbxref=%0Aline",
+        ]
+    )
+    table = _gff3_attributes_table(attributes)
+    dicts = _gff3_attributes_dicts(len(attributes), table)
+    expected = [_gff3_parse_attributes(a) for a in attributes[:2]]
+    expected += [dict(), dict()]
+    # N.B., the original parser fails on values containing "=".
+    expected += [dict(ID="ünïcodeé", description="x=y", Dbxref="\nline")]
+    assert dicts == expected
+
+    # Check conversion to and from arrays.
+    df = pd.DataFrame(
+        {
+            "contig": ["2L", "2L", "3R", "X", "X"],
+            "source": "test",
+            "type": ["gene", "mRNA", np.nan, "exon", "CDS"],
+            "start": np.arange(5),
+            "end": np.arange(5) + 10,
+            "score": np.nan,
+            "strand": ["+", "-", np.nan, "+", "+"],
+            "phase": [np.nan, np.nan, np.nan, np.nan, 0],
+        }
+    )
+    df_out, table_out = _arrays_to_gff3(_gff3_to_arrays(df, table))
+    pd.testing.assert_frame_equal(df_out, df)
+    pd.testing.assert_frame_equal(table_out, table)